@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Construction time of the chunked prefill (split-fuse) attention mask of
+`AttentionMaskBuilder.get_splitfuse_attn_mask` when the batch is longer than
+the cached mask, across batch shapes:
+
+- loop: the previous builder, a dense host tensor filled request by request
+  with `tril()` and `masked_fill_`, then copied to the device
+- vectorized: `AttentionMaskBuilder._build_splitfuse_attn_mask`, one broadcast
+  comparison on the device against per-row limits
+
+Both masks are checked to be equal before timing.
+
+    python benchmarks/attention/bench_splitfuse_mask.py
+    python benchmarks/attention/bench_splitfuse_mask.py --device npu --dtype float16
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "omni" / "models" / "common" / "layers" / "attention" / "backend"))
+from attention_mask import AttentionMaskBuilder  # noqa: E402
+
+MASK_VALUE = -10000
+
+# (number of decodes, number of prefill chunks, chunk length, context length of the chunks)
+SHAPES = [
+    (0, 1, 2048, 0),
+    (0, 1, 2048, 30000),
+    (32, 1, 1024, 8000),
+    (64, 4, 512, 16000),
+    (128, 2, 4096, 60000),
+]
+
+
+def loop_mask(seq_lens, query_lens, dtype, device):
+    max_seq_len = max(seq_lens, default=0)
+    attn_mask = torch.zeros((sum(query_lens), max_seq_len), dtype=dtype, device="cpu")
+    current_row = 0
+    for seq_len, q_len in zip(seq_lens, query_lens):
+        context_len = seq_len - q_len
+        attn_mask[current_row:current_row + q_len, context_len:] = MASK_VALUE
+        right_tensor = attn_mask[current_row:current_row + q_len, context_len:seq_len]
+        right_tensor.masked_fill_(right_tensor.tril() == MASK_VALUE, 0)
+        current_row += q_len
+    return attn_mask.to(device, non_blocking=True)
+
+
+def make_batch(num_decodes, num_chunks, chunk_len, context_len):
+    seq_lens, query_lens = [], []
+    for i in range(num_decodes):
+        seq_lens.append(context_len // 2 + i)
+        query_lens.append(1)
+    for _ in range(num_chunks):
+        seq_lens.append(context_len + chunk_len)
+        query_lens.append(chunk_len)
+    return seq_lens, query_lens
+
+
+def sync(device):
+    if device.type == "npu":
+        torch.npu.synchronize()
+    elif device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def timeit(fn, device, iters):
+    fn()
+    sync(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    sync(device)
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", type=str, default="float16", choices=["float16", "bfloat16", "float32"])
+    parser.add_argument("--iters", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.device == "npu":
+        import torch_npu  # noqa: F401
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    builder = AttentionMaskBuilder.initialize_from_len(128, dtype)
+
+    print(f"{'decodes':>8} {'chunks':>7} {'chunk':>6} {'context':>8} {'mask MB':>8}"
+          f" {'loop ms':>9} {'vector ms':>10} {'speedup':>8}")
+    for num_decodes, num_chunks, chunk_len, context_len in SHAPES:
+        seq_lens, query_lens = make_batch(num_decodes, num_chunks, chunk_len, context_len)
+        max_seq_len = max(seq_lens)
+        seq_lens_t = torch.tensor(seq_lens, dtype=torch.int64)
+        query_lens_t = torch.tensor(query_lens, dtype=torch.int64)
+
+        expected = loop_mask(seq_lens, query_lens, dtype, device)
+        actual = builder._build_splitfuse_attn_mask(seq_lens_t, query_lens_t, max_seq_len, dtype, device)
+        if not torch.equal(expected, actual):
+            raise AssertionError(f"mask mismatch for shape {(num_decodes, num_chunks, chunk_len, context_len)}")
+
+        t_loop = timeit(lambda: loop_mask(seq_lens, query_lens, dtype, device), device, args.iters)
+        t_vec = timeit(lambda: builder._build_splitfuse_attn_mask(
+            seq_lens_t, query_lens_t, max_seq_len, dtype, device), device, args.iters)
+        mask_mb = expected.numel() * expected.element_size() / 2**20
+        print(f"{num_decodes:>8} {num_chunks:>7} {chunk_len:>6} {context_len:>8} {mask_mb:>8.1f}"
+              f" {t_loop * 1e3:>9.2f} {t_vec * 1e3:>10.2f} {t_loop / t_vec:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
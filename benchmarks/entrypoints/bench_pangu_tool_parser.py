@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Streaming cost of `PanguToolParser.extract_tool_calls_streaming` on a long
+synthetic output with text and tool calls, streamed one delta at a time like
+the OpenAI chat serving does:
+
+- rescan: the previous parser, which counts the tool call tags over all token
+  ids, splits the whole text and parses the whole tool call on every delta
+  (`RescanPanguToolParser` of omni/models/pangu/tests/pangu_tool_parser_reference.py)
+- incremental: `PanguToolParser`, which carries the tag counts, the offset of
+  the last tool call and the partial parse of its arguments across deltas
+
+The DeltaMessage sequences (ignoring the random tool call ids) and the final
+`prev_tool_call_arr` / `streamed_args_for_tool` of both parsers are checked to
+be identical before the timings are reported.
+
+    python benchmarks/entrypoints/bench_pangu_tool_parser.py
+    python benchmarks/entrypoints/bench_pangu_tool_parser.py --num-tokens 50000 --num-tool-calls 8
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+
+PANGU_DIR = Path(__file__).resolve().parents[2] / "omni" / "models" / "pangu"
+sys.path.insert(0, str(PANGU_DIR / "tool_parsers"))
+sys.path.insert(0, str(PANGU_DIR / "tests"))
+from pangu_tool_parser import PanguToolParser  # noqa: E402
+from pangu_tool_parser_reference import (RescanPanguToolParser,  # noqa: E402
+                                         SyntheticTokenizer, comparable,
+                                         make_output, stream)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-tokens", type=int, default=20000)
+    parser.add_argument("--num-tool-calls", type=int, default=4)
+    parser.add_argument("--tokens-per-delta", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tokenizer = SyntheticTokenizer()
+    pieces = make_output(args.num_tokens, args.num_tool_calls, random.Random(args.seed))
+
+    results = {}
+    for name, parser_class in (("rescan", RescanPanguToolParser), ("incremental", PanguToolParser)):
+        tool_parser = parser_class(tokenizer)
+        deltas, elapsed = stream(tool_parser, pieces, tokenizer, args.tokens_per_delta)
+        results[name] = (elapsed, [comparable(delta) for delta in deltas],
+                         tool_parser.prev_tool_call_arr, tool_parser.streamed_args_for_tool)
+
+    _, rescan_deltas, rescan_tool_calls, rescan_args = results["rescan"]
+    _, deltas, tool_calls, streamed_args = results["incremental"]
+    for i, (expected, actual) in enumerate(zip(rescan_deltas, deltas)):
+        if expected != actual:
+            raise AssertionError(f"delta {i} differs: {expected} vs {actual}")
+    if rescan_tool_calls != tool_calls or rescan_args != streamed_args:
+        raise AssertionError("final tool call state differs")
+
+    print(f"{len(pieces)} tokens, {len(deltas)} deltas, {args.num_tool_calls} tool calls: identical DeltaMessages")
+    print(f"{'parser':>12} {'total ms':>10} {'us/delta':>10}")
+    for name, (elapsed, *_) in results.items():
+        print(f"{name:>12} {elapsed * 1e3:>10.1f} {elapsed / len(deltas) * 1e6:>10.1f}")
+    print(f"speedup: {results['rescan'][0] / results['incremental'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""End-to-end benchmark of the PD connector workers on a CPU host, over the
+loopback KV transfer backend (`kv_transfer_backend: loopback`).
+
+A prefill and a decode `LLMDataDistConnector` run in two processes, with
+synthetic rank tables, MLA-shaped CPU KV caches and the latency and bandwidth
+injected by the loopback backend. The decode process submits requests the way
+its scheduler does, a batch of `DatadistConnectorMetadata` per step, and polls
+`get_finished`. The whole connector path is exercised: thread pools and
+per-cluster queues, block slicing, the ZMQ acks to the prefill side and its
+`get_finished`. The pulled blocks are checked against the prefill caches.
+
+It reports the pull throughput, the latency from the submission of a request
+to its `done_recving` and the number of requests released on the prefill side.
+
+Needs vllm, torch and pyzmq, but neither llm_datadist nor NPUs.
+
+    python benchmarks/pd/bench_loopback_connector.py
+    python benchmarks/pd/bench_loopback_connector.py --latency-ms 0.2 --bandwidth-gb-s 10 \\
+        --additional-config '{"multi_thread_pull_kv": true, "batch_pull_kv": true}'
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+PREFILL_IP, DECODE_IP = "127.0.0.1", "127.0.0.2"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_rank_tables(workdir: str) -> dict[str, dict[str, str]]:
+    """Rank tables of one prefill and one decode instance with one device each, and the env of both roles."""
+    servers = {
+        "prefill": {"server_id": PREFILL_IP, "server_ip": PREFILL_IP,
+                    "device": [{"device_id": "0", "device_ip": "10.0.0.1", "rank_id": "0"}]},
+        "decode": {"server_id": DECODE_IP, "server_ip": DECODE_IP,
+                   "device": [{"device_id": "0", "device_ip": "10.0.1.1", "rank_id": "0"}]},
+    }
+    global_rank_table = {"server_group_list": [
+        {"group_id": str(group_id), "server_count": "1", "server_list": [servers[role]]}
+        for group_id, role in enumerate(("prefill", "decode"))
+    ]}
+    global_path = os.path.join(workdir, "global_ranktable.json")
+    with open(global_path, "w", encoding="utf-8") as f:
+        json.dump(global_rank_table, f)
+
+    envs = {}
+    for role, server in servers.items():
+        local_path = os.path.join(workdir, f"local_ranktable_{role}.json")
+        with open(local_path, "w", encoding="utf-8") as f:
+            json.dump({"server_list": [server]}, f)
+        envs[role] = {
+            "ROLE": role,
+            "RANK_TABLE_FILE_PATH": local_path,
+            "GLOBAL_RANK_TABLE_FILE_PATH": global_path,
+            "PREFILL_POD_NUM": "1",
+            "DECODE_POD_NUM": "1",
+            "LOCAL_DECODE_SERVER_IP_LIST": DECODE_IP,
+            "GLOBAL_DECODE_SERVER_IP_LIST": DECODE_IP,
+        }
+    return envs
+
+
+def init_connector(kv_role: str, args, dist_port: int):
+    """A worker side LLMDataDistConnector over the loopback backend, in a single rank world."""
+    from vllm.config import KVTransferConfig
+    from vllm.distributed import ensure_model_parallel_initialized, init_distributed_environment
+    from vllm.distributed.kv_transfer.kv_connector.v1.base import KVConnectorRole
+
+    init_distributed_environment(world_size=1, rank=0, local_rank=0, backend="gloo",
+                                 distributed_init_method=f"tcp://127.0.0.1:{dist_port}")
+    ensure_model_parallel_initialized(1, 1)
+    from omni.accelerators.pd.llmdatadist_connector_v1 import LLMDataDistConnector
+
+    kv_transfer_config = KVTransferConfig(
+        kv_connector="AscendHcclConnectorV1",
+        kv_role=kv_role,
+        kv_connector_extra_config={
+            "kv_transfer_backend": "loopback",
+            "loopback_dir": args.loopback_dir,
+            "loopback_latency_ms": args.latency_ms,
+            "loopback_bandwidth_gb_s": args.bandwidth_gb_s,
+            # the requests are never finished on the prefill scheduler here, there is nothing to lease
+            "kv_lease_ttl_s": 0,
+        },
+    )
+    # only the fields of VllmConfig that the connector workers read
+    vllm_config = SimpleNamespace(
+        kv_transfer_config=kv_transfer_config,
+        additional_config=json.loads(args.additional_config),
+        cache_config=SimpleNamespace(block_size=args.block_size),
+        parallel_config=SimpleNamespace(data_parallel_rank_local=0),
+        npu_compilation_config=SimpleNamespace(level=0),
+    )
+    return LLMDataDistConnector(vllm_config, KVConnectorRole.WORKER)
+
+
+def make_kv_caches(args, num_blocks: int):
+    """MLA-shaped caches: a (nope, rope) tuple per layer."""
+    import torch
+    dtype = getattr(torch, args.dtype)
+    return {
+        f"model.layers.{layer}.self_attn.attn": (
+            torch.zeros((num_blocks, args.block_size, 1, args.kv_lora_rank), dtype=dtype),
+            torch.zeros((num_blocks, args.block_size, 1, args.rope_dim), dtype=dtype),
+        )
+        for layer in range(args.num_layers)
+    }
+
+
+def block_value(block_id: int, layer: int) -> int:
+    # small integers, exact in every float dtype
+    return (block_id + 7 * layer) % 128
+
+
+def run_prefill(args, env, dist_port, ready, stop, results):
+    os.environ.update(env)
+    connector = init_connector("kv_producer", args, dist_port)
+    kv_caches = make_kv_caches(args, args.prefill_blocks)
+    for name, caches in kv_caches.items():
+        layer = int(name.split(".")[2])
+        for cache in caches:
+            for block_id in range(args.prefill_blocks):
+                cache[block_id].fill_(block_value(block_id, layer))
+    connector.register_kv_caches(kv_caches)
+    ready.set()
+
+    released = 0
+    while not stop.is_set():
+        done_sending, _ = connector.get_finished(set())
+        released += len(done_sending)
+        time.sleep(0.001)
+    done_sending, _ = connector.get_finished(set())
+    results.put(("prefill", {"released": released + len(done_sending)}))
+
+
+def check_blocks(kv_caches, local_block_ids, remote_block_ids) -> bool:
+    for name, caches in kv_caches.items():
+        layer = int(name.split(".")[2])
+        for cache in caches:
+            for local, remote in zip(local_block_ids, remote_block_ids):
+                if not bool((cache[local] == block_value(remote, layer)).all()):
+                    return False
+    return True
+
+
+def run_decode(args, env, dist_port, prefill_ready, results):
+    os.environ.update(env)
+    from omni.accelerators.pd.llmdatadist_connector_v1 import DatadistConnectorMetadata
+
+    connector = init_connector("kv_consumer", args, dist_port)
+    kv_caches = make_kv_caches(args, args.decode_blocks)
+    if not prefill_ready.wait(timeout=300):
+        raise RuntimeError("The prefill process did not start.")
+    connector.register_kv_caches(kv_caches)
+
+    rng = random.Random(args.seed)
+    remote_host = f"tcp://{PREFILL_IP}:{os.environ['VLLM_LLMDATADIST_ZMQ_PORT']}"
+    free_blocks = list(range(args.decode_blocks))
+    inflight = {}  # request id -> (submit time, local block ids, remote block ids)
+    latencies = []
+    num_submitted = num_checked = 0
+    start = time.perf_counter()
+    while num_submitted < args.num_requests or inflight:
+        metadata = DatadistConnectorMetadata()
+        while (num_submitted < args.num_requests and len(metadata.requests) < args.requests_per_step
+               and len(free_blocks) >= args.blocks_per_request):
+            request_id = f"req-{num_submitted}"
+            local_block_ids = [free_blocks.pop() for _ in range(args.blocks_per_request)]
+            remote_block_ids = rng.sample(range(args.prefill_blocks), args.blocks_per_request)
+            metadata.add_new_req(request_id, local_block_ids, dict(
+                remote_block_ids=remote_block_ids, remote_cluster_id="0",
+                remote_host_ip=remote_host, spec_token_ids=None))
+            inflight[request_id] = (time.perf_counter(), local_block_ids, remote_block_ids)
+            num_submitted += 1
+        if metadata.requests:
+            connector.bind_connector_metadata(metadata)
+            connector.start_load_kv(None)
+            connector.clear_connector_metadata()
+
+        _, done_recving = connector.get_finished(set())
+        now = time.perf_counter()
+        for request_id in done_recving:
+            submit_time, local_block_ids, remote_block_ids = inflight.pop(request_id)
+            latencies.append(now - submit_time)
+            if int(request_id.split("-")[1]) % args.check_every == 0:
+                if not check_blocks(kv_caches, local_block_ids, remote_block_ids):
+                    raise AssertionError(f"The blocks of {request_id} differ from the prefill caches.")
+                num_checked += 1
+            free_blocks.extend(local_block_ids)
+        time.sleep(args.step_ms / 1000)
+    elapsed = time.perf_counter() - start
+
+    block_bytes = sum(cache[0].numel() * cache.element_size() for caches in kv_caches.values() for cache in caches)
+    latencies.sort()
+    results.put(("decode", {
+        "elapsed": elapsed,
+        "bytes": args.num_requests * args.blocks_per_request * block_bytes,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max": latencies[-1],
+        "checked": num_checked,
+    }))
+
+
+def wait_for_result(results, processes):
+    """The next (role, result) of `results`, failing as soon as a process has died."""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode is not None and process.exitcode != 0:
+                    raise RuntimeError(f"The {process.name} process exited with {process.exitcode}, see its logs.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-requests", type=int, default=256)
+    parser.add_argument("--requests-per-step", type=int, default=8)
+    parser.add_argument("--blocks-per-request", type=int, default=16)
+    parser.add_argument("--step-ms", type=float, default=1.0, help="time between two scheduler steps on decode")
+    parser.add_argument("--num-layers", type=int, default=8)
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--kv-lora-rank", type=int, default=512)
+    parser.add_argument("--rope-dim", type=int, default=64)
+    parser.add_argument("--dtype", default="bfloat16")
+    parser.add_argument("--prefill-blocks", type=int, default=256)
+    parser.add_argument("--decode-blocks", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="injected latency of every pull")
+    parser.add_argument("--bandwidth-gb-s", type=float, default=0.0, help="injected link bandwidth, 0 for no limit")
+    parser.add_argument("--additional-config", default="{}", help="additional_config of both connectors, as json")
+    parser.add_argument("--loopback-dir", default="/dev/shm/omni_kv_loopback_bench")
+    parser.add_argument("--check-every", type=int, default=8, help="check the blocks of every n-th request")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.blocks_per_request > min(args.prefill_blocks, args.decode_blocks):
+        parser.error("--blocks-per-request should not exceed --prefill-blocks and --decode-blocks")
+
+    ctx = multiprocessing.get_context("spawn")
+    prefill_ready, stop = ctx.Event(), ctx.Event()
+    results = ctx.Queue()
+    with tempfile.TemporaryDirectory() as workdir:
+        envs = write_rank_tables(workdir)
+        zmq_port = str(free_port())
+        for env in envs.values():
+            env["VLLM_LLMDATADIST_ZMQ_PORT"] = zmq_port
+            env["VLLM_THREAD_DUMP_PATH"] = os.path.join(workdir, "threads")
+        prefill = ctx.Process(target=run_prefill, name="prefill",
+                              args=(args, envs["prefill"], free_port(), prefill_ready, stop, results))
+        decode = ctx.Process(target=run_decode, name="decode",
+                             args=(args, envs["decode"], free_port(), prefill_ready, results))
+        prefill.start()
+        decode.start()
+        try:
+            _, decode_result = wait_for_result(results, (prefill, decode))
+            # the last acks may still be on their way to the prefill side
+            time.sleep(0.5)
+            stop.set()
+            _, prefill_result = wait_for_result(results, (prefill, ))
+        finally:
+            for process in (decode, prefill):
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+    print(f"{args.num_requests} requests x {args.blocks_per_request} blocks, {args.num_layers} layers, "
+          f"latency {args.latency_ms} ms, bandwidth {args.bandwidth_gb_s or 'unlimited'} GB/s, "
+          f"additional_config {args.additional_config}")
+    print(f"throughput: {decode_result['bytes'] / decode_result['elapsed'] / 1e9:.2f} GB/s "
+          f"({decode_result['bytes'] / 2**20:.0f} MiB in {decode_result['elapsed']:.2f} s)")
+    print(f"request completion latency: p50 {decode_result['p50'] * 1e3:.2f} ms, "
+          f"p99 {decode_result['p99'] * 1e3:.2f} ms, max {decode_result['max'] * 1e3:.2f} ms")
+    print(f"checked requests: {decode_result['checked']}, released on prefill: "
+          f"{prefill_result['released']}/{args.num_requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Microbenchmark of the async_pull_kv fast path metadata serialization:
+pickle of the whole metadata object versus the framed int32 format of
+`omni.accelerators.pd.metadata_codec`.
+
+    python benchmarks/pd/bench_metadata_codec.py --num-blocks 1000 10000 100000
+"""
+
+import argparse
+import pickle
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "omni" / "accelerators" / "pd"))
+from metadata_codec import decode_requests, encode_requests  # noqa: E402
+
+
+# Same fields as `llmdatadist_connector_v1.ReqMeta`, redefined here so that the
+# benchmark runs without vllm installed.
+@dataclass
+class ReqMeta:
+    local_block_ids: list
+    remote_block_ids: list
+    remote_host: str
+    remote_cluster_id: str
+    spec_token_ids: Optional[list[int]]
+
+
+class Metadata:
+    def __init__(self, requests):
+        self.requests = requests
+
+
+def make_requests(num_reqs: int, num_blocks: int, omni: bool) -> dict[str, ReqMeta]:
+    requests = {}
+    for i in range(num_reqs):
+        remote = list(range(i * num_blocks, (i + 1) * num_blocks))
+        local = list(range(num_blocks, 0, -1))
+        if omni:
+            local = [local, local[:4]]
+        requests[f"chatcmpl-{i:08d}"] = ReqMeta(
+            local_block_ids=local,
+            remote_block_ids=remote,
+            remote_host="tcp://10.0.0.1:5568",
+            remote_cluster_id="16",
+            spec_token_ids=[1],
+        )
+    return requests
+
+
+def timeit(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-blocks", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="block ids per request")
+    parser.add_argument("--num-reqs", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--omni", action="store_true", help="use the omni attention nested layout")
+    args = parser.parse_args()
+
+    print(f"{'blocks':>8} {'pickle enc':>11} {'pickle dec':>11} {'frame enc':>11} {'frame dec':>11}"
+          f" {'pickle B':>10} {'frame B':>10}   (us per message)")
+    for num_blocks in args.num_blocks:
+        requests = make_requests(args.num_reqs, num_blocks, args.omni)
+        metadata = Metadata(requests)
+        payload = pickle.dumps(metadata)
+        frames = [bytes(frame) for frame in encode_requests(requests)]
+        decoded = decode_requests(frames)
+        for req_id, meta in requests.items():
+            if decoded[req_id]["remote_block_ids"].tolist() != meta.remote_block_ids:
+                raise RuntimeError(f"Round trip mismatch for {req_id}.")
+
+        pickle_enc = timeit(lambda: pickle.dumps(metadata), args.repeat)
+        pickle_dec = timeit(lambda: pickle.loads(payload), args.repeat)
+        frame_enc = timeit(lambda: encode_requests(requests), args.repeat)
+        frame_dec = timeit(lambda: decode_requests(frames), args.repeat)
+        print(f"{num_blocks:>8} {pickle_enc:>11.1f} {pickle_dec:>11.1f} {frame_enc:>11.1f} {frame_dec:>11.1f}"
+              f" {len(payload):>10} {sum(len(f) for f in frames):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Time of the rank-modulo replica selection of `HEAT_ExpertsBalancer`
+(`placement_pattern_super`) on a placement pattern:
+
+- loop: the previous selection, one `torch.where` and `torch.sort` per
+  (layer, expert) with replicas that are not on the rank
+- vectorized: `replica_selection.replica_placement_pattern`, cumsum/gather ops
+- all ranks: `replica_selection.select_replica_devices` for every rank in one
+  pass, as used by `HEAT_ExpertsBalancer.build_expert_mappings_all_ranks`,
+  against the loop run once per rank
+
+Both selections are checked to be equal before timing. Without `--pattern`,
+every device holds an even share of the experts of each layer plus
+`--redundant` random replicas.
+
+    python benchmarks/placement/bench_heat_mapping.py
+    python benchmarks/placement/bench_heat_mapping.py --pattern omni/accelerators/placement/tests/patterns/DSV3_RedFullLays_+58_58_MoELayers_64_dies_Rand_0411.npy
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "omni" / "accelerators" / "placement" / "omni_planner" / "optim"))
+from replica_selection import replica_owner_table, replica_placement_pattern, select_replica_devices  # noqa: E402
+
+
+def loop_placement_pattern_super(placement_pattern, rank):
+    expert_counts = torch.sum(placement_pattern, dim=0, dtype=torch.int)
+    placement_pattern_super = torch.zeros_like(placement_pattern, dtype=torch.int)
+    placement_pattern_super = torch.where((expert_counts == 1).unsqueeze(0), placement_pattern, placement_pattern_super)
+    multi_device_mask = (expert_counts >= 2)
+    placement_pattern_super[rank, (placement_pattern[rank] == 1) & multi_device_mask] = 1
+    l_indices, e_indices = torch.where((~(placement_pattern[rank] == 1)) & multi_device_mask)
+    if len(l_indices) > 0:
+        relevant_mapping = placement_pattern[:, l_indices, e_indices]
+        target_indices_in_group = rank % expert_counts[l_indices, e_indices]
+        for i in range(len(l_indices)):
+            devices_with_expert = torch.where(relevant_mapping[:, i] == 1)[0]
+            sorted_devices = torch.sort(devices_with_expert)[0]
+            placement_pattern_super[sorted_devices[target_indices_in_group[i]], l_indices[i], e_indices[i]] = 1
+    return placement_pattern_super
+
+
+def synthetic_pattern(num_devices, num_layers, num_experts, redundant, rng):
+    pattern = np.zeros((num_devices, num_layers, num_experts), dtype=np.int64)
+    for layer in range(num_layers):
+        experts = rng.permutation(num_experts)
+        pattern[experts % num_devices, layer, experts] = 1
+        for device in range(num_devices):
+            free = np.flatnonzero(pattern[device, layer] == 0)
+            pattern[device, layer, rng.choice(free, size=min(redundant, len(free)), replace=False)] = 1
+    return torch.from_numpy(pattern)
+
+
+def timeit(fn, iters):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pattern", type=str, default=None, help="placement pattern .npy file")
+    parser.add_argument("--devices", type=int, default=64)
+    parser.add_argument("--layers", type=int, default=58)
+    parser.add_argument("--experts", type=int, default=256)
+    parser.add_argument("--redundant", type=int, default=1, help="extra replicas per device and layer")
+    parser.add_argument("--loop-ranks", type=int, default=4, help="ranks timed with the loop, extrapolated to all")
+    parser.add_argument("--iters", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.pattern:
+        placement_pattern = torch.from_numpy(np.load(args.pattern).astype(np.int64))
+    else:
+        placement_pattern = synthetic_pattern(args.devices, args.layers, args.experts, args.redundant,
+                                              np.random.default_rng(args.seed))
+    num_devices, num_layers, num_experts = placement_pattern.shape
+    expert_counts = placement_pattern.sum(dim=0)
+    print(f"{num_devices} devices, {num_layers} layers, {num_experts} experts,"
+          f" {int((expert_counts >= 2).sum())} (layer, expert) pairs with replicas")
+
+    loop_ranks = list(range(min(args.loop_ranks, num_devices)))
+    for rank in loop_ranks:
+        if not torch.equal(loop_placement_pattern_super(placement_pattern, rank),
+                           replica_placement_pattern(placement_pattern, rank)):
+            raise AssertionError(f"placement_pattern_super mismatch for rank {rank}")
+
+    t_loop = sum(timeit(lambda: loop_placement_pattern_super(placement_pattern, rank), 1)
+                 for rank in loop_ranks) / len(loop_ranks)
+    t_vec = timeit(lambda: replica_placement_pattern(placement_pattern, 0), args.iters)
+    t_all = timeit(lambda: select_replica_devices(placement_pattern, torch.arange(num_devices),
+                                                  replica_owner_table(placement_pattern)), args.iters)
+
+    print(f"{'':>10} {'loop ms':>10} {'vector ms':>10} {'speedup':>8}")
+    print(f"{'one rank':>10} {t_loop * 1e3:>10.2f} {t_vec * 1e3:>10.2f} {t_loop / t_vec:>7.1f}x")
+    print(f"{'all ranks':>10} {t_loop * num_devices * 1e3:>10.2f} {t_all * 1e3:>10.2f}"
+          f" {t_loop * num_devices / t_all:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
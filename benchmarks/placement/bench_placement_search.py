@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Load imbalance of the placement patterns of omni_pattern_tool step 2 on the
+shapes (ranks, layers, experts, replicas per rank) of the bundled pattern files:
+
+- bundled: the pattern file itself
+- greedy: `allocate_expert_deployments_improved` + `distribute_experts_to_ranks`
+  with the same number of experts per rank
+- local search: `refine_placement_local_search` seeded from the greedy placement
+
+The load of a rank is the sum of load / deployments of its experts, like in
+step 4. The script reports the mean over the layers of the max-to-mean rank
+load and the sum over the layers of the maximum rank load ("Load Balance
+Degree" of step 4's `calculate_max_load_reduction`). Without `--load`, expert
+loads are drawn from a log-normal distribution per layer.
+
+    python benchmarks/placement/bench_placement_search.py
+    python benchmarks/placement/bench_placement_search.py --load topk_id_count/topk_ids_count_xxx.npy --layers 58
+"""
+
+import argparse
+import glob
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+PLACEMENT_DIR = Path(__file__).resolve().parents[2] / "omni" / "accelerators" / "placement"
+sys.path.insert(0, str(PLACEMENT_DIR / "utils" / "omni_pattern_tool"))
+from step_1_generate_csv_with_ceiling import load_activation_counts  # noqa: E402
+from step_2_placement_pattern_generation import (  # noqa: E402
+    allocate_expert_deployments_improved, distribute_experts_to_ranks, refine_placement_local_search)
+
+
+def rank_loads(placement_matrix, loads):
+    return placement_matrix @ (loads / np.maximum(placement_matrix.sum(axis=0), 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patterns", nargs="+", default=None, help="placement pattern .npy files (default: bundled ones)")
+    parser.add_argument("--load", type=str, default=None, help="step 1 activation counts (.npy or .csv)")
+    parser.add_argument("--layers", type=int, default=8, help="layers evaluated per pattern")
+    parser.add_argument("--sigma", type=float, default=0.8, help="log-normal sigma of the synthetic loads")
+    parser.add_argument("--iterations", type=int, default=5000, help="local search moves per layer")
+    parser.add_argument("--expert-redundant-limit", type=int, default=11)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    paths = args.patterns or sorted(glob.glob(str(PLACEMENT_DIR / "tests" / "patterns" / "*.npy"))
+                                    + glob.glob(str(PLACEMENT_DIR / "patterns" / "**" / "*.npy"), recursive=True))
+    recorded = load_activation_counts(args.load) if args.load else None
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'pattern':<44} {'method':<13} {'max/mean':>9} {'sum max':>10} {'vs greedy':>10} {'s/layer':>8}")
+    for path in paths:
+        pattern = np.load(path).astype(np.int32)
+        num_ranks, num_layers, num_experts = pattern.shape
+        results = {"bundled": [], "greedy": [], "local search": []}
+        times = {"bundled": 0.0, "greedy": 0.0, "local search": 0.0}
+        for layer in range(min(args.layers, num_layers)):
+            if recorded is not None:
+                loads = np.asarray(recorded[layer % recorded.shape[0]], dtype=float)
+                if loads.shape[0] != num_experts:
+                    sys.exit(f"{args.load} has {loads.shape[0]} experts, {path} has {num_experts}")
+            else:
+                loads = rng.lognormal(0.0, args.sigma, num_experts) * 100
+            mean_load = loads.sum() / num_ranks
+            results["bundled"].append(rank_loads(pattern[:, layer], loads).max() / mean_load)
+
+            slots = int(pattern[:, layer].sum(axis=1).max())
+            budget = slots * num_ranks - num_experts
+            start = time.perf_counter()
+            deployments = allocate_expert_deployments_improved(
+                loads, args.expert_redundant_limit, budget, is_redundant=budget > 0)
+            greedy_max, greedy = distribute_experts_to_ranks(loads, deployments, num_ranks, layer)
+            times["greedy"] += time.perf_counter() - start
+            results["greedy"].append(greedy_max / mean_load)
+
+            start = time.perf_counter()
+            refined_max, refined = refine_placement_local_search(
+                loads, greedy, args.expert_redundant_limit, is_redundant=budget > 0,
+                num_iterations=args.iterations, seed=layer, layer_idx=layer)
+            times["local search"] += time.perf_counter() - start
+            deployed = refined.sum(axis=0)
+            assert refined.sum(axis=1).tolist() == greedy.sum(axis=1).tolist() and deployed.min() >= 1 \
+                and deployed.max() <= args.expert_redundant_limit + 1, "constraint violated"
+            results["local search"].append(refined_max / mean_load)
+
+        name = Path(path).name
+        name = name if len(name) <= 44 else name[:41] + "..."
+        greedy_sum = float(np.sum(results["greedy"]))
+        for method, ratios in results.items():
+            ratio_sum = float(np.sum(ratios))
+            # the mean load of every layer is normalized to 1, so the sum of max/mean is the sum of maximum loads
+            reduction = (greedy_sum - ratio_sum) / greedy_sum * 100
+            print(f"{name:<44} {method:<13} {np.mean(ratios):>9.4f} {ratio_sum:>10.3f} {reduction:>9.2f}%"
+                  f" {times[method] / len(ratios):>8.3f}")
+            name = ""
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""CPU-only simulation of the prefill-first NpuHybridScheduler admission
+policies (`omni.adaptors.vllm.worker.npu_admission`).
+
+A prompt-length trace is replayed against a simple engine model: a step either
+prefills the admitted requests (cost linear in the number of tokens) or decodes
+one token of every running request. The KV cache capacity and the number of
+running requests are bounded like in the scheduler. For every policy the
+script reports TTFT percentiles and the prefill batch utilization, i.e. the
+scheduled tokens over `max_num_batched_tokens` averaged over prefill steps.
+
+    python benchmarks/scheduler/bench_admission_policy.py --num-reqs 2000 --rate 18
+    python benchmarks/scheduler/bench_admission_policy.py --trace lengths.txt
+
+The policies only differ when requests queue up. With the default engine model
+the synthetic trace saturates at about 19 req/s; at 8 req/s every policy
+admits each request on arrival (18% utilization, same TTFT). The default rate
+of 18 req/s is close to saturation:
+
+      policy  TTFT p50      p90      p99  long p99  prefill util  prefills
+        fifo     0.296    1.694    3.393     3.413         31.3%      1030
+         spf     0.148    0.693    5.668     8.094         28.9%      1119
+     binpack     0.195    2.476   10.993     1.559         32.5%       992
+
+spf halves the median TTFT at the cost of long prompts. binpack fills batches
+best and serves long prompts sooner, but leaves some short prompts waiting
+longest. `--ttft-deadline 2`
+bounds the p99 of both to that of fifo (about 3.4 s).
+
+A trace file has one request per line, either `prompt_len` or
+`arrival_s,prompt_len[,output_len]`.
+"""
+
+import argparse
+import random
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "omni" / "adaptors" / "vllm" / "worker"))
+from npu_admission import ADMISSION_POLICIES, create_admission_policy  # noqa: E402
+
+
+@dataclass(eq=False)
+class SimRequest:
+    arrival_time: float
+    num_tokens: int
+    output_len: int
+    num_computed_tokens: int = 0
+    first_token_time: float = -1.0
+    num_decoded: int = 0
+
+
+def load_trace(path: str, rate: float, output_len: int, rng: random.Random) -> list[SimRequest]:
+    requests, now = [], 0.0
+    for line in Path(path).read_text().splitlines():
+        fields = [f for f in line.replace(",", " ").split() if f]
+        if not fields:
+            continue
+        if len(fields) == 1:
+            now += rng.expovariate(rate)
+            requests.append(SimRequest(now, int(fields[0]), output_len))
+        else:
+            out = int(fields[2]) if len(fields) > 2 else output_len
+            requests.append(SimRequest(float(fields[0]), int(fields[1]), out))
+    return sorted(requests, key=lambda r: r.arrival_time)
+
+
+def synthetic_trace(num_reqs: int, rate: float, output_len: int, max_len: int,
+                    rng: random.Random) -> list[SimRequest]:
+    """Mostly short chat prompts with a heavy tail of long documents."""
+    requests, now = [], 0.0
+    for _ in range(num_reqs):
+        now += rng.expovariate(rate)
+        if rng.random() < 0.15:
+            length = rng.randint(max_len // 4, max_len)
+        else:
+            length = min(max_len, int(rng.lognormvariate(6.0, 0.8)) + 16)
+        requests.append(SimRequest(now, length, output_len))
+    return requests
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def simulate(trace: list[SimRequest], policy, args) -> dict:
+    requests = [SimRequest(r.arrival_time, r.num_tokens, r.output_len) for r in trace]
+    pending = list(requests)
+    pending.reverse()
+    waiting: list[SimRequest] = []
+    running: list[SimRequest] = []
+    kv_used = 0
+    now = 0.0
+    prefill_utils = []
+    num_done = 0
+
+    while num_done < len(requests):
+        while pending and pending[-1].arrival_time <= now:
+            waiting.append(pending.pop())
+        if not waiting and not running:
+            now = pending[-1].arrival_time
+            continue
+
+        # Prefill-first: try to build a prefill batch.
+        budget = args.max_num_batched_tokens
+        admitted = []
+        if waiting:
+            ordered = policy.order(waiting, budget, now, args.max_num_seqs - len(running))
+            skipped = []
+            for i, request in enumerate(ordered):
+                if budget <= 0 or len(running) + len(admitted) >= args.max_num_seqs:
+                    skipped.extend(ordered[i:])
+                    break
+                if request.num_tokens > budget:
+                    skipped.append(request)
+                    continue
+                need = request.num_tokens + request.output_len
+                if kv_used + need > args.kv_capacity:
+                    if policy.stop_on_alloc_failure:
+                        skipped.extend(ordered[i:])
+                        break
+                    skipped.append(request)
+                    continue
+                kv_used += need
+                budget -= request.num_tokens
+                admitted.append(request)
+            waiting = skipped
+
+        if admitted:
+            tokens = sum(r.num_tokens for r in admitted)
+            now += args.step_overhead + tokens * args.prefill_cost_per_token
+            prefill_utils.append(tokens / args.max_num_batched_tokens)
+            for request in admitted:
+                request.first_token_time = now
+                running.append(request)
+            continue
+
+        if not running:
+            # Nothing fits until a new request arrives.
+            now = pending[-1].arrival_time if pending else now
+            continue
+        now += args.step_overhead + len(running) * args.decode_cost_per_seq
+        still_running = []
+        for request in running:
+            request.num_decoded += 1
+            if request.num_decoded >= request.output_len:
+                kv_used -= request.num_tokens + request.output_len
+                num_done += 1
+            else:
+                still_running.append(request)
+        running = still_running
+
+    ttft = [r.first_token_time - r.arrival_time for r in requests]
+    long_ttft = [r.first_token_time - r.arrival_time for r in requests
+                 if r.num_tokens >= args.max_num_batched_tokens // 2]
+    return dict(
+        p50=percentile(ttft, 50),
+        p90=percentile(ttft, 90),
+        p99=percentile(ttft, 99),
+        long_p99=percentile(long_ttft, 99),
+        util=sum(prefill_utils) / len(prefill_utils) if prefill_utils else 0.0,
+        prefill_steps=len(prefill_utils),
+        makespan=now,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", type=str, default=None, help="prompt length trace file")
+    parser.add_argument("--num-reqs", type=int, default=2000, help="requests of the synthetic trace")
+    parser.add_argument("--rate", type=float, default=18.0, help="arrival rate (req/s) if the trace has none")
+    parser.add_argument("--max-len", type=int, default=8192, help="longest synthetic prompt")
+    parser.add_argument("--output-len", type=int, default=64)
+    parser.add_argument("--max-num-batched-tokens", type=int, default=8192)
+    parser.add_argument("--max-num-seqs", type=int, default=64)
+    parser.add_argument("--kv-capacity", type=int, default=262144, help="KV cache capacity in tokens")
+    parser.add_argument("--step-overhead", type=float, default=0.01, help="fixed cost of a step (s)")
+    parser.add_argument("--prefill-cost-per-token", type=float, default=2e-5)
+    parser.add_argument("--decode-cost-per-seq", type=float, default=2e-4)
+    parser.add_argument("--ttft-deadline", type=float, default=0.0, help="admission_ttft_deadline_s")
+    parser.add_argument("--aging", type=float, default=1024.0, help="admission_aging_tokens_per_s")
+    parser.add_argument("--window", type=int, default=64, help="admission_window")
+    parser.add_argument("--policies", nargs="+", default=list(ADMISSION_POLICIES), choices=ADMISSION_POLICIES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.trace:
+        trace = load_trace(args.trace, args.rate, args.output_len, rng)
+    else:
+        trace = synthetic_trace(args.num_reqs, args.rate, args.output_len, args.max_len, rng)
+    # the scheduler rejects prompts longer than the token budget
+    trace = [r for r in trace if r.num_tokens <= args.max_num_batched_tokens]
+
+    print(f"{len(trace)} requests, mean prompt {sum(r.num_tokens for r in trace) / len(trace):.0f} tokens")
+    print(f"{'policy':>8} {'TTFT p50':>9} {'p90':>8} {'p99':>8} {'long p99':>9}"
+          f" {'prefill util':>13} {'prefills':>9} {'makespan':>9}   (seconds)")
+    for name in args.policies:
+        policy = create_admission_policy(dict(
+            admission_policy=name,
+            admission_ttft_deadline_s=args.ttft_deadline,
+            admission_aging_tokens_per_s=args.aging,
+            admission_window=args.window,
+        ))
+        res = simulate(trace, policy, args)
+        print(f"{name:>8} {res['p50']:>9.3f} {res['p90']:>8.3f} {res['p99']:>8.3f} {res['long_p99']:>9.3f}"
+              f" {res['util']:>12.1%} {res['prefill_steps']:>9} {res['makespan']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Padding waste of torchair decode gear lists on a decode batch size histogram
+(`omni.adaptors.vllm.compilation.gear_optimizer`).
+
+For the current `decode_gear_list` and for the gears chosen by `optimize_gears`
+with 1..MAX_GEAR_NUM gears, the script reports the padded tokens per decode
+step and the fraction of the computed rows that are padding.
+
+The histogram is either recorded by the model runner
+(`decode_batch_histogram_dump_path`, one file per DP rank) or synthesized: every
+DP rank runs a batch drawn around `--mean-batch`, and the gear is chosen for
+the largest batch over the DP ranks, like in `NPUModelRunner`.
+
+    python benchmarks/worker/bench_gear_selection.py --histogram "/tmp/gears.dp*.json" --max-batch-size 128 --current 128
+    python benchmarks/worker/bench_gear_selection.py --dp 8 --mean-batch 24 --max-batch-size 64 --current 8 16 32 64
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "omni" / "adaptors" / "vllm" / "compilation"))
+from gear_optimizer import DecodeBatchHistogram, optimize_gears, padded_tokens  # noqa: E402
+
+MAX_GEAR_NUM = 6  # compile_config.MAX_GEAR_NUM, which needs torchair to import
+
+
+def synthetic_histogram(num_steps: int, dp: int, mean_batch: float, max_batch_size: int,
+                        rng: random.Random) -> dict[int, int]:
+    histogram = DecodeBatchHistogram()
+    for _ in range(num_steps):
+        sizes = [min(max_batch_size, max(1, round(rng.gauss(mean_batch, mean_batch / 3)))) for _ in range(dp)]
+        histogram.record(max(sizes))
+    return histogram.counts
+
+
+def report(name: str, counts: dict[int, int], gears: list[int]) -> None:
+    num_steps = sum(counts.values())
+    num_tokens = sum(size * count for size, count in counts.items())
+    padding = padded_tokens(counts, gears)
+    print(f"{name:>10} {padding / num_steps:>12.2f} {padding / (padding + num_tokens):>9.1%}   {gears}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--histogram", nargs="+", default=None, help="recorded histogram files or glob patterns")
+    parser.add_argument("--max-batch-size", type=int, default=64,
+                        help="largest gear, in tokens: max_num_seqs * (1 + num_speculative_tokens)")
+    parser.add_argument("--current", type=int, nargs="+", default=None, help="current decode_gear_list")
+    parser.add_argument("--align", type=int, default=1, help="gears are multiples of it, 1 + num_speculative_tokens")
+    parser.add_argument("--num-steps", type=int, default=100000, help="steps of the synthetic histogram")
+    parser.add_argument("--dp", type=int, default=4, help="DP ranks of the synthetic histogram")
+    parser.add_argument("--mean-batch", type=float, default=20.0, help="mean batch of a DP rank")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.histogram:
+        counts = DecodeBatchHistogram.load(args.histogram).counts
+    else:
+        counts = synthetic_histogram(args.num_steps, args.dp, args.mean_batch, args.max_batch_size,
+                                     random.Random(args.seed))
+    if not counts:
+        sys.exit("empty histogram")
+    current = sorted(args.current or [args.max_batch_size])
+
+    print(f"{sum(counts.values())} decode steps, {len(counts)} distinct batch sizes")
+    print(f"{'gears':>10} {'pad tok/step':>12} {'pad rows':>9}   gear list")
+    report("current", counts, current)
+    for num_gears in range(1, MAX_GEAR_NUM + 1):
+        start = time.perf_counter()
+        gears = optimize_gears(counts, args.max_batch_size, num_gears, args.align)
+        elapsed = time.perf_counter() - start
+        report(f"opt {num_gears}", counts, gears)
+    print(f"optimizing {MAX_GEAR_NUM} gears took {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
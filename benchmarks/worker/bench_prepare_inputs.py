@@ -0,0 +1,131 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Host-side microbenchmark of the decode part of `NPUModelRunner._prepare_inputs`
+and of the input_ids padding of `_execute_model`, against the batch size:
+
+- baseline: a zero padding is allocated and concatenated to positions and
+  input_ids, and the sample indices are copied from numpy, every step
+- arena: the persistent per-gear buffers of
+  `omni.adaptors.vllm.worker.npu_input_buffers` are updated in place and the
+  sample indices are a slice of a persistent arange
+
+Only the host time of the launches is measured, which is what the decode hot
+loop waits for before the graph can be launched.
+
+    python benchmarks/worker/bench_prepare_inputs.py --batch-sizes 1 8 32 64 128 --gears 8 32 64 128
+    python benchmarks/worker/bench_prepare_inputs.py --device npu
+"""
+
+import argparse
+import bisect
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "omni" / "adaptors" / "vllm" / "worker"))
+from npu_input_buffers import GearBufferArena  # noqa: E402
+
+
+class DecodeInputs:
+    """The persistent buffers of the model runner used by both variants."""
+
+    def __init__(self, max_num_tokens: int, device: torch.device):
+        self.device = device
+        self.positions_cpu = torch.zeros(max_num_tokens, dtype=torch.int64)
+        self.positions_np = self.positions_cpu.numpy()
+        self.positions = torch.zeros(max_num_tokens, dtype=torch.int64, device=device)
+        self.input_ids_cpu = torch.zeros(max_num_tokens, dtype=torch.int64)
+        self.input_ids = torch.zeros(max_num_tokens, dtype=torch.int64, device=device)
+        self.arange_np = np.arange(max_num_tokens)
+        self.arange_dev = torch.arange(max_num_tokens, dtype=torch.int64, device=device)
+        self.num_computed_tokens = np.random.randint(100, 4000, size=max_num_tokens).astype(np.int32)
+
+    def common(self, num_reqs: int):
+        """The numpy part shared by both variants, and the host to device copies."""
+        num_scheduled_tokens = np.ones(num_reqs, dtype=np.int32)
+        req_indices = np.repeat(self.arange_np[:num_reqs], num_scheduled_tokens)
+        cu_num_tokens = np.cumsum(num_scheduled_tokens)
+        cumsums_offsets = np.repeat(cu_num_tokens - num_scheduled_tokens, num_scheduled_tokens)
+        arange = self.arange_np[:num_reqs] - cumsums_offsets
+        np.add(self.num_computed_tokens[req_indices], arange, out=self.positions_np[:num_reqs])
+        self.positions[:num_reqs].copy_(self.positions_cpu[:num_reqs], non_blocking=True)
+        self.input_ids[:num_reqs].copy_(self.input_ids_cpu[:num_reqs], non_blocking=True)
+        return cu_num_tokens
+
+
+def baseline_step(inputs: DecodeInputs, num_reqs: int, gear: int):
+    cu_num_tokens = inputs.common(num_reqs)
+    pad = gear - num_reqs
+    positions = inputs.positions[:num_reqs]
+    positions = torch.cat([positions, torch.zeros(pad, dtype=positions.dtype, device=positions.device)])
+    sample_indices = torch.from_numpy(cu_num_tokens - 1).to(inputs.device, non_blocking=True)
+    input_ids = inputs.input_ids[:num_reqs]
+    if pad > 0:
+        input_ids = torch.cat([input_ids, torch.zeros(pad, dtype=input_ids.dtype, device=input_ids.device)])
+    return input_ids, positions, sample_indices
+
+
+def arena_step(inputs: DecodeInputs, arena: GearBufferArena, num_reqs: int, gear: int):
+    inputs.common(num_reqs)
+    buffers = arena.get(gear)
+    positions = buffers.fill_positions(inputs.positions[:num_reqs])
+    sample_indices = inputs.arange_dev[:num_reqs]
+    input_ids = buffers.fill_input_ids(inputs.input_ids[:num_reqs])
+    return input_ids, positions, sample_indices
+
+
+def synchronize(device: torch.device):
+    if device.type == "npu":
+        torch.npu.synchronize()
+
+
+def timeit(fn, device: torch.device, repeat: int) -> float:
+    for _ in range(10):
+        fn()
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = time.perf_counter() - start
+    synchronize(device)
+    return elapsed / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16, 32, 64, 96, 128])
+    parser.add_argument("--gears", type=int, nargs="+", default=[8, 16, 32, 64, 128])
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or npu")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.device == "npu":
+        import torch_npu  # noqa: F401
+    device = torch.device(args.device)
+    gears = sorted(args.gears)
+    inputs = DecodeInputs(max(gears), device)
+    arena = GearBufferArena(gears, dtype=torch.int64, device=device)
+
+    print(f"{'batch':>6} {'gear':>6} {'baseline us':>12} {'arena us':>10} {'speedup':>8}")
+    for num_reqs in args.batch_sizes:
+        idx = bisect.bisect_left(gears, num_reqs)
+        if idx == len(gears):
+            print(f"{num_reqs:>6} exceeds the largest gear, skipped")
+            continue
+        gear = gears[idx]
+        base_ids, base_pos, base_idx = baseline_step(inputs, num_reqs, gear)
+        arena_ids, arena_pos, arena_idx = arena_step(inputs, arena, num_reqs, gear)
+        if not (torch.equal(base_ids, arena_ids) and torch.equal(base_pos, arena_pos)
+                and torch.equal(base_idx.to(arena_idx.dtype), arena_idx)):
+            raise RuntimeError(f"Mismatching inputs for batch size {num_reqs}.")
+        base = timeit(lambda: baseline_step(inputs, num_reqs, gear), device, args.repeat)
+        new = timeit(lambda: arena_step(inputs, arena, num_reqs, gear), device, args.repeat)
+        print(f"{num_reqs:>6} {gear:>6} {base:>12.1f} {new:>10.1f} {base / new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
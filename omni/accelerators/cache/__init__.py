@@ -21,11 +21,10 @@ from .kv_cache_manager import (
     OmniKVCacheBlocks,
     OmniKVCacheManager,
 )
-from .pd import OmniBiGroupDataDistManager
-from .utils import compute_omni_attn_metadata
+from .utils import compute_omni_attn_metadata, compute_omni_attn_prefill_context
 
 
-def apply_omni_attn_patch(enable=False, is_kv_consumer=True, config=None):
+def apply_omni_attn_patch(enable=False, is_kv_consumer=True, config=None, is_colocated=False):
     if not enable:
         return
 
@@ -54,19 +53,26 @@ def apply_omni_attn_patch(enable=False, is_kv_consumer=True, config=None):
             if not isinstance(pattern, list) or any(pi not in [0,1] for pi in pattern):
                 raise ValueError(f"pattern should be a list of 0s and 1s, but is given {pattern}")
             itfc.PATTERN = pattern
+        if "enable_prefix_caching" in config:
+            prefix_caching_val = config["enable_prefix_caching"]
+            if not isinstance(prefix_caching_val, bool):
+                raise ValueError(f"enable_prefix_caching should be bool, but is given {prefix_caching_val}")
+            OmniKVCacheManager.prefix_caching_opt_in = prefix_caching_val
 
-    if is_kv_consumer:
-        # use Omni-related classes and methods only for KV consumers
-        kv_cache_utils.get_kv_cache_config = get_kv_cache_config_omni_type
-        engine_core.get_kv_cache_config = get_kv_cache_config_omni_type
-        GPUModelRunner.get_kv_cache_spec = get_omni_hybrid_kv_cache_spec
-        block_table.MultiGroupBlockTable = OmniMultiGroupBlockTable
-        gpu_input_batch.MultiGroupBlockTable = OmniMultiGroupBlockTable
+    # prefill instances keep only the sink and recent window in compressed
+    # layers as well, which is what decode instances pull
+    kv_cache_utils.get_kv_cache_config = get_kv_cache_config_omni_type
+    engine_core.get_kv_cache_config = get_kv_cache_config_omni_type
+    GPUModelRunner.get_kv_cache_spec = get_omni_hybrid_kv_cache_spec
+    block_table.MultiGroupBlockTable = OmniMultiGroupBlockTable
+    gpu_input_batch.MultiGroupBlockTable = OmniMultiGroupBlockTable
 
-        orig_manager.KVCacheBlocks = OmniKVCacheBlocks
-        orig_manager.KVCacheManager = OmniKVCacheManager
-        scheduler.KVCacheBlocks = OmniKVCacheBlocks
-        scheduler.KVCacheManager = OmniKVCacheManager
+    orig_manager.KVCacheBlocks = OmniKVCacheBlocks
+    orig_manager.KVCacheManager = OmniKVCacheManager
+    scheduler.KVCacheBlocks = OmniKVCacheBlocks
+    scheduler.KVCacheManager = OmniKVCacheManager
+    # prompts are prefilled locally into the compressed layers, except on decode instances
+    OmniKVCacheManager.window_from_remote_prefill = is_kv_consumer and not is_colocated
 
 
 __all__ = [
@@ -11,7 +11,7 @@ from vllm.distributed.kv_events import KVCacheEvent
 from vllm.logger import init_logger
 from vllm.utils import sha256
 from vllm.v1.core.block_pool import BlockPool
-from vllm.v1.core.kv_cache_utils import BlockHashType, KVCacheBlock
+from vllm.v1.core.kv_cache_utils import BlockHashType, KVCacheBlock, hash_request_tokens
 from vllm.v1.core.single_type_kv_cache_manager import SingleTypeKVCacheManager, FullAttentionManager
 from vllm.v1.kv_cache_interface import KVCacheSpec, FullAttentionSpec
 from vllm.v1.metrics.stats import PrefixCacheStats
@@ -60,6 +60,13 @@ class OmniKVCacheBlocks:
 
 
 class OmniKVCacheManager:
+    # Whether the compressed windows of a request are pulled from a prefill
+    # instance. On colocated and prefill instances they are computed locally
+    # from the whole prompt, so a prefix cache hit would leave them incomplete.
+    window_from_remote_prefill: bool = True
+    # Prefix caching is opt-in with omni attention (`enable_prefix_caching` in
+    # omni_attn_config), even when vLLM enables it by default.
+    prefix_caching_opt_in: bool = False
 
     def __init__(
         self,
@@ -76,12 +83,10 @@ class OmniKVCacheManager:
                 "OmniKVCacheManager does not support hybrid models with more than 2 "
                 "kv cache groups"
             )
-        if enable_caching:
+        if enable_caching and not self.prefix_caching_opt_in:
             enable_caching = False
-            logger.warning("OmniKVCacheManager does not support prefix caching yet, enable_caching is set to False")
-
-        if enable_kv_cache_events:
-            raise ValueError("OmniKVCacheManager does not support cache events yet")
+            logger.warning("OmniKVCacheManager disables prefix caching unless enable_prefix_caching "
+                           "is set in omni_attn_config.")
         # `block_size` of all groups are assumed to be the same
         self.block_size = kv_cache_config.kv_cache_groups[0].kv_cache_spec.block_size
         self.num_gpu_blocks = kv_cache_config.num_blocks
@@ -113,8 +118,11 @@ class OmniKVCacheManager:
                 )
             else:
                 num_blocks = kv_cache_config.num_blocks_per_group[type(group.kv_cache_spec)]
+                # NOTE: blocks of compressed layers only hold the sink and recent
+                # window of a request, which is rebuilt from the remote prefill
+                # every time, so they never take part in prefix caching.
                 bp = BlockPool(
-                    num_blocks, enable_caching, enable_kv_cache_events
+                    num_blocks, False, enable_kv_cache_events
                 )
                 self.block_pools.append(bp)
                 self.hybrid_managers.append(get_manager_for_kv_cache_spec(
@@ -180,14 +188,46 @@ class OmniKVCacheManager:
         # Prefix caching is disabled or
         # When the request requires prompt logprobs, we skip prefix caching.
         if (not self.enable_caching
+                or not self.window_from_remote_prefill
                 or request.sampling_params.prompt_logprobs is not None):
             return OmniKVCacheBlocks.create_empty(), 0
 
-        # Think about the logic related to prefix caching in omni attention.
-        # Currently disabled. So the function just returns empty blocks and 0.
-        # The two return values correspond to the arguments `new_computed_blocks`
-        # and `num_new_computed_tokens` in method `self.allocate_slots()`.
-        raise RuntimeError("Prefix caching is not supported with OmniAttention yet.")
+        # The block hashes for the request may already be computed
+        # if the scheduler has tried to schedule the request before.
+        block_hashes = self.req_to_block_hashes[request.request_id]
+        if not block_hashes:
+            block_hashes = hash_request_tokens(self.caching_hash_fn,
+                                               self.block_size, request)
+            self.req_to_block_hashes[request.request_id] = block_hashes
+
+        if self.log_stats:
+            if self.prefix_cache_stats is None:
+                raise RuntimeError("log_stats is enabled but prefix_cache_stats is None.")
+            self.prefix_cache_stats.requests += 1
+
+        # NOTE: When all tokens hit the cache, we must recompute the last token
+        # to obtain logits. Thus, set max_cache_hit_length to prompt_length - 1.
+        max_cache_hit_length = request.num_tokens - 1
+
+        # Only full attention layers share blocks across requests. Compressed
+        # layers keep the sink and the recent window only, whose contents depend
+        # on the whole prefix and are rebuilt into freshly allocated blocks
+        # (pulled from P together with the uncached tail of the prompt).
+        computed_blocks = self.hybrid_managers[0].find_longest_cache_hit(
+            block_hashes, max_cache_hit_length)
+        # Since incomplete blocks are not eligible for sharing,
+        # `num_computed_tokens` is always a multiple of `block_size`.
+        num_computed_tokens = len(computed_blocks) * self.block_size
+
+        if self.log_stats:
+            self.prefix_cache_stats.queries += request.num_tokens
+            self.prefix_cache_stats.hits += num_computed_tokens
+
+        if num_computed_tokens == 0:
+            return OmniKVCacheBlocks.create_empty(), 0
+        return OmniKVCacheBlocks(
+            [computed_blocks] + [[] for _ in self.hybrid_managers[1:]]
+        ), num_computed_tokens
 
     def allocate_slots(
         self,
@@ -237,10 +277,10 @@ class OmniKVCacheManager:
         if num_new_tokens == 0:
             raise ValueError("num_new_tokens must be greater than 0")
 
-        if new_computed_blocks is not None:
+        if new_computed_blocks is not None and len(new_computed_blocks.blocks) > 0:
             new_computed_block_list = new_computed_blocks.blocks
         else:
-            new_computed_block_list = []
+            new_computed_block_list = [[] for _ in self.hybrid_managers]
 
         # Free the blocks that are skipped during the attention computation
         # (e.g., tokens outside the sliding window).
@@ -262,8 +302,8 @@ class OmniKVCacheManager:
             mgr.get_num_blocks_to_allocate(
                 request_id=request.request_id,
                 num_tokens=num_tokens_need_slot,
-                new_computed_blocks=new_computed_block_list,
-            ) for mgr in self.hybrid_managers]
+                new_computed_blocks=group_computed_blocks,
+            ) for mgr, group_computed_blocks in zip(self.hybrid_managers, new_computed_block_list)]
 
         free_blocks = [bp.get_num_free_blocks() for bp in self.block_pools]
         if any(need > free for need, free in zip(num_blocks_to_allocate, free_blocks)):
@@ -272,10 +312,15 @@ class OmniKVCacheManager:
 
         # Touch the computed blocks to make sure they won't be evicted.
         if self.enable_caching:
-            raise RuntimeError("Prefix caching is not supported with OmniAttention yet.")
-        elif len(new_computed_block_list) > 0:
+            self.block_pools[0].touch(new_computed_block_list[0])
+        elif any(len(group_computed_blocks) > 0 for group_computed_blocks in new_computed_block_list):
             raise RuntimeError("Computed blocks should be empty when prefix caching is disabled")
 
+        # Append the new computed blocks to the request blocks until now to
+        # avoid the case where the new blocks cannot be allocated.
+        for mgr, group_computed_blocks in zip(self.hybrid_managers, new_computed_block_list):
+            mgr.save_new_computed_blocks(request.request_id, group_computed_blocks)
+
         # outer list is group
         # inner list is blocks of each group
         new_blocks: list[list[KVCacheBlock]] = []
@@ -396,7 +441,8 @@ class OmniKVCacheManager:
 
     def take_events(self) -> list[KVCacheEvent]:
         """Take the KV cache events from the block pool. For multiple KV Cache groups,
-        only return full attention KV events.
+        only return full attention KV events, since only the full attention pool
+        caches blocks.
 
         Returns:
             A list of KV cache events.
@@ -466,7 +512,8 @@ class OmniAttentionManager(SingleTypeKVCacheManager):
 
     def find_longest_cache_hit(self, block_hashes: list[BlockHashType],
                                max_length: int) -> list[KVCacheBlock]:
-        raise NotImplementedError("Method find_longest_cache_hit is not implemented yet for OmniAttentionManager")
+        # sink and recent blocks are rebuilt for each request and never shared
+        return []
 
     def remove_skipped_blocks(self, request_id: str,
                               num_computed_tokens: int) -> None:
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from typing_extensions import override
 import torch
 from llm_datadist.v2.llm_types import Cache, CacheDesc, BlocksCacheKey
@@ -7,6 +9,7 @@ from omni.accelerators.pd.llmdatadist_manager import (
     unzip_kv_cache,
     logger,
 )
+from omni.accelerators.pd.metrics import kv_cache_block_bytes
 from . import kv_cache_interface as itfc
 
 class OmniBiGroupDataDistManager(LLMDataDistManager):
@@ -78,15 +81,30 @@ class OmniBiGroupDataDistManager(LLMDataDistManager):
         logger.error(f" ***** registerd_kv_caches num:{sum([len(group_kv_caches) for group_kv_caches in self.registerd_kv_caches])}")
 
     @override
-    def pull_kv(self, src_blocks: list[int], tgt_blocks: list[list[int]], prompt_cluster_id: int):
+    def group_block_bytes(self, kv_caches: dict[str, torch.Tensor]) -> list[int]:
+        flatten_kv_caches = unzip_kv_cache(kv_caches)
+        num_layers = len(flatten_kv_caches[0])
+        return [
+            kv_cache_block_bytes([sub_kv_caches[i] for sub_kv_caches in flatten_kv_caches
+                                  for i in range(num_layers) if itfc.PATTERN[i] == flag])
+            for flag in range(len(self.registerd_kv_caches))
+        ]
+
+    @override
+    def pull_kv(self, src_blocks: list[int], tgt_blocks: list[list[int]], prompt_cluster_id: int,
+                deadline: Optional[float] = None):
         """Pull KV Caches for both full and omni attention layers. The input `tgt_blocks`
         is a list of lists of ints like [[blk1,...,blk100], [blk1,blk2,blk3]], where the
         first sublist is the block table for full attention layers while the second is
-        for omni. In contrast, `src_blocks` is a list corresponding to the block table
-        allocated for all layers during prefill.
+        for omni. `src_blocks` has the same layout, since prefill instances only keep the
+        sink and recent blocks in omni layers too, which are pulled one to one. A flat
+        `src_blocks` is the block table of a prefill keeping the full KV cache in every
+        layer, out of which the omni layers pull the sink and recent blocks. No pull call
+        is started after `deadline`.
         """
         if isinstance(src_blocks[0], int):
             src_blocks = [src_blocks] * len(tgt_blocks)
+        self.wait_for_links(prompt_cluster_id)
         torch.npu.set_device(f"npu:{self.local_rank}")
         sink, recent = itfc.SINK, itfc.RECENT
         omni_max_blocks = sink + recent
@@ -105,8 +123,10 @@ class OmniBiGroupDataDistManager(LLMDataDistManager):
                 prompt_cache_key = BlocksCacheKey(
                     prompt_cluster_id=prompt_cluster_id, model_id=cur_id)
                 if flag == 0:
+                    if len(group_tgt_blocks) == 0:
+                        continue
                     self._pull_blocks(prompt_cache_key, kv_cache,
-                                      group_src_blocks, group_tgt_blocks)
+                                      group_src_blocks, group_tgt_blocks, deadline=deadline)
                 else:
                     if len(group_tgt_blocks) == 0:
                         continue
@@ -120,4 +140,4 @@ class OmniBiGroupDataDistManager(LLMDataDistManager):
                                            f"{src_blocks=}, {tgt_blocks=}, "
                                            f"{len(tmp_src)=}, {len(tmp_tgt)=}.")
                     self._pull_blocks(prompt_cache_key, kv_cache,
-                                      tmp_src, tmp_tgt)
+                                      tmp_src, tmp_tgt, deadline=deadline)
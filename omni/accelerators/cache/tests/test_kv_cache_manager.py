@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import time
+import unittest
+from unittest import mock
+
+import torch
+from vllm.distributed.kv_events import BlockRemoved, BlockStored
+from vllm.sampling_params import SamplingParams
+from vllm.v1.core.kv_cache_utils import KVCacheGroupSpec
+from vllm.v1.kv_cache_interface import FullAttentionSpec
+from vllm.v1.request import Request
+
+from omni.accelerators.cache.kv_cache_interface import OmniAttentionSpec, OmniKVCacheConfig
+from omni.accelerators.cache.kv_cache_manager import OmniKVCacheManager
+
+BLOCK_SIZE = 16
+SINK_BLOCKS = 1
+RECENT_BLOCKS = 2
+
+
+def make_manager(num_blocks: int, num_omni_blocks: int, **kwargs) -> OmniKVCacheManager:
+    full_spec = FullAttentionSpec(block_size=BLOCK_SIZE, num_kv_heads=1, head_size=64,
+                                  dtype=torch.float16, use_mla=True)
+    omni_spec = OmniAttentionSpec(block_size=BLOCK_SIZE, num_kv_heads=1, head_size=64,
+                                  dtype=torch.float16, use_mla=True,
+                                  sink_blocks=SINK_BLOCKS, recent_blocks=RECENT_BLOCKS)
+    config = OmniKVCacheConfig(
+        num_blocks=num_blocks,
+        tensors={},
+        kv_cache_groups=[KVCacheGroupSpec(["layers.0"], full_spec), KVCacheGroupSpec(["layers.1"], omni_spec)],
+        num_blocks_per_group={OmniAttentionSpec: num_omni_blocks},
+    )
+    return OmniKVCacheManager(config, max_model_len=1024, **kwargs)
+
+
+def make_request(request_id: str, prompt_token_ids: list[int]) -> Request:
+    return Request(
+        request_id=request_id,
+        prompt_token_ids=prompt_token_ids,
+        multi_modal_inputs=None,
+        multi_modal_hashes=None,
+        multi_modal_placeholders=None,
+        sampling_params=SamplingParams(max_tokens=16),
+        eos_token_id=None,
+        arrival_time=time.time(),
+    )
+
+
+def schedule(manager: OmniKVCacheManager, request: Request):
+    """Allocate the uncached prompt of `request` the way the scheduler does."""
+    computed_blocks, num_computed_tokens = manager.get_computed_blocks(request)
+    new_blocks = manager.allocate_slots(request, request.num_tokens - num_computed_tokens,
+                                        num_computed_tokens, computed_blocks)
+    if new_blocks is not None:
+        request.num_computed_tokens = request.num_tokens
+    return computed_blocks, num_computed_tokens, new_blocks
+
+
+class TestPrefixCaching(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(OmniKVCacheManager, "prefix_caching_opt_in", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_off_unless_opted_in(self):
+        with mock.patch.object(OmniKVCacheManager, "prefix_caching_opt_in", False):
+            manager = make_manager(16, 16, enable_caching=True)
+        self.assertFalse(manager.enable_caching)
+        prompt = list(range(3 * BLOCK_SIZE + 1))
+        schedule(manager, make_request("0", prompt))
+        self.assertEqual(manager.get_computed_blocks(make_request("1", prompt)), (mock.ANY, 0))
+
+    def test_hit(self):
+        manager = make_manager(16, 16, enable_caching=True)
+        prompt = list(range(3 * BLOCK_SIZE + 1))
+        req0 = make_request("0", prompt)
+        schedule(manager, req0)
+        req1 = make_request("1", prompt)
+        computed_blocks, num_computed_tokens, new_blocks = schedule(manager, req1)
+
+        self.assertEqual(num_computed_tokens, 3 * BLOCK_SIZE)
+        # full attn blocks are shared, the compressed group only gets fresh blocks
+        self.assertEqual(computed_blocks.get_block_ids(), [manager.get_block_ids("0")[0][:3], []])
+        full_ids, omni_ids = manager.get_block_ids("1")
+        self.assertEqual(full_ids[:3], manager.get_block_ids("0")[0][:3])
+        self.assertEqual(len(new_blocks.blocks[0]), 1)
+        self.assertEqual(len(omni_ids), SINK_BLOCKS + RECENT_BLOCKS)
+        self.assertFalse(set(omni_ids) & set(manager.get_block_ids("0")[1]))
+
+    def test_partial_hit(self):
+        manager = make_manager(16, 16, enable_caching=True)
+        prompt = list(range(3 * BLOCK_SIZE + 1))
+        schedule(manager, make_request("0", prompt))
+        # diverges in the third block
+        other = prompt[:2 * BLOCK_SIZE] + [-1] * (BLOCK_SIZE + 5)
+        _, num_computed_tokens, new_blocks = schedule(manager, make_request("1", other))
+        self.assertEqual(num_computed_tokens, 2 * BLOCK_SIZE)
+        self.assertEqual(len(new_blocks.blocks[0]), 2)
+        self.assertEqual(manager.get_block_ids("1")[0][:2], manager.get_block_ids("0")[0][:2])
+
+    def test_whole_prompt_hit_recomputes_last_token(self):
+        manager = make_manager(16, 16, enable_caching=True)
+        prompt = list(range(2 * BLOCK_SIZE))
+        schedule(manager, make_request("0", prompt))
+        _, num_computed_tokens = manager.get_computed_blocks(make_request("1", prompt))
+        self.assertEqual(num_computed_tokens, BLOCK_SIZE)
+
+    def test_eviction(self):
+        # 4 full attn blocks and 6 compressed blocks besides the null blocks
+        manager = make_manager(5, 7, enable_caching=True)
+        prompt = list(range(2 * BLOCK_SIZE + 1))
+        req0 = make_request("0", prompt)
+        schedule(manager, req0)
+        manager.free(req0)
+
+        # a prompt of 4 blocks evicts the cached prefix of req0
+        req1 = make_request("1", list(range(1000, 1000 + 4 * BLOCK_SIZE)))
+        self.assertIsNotNone(schedule(manager, req1)[2])
+        manager.free(req1)
+        _, num_computed_tokens = manager.get_computed_blocks(make_request("2", prompt))
+        self.assertEqual(num_computed_tokens, 0)
+
+    def test_compressed_group_exhausted(self):
+        # room for the full attn blocks of 3 requests, but the windows of 2 only
+        manager = make_manager(16, 2 * (SINK_BLOCKS + RECENT_BLOCKS) + 1, enable_caching=True)
+        prompt = list(range(2 * BLOCK_SIZE + 1))
+        schedule(manager, make_request("0", prompt))
+        schedule(manager, make_request("1", prompt))
+        req2 = make_request("2", prompt)
+        num_free_full = manager.block_pools[0].get_num_free_blocks()
+        self.assertIsNone(schedule(manager, req2)[2])
+        # a failed allocation neither takes nor pins full attn blocks
+        self.assertEqual(manager.block_pools[0].get_num_free_blocks(), num_free_full)
+
+        # the windows of a finished request are reused
+        manager.free(make_request("0", prompt))
+        self.assertIsNotNone(schedule(manager, req2)[2])
+        self.assertEqual(manager.get_block_ids("2")[0][:2], manager.get_block_ids("1")[0][:2])
+
+
+class TestKVCacheEvents(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(OmniKVCacheManager, "prefix_caching_opt_in", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored_and_removed_events_of_cached_prefix(self):
+        # 4 full attn blocks besides the null block, enough for one prompt of 3 blocks
+        manager = make_manager(5, 8, enable_caching=True, enable_kv_cache_events=True)
+        prompt = list(range(2 * BLOCK_SIZE + 1))
+        req0 = make_request("0", prompt)
+        schedule(manager, req0)
+
+        events = manager.take_events()
+        self.assertEqual(len(events), 1)
+        self.assertIsInstance(events[0], BlockStored)
+        self.assertEqual(len(events[0].block_hashes), 2)
+        self.assertEqual(events[0].token_ids, prompt[:2 * BLOCK_SIZE])
+        self.assertEqual(manager.take_events(), [])
+        stored = set(events[0].block_hashes)
+
+        # the prefix of req0 is hit, no block is stored again
+        manager.free(req0)
+        req1 = make_request("1", prompt)
+        _, num_computed_tokens, _ = schedule(manager, req1)
+        self.assertEqual(num_computed_tokens, 2 * BLOCK_SIZE)
+        self.assertEqual(manager.take_events(), [])
+        manager.free(req1)
+
+        # a new prompt of 4 blocks evicts the cached prefix
+        schedule(manager, make_request("2", list(range(1000, 1000 + 4 * BLOCK_SIZE))))
+        events = manager.take_events()
+        removed = {h for e in events if isinstance(e, BlockRemoved) for h in e.block_hashes}
+        self.assertEqual(removed, stored)
+        self.assertTrue(all(isinstance(e, (BlockStored, BlockRemoved)) for e in events))
+
+
+if __name__ == "__main__":
+    unittest.main()
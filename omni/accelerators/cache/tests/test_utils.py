@@ -0,0 +1,167 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import random
+import unittest
+
+import numpy as np
+
+from omni.accelerators.cache.utils import (
+    compute_omni_attn_metadata_np,
+    compute_omni_attn_prefill_context_np,
+)
+
+PAD_SLOT_ID = -1
+
+
+def ref_window_pos(position, prompt_len, sink, recent):
+    """Position of a token in the compressed cache of its request."""
+    if prompt_len > sink + recent:
+        if position < sink:
+            return position
+        return sink + (position - prompt_len) % recent
+    if position < sink + recent:
+        return position
+    return sink + (position - sink - recent) % recent
+
+
+def ref_slot_mapping(sink, recent, block_size, block_table, num_decodes,
+                     prompt_lens, query_lens, seq_lens):
+    """Token by token version of the slot mapping, one token per decode."""
+    slots = []
+    for i, (prompt_len, query_len, seq_len) in enumerate(zip(prompt_lens, query_lens, seq_lens)):
+        for t in range(query_len):
+            position = seq_len - query_len + t
+            # a prefill chunk only writes the tokens still cached after it
+            if i >= num_decodes and position >= sink and t < query_len - recent:
+                slots.append(PAD_SLOT_ID)
+                continue
+            pos = ref_window_pos(position, prompt_len, sink, recent)
+            slots.append(block_table[i][pos // block_size] * block_size + pos % block_size)
+    return slots
+
+
+class TestComputeOmniAttnMetadata(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def _random_config(self):
+        block_size = self.rng.choice([1, 2, 4])
+        sink_blocks, recent_blocks = self.rng.randint(1, 2), self.rng.randint(1, 3)
+        return block_size * sink_blocks, block_size * recent_blocks, block_size, sink_blocks + recent_blocks
+
+    def _block_table(self, num_reqs, num_blocks):
+        ids = self.rng.sample(range(1000), num_reqs * num_blocks)
+        return np.array(ids, dtype=np.int32).reshape(num_reqs, num_blocks)
+
+    def test_mixed_batch_matches_reference(self):
+        for _ in range(200):
+            sink, recent, block_size, num_blocks = self._random_config()
+            num_decodes, num_prefills = self.rng.randint(0, 3), self.rng.randint(0, 3)
+            if num_decodes + num_prefills == 0:
+                continue
+            prompt_lens, query_lens, seq_lens = [], [], []
+            for _ in range(num_decodes):
+                prompt_lens.append(self.rng.randint(1, 3 * (sink + recent)))
+                query_lens.append(1)
+                seq_lens.append(prompt_lens[-1] + self.rng.randint(1, 3 * (sink + recent)))
+            for _ in range(num_prefills):
+                prompt_lens.append(self.rng.randint(1, 3 * (sink + recent)))
+                seq_lens.append(self.rng.randint(1, prompt_lens[-1]))
+                query_lens.append(self.rng.randint(1, seq_lens[-1]))
+            block_table = self._block_table(num_decodes + num_prefills, num_blocks)
+
+            bt, slots, seq_lens_out = compute_omni_attn_metadata_np(
+                sink, recent, block_size, block_table, num_decodes, num_decodes, num_prefills,
+                np.array(prompt_lens), np.array(query_lens), np.array(seq_lens))
+            expected = ref_slot_mapping(sink, recent, block_size, block_table, num_decodes,
+                                        prompt_lens, query_lens, seq_lens)
+            self.assertEqual(slots.tolist(), expected)
+            np.testing.assert_array_equal(bt, block_table)
+            self.assertIsNone(seq_lens_out)
+
+    def test_cache_keeps_sink_and_recent_tokens(self):
+        """Replay chunked prefills then decodes on a simulated cache: after
+        every step it holds the sink and the latest `recent` tokens."""
+        for _ in range(100):
+            sink, recent, block_size, num_blocks = self._random_config()
+            num_reqs = self.rng.randint(1, 4)
+            prompt_lens = [self.rng.randint(1, 4 * (sink + recent)) for _ in range(num_reqs)]
+            block_table = self._block_table(num_reqs, num_blocks)
+            caches = [dict() for _ in range(num_reqs)]
+            num_computed = [0] * num_reqs
+
+            def step(reqs, query_lens, num_decodes):
+                seq_lens = [num_computed[i] + q for i, q in zip(reqs, query_lens)]
+                _, slots, _ = compute_omni_attn_metadata_np(
+                    sink, recent, block_size, block_table[reqs], num_decodes, num_decodes,
+                    len(reqs) - num_decodes, np.array([prompt_lens[i] for i in reqs]),
+                    np.array(query_lens), np.array(seq_lens))
+                if num_decodes == 0:
+                    # a chunk attends to the sink and recent tokens of the previous ones
+                    context_slots, merge_index, kv_lens = compute_omni_attn_prefill_context_np(
+                        sink, recent, block_size, block_table[reqs], np.array([prompt_lens[i] for i in reqs]),
+                        np.array(query_lens), np.array(seq_lens))
+                    # positions of the context read from the cache, then of the fresh KV
+                    kv_positions = [caches[i][slot] for i, slot in zip(
+                        np.repeat(reqs, kv_lens - query_lens), context_slots.tolist())]
+                    kv_positions += [num_computed[i] + t for i, q in zip(reqs, query_lens) for t in range(q)]
+                    kv_positions = np.array(kv_positions, dtype=np.int64)[merge_index]
+                    for i, kv in zip(reqs, np.split(kv_positions, np.cumsum(kv_lens)[:-1])):
+                        expected = list(range(min(sink, num_computed[i])))
+                        expected += list(range(max(sink, num_computed[i] - recent), num_computed[i]))
+                        expected += list(range(num_computed[i], seq_lens[reqs.index(i)]))
+                        self.assertEqual(kv.tolist(), expected)
+                written = slots[slots != PAD_SLOT_ID]
+                self.assertEqual(len(set(written.tolist())), len(written))
+                k = 0
+                for i, query_len in zip(reqs, query_lens):
+                    for t in range(query_len):
+                        if slots[k] != PAD_SLOT_ID:
+                            caches[i][int(slots[k])] = num_computed[i] + t
+                        k += 1
+                    num_computed[i] += query_len
+                    seq_len = num_computed[i]
+                    expected = set(range(min(sink, seq_len)))
+                    expected |= set(range(max(sink, seq_len - recent), seq_len))
+                    if seq_len <= sink + recent:
+                        expected = set(range(seq_len))
+                    self.assertEqual(set(caches[i].values()), expected)
+
+            while any(num_computed[i] < prompt_lens[i] for i in range(num_reqs)):
+                reqs = [i for i in range(num_reqs) if num_computed[i] < prompt_lens[i]]
+                step(reqs, [min(prompt_lens[i] - num_computed[i], self.rng.randint(1, 2 * (sink + recent)))
+                            for i in reqs], 0)
+            for _ in range(self.rng.randint(1, 2 * (sink + recent))):
+                step(list(range(num_reqs)), [1] * num_reqs, num_reqs)
+
+    def test_prefill_context(self):
+        sink, recent, block_size = 2, 4, 2
+        block_table = np.arange(9, dtype=np.int32).reshape(3, 3)
+        # a first chunk, a chunk after 3 tokens, and one after 9 tokens of a long prompt
+        slots, merge_index, kv_lens = compute_omni_attn_prefill_context_np(
+            sink, recent, block_size, block_table, np.array([4, 8, 12]), np.array([4, 2, 3]), np.array([4, 5, 12]))
+        # positions 0, 1, 2 then 0, 1, 5, 6, 7, 8, in rings anchored at 8 and 12
+        self.assertEqual(slots.tolist(), [6, 7, 10, 12, 13, 15, 16, 17, 14])
+        self.assertEqual(kv_lens.tolist(), [4, 5, 9])
+        self.assertEqual(merge_index.tolist(), [9, 10, 11, 12, 0, 1, 2, 13, 14, 3, 4, 5, 6, 7, 8, 15, 16, 17])
+
+    def test_speculative_decode_shifts_decode_rows_only(self):
+        sink, recent, block_size = 2, 4, 2
+        block_table = np.arange(9, dtype=np.int32).reshape(3, 3)
+        bt, slots, seq_lens = compute_omni_attn_metadata_np(
+            sink, recent, block_size, block_table, 2, 4, 1,
+            np.array([10, 6, 3]), np.array([2, 2, 3]), np.array([14, 8, 3]))
+        self.assertEqual(len(slots), 7)
+        self.assertEqual(seq_lens.shape, (4, ))
+        np.testing.assert_array_equal(bt[2], block_table[2])
+
+    def test_uneven_decode_tokens(self):
+        with self.assertRaises(RuntimeError):
+            compute_omni_attn_metadata_np(
+                2, 4, 2, np.zeros((2, 3), dtype=np.int32), 2, 3, 0,
+                np.array([8, 8]), np.array([1, 2]), np.array([9, 10]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import numpy as np
 import torch
+from vllm.attention.backends.utils import PAD_SLOT_ID
 from vllm.v1.worker.block_table import BlockTable
 from .kv_cache_interface import OmniAttentionSpec
 
@@ -17,21 +18,100 @@ def compute_omni_attn_metadata(
     device: torch.device,
     use_spec_decode: bool = False,
 ):
-    if num_prefills > 0:
-        raise RuntimeError("Only support PD disaggregation and only enabled in D now.")
-    if num_decode_tokens % num_decodes != 0:
-        raise RuntimeError(f"num_decode_tokens is {num_decode_tokens} while num_decodes is {num_decodes}")
-
     num_reqs = num_decodes + num_prefills
-    tokens_per_req = num_decode_tokens // num_decodes
-    # TODO: should change to numpy array for faster performance
-    block_table_np = block_table.get_numpy_array()[:num_reqs]  # (batch_size, max_blocks)
-    sink, recent, block_size = (
+    block_table_np, slot_mapping, omni_attn_seq_lens = compute_omni_attn_metadata_np(
         kv_cache_spec.sink,
         kv_cache_spec.recent,
-        kv_cache_spec.block_size
+        kv_cache_spec.block_size,
+        block_table.get_numpy_array()[:num_reqs],  # (batch_size, max_blocks)
+        num_decodes,
+        num_decode_tokens,
+        num_prefills,
+        prompt_lens,
+        query_lens,
+        seq_lens,
+    )
+    if len(slot_mapping) != num_actual_tokens:
+        raise RuntimeError(f"{len(slot_mapping)} slots are computed for {num_actual_tokens} tokens.")
+
+    return (
+        torch.from_numpy(block_table_np).to(torch.int32),
+        torch.from_numpy(slot_mapping).to(torch.int64),
+        torch.from_numpy(omni_attn_seq_lens).to(torch.int64) if omni_attn_seq_lens is not None else None,
     )
 
+
+def compute_omni_attn_prefill_context(
+    kv_cache_spec: OmniAttentionSpec,
+    block_table: BlockTable,
+    num_decodes: int,
+    num_prefills: int,
+    prompt_lens: np.ndarray,
+    query_lens: np.ndarray,
+    seq_lens: np.ndarray,
+):
+    context_slots, merge_index, kv_lens = compute_omni_attn_prefill_context_np(
+        kv_cache_spec.sink,
+        kv_cache_spec.recent,
+        kv_cache_spec.block_size,
+        block_table.get_numpy_array()[num_decodes:num_decodes + num_prefills],
+        prompt_lens,
+        query_lens,
+        seq_lens,
+    )
+    return torch.from_numpy(context_slots), torch.from_numpy(merge_index).to(torch.int64), kv_lens
+
+
+def compute_omni_attn_metadata_np(
+    sink: int,
+    recent: int,
+    block_size: int,
+    block_table_np: np.ndarray,
+    num_decodes: int,
+    num_decode_tokens: int,
+    num_prefills: int,
+    prompt_lens: np.ndarray,
+    query_lens: np.ndarray,
+    seq_lens: np.ndarray,
+):
+    """Block table, slot mapping and (with speculative tokens) decode seq_lens
+    of a compressed layer, for a batch of decodes followed by prefills.
+
+    A compressed layer keeps the first `sink` tokens of a request and a ring
+    of its `recent` latest ones. Token p lives at `p` while the sequence fits
+    in sink + recent tokens, and at `sink + (p - A) % recent` afterwards,
+    where A = max(sink + recent, prompt_len). For a long prompt the ring is
+    anchored at its end, so the last `recent` prompt tokens fill it exactly,
+    as after a pull from a prefill instance, and decode overwrites the oldest.
+
+    A prefill chunk only writes the tokens that are still in the cache after
+    it: the sink tokens and its last `recent` tokens. The other ones get
+    PAD_SLOT_ID, so that no slot is written twice in one step. Prefill rows of
+    the block table are returned as is.
+    """
+    block_table_np = block_table_np[:num_decodes + num_prefills]
+    slot_mapping = np.empty(0, dtype=np.int64)
+    omni_attn_seq_lens = None
+    if num_decodes > 0:
+        block_table_np, slot_mapping, omni_attn_seq_lens = _compute_decode_metadata(
+            sink, recent, block_size, block_table_np, num_decodes, num_decode_tokens,
+            np.asarray(prompt_lens[:num_decodes]), np.asarray(seq_lens[:num_decodes]))
+    if num_prefills > 0:
+        prefill_slot_mapping = _compute_prefill_slot_mapping(
+            sink, recent, block_size, block_table_np[num_decodes:],
+            np.asarray(prompt_lens[num_decodes:]), np.asarray(query_lens[num_decodes:]),
+            np.asarray(seq_lens[num_decodes:]))
+        slot_mapping = np.concatenate([slot_mapping, prefill_slot_mapping])
+    return block_table_np, slot_mapping, omni_attn_seq_lens
+
+
+def _compute_decode_metadata(sink, recent, block_size, block_table_np, num_decodes,
+                             num_decode_tokens, prompt_lens, seq_lens):
+    if num_decode_tokens % num_decodes != 0:
+        raise RuntimeError(f"num_decode_tokens is {num_decode_tokens} while num_decodes is {num_decodes}")
+    tokens_per_req = num_decode_tokens // num_decodes
+    max_num_blocks = (sink + recent) // block_size
+
     # repeat prompt_lens and seq_lens for each speculative token
     if tokens_per_req > 1:
         prompt_lens = np.repeat(prompt_lens, tokens_per_req)
@@ -60,13 +140,14 @@ def compute_omni_attn_metadata(
         last_token_idx = np.arange(tokens_per_req-1, num_decode_tokens, tokens_per_req)
         block_num_last_token = block_num_per_token[last_token_idx]
         mask = (seq_lens > sink + recent)
-        block_shifts = np.where(mask, kv_cache_spec.max_num_blocks-block_num_last_token-1, 0)
+        block_shifts = np.where(mask, max_num_blocks-block_num_last_token-1, 0)
 
-        # shift block table rows
-        m, n = block_table_np.shape
+        # shift block table rows of the decodes
+        decode_block_table = block_table_np[:num_decodes]
+        m, n = decode_block_table.shape
         rows, cols = np.indices((m, n))
         cols = (cols - block_shifts[:, None]) % n
-        block_table_np = block_table_np[rows, cols]
+        block_table_np = np.concatenate([decode_block_table[rows, cols], block_table_np[num_decodes:]])
 
         # compute seq_lens
         last_token_pos = window_pos[last_token_idx]
@@ -74,9 +155,75 @@ def compute_omni_attn_metadata(
         omni_attn_seq_lens = (seq_len_last_token[:, None] + np.arange(-tokens_per_req+1, 1)).flatten()
     else:
         omni_attn_seq_lens = None
+    return block_table_np, slot_mapping.astype(np.int64), omni_attn_seq_lens
 
-    return (
-        torch.from_numpy(block_table_np).to(torch.int32),
-        torch.from_numpy(slot_mapping).to(torch.int64),
-        torch.from_numpy(omni_attn_seq_lens).to(torch.int64) if omni_attn_seq_lens is not None else None,
-    )
+
+def _compute_prefill_slot_mapping(sink, recent, block_size, block_table_np,
+                                  prompt_lens, query_lens, seq_lens):
+    query_lens = query_lens.astype(np.int64)
+    num_tokens = int(query_lens.sum())
+    req_ids = np.repeat(np.arange(len(query_lens)), query_lens)
+    # position of every token: seq_len - query_len + its index in the chunk
+    cu_query_lens = np.cumsum(query_lens)
+    offsets = np.arange(num_tokens) - np.repeat(cu_query_lens - query_lens, query_lens)
+    positions = np.repeat(seq_lens - query_lens, query_lens) + offsets
+
+    window_pos = _window_positions(sink, recent, positions, np.repeat(prompt_lens, query_lens))
+
+    # A ring slot is written by at most one token of the chunk, its latest.
+    # Direct positions past the sink are ring slots too, once a re-prefilled
+    # sequence (after preemption) goes beyond sink + recent.
+    kept = (positions < sink) | (offsets >= np.repeat(query_lens, query_lens) - recent)
+    slots = block_table_np[req_ids, window_pos // block_size] * block_size + window_pos % block_size
+    return np.where(kept, slots, PAD_SLOT_ID).astype(np.int64)
+
+
+def compute_omni_attn_prefill_context_np(
+    sink: int,
+    recent: int,
+    block_size: int,
+    block_table_np: np.ndarray,
+    prompt_lens: np.ndarray,
+    query_lens: np.ndarray,
+    seq_lens: np.ndarray,
+):
+    """Cached context of a batch of prefill chunks in a compressed layer.
+
+    A chunk continuing a prompt attends to what the previous chunks left in
+    the cache: the first `sink` tokens and the `recent` latest ones, in order
+    of position. They must be read before the chunk is written, since its
+    recent tokens overwrite the oldest ones of the ring.
+
+    Returns the slots of the context tokens of all the chunks, the rows of
+    [context, chunk] of every chunk in the context followed by the fresh KV
+    of the batch, and the KV length of every chunk.
+    """
+    query_lens = query_lens.astype(np.int64)
+    context_ends = seq_lens.astype(np.int64) - query_lens
+    num_sink = np.minimum(sink, context_ends)
+    recent_starts = np.maximum(sink, context_ends - recent)
+    context_lens = num_sink + np.maximum(context_ends - recent_starts, 0)
+
+    num_context_tokens = int(context_lens.sum())
+    req_ids = np.repeat(np.arange(len(context_lens)), context_lens)
+    offsets = np.arange(num_context_tokens) - np.repeat(np.cumsum(context_lens) - context_lens, context_lens)
+    num_sink = np.repeat(num_sink, context_lens)
+    positions = np.where(offsets < num_sink, offsets, offsets - num_sink + np.repeat(recent_starts, context_lens))
+    window_pos = _window_positions(sink, recent, positions, np.repeat(prompt_lens, context_lens))
+    slots = block_table_np[req_ids, window_pos // block_size] * block_size + window_pos % block_size
+
+    kv_lens = context_lens + query_lens
+    req_ids = np.repeat(np.arange(len(kv_lens)), kv_lens)
+    offsets = np.arange(int(kv_lens.sum())) - np.repeat(np.cumsum(kv_lens) - kv_lens, kv_lens)
+    context_starts = np.cumsum(context_lens) - context_lens
+    query_starts = num_context_tokens + np.cumsum(query_lens) - query_lens - context_lens
+    merge_index = np.where(offsets < context_lens[req_ids], context_starts[req_ids], query_starts[req_ids]) + offsets
+    return slots.astype(np.int64), merge_index, kv_lens
+
+
+def _window_positions(sink, recent, positions, prompt_lens):
+    compressed = prompt_lens > sink + recent
+    # tokens below it are stored at their position, the others in the ring
+    num_direct = np.where(compressed, sink, sink + recent)
+    anchors = np.maximum(sink + recent, prompt_lens)
+    return np.where(positions < num_direct, positions, (positions - anchors) % recent + sink)
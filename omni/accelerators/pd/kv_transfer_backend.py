@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""
+KV transfer backends of the PD connector.
+
+The connector workers only use the KV transfer through `KVTransferBackend`.
+The backend is chosen by `kv_transfer_backend` in the extra config of
+kv_transfer_config:
+
+- llmdatadist (default): `LLMDataDistManager` over the links of llm_datadist,
+  or `OmniBiGroupDataDistManager` with omni attention.
+- loopback: `LoopbackDataDistManager`, which copies between CPU tensors shared
+  by the prefill and decode processes of one host, with an injected latency and
+  bandwidth. It needs neither llm_datadist nor NPUs, so that the connector can
+  be tested and benchmarked on a CPU host (benchmarks/pd/bench_loopback_connector.py).
+"""
+
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import torch
+from vllm.config import VllmConfig
+from vllm.logger import init_logger
+from omni.accelerators.pd.metrics import kv_cache_block_bytes
+
+logger = init_logger(__name__)
+
+KV_TRANSFER_BACKENDS = ("llmdatadist", "loopback")
+
+
+class KVTransferBackend(ABC):
+    """What the connector workers use of a KV transfer backend.
+
+    Besides the methods below, a backend has the attributes:
+
+    - data_dist_config: the `LLMDataDistConfig` of the worker.
+    - local_rank: the local rank of the worker.
+    - num_layers: number of layers of every registered cache, set by `register_memory`.
+    """
+
+    @abstractmethod
+    def register_memory(self, kv_caches: dict[str, torch.Tensor]):
+        """Register the KV caches of the worker, so that the decode side can pull from them."""
+        raise NotImplementedError
+
+    def group_block_bytes(self, kv_caches: dict[str, torch.Tensor]) -> list[int]:
+        """Bytes of one block id of every KV cache group, in the order of the
+        groups of nested block id lists."""
+        return [kv_cache_block_bytes(kv_caches)]
+
+    def is_pulled_from(self) -> bool:
+        """Whether decode workers pull from this prefill worker, which only then needs staging caches in staged mode."""
+        return True
+
+    def register_staging_memory(self, staging_caches: list[list[torch.Tensor]]):
+        """Register the host staging caches of staged mode, laid out like the output of `unzip_kv_cache`."""
+        raise ValueError(f"kv_transfer_mode staged is not supported by {type(self).__name__}.")
+
+    @abstractmethod
+    def register_link(self):
+        """Set up the links between the prefill and decode workers. With multi_rank_pull_kv,
+        on the decode side, it returns the P cluster ids of every link and the link status."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def pull_kv(self, src_blocks, tgt_blocks, prompt_cluster_id, layer_range: Optional[range] = None,
+                deadline: Optional[float] = None):
+        """Pull the blocks `src_blocks` of cluster `prompt_cluster_id` into the local blocks
+        `tgt_blocks`, for all layers or for the layers in `layer_range` only. Once the wall
+        clock time `deadline` has passed, when the prefill side may release the blocks, no
+        more of them are read: KVLeaseExpiredError is raised (see `check_lease_deadline`)."""
+        raise NotImplementedError
+
+
+def create_kv_transfer_backend(vllm_config: VllmConfig) -> KVTransferBackend:
+    backend = vllm_config.kv_transfer_config.get_from_extra_config("kv_transfer_backend", "llmdatadist")
+    if backend not in KV_TRANSFER_BACKENDS:
+        raise ValueError(f"kv_transfer_backend should be one of {KV_TRANSFER_BACKENDS}, but is {backend}.")
+    if backend == "loopback":
+        from omni.accelerators.pd.loopback_backend import LoopbackDataDistManager
+        logger.warning("The PD connector is using the loopback KV transfer backend, for tests and benchmarks only.")
+        return LoopbackDataDistManager(vllm_config)
+
+    from omni.accelerators.cache import ENABLED
+    if ENABLED:
+        # imported from its module, omni.accelerators.cache itself does not need llm_datadist
+        from omni.accelerators.cache.pd import OmniBiGroupDataDistManager
+        logger.warning("The PD connector is using Omni datadist manager for KV transfer.")
+        return OmniBiGroupDataDistManager(vllm_config)
+    from omni.accelerators.pd.llmdatadist_manager import LLMDataDistManager
+    return LLMDataDistManager(vllm_config)
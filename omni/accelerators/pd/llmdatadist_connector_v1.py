@@ -10,10 +10,9 @@ from typing import TYPE_CHECKING, Any, Optional
 import zmq
 import os
 import time
-import pickle
 
 from vllm.envs import VLLM_RPC_TIMEOUT
-from vllm.config import VllmConfig
+from vllm.config import CompilationLevel, VllmConfig
 from vllm.distributed.kv_transfer.kv_connector.v1.base import (
     KVConnectorBase_V1, KVConnectorMetadata, KVConnectorRole)
 from vllm.distributed.parallel_state import get_tensor_model_parallel_rank
@@ -28,9 +27,10 @@ if TYPE_CHECKING:
     from vllm.forward_context import ForwardContext
     from vllm.v1.request import Request
 from vllm.v1.request import Request
-from vllm.utils import round_down
+from vllm.utils import cdiv, is_pin_memory_available, round_down
 from dataclasses import dataclass
 from collections import defaultdict
+import numpy as np
 import torch
 from vllm.distributed.parallel_state import (
     get_tensor_model_parallel_rank, get_tensor_model_parallel_world_size,
@@ -51,7 +51,21 @@ logger = init_logger(__name__)
 VLLM_LLMDATADIST_ZMQ_PORT = int(os.environ.get("VLLM_LLMDATADIST_ZMQ_PORT", "5568"))
 thread_dump_path = os.environ.get("VLLM_THREAD_DUMP_PATH", "/tmp/vllm_thread_info")
 
-from omni.accelerators.pd.llmdatadist_manager import LLMDataDistManager, LLMDataDistConfig
+# Default flush thresholds of the batched pull mode (`batch_pull_kv`).
+DEFAULT_BATCH_PULL_KV_MAX_BLOCKS = 1024
+DEFAULT_BATCH_PULL_KV_TIMEOUT_MS = 0
+# Default number of layers pulled at a time in the layerwise pull mode (`layerwise_pull_kv`).
+DEFAULT_LAYERWISE_PULL_KV_NUM_LAYERS = 4
+# Seconds between two sweeps of the expired leases of prefill blocks (`kv_lease_ttl_s`).
+LEASE_SWEEP_INTERVAL_S = 1.0
+
+from omni.accelerators.pd.kv_transfer_backend import create_kv_transfer_backend
+from omni.accelerators.pd.llmdatadist_manager import LLMDataDistConfig, ordered_layer_names, unzip_kv_cache
+from omni.accelerators.pd.metrics import create_kv_transfer_metrics
+from omni.accelerators.pd.metadata_codec import decode_requests, encode_requests, to_block_id_list
+from omni.accelerators.pd.utils import (STAGING_BLOCK_ID_BASE, BlockLeaseTable, LayerLoadTracker,
+                                       LinkThroughputTracker, StagingSlotAllocator, block_bytes_of, contiguous_runs,
+                                       layer_groups, num_blocks_of, stripe_pull_blocks)
 
 
 @dataclass
@@ -61,6 +75,14 @@ class ReqMeta:
     remote_host: str
     remote_cluster_id: str
     spec_token_ids: Optional[list[int]]
+    # wall clock time after which the prefill side may release the remote blocks, None if they are held for ever
+    lease_deadline: Optional[float] = None
+
+
+@dataclass
+class StagedReqMeta:
+    block_ids: list[int]
+    staging_slots: list[int]
 
 
 class DatadistConnectorMetadata(KVConnectorMetadata):
@@ -68,6 +90,10 @@ class DatadistConnectorMetadata(KVConnectorMetadata):
 
     def __init__(self):
         self.requests: dict[str, ReqMeta] = {}
+        # prefill side in staged mode: requests whose prompt is completed in this step
+        self.staged_requests: dict[str, StagedReqMeta] = {}
+        # prefill side: requests whose blocks started waiting for the decode pull -> number of blocks
+        self.leases: dict[str, int] = {}
 
     def add_new_req(
         self,
@@ -81,8 +107,12 @@ class DatadistConnectorMetadata(KVConnectorMetadata):
             remote_host=kv_transfer_params["remote_host_ip"],
             remote_cluster_id=kv_transfer_params["remote_cluster_id"],
             spec_token_ids=kv_transfer_params["spec_token_ids"],
+            lease_deadline=kv_transfer_params.get("lease_deadline"),
         )
 
+    def add_staged_req(self, request_id: str, block_ids: list[int], staging_slots: list[int]):
+        self.staged_requests[request_id] = StagedReqMeta(block_ids=block_ids, staging_slots=staging_slots)
+
 
 class LLMDataDistConnector(KVConnectorBase_V1):
     def __init__(self, vllm_config: VllmConfig, role: KVConnectorRole):
@@ -97,7 +127,8 @@ class LLMDataDistConnector(KVConnectorBase_V1):
 
         if role == KVConnectorRole.SCHEDULER:
             if self.is_prefill:
-                self.connector_scheduler = PrefillConnectorScheduler(self.cluster_id, self.host_ip, str(self.host_port))
+                self.connector_scheduler = PrefillConnectorScheduler(vllm_config, self.datadist_config, self.cluster_id,
+                                                                     self.host_ip, str(self.host_port))
             else:
                 self.connector_scheduler = DecodeConnectorScheduler(vllm_config)
             self.connector_worker = None
@@ -168,26 +199,62 @@ class LLMDataDistConnector(KVConnectorBase_V1):
         self.connector_worker.start_load_kv(self._connector_metadata)
 
     def wait_for_layer_load(self, layer_name: str) -> None:
-        """Connector does not do layerwise saving."""
-        pass
+        """Block until the KV of `layer_name` has arrived, only with `layerwise_pull_kv` on decode."""
+        if self.connector_worker is None:
+            raise RuntimeError("self.connector_worker cannot be None")
+        self.connector_worker.wait_for_layer_load(layer_name)
 
     def save_kv_layer(self, layer_name: str, kv_layer: torch.Tensor,
                       attn_metadata: "AttentionMetadata", **kwargs) -> None:
-        """Connector does not save explicitly."""
-        pass
+        """Copy `layer_name` into the staging caches, only in staged mode on prefill."""
+        if self.connector_worker is None:
+            raise RuntimeError("self.connector_worker cannot be None")
+        self.connector_worker.save_kv_layer(layer_name, kv_layer)
 
     def wait_for_save(self):
-        """Connector does not save explicitly."""
-        pass
+        """Block until the copies of `save_kv_layer` are done, only in staged mode on prefill."""
+        if self.connector_worker is None:
+            raise RuntimeError("self.connector_worker cannot be None")
+        self.connector_worker.wait_for_save()
 
 class PrefillConnectorScheduler:
     """Implementation of Scheduler side methods"""
 
-    def __init__(self, cluster_id: str, host_ip: str, host_port: str):
+    def __init__(self, vllm_config: VllmConfig, datadist_config: LLMDataDistConfig,
+                 cluster_id: str, host_ip: str, host_port: str):
         self.cluster_id = cluster_id
         self.host_ip = host_ip
         self.host_port = host_port
         logger.info("Initializing LLMDataDist Scheduler %s %s %s", cluster_id, host_ip, host_port)
+        self.kv_lease_ttl_s = datadist_config.kv_lease_ttl_s
+        # delayed-free requests of the last steps, whose leases are started by the worker
+        self._new_leases: dict[str, int] = {}
+
+        # Staged mode: the workers copy the KV of a request into host staging caches while its last prompt
+        # chunk is computed, so its blocks are freed when it finishes, and the decode side pulls from the
+        # staging slots. The slots are released when the decode side acks them on `staging_ack_port`.
+        self.stage_kv = datadist_config.is_staged_mode
+        if self.stage_kv:
+            self.block_size = vllm_config.cache_config.block_size
+            self.staging_slots = StagingSlotAllocator(datadist_config.kv_staging_blocks)
+            # request id -> (number of prompt tokens, block ids), until its prompt is scheduled to completion
+            self._prefill_blocks: dict[str, tuple[int, list[int]]] = {}
+            # request id -> staging slots holding its KV, until the decode side has pulled it
+            self._staged_slots: dict[str, list[int]] = {}
+            self._staging_lock = threading.Lock()
+            # the staging slots of a request are released after kv_lease_ttl_s if the decode side never acks them
+            self._staging_leases = BlockLeaseTable(
+                self.kv_lease_ttl_s, datadist_config.kv_lease_grace_s) if self.kv_lease_ttl_s > 0 else None
+            self.staging_ack_port = int(vllm_config.kv_transfer_config.get_from_extra_config(
+                "kv_staging_ack_port", int(host_port) + 1))
+            self.ctx = zmq.Context()
+            self.ack_socket = self.ctx.socket(zmq.constants.PULL)
+            self.ack_socket.bind(f"tcp://{self.host_ip}:{self.staging_ack_port}")
+            thread_name = "prefill_connector_get_pulled_staging_req_list"
+            self.thread = threading.Thread(target=self.get_pulled_staging_req_list, daemon=True, name=thread_name)
+            self.thread.start()
+            logger.info("Prefill staged mode with %d staging blocks, acks on port %d",
+                        datadist_config.kv_staging_blocks, self.staging_ack_port)
 
     def get_num_new_matched_tokens(
             self, request: "Request",
@@ -204,8 +271,74 @@ class PrefillConnectorScheduler:
             scheduler_output: SchedulerOutput,
     ) -> KVConnectorMetadata:
         metadata = DatadistConnectorMetadata()
+        metadata.leases, self._new_leases = self._new_leases, {}
+        if not self.stage_kv:
+            return metadata
+
+        for new_req in scheduler_output.scheduled_new_reqs:
+            self._prefill_blocks[new_req.req_id] = (len(new_req.prompt_token_ids), list(new_req.block_ids[0]))
+            self._maybe_stage(metadata, new_req.req_id,
+                             new_req.num_computed_tokens + scheduler_output.num_scheduled_tokens[new_req.req_id])
+        for cached_req in scheduler_output.scheduled_cached_reqs:
+            if cached_req.req_id not in self._prefill_blocks:
+                continue
+            num_prompt_tokens, block_ids = self._prefill_blocks[cached_req.req_id]
+            if cached_req.resumed_from_preemption:
+                # a resumed request gets all of its blocks again
+                block_ids = list(cached_req.new_block_ids[0])
+            else:
+                block_ids.extend(cached_req.new_block_ids[0])
+            self._prefill_blocks[cached_req.req_id] = (num_prompt_tokens, block_ids)
+            self._maybe_stage(metadata, cached_req.req_id,
+                             cached_req.num_computed_tokens + scheduler_output.num_scheduled_tokens[cached_req.req_id])
         return metadata
 
+    def _maybe_stage(self, metadata: DatadistConnectorMetadata, request_id: str, num_computed_tokens: int):
+        """Stage the request in this step if its prompt is completed by it. Without enough
+        free staging slots its KV is pulled from its blocks, which are held until then."""
+        num_prompt_tokens, block_ids = self._prefill_blocks[request_id]
+        if num_computed_tokens < num_prompt_tokens:
+            return
+        del self._prefill_blocks[request_id]
+        block_ids = block_ids[:cdiv(num_prompt_tokens, self.block_size)]
+        slots = self.staging_slots.allocate(len(block_ids))
+        if slots is None:
+            logger.warning("Request %s: %d staging blocks needed, %d free, falls back to pull.",
+                           request_id, len(block_ids), self.staging_slots.num_free)
+            return
+        with self._staging_lock:
+            self._staged_slots[request_id] = slots
+        metadata.add_staged_req(request_id, block_ids, slots)
+
+    def get_pulled_staging_req_list(self):
+        last_sweep_time = time.monotonic()
+        while True:
+            try:
+                if self.ack_socket.poll(timeout=10) > 0:
+                    id_list = json.loads(self.ack_socket.recv_string())
+                    logger.debug("Received staging acks: %s", id_list)
+                    if self._staging_leases is not None:
+                        with self._staging_lock:
+                            id_list = self._staging_leases.ack(id_list)
+                    self._release_staging(id_list)
+                if self._staging_leases is not None and time.monotonic() - last_sweep_time >= LEASE_SWEEP_INTERVAL_S:
+                    last_sweep_time = time.monotonic()
+                    with self._staging_lock:
+                        expired = self._staging_leases.expire()
+                    if expired:
+                        logger.warning("Releasing the staging slots of %d requests not pulled within %.0fs: %s",
+                                       len(expired), self.kv_lease_ttl_s, [req_id for req_id, _ in expired])
+                        self._release_staging([req_id for req_id, _ in expired])
+            except Exception as e:
+                logger.error("get pulled staging req list failed: %s", e)
+
+    def _release_staging(self, request_ids: list[str]):
+        for request_id in request_ids:
+            with self._staging_lock:
+                slots = self._staged_slots.pop(request_id, None)
+            if slots is not None:
+                self.staging_slots.free(slots)
+
     def request_finished(
             self,
             request: "Request",
@@ -216,17 +349,49 @@ class PrefillConnectorScheduler:
         Once a request is finished, determine whether request blocks
         should be freed now or will be sent asynchronously and freed later.
         """
+        if self.stage_kv:
+            self._prefill_blocks.pop(request.request_id, None)
+            with self._staging_lock:
+                slots = self._staged_slots.get(request.request_id)
+            if slots is not None:
+                if request.status != RequestStatus.FINISHED_LENGTH_CAPPED:
+                    self._release_staging([request.request_id])
+                    return False, None
+                if self._staging_leases is not None:
+                    with self._staging_lock:
+                        self._staging_leases.add(request.request_id, len(slots))
+                # the KV is in the staging caches already, the blocks are freed now
+                return False, dict(
+                    remote_block_ids=[STAGING_BLOCK_ID_BASE + slot for slot in slots],
+                    remote_cluster_id=self.cluster_id,
+                    remote_host_ip=f"tcp://{self.host_ip}:{self.staging_ack_port}",
+                    spec_token_ids=spec_token_ids,
+                    lease_deadline=self._lease_deadline(),
+                )
+
         if request.status != RequestStatus.FINISHED_LENGTH_CAPPED:
             return False, None
 
-        delay_free_blocks = len(block_ids) > 0
+        # with omni attention, block_ids is [[full attn blocks], [omni attn blocks]]
+        num_blocks = num_blocks_of(block_ids)
+        delay_free_blocks = num_blocks > 0
+        if delay_free_blocks and self.kv_lease_ttl_s > 0:
+            self._new_leases[request.request_id] = num_blocks
         return delay_free_blocks, dict(
             remote_block_ids=block_ids,
             remote_cluster_id=self.cluster_id,
             remote_host_ip=f"tcp://{self.host_ip}:{self.host_port}",
-            spec_token_ids=spec_token_ids
+            spec_token_ids=spec_token_ids,
+            lease_deadline=self._lease_deadline(),
         )
 
+    def _lease_deadline(self) -> Optional[float]:
+        """Wall clock time after which the decode side must not start pulling a request finished now.
+        Its lease, started by the worker after this, releases the blocks kv_lease_grace_s later still."""
+        if self.kv_lease_ttl_s <= 0:
+            return None
+        return time.time() + self.kv_lease_ttl_s
+
 
 class PrefillConnectorWorker:
     """Implementation of Worker side methods"""
@@ -236,33 +401,115 @@ class PrefillConnectorWorker:
         self.host_ip = host_ip
         self.host_port = host_port
         self.rank = get_tensor_model_parallel_rank()
+        self.datadist_manager = create_kv_transfer_backend(vllm_config)
         if self.rank == 0:
+            self.metrics = create_kv_transfer_metrics("prefill", vllm_config)
+            # the acks do not tell which decode cluster pulled, so the series are those of this prefill cluster
+            self.metrics_cluster_id = self.datadist_manager.data_dist_config.cluster_id
             self.ctx = zmq.Context()
             self.input_socket = self.ctx.socket(zmq.constants.PULL)
             self.input_socket.bind(f"tcp://{self.host_ip}:{self.host_port}")
             self._transfer_lock = threading.Lock()
             self.receive_req_list = []
+            # the blocks of a request are released after kv_lease_ttl_s if the decode side never acks them
+            self.leases: Optional[BlockLeaseTable] = None
             thread_name = "prefill_connector_get_pulled_kv_req_list"
             self.thread = threading.Thread(target=self.get_pulled_kv_req_list, daemon=True, name=thread_name)
             self.thread.start()
             dump_thread_to_file(self.thread, thread_name, thread_dump_path)
-        from omni.accelerators.cache import OmniBiGroupDataDistManager, ENABLED
-        if ENABLED:
-            manager_cls = OmniBiGroupDataDistManager
-            logger.warning(f"PrefillingConnector is using Omni datadist manager for KV transfer.")
-            self.datadist_manager = manager_cls(vllm_config)
-        else:
-            manager_cls = LLMDataDistManager
-            self.datadist_manager = manager_cls(vllm_config)
+        from omni.accelerators.cache import ENABLED
+
+        data_dist_config = self.datadist_manager.data_dist_config
+        if self.rank == 0 and data_dist_config.kv_lease_ttl_s > 0:
+            self.leases = BlockLeaseTable(data_dist_config.kv_lease_ttl_s, data_dist_config.kv_lease_grace_s)
+
+        self.stage_kv = self.datadist_manager.data_dist_config.is_staged_mode
+        if self.stage_kv and ENABLED:
+            raise ValueError("kv_transfer_mode staged is not supported with omni attention.")
+        # set when kv caches are registered, only used in staged mode
+        self.staging_caches: list[list[torch.Tensor]] = []
+        self.layer_indices: dict[str, int] = {}
+        self.device = None
+        self.copy_stream = None
+        # blocks of the requests staged in the current step, and the runs of their staging slots
+        self._staged_block_ids: Optional[torch.Tensor] = None
+        self._staged_slot_runs: list[tuple[int, int, int]] = []
+        # gathered blocks of the copies in flight, kept alive until they are done
+        self._copy_buffers: list[torch.Tensor] = []
 
     def register_kv_caches(self, kv_caches: dict[str, torch.Tensor]):
         self.datadist_manager.register_memory(kv_caches)
+        if self.stage_kv:
+            self._init_staging_caches(kv_caches)
         self.datadist_manager.register_link()
-        pass
+
+    def _init_staging_caches(self, kv_caches: dict[str, torch.Tensor]):
+        if not self.datadist_manager.is_pulled_from():
+            # no decode rank pulls from this rank, whose staging caches would never be read
+            logger.info("No decode rank pulls from this rank, it does not stage the KV.")
+            return
+        num_blocks = self.datadist_manager.data_dist_config.kv_staging_blocks
+        flatten_kv_caches = unzip_kv_cache(kv_caches)
+        self.staging_caches = [
+            [
+                torch.empty((num_blocks, ) + tuple(cache.shape[1:]),
+                            dtype=cache.dtype,
+                            device="cpu",
+                            pin_memory=is_pin_memory_available())
+                for cache in sub_kv_caches
+            ]
+            for sub_kv_caches in flatten_kv_caches
+        ]
+        self.datadist_manager.register_staging_memory(self.staging_caches)
+        self.layer_indices = {name: i for i, name in enumerate(ordered_layer_names(kv_caches))}
+        self.device = flatten_kv_caches[0][0].device
+        self.copy_stream = torch.npu.Stream()
+        num_bytes = sum(cache.numel() * cache.element_size()
+                        for sub_staging_caches in self.staging_caches for cache in sub_staging_caches)
+        logger.info("Allocated %d host staging blocks for staged mode, %.2f GB.", num_blocks, num_bytes / 1e9)
 
     def start_load_kv(self, metadata: DatadistConnectorMetadata):
+        if self.rank == 0 and self.leases is not None and metadata.leases:
+            with self._transfer_lock:
+                for request_id, num_blocks in metadata.leases.items():
+                    self.leases.add(request_id, num_blocks)
+                self.metrics.set_leased_blocks(self.metrics_cluster_id, self.leases.num_blocks)
+        if not self.staging_caches or not metadata.staged_requests:
+            return
+        block_ids, slots = [], []
+        for meta in metadata.staged_requests.values():
+            block_ids.extend(meta.block_ids)
+            slots.extend(meta.staging_slots)
+        self._staged_block_ids = torch.tensor(block_ids, dtype=torch.int64, device=self.device)
+        self._staged_slot_runs = contiguous_runs(slots)
+
+    def wait_for_layer_load(self, layer_name: str):
         pass
 
+    def save_kv_layer(self, layer_name: str, kv_layer):
+        if self._staged_block_ids is None:
+            return
+        layer = self.layer_indices.get(layer_name)
+        if layer is None:
+            return
+        # the copies start once the layer is written, on a side stream so that the next layers are not delayed
+        self.copy_stream.wait_stream(torch.npu.current_stream())
+        with torch.npu.stream(self.copy_stream):
+            for cache_idx, cache in enumerate(kv_layer if isinstance(kv_layer, (tuple, list)) else (kv_layer, )):
+                gathered = cache.index_select(0, self._staged_block_ids)
+                staging_cache = self.staging_caches[cache_idx][layer]
+                for position, slot, length in self._staged_slot_runs:
+                    staging_cache[slot:slot + length].copy_(gathered[position:position + length], non_blocking=True)
+                self._copy_buffers.append(gathered)
+
+    def wait_for_save(self):
+        # called after the drafter layers too, the blocks of the staged requests are freed when they finish,
+        # right after this step
+        if self._copy_buffers:
+            self.copy_stream.synchronize()
+            self._copy_buffers.clear()
+        self._staged_block_ids = None
+
     def get_finished(self) -> tuple[set[str], set[str]]:
         """
         Get requests that are done sending or recving.
@@ -278,10 +525,14 @@ class PrefillConnectorWorker:
                     logger.debug(f"Get_finished: request {req_id}")
                     all_done_sending.add(req_id)
                 self.receive_req_list.clear()
+            self.metrics.record_released(self.metrics_cluster_id, len(all_done_sending))
+            self.metrics.set_queue_depth(self.metrics_cluster_id, 0)
+            self.metrics.maybe_log()
 
         return all_done_sending, all_done_recving
 
     def get_pulled_kv_req_list(self):
+        last_sweep_time = time.monotonic()
         while True:
             try:
                 if self.input_socket.poll(timeout=10) > 0:
@@ -289,10 +540,32 @@ class PrefillConnectorWorker:
                     id_list = json.loads(message)  # Parse the received JSON string into a list
                     logger.debug("Received: %s", id_list)
                     with self._transfer_lock:
+                        if self.leases is not None:
+                            # acks of expired leases are dropped, their blocks are released already
+                            id_list = self.leases.ack(id_list)
+                            self.metrics.set_leased_blocks(self.metrics_cluster_id, self.leases.num_blocks)
                         self.receive_req_list.extend(id_list)
+                        self.metrics.set_queue_depth(self.metrics_cluster_id, len(self.receive_req_list))
+                if self.leases is not None and time.monotonic() - last_sweep_time >= LEASE_SWEEP_INTERVAL_S:
+                    last_sweep_time = time.monotonic()
+                    self._expire_leases()
             except Exception as e:
+                self.metrics.record_failure(self.metrics_cluster_id)
                 logger.error("get pulled kv req list failed: %s", e)
 
+    def _expire_leases(self):
+        """Report the requests whose lease expired as done sending, so that the scheduler frees their blocks."""
+        with self._transfer_lock:
+            expired = self.leases.expire()
+            if not expired:
+                return
+            self.receive_req_list.extend(req_id for req_id, _ in expired)
+            self.metrics.set_leased_blocks(self.metrics_cluster_id, self.leases.num_blocks)
+            self.metrics.set_queue_depth(self.metrics_cluster_id, len(self.receive_req_list))
+        self.metrics.record_lease_expired(self.metrics_cluster_id, len(expired))
+        logger.warning("Releasing the KV blocks of %d requests not pulled within %.0fs: %s",
+                       len(expired), self.leases.ttl_s, [req_id for req_id, _ in expired])
+
 
 class DecodeConnectorScheduler:
     """Implementation of Scheduler side methods"""
@@ -377,8 +650,7 @@ class DecodeConnectorScheduler:
             if scheduler_output is None:
                 # Let go fast path
                 if metadata.requests:
-                    serialized_data = pickle.dumps(metadata)
-                    self.pub.send(serialized_data)
+                    self.pub.send_multipart(encode_requests(metadata.requests), copy=False)
 
         return metadata
 
@@ -405,22 +677,50 @@ class DecodeConnectorWorker:
             self.async_pull_kv = additional_config.get("async_pull_kv", False)
             self.multi_thread_pull_kv = additional_config.get("multi_thread_pull_kv", False)
             self.multi_rank_pull_kv = additional_config.get("multi_rank_pull_kv", False)
+            self.batch_pull_kv = additional_config.get("batch_pull_kv", False)
+            self.batch_pull_kv_max_blocks = int(additional_config.get(
+                "batch_pull_kv_max_blocks", DEFAULT_BATCH_PULL_KV_MAX_BLOCKS))
+            self.batch_pull_kv_timeout = additional_config.get(
+                "batch_pull_kv_timeout_ms", DEFAULT_BATCH_PULL_KV_TIMEOUT_MS) / 1000
+            self.layerwise_pull_kv = additional_config.get("layerwise_pull_kv", False)
+            self.layerwise_pull_kv_num_layers = int(additional_config.get(
+                "layerwise_pull_kv_num_layers", DEFAULT_LAYERWISE_PULL_KV_NUM_LAYERS))
         else:
             self.async_pull_kv = False
             self.multi_thread_pull_kv = False
             self.multi_rank_pull_kv = False
+            self.batch_pull_kv = False
+            self.batch_pull_kv_max_blocks = DEFAULT_BATCH_PULL_KV_MAX_BLOCKS
+            self.batch_pull_kv_timeout = DEFAULT_BATCH_PULL_KV_TIMEOUT_MS / 1000
+            self.layerwise_pull_kv = False
+            self.layerwise_pull_kv_num_layers = DEFAULT_LAYERWISE_PULL_KV_NUM_LAYERS
+        if self.batch_pull_kv_max_blocks <= 0:
+            raise ValueError(f"batch_pull_kv_max_blocks should be positive, but is {self.batch_pull_kv_max_blocks}.")
+        if self.layerwise_pull_kv_num_layers <= 0:
+            raise ValueError(
+                f"layerwise_pull_kv_num_layers should be positive, but is {self.layerwise_pull_kv_num_layers}.")
         if self.multi_rank_pull_kv:
             self.multi_thread_pull_kv = True
-        from omni.accelerators.cache import OmniBiGroupDataDistManager, ENABLED
-        if ENABLED:
-            manager_cls = OmniBiGroupDataDistManager
-            logger.warning(f"DecodeConnector is using Omni datadist manager for KV transfer.")
-            self.datadist_manager = manager_cls(vllm_config)
-        else:
-            manager_cls = LLMDataDistManager
-            self.datadist_manager = manager_cls(vllm_config)
+        from omni.accelerators.cache import ENABLED
+        if self.layerwise_pull_kv:
+            # the forward waits for every layer in python, which a compiled decode graph cannot do
+            if vllm_config.npu_compilation_config.level > CompilationLevel.NO_COMPILATION:
+                raise ValueError("layerwise_pull_kv is only supported in eager mode.")
+            if ENABLED:
+                raise ValueError("layerwise_pull_kv is not supported with omni attention.")
+        self.datadist_manager = create_kv_transfer_backend(vllm_config)
         self._recving_transfers: list = []
+        # request id -> number of stripes received, used by multi_rank_pull_kv
         self._done_recving_count: defaultdict[str, int] = defaultdict(lambda: 0)
+        self.link_throughput = LinkThroughputTracker()
+        self.metrics = create_kv_transfer_metrics("decode", vllm_config)
+        # bytes of one block over all layers, set when kv caches are registered
+        self.block_bytes = 0
+        self.group_block_bytes = [0]
+        # set when kv caches are registered, only used by `layerwise_pull_kv`
+        self.layer_load_tracker: Optional[LayerLoadTracker] = None
+        self.layer_indices: dict[str, int] = {}
+        self.layer_groups: list[range] = []
 
         self._pull_kv_lock = threading.Lock()
         self.queues = {} # cluster_id -> queue.Queue
@@ -467,11 +767,15 @@ class DecodeConnectorWorker:
         sub.setsockopt_string(zmq.SUBSCRIBE, "")
         
         while True:
-            serialized_data = sub.recv()
-            metadata = pickle.loads(serialized_data)
+            frames = sub.recv_multipart(copy=False)
+            metadata = DatadistConnectorMetadata()
+            metadata.requests = {
+                req_id: ReqMeta(**req_meta) for req_id, req_meta in decode_requests(frames).items()
+            }
+            need_load = False
             for req_id, meta in metadata.requests.items():
                 if (len(meta.local_block_ids) > 0) and (len(meta.remote_block_ids) > 0):
-                    self.start_load_kv(metadata)
+                    need_load = True
                     logger.info(
                         "Received fast path request for request %s with "
                         "local_block_ids: %s, remote_block_ids: %s.",
@@ -479,24 +783,83 @@ class DecodeConnectorWorker:
                         len(meta.local_block_ids),
                         len(meta.remote_block_ids)
                     )
+            if need_load:
+                self.start_load_kv(metadata)
 
     def worker(self, cluster_id):
+        """Pull the tasks queued for `cluster_id`, for ever. Every task taken from
+        the queue is marked done, and a failed pull does not stop the thread."""
         q = self.queues[cluster_id]
         time.sleep(0)
         while True:
             task = q.get()
+            self.metrics.set_queue_depth(cluster_id, q.qsize())
             if task is None:
+                q.task_done()
                 continue
+            leftover = None
+            if self.batch_pull_kv and is_mergeable_task(task):
+                tasks, leftover = self._coalesce_tasks(q, task)
+                self.metrics.set_queue_depth(cluster_id, q.qsize())
+            else:
+                tasks = [task]
+            self._run_task_batch(q, tasks, cluster_id)
+            if leftover is not None:
+                # taken from the queue by the batch, it is pulled whether the batch failed or not
+                self._run_task_batch(q, [leftover], cluster_id)
+
+    def _coalesce_tasks(self, q: queue.Queue, first_task: dict) -> tuple[list[dict], Optional[dict]]:
+        """Collect the tasks waiting in `q` behind `first_task` into one batch.
+
+        The batch is flushed once it holds `batch_pull_kv_max_blocks` blocks, or
+        when `batch_pull_kv_timeout_ms` has passed since the first task. With the
+        default timeout of 0 only the tasks that are already queued are merged,
+        so no latency is added when the link is idle.
+
+        Returns:
+            The tasks to pull together, and a task that was taken from the queue
+            but cannot be merged (e.g. omni attention layout), or None.
+        """
+        tasks = [first_task]
+        num_blocks = len(first_task['local_block_ids'])
+        deadline = time.monotonic() + self.batch_pull_kv_timeout
+        while num_blocks < self.batch_pull_kv_max_blocks:
             try:
-                self._read_blocks(**task)
-            except Exception as e:
-                logger.error("KV transfer task failed in thread %s: %s", cluster_id, e)
-                self._send_pulled_kv_req_list(task['remote_host_ip'], [task['request_id']])
-                raise RuntimeError(f"Failed to pull kv for request:{task['request_id']} from cluster:{cluster_id}.")
-            q.task_done()
+                timeout = deadline - time.monotonic()
+                task = q.get(timeout=timeout) if timeout > 0 else q.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                q.task_done()
+                continue
+            if not is_mergeable_task(task):
+                return tasks, task
+            tasks.append(task)
+            num_blocks += len(task['local_block_ids'])
+        return tasks, None
+
+    def _run_task_batch(self, q: queue.Queue, tasks: list[dict], cluster_id):
+        """Pull `tasks` together and mark them done in `q`. The requests of a failed
+        pull are acked to the prefill side, which releases their blocks, and dropped."""
+        try:
+            self._read_blocks_batch(tasks)
+        except Exception as e:
+            req_ids = [task['request_id'] for task in tasks]
+            logger.error("Failed to pull kv for requests:%s from cluster:%s: %s", req_ids, cluster_id, e)
+            for remote_host_ip, host_req_ids in group_req_ids_by_host(tasks).items():
+                self._send_pulled_kv_req_list(remote_host_ip, host_req_ids)
+        finally:
+            for _ in tasks:
+                q.task_done()
 
     def register_kv_caches(self, kv_caches: dict[str, torch.Tensor]):
         self.datadist_manager.register_memory(kv_caches)
+        self.group_block_bytes = self.datadist_manager.group_block_bytes(kv_caches)
+        self.block_bytes = self.group_block_bytes[0]
+        if self.layerwise_pull_kv:
+            self.layer_indices = {name: i for i, name in enumerate(ordered_layer_names(kv_caches))}
+            self.layer_groups = layer_groups(self.datadist_manager.num_layers, self.layerwise_pull_kv_num_layers)
+            self.layer_load_tracker = LayerLoadTracker(self.datadist_manager.num_layers)
         if self.multi_rank_pull_kv:
             self.registed_link_infos, _ = self.datadist_manager.register_link()
             logger.info(f" ***** registed_link_infos: {self.registed_link_infos}")
@@ -521,6 +884,8 @@ class DecodeConnectorWorker:
     def start_load_kv(self, metadata: DatadistConnectorMetadata):
         logger.info(f" ***** start_load_kv: {len(metadata.requests)}")
         futures = []
+        # remote_cluster_id -> tasks to be pulled together, only used by `batch_pull_kv`
+        pending_batches: defaultdict[str, list[dict]] = defaultdict(list)
         for req_id, meta in metadata.requests.items():
             # if the local_block_ids is empty, skip pulling kv for the request
             if len(meta.local_block_ids) == 0:
@@ -528,7 +893,7 @@ class DecodeConnectorWorker:
                 continue
             # If local_block_ids is a flat list of int, omni-attention is not used
             # and we can directly use the local_block_ids and remote_block_ids
-            if isinstance(meta.local_block_ids[0], int):
+            if isinstance(meta.local_block_ids[0], (int, np.integer)):
                 # local_block_ids (kv blocks in D) is more than remote_block_ids (kv blocks in P), cannot correctly pull kv
                 # raise RuntimeError to stop the process
                 if len(meta.remote_block_ids) < len(meta.local_block_ids):
@@ -549,10 +914,11 @@ class DecodeConnectorWorker:
             # If local_block_ids is a list of lists (e.g., [[], []]), omni-attention is used
             # local_block_ids[0] is a list of local block ids for uncompressed layers
             # local_block_ids[1] is a list of local block ids for compressed layers
-            elif isinstance(meta.local_block_ids[0], list):
-                # If local_block_ids[0] is a list of lists, we need to ensure that remote_block_ids
-                # is a list of lists as well, where each sublist corresponds to the local_block
-                meta.remote_block_ids = [meta.remote_block_ids] * len(meta.local_block_ids)
+            elif isinstance(meta.local_block_ids[0], (list, np.ndarray)):
+                # remote_block_ids is a list of lists as well, unless the prefill instance keeps
+                # the full KV cache in every layer, where each group selects from all its blocks
+                if len(meta.remote_block_ids) == 0 or isinstance(meta.remote_block_ids[0], (int, np.integer)):
+                    meta.remote_block_ids = [meta.remote_block_ids] * len(meta.local_block_ids)
                 # If local_block_ids[0] is empty, skip pulling kv for the request
                 if len(meta.local_block_ids[0]) == 0:
                     logger.info(f" ***** Request {req_id} has 0 local blocks, skip load kv.")
@@ -576,50 +942,35 @@ class DecodeConnectorWorker:
             else:
                 logger.error(f"Unexpected type for meta.local_block_ids[0]: {type(meta.local_block_ids[0])}")
                 raise RuntimeError(f"Unexpected type for meta.local_block_ids[0]: {type(meta.local_block_ids[0])}")
+            if self.layerwise_pull_kv and not self.multi_rank_pull_kv:
+                self.layer_load_tracker.add(req_id)
             if self.multi_rank_pull_kv:
                 # If multi_rank_pull_kv is enabled, each DP rank will pull kv from multiple P ranks
-                # and the cluster_ids are obtained from registed_link_infos
+                # and the cluster_ids are obtained from registed_link_infos.
+                # The blocks are striped across all P ranks, weighted by the measured link throughput.
                 cluster_ids = self.registed_link_infos[meta.remote_cluster_id][self.cluster_id + self.datadist_manager.local_rank]
-                # If the local_block_ids is a flat list of int, we can directly use it
-                # As multi_rank_pull_kv is designed to pull kv from two P ranks,
-                # we split the local_block_ids and remote_block_ids into two parts
-                if not isinstance(meta.local_block_ids[0], list):
-                    block_thre = len(meta.local_block_ids) // 2
-                # If the local_block_ids is a flat list of list, only split the blocks for uncompressed layers
-                else:
-                    block_thre = len(meta.local_block_ids[0]) // 2
-                for idx_cluster, cluster_id in enumerate(cluster_ids):
-                    if not isinstance(meta.local_block_ids[0], list):
-                        if idx_cluster == 0:
-                            local_blocks = meta.local_block_ids[:block_thre]
-                            remote_blocks = meta.remote_block_ids[:block_thre]
-                            len_local_blocks = len(local_blocks)
-                        else:
-                            local_blocks = meta.local_block_ids[block_thre:]
-                            remote_blocks = meta.remote_block_ids[block_thre:]
-                            len_local_blocks = len(local_blocks)
-                    else:
-                        if idx_cluster == 0:
-                            # For uncompressed layers, split the local_block_ids[0] and remote_block_ids
-                            # For compressed layers, only pull kv from the second P rank
-                            local_blocks = [meta.local_block_ids[0][:block_thre], []]
-                            # remote_blocks need to be split as well for getting kv blocks for compressed layers in P
-                            remote_blocks = [meta.remote_block_ids[0][:block_thre], []]
-                            len_local_blocks = len(local_blocks[0])
-                        else:
-                            local_blocks = [meta.local_block_ids[0][block_thre:], meta.local_block_ids[1]]
-                            remote_blocks = [meta.remote_block_ids[0][block_thre:], meta.remote_block_ids[1]]
-                            len_local_blocks = len(local_blocks[0])
-                    if len_local_blocks > 0:
-                        task = {
+                stripes = stripe_pull_blocks(meta.local_block_ids, meta.remote_block_ids,
+                                             self.link_throughput.weights(cluster_ids))
+                stripe_tasks = []
+                for cluster_id, (local_blocks, remote_blocks) in zip(cluster_ids, stripes):
+                    if num_blocks_of(local_blocks) > 0:
+                        stripe_tasks.append({
                             'request_id': req_id,
                             'dst_cluster_id': cluster_id,
                             'local_block_ids': local_blocks,
                             'remote_block_ids': remote_blocks,
                             'remote_host_ip': meta.remote_host,
-                        }
-                        logger.warning(f"*********** dst cluster_id is {cluster_id}.")
-                        self.queues[cluster_id].put(task)
+                            'num_stripes': 0,
+                            'lease_deadline': meta.lease_deadline,
+                        })
+                if self.layerwise_pull_kv:
+                    self.layer_load_tracker.add(req_id, num_parts=len(stripe_tasks))
+                for task in stripe_tasks:
+                    task['num_stripes'] = len(stripe_tasks)
+                    logger.debug(f"*********** dst cluster_id is {task['dst_cluster_id']}.")
+                    q = self.queues[task['dst_cluster_id']]
+                    q.put(task)
+                    self.metrics.set_queue_depth(task['dst_cluster_id'], q.qsize())
             elif self.multi_thread_pull_kv:
                 cluster_id = int(meta.remote_cluster_id)
                 task = {
@@ -628,9 +979,20 @@ class DecodeConnectorWorker:
                     'local_block_ids': meta.local_block_ids,
                     'remote_block_ids': meta.remote_block_ids,
                     'remote_host_ip': meta.remote_host,
+                    'lease_deadline': meta.lease_deadline,
                 }
-                
+
                 self.queues[cluster_id].put(task)
+                self.metrics.set_queue_depth(cluster_id, self.queues[cluster_id].qsize())
+            elif self.batch_pull_kv and isinstance(meta.local_block_ids[0], (int, np.integer)):
+                pending_batches[meta.remote_cluster_id].append({
+                    'request_id': req_id,
+                    'dst_cluster_id': meta.remote_cluster_id,
+                    'local_block_ids': meta.local_block_ids,
+                    'remote_block_ids': meta.remote_block_ids,
+                    'remote_host_ip': meta.remote_host,
+                    'lease_deadline': meta.lease_deadline,
+                })
             else:
                 # Use ThreadPoolExecutor to handle the task
                 future = self.executor.submit(
@@ -640,9 +1002,14 @@ class DecodeConnectorWorker:
                                 dst_cluster_id=meta.remote_cluster_id, 
                                 request_id=req_id,
                                 remote_host_ip=meta.remote_host,
+                                lease_deadline=meta.lease_deadline,
                             )
                 futures.append(future)
 
+        for tasks in pending_batches.values():
+            for batch in split_task_batch(tasks, self.batch_pull_kv_max_blocks):
+                futures.append(self.executor.submit(self._read_blocks_batch, batch))
+
         if not self.multi_thread_pull_kv:
             for future in futures:
                 future.add_done_callback(handle_exception)
@@ -654,15 +1021,102 @@ class DecodeConnectorWorker:
         dst_cluster_id: str,
         request_id: str,
         remote_host_ip: str,
+        num_stripes: int = 1,
+        lease_deadline: Optional[float] = None,
     ):
         start = time.time()
-        self.datadist_manager.pull_kv(remote_block_ids, local_block_ids, dst_cluster_id)
-        self._send_pulled_kv_req_list(remote_host_ip, [request_id])
-        with self._transfer_lock:
-            self._recving_transfers.append(request_id)
+        num_blocks = num_blocks_of(local_block_ids)
+        num_bytes = block_bytes_of(local_block_ids, self.group_block_bytes)
+        with self.metrics.track_transfer(dst_cluster_id, num_blocks, num_bytes):
+            self._pull_kv([request_id], to_block_id_list(remote_block_ids), to_block_id_list(local_block_ids),
+                          dst_cluster_id, lease_deadline)
+        # throughput in full attention blocks, the unit the stripes are split in
+        self.link_throughput.update(dst_cluster_id, num_bytes / self.block_bytes, time.time() - start)
+        if self._complete_stripe(request_id, num_stripes):
+            self._send_pulled_kv_req_list(remote_host_ip, [request_id])
+            if not self.layerwise_pull_kv:
+                with self._transfer_lock:
+                    self._recving_transfers.append(request_id)
         cost = time.time() - start
         logger.info(f" ***** read block, req_id:{request_id}, cost:{cost:.6f}")
 
+    def _pull_kv(self, request_ids: list[str], remote_block_ids, local_block_ids, dst_cluster_id,
+                 lease_deadline: Optional[float] = None):
+        """Pull the blocks of `request_ids`. With `layerwise_pull_kv` they are pulled
+        layer group by layer group, and every group is marked loaded as soon as it
+        has arrived, so that the requests can be scheduled before their last layer.
+
+        Nothing is pulled after `lease_deadline`, when the prefill side may release
+        the blocks: the pull fails with KVLeaseExpiredError and the requests are
+        dropped like those of any failed pull."""
+        if not self.layerwise_pull_kv:
+            self.datadist_manager.pull_kv(remote_block_ids, local_block_ids, dst_cluster_id,
+                                          deadline=lease_deadline)
+            return
+        try:
+            for layer_range in self.layer_groups:
+                self.datadist_manager.pull_kv(remote_block_ids, local_block_ids, dst_cluster_id, layer_range,
+                                              deadline=lease_deadline)
+                for request_id in request_ids:
+                    self.layer_load_tracker.mark_loaded(request_id, layer_range)
+        except Exception:
+            # a request may be running already, its forward fails on the layers that will not arrive
+            for request_id in request_ids:
+                self.layer_load_tracker.fail(request_id)
+            raise
+
+    def save_kv_layer(self, layer_name: str, kv_layer):
+        pass
+
+    def wait_for_save(self):
+        pass
+
+    def wait_for_layer_load(self, layer_name: str):
+        if self.layer_load_tracker is None:
+            return
+        layer = self.layer_indices.get(layer_name)
+        if layer is not None:
+            self.layer_load_tracker.wait_for_layer(layer)
+
+    def _complete_stripe(self, request_id: str, num_stripes: int) -> bool:
+        """Count a finished stripe of a request pulled from multiple P ranks.
+        Returns True once all stripes of the request have arrived."""
+        if num_stripes <= 1:
+            return True
+        with self._transfer_lock:
+            self._done_recving_count[request_id] += 1
+            if self._done_recving_count[request_id] < num_stripes:
+                return False
+            del self._done_recving_count[request_id]
+        return True
+
+    def _read_blocks_batch(self, tasks: list[dict]):
+        """Pull the KV of several requests from the same prefill cluster with
+        a single `pull_kv` call, then ack all of them to the prefill side at once.
+        """
+        if len(tasks) == 1:
+            self._read_blocks(**tasks[0])
+            return
+        start = time.time()
+        local_block_ids, remote_block_ids = merge_block_ids(tasks)
+        with self.metrics.track_transfer(tasks[0]['dst_cluster_id'], len(local_block_ids),
+                                         len(local_block_ids) * self.block_bytes):
+            self._pull_kv([task['request_id'] for task in tasks], remote_block_ids, local_block_ids,
+                          tasks[0]['dst_cluster_id'], earliest_lease_deadline(tasks))
+        self.link_throughput.update(tasks[0]['dst_cluster_id'], len(local_block_ids), time.time() - start)
+        done_tasks = [
+            task for task in tasks
+            if self._complete_stripe(task['request_id'], task.get('num_stripes', 1))
+        ]
+        req_ids = [task['request_id'] for task in done_tasks]
+        for remote_host_ip, host_req_ids in group_req_ids_by_host(done_tasks).items():
+            self._send_pulled_kv_req_list(remote_host_ip, host_req_ids)
+        if not self.layerwise_pull_kv:
+            with self._transfer_lock:
+                self._recving_transfers.extend(req_ids)
+        cost = time.time() - start
+        logger.info(f" ***** read blocks batch, req_ids:{req_ids}, num_blocks:{len(local_block_ids)}, cost:{cost:.6f}")
+
 
     def _send_pulled_kv_req_list(self, path, data):
         if path in self.zmq_socket_map:
@@ -685,9 +1139,13 @@ class DecodeConnectorWorker:
         all_done_sending: set[str] = set()
         with self._transfer_lock:
             all_done_recving = self._pop_done_transfers(self._recving_transfers)
+        if self.layer_load_tracker is not None:
+            # scheduled once their first layer has arrived, the forward waits for the others
+            all_done_recving |= self.layer_load_tracker.release()
         if len(all_done_recving) > 0:
             logger.debug(
                 "Get_finished: %s requests done recving", len(all_done_recving))
+        self.metrics.maybe_log()
 
         return all_done_sending, all_done_recving
 
@@ -698,6 +1156,54 @@ class DecodeConnectorWorker:
         self._recving_transfers.clear()
         return done_req_ids
 
+def is_mergeable_task(task: dict) -> bool:
+    """Only tasks with a flat block id list can be merged. With omni attention
+    the compressed layers select their sink and recent blocks per request."""
+    local_block_ids = task['local_block_ids']
+    return len(local_block_ids) > 0 and isinstance(local_block_ids[0], (int, np.integer))
+
+
+def merge_block_ids(tasks: list[dict]) -> tuple[list[int], list[int]]:
+    """Concatenate the (local, remote) block pairs of several tasks. Pairs are
+    sorted by remote block id so that adjacent blocks of the prefill side form
+    contiguous ranges in the merged pull.
+    """
+    pairs = sorted(
+        (remote, local)
+        for task in tasks
+        for local, remote in zip(task['local_block_ids'], task['remote_block_ids'])
+    )
+    return [int(local) for _, local in pairs], [int(remote) for remote, _ in pairs]
+
+
+def earliest_lease_deadline(tasks: list[dict]) -> Optional[float]:
+    """The lease deadline of a batch of tasks pulled together, that of its first lease to end."""
+    deadlines = [task['lease_deadline'] for task in tasks if task.get('lease_deadline') is not None]
+    return min(deadlines) if deadlines else None
+
+
+def split_task_batch(tasks: list[dict], max_blocks: int) -> Iterator[list[dict]]:
+    """Split tasks into consecutive batches holding at most `max_blocks` blocks,
+    a single task larger than `max_blocks` forms a batch on its own."""
+    batch, num_blocks = [], 0
+    for task in tasks:
+        task_blocks = len(task['local_block_ids'])
+        if batch and num_blocks + task_blocks > max_blocks:
+            yield batch
+            batch, num_blocks = [], 0
+        batch.append(task)
+        num_blocks += task_blocks
+    if batch:
+        yield batch
+
+
+def group_req_ids_by_host(tasks: list[dict]) -> dict[str, list[str]]:
+    req_ids_by_host: defaultdict[str, list[str]] = defaultdict(list)
+    for task in tasks:
+        req_ids_by_host[task['remote_host_ip']].append(task['request_id'])
+    return req_ids_by_host
+
+
 def handle_exception(future):
     if future.exception():
         logger.error(f"Exception occurred in future: {future.exception()}")
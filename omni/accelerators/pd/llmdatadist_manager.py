@@ -2,58 +2,83 @@
 # Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
 
 import json
+import threading
 import time
 from collections import defaultdict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import cached_property
+from typing import Optional
 
-import llm_datadist
 import torch
-from llm_datadist import (BlocksCacheKey, CacheDesc, LLMConfig,
-                          LLMDataDist, LLMRole, RegisterMemStatus, LLMException, LLMStatusCode)
+try:
+    import llm_datadist
+    from llm_datadist import (BlocksCacheKey, CacheDesc, LLMConfig, Placement,
+                              LLMDataDist, LLMRole, RegisterMemStatus, LLMException, LLMStatusCode)
+except ImportError:
+    # only the loopback backend (`kv_transfer_backend: loopback`) can be used without llm_datadist
+    llm_datadist = None
 
 from vllm.config import KVTransferConfig
 from vllm.distributed import get_world_group
 from vllm.logger import init_logger
 from vllm.model_executor.models.utils import extract_layer_index
+from omni.accelerators.pd.kv_transfer_backend import KVTransferBackend
 from omni.accelerators.pd.ranktable.local_info import LocalInfo
 from omni.accelerators.pd.ranktable.rank_table import GlobalRankTable
-from omni.accelerators.pd.utils import get_p_start_rank, prepare_ranktables
+from omni.accelerators.pd.utils import (backoff_delays, check_lease_deadline, get_p_start_rank, prepare_ranktables,
+                                       split_staging_blocks)
 from vllm.config import VllmConfig
 import os
 
 logger = init_logger(__name__)
 
-_ROLE_STR_TO_ENUM = {
-    "kv_producer": LLMRole.PROMPT,
-    "kv_consumer": LLMRole.DECODER
-}
-
-TORCH_DTYPE_TO_NPU_DTYPE = {
-    torch.half: llm_datadist.DataType.DT_FLOAT16,
-    torch.float16: llm_datadist.DataType.DT_FLOAT16,
-    torch.bfloat16: llm_datadist.DataType.DT_BF16,
-    torch.float: llm_datadist.DataType.DT_FLOAT,
-    torch.float32: llm_datadist.DataType.DT_FLOAT,
-    torch.int8: llm_datadist.DataType.DT_INT8,
-    torch.int64: llm_datadist.DataType.DT_INT64,
-    torch.int32: llm_datadist.DataType.DT_INT32
-}
-
-SCHEDULER_LINK_BATCH_SIZE = 32
-SCHEDULER_LINK_INTERVAL = 0.5
+if llm_datadist is not None:
+    _ROLE_STR_TO_ENUM = {
+        "kv_producer": LLMRole.PROMPT,
+        "kv_consumer": LLMRole.DECODER
+    }
+
+    TORCH_DTYPE_TO_NPU_DTYPE = {
+        torch.half: llm_datadist.DataType.DT_FLOAT16,
+        torch.float16: llm_datadist.DataType.DT_FLOAT16,
+        torch.bfloat16: llm_datadist.DataType.DT_BF16,
+        torch.float: llm_datadist.DataType.DT_FLOAT,
+        torch.float32: llm_datadist.DataType.DT_FLOAT,
+        torch.int8: llm_datadist.DataType.DT_INT8,
+        torch.int64: llm_datadist.DataType.DT_INT64,
+        torch.int32: llm_datadist.DataType.DT_INT32
+    }
+
+    RETRYABLE_CODES = [
+        LLMStatusCode.LLM_REPEAT_REQUEST,
+        LLMStatusCode.LLM_CLUSTER_NUM_EXCEED_LIMIT,
+        LLMStatusCode.LLM_PROCESSING_LINK,  # Building chain is in progress
+        LLMStatusCode.LLM_DEVICE_OUT_OF_MEMORY,
+        LLMStatusCode.LLM_TIMEOUT,
+        LLMStatusCode.LLM_WAIT_PROCESS_TIMEOUT,
+        LLMStatusCode.LLM_LINK_BUSY,
+    ]
+
+KV_TRANSFER_MODES = ("pull", "staged")
+# Seconds the KV blocks of a finished prefill request are held for the decode pull (0 to hold them until the pull),
+# and seconds more before they are released, as the decode side only stops starting pulls at the end of the lease.
+# The grace covers a pull call in flight, bounded by the sync_kv_timeout of llm_datadist, and the clock skew of hosts.
+DEFAULT_KV_LEASE_TTL_S = 120
+DEFAULT_KV_LEASE_GRACE_S = 30
+# Milliseconds a pull call of llm_datadist waits for the KV at most (RoCE timeout is 20s).
+KV_PULL_TIMEOUT_MS = 20000
+
+# Number of KV links set up at the same time, attempts per link and seconds to wait for a link to be ready (0 for ever).
+DEFAULT_KV_LINK_PARALLELISM = 8
+DEFAULT_KV_LINK_RETRY_TIMES = 3
+DEFAULT_KV_LINK_TIMEOUT_S = 0
+KV_LINK_RETRY_BASE_SECOND = 1.0
+KV_LINK_RETRY_MAX_SECOND = 30.0
+KV_LINK_STATUS_INTERVAL_SECOND = 0.05
+KV_LINK_STATUS_MAX_INTERVAL_SECOND = 3.0
 KV_CACHE_RETRY_TIMES = 3
 KV_CACHE_RETRY_WAIT_SECOND = 2
 
-RETRYABLE_CODES = [
-    LLMStatusCode.LLM_REPEAT_REQUEST,
-    LLMStatusCode.LLM_CLUSTER_NUM_EXCEED_LIMIT,
-    LLMStatusCode.LLM_PROCESSING_LINK,  # Building chain is in progress
-    LLMStatusCode.LLM_DEVICE_OUT_OF_MEMORY,
-    LLMStatusCode.LLM_TIMEOUT,
-    LLMStatusCode.LLM_WAIT_PROCESS_TIMEOUT,
-    LLMStatusCode.LLM_LINK_BUSY,
-]
-
 
 class LLMDataDistConfig:
     """
@@ -67,6 +92,28 @@ class LLMDataDistConfig:
         else:
             self.multi_rank_pull_kv = False
         self.kv_transfer_config = vllm_config.kv_transfer_config
+        # staged mode: the prefill side offloads every layer into host staging caches as soon as it is computed,
+        # and frees its blocks right after the last layer, the decode side pulls from the staging caches
+        self.kv_transfer_mode = self.kv_transfer_config.get_from_extra_config("kv_transfer_mode", "pull")
+        if self.kv_transfer_mode not in KV_TRANSFER_MODES:
+            raise ValueError(f"kv_transfer_mode should be one of {KV_TRANSFER_MODES}, but is {self.kv_transfer_mode}.")
+        # pinned host memory of every layer, on every prefill rank that is pulled from, so it has no default
+        self.kv_staging_blocks = int(self.kv_transfer_config.get_from_extra_config("kv_staging_blocks", 0))
+        if self.kv_transfer_mode == "staged" and self.kv_staging_blocks <= 0:
+            raise ValueError(f"kv_transfer_mode staged needs kv_staging_blocks, the number of host staging "
+                             f"blocks, to be positive, but it is {self.kv_staging_blocks}.")
+        # 0 holds the blocks until the decode side has pulled them, however long it takes
+        self.kv_lease_ttl_s = float(self.kv_transfer_config.get_from_extra_config(
+            "kv_lease_ttl_s", DEFAULT_KV_LEASE_TTL_S))
+        if self.kv_lease_ttl_s < 0:
+            raise ValueError(f"kv_lease_ttl_s should not be negative, but is {self.kv_lease_ttl_s}.")
+        self.kv_lease_grace_s = float(self.kv_transfer_config.get_from_extra_config(
+            "kv_lease_grace_s", DEFAULT_KV_LEASE_GRACE_S))
+        if self.kv_lease_grace_s < 0:
+            raise ValueError(f"kv_lease_grace_s should not be negative, but is {self.kv_lease_grace_s}.")
+        if self.kv_lease_ttl_s > 0 and self.kv_lease_grace_s * 1000 <= KV_PULL_TIMEOUT_MS:
+            logger.warning(f"kv_lease_grace_s {self.kv_lease_grace_s} does not cover a pull call of "
+                           f"{KV_PULL_TIMEOUT_MS / 1000}s, a pull may read blocks released by an expired lease.")
 
         self.local_info = LocalInfo()
         self.global_rank_table = GlobalRankTable()
@@ -126,17 +173,28 @@ class LLMDataDistConfig:
 
     @cached_property
     def is_prefill(self):
-        return self.role == LLMRole.PROMPT
+        return self.kv_transfer_config.kv_role == "kv_producer"
+
+    @cached_property
+    def is_staged_mode(self):
+        return self.kv_transfer_mode == "staged"
 
 
-class LLMDataDistManager:
+class LLMDataDistManager(KVTransferBackend):
     def __init__(self, vllm_config: VllmConfig):
+        if llm_datadist is None:
+            raise ImportError("llm_datadist is required by the llmdatadist KV transfer backend.")
         additional_config = vllm_config.additional_config
         if additional_config:  # pragma: no cover
             self.multi_rank_pull_kv = additional_config.get("multi_rank_pull_kv", False)
+            # number of P ranks each D rank pulls from when multi_rank_pull_kv is enabled
+            self.multi_rank_pull_kv_num_ranks = int(additional_config.get("multi_rank_pull_kv_num_ranks", 2))
         else:  # pragma: no cover
             self.multi_rank_pull_kv = False
-        kv_transfer_config = vllm_config.kv_transfer_config
+            self.multi_rank_pull_kv_num_ranks = 2
+        if self.multi_rank_pull_kv_num_ranks < 1:
+            raise ValueError(f"multi_rank_pull_kv_num_ranks should be positive, but is {self.multi_rank_pull_kv_num_ranks}.")
+        self._init_links(vllm_config.kv_transfer_config)
         self.data_dist_config = LLMDataDistConfig(vllm_config)
         self.rank = self.data_dist_config.rank
         self.local_rank = self.data_dist_config.local_rank
@@ -144,7 +202,38 @@ class LLMDataDistManager:
         self.data_dist_engine = self._init_llm_data_dist()
 
         self.registerd_kv_caches = []
+        # host staging caches of staged mode, only pulled from by the decode side
+        self.registerd_staging_caches = []
+        # number of layers in every registered cache, in the order of layer_index
+        self.num_layers = 0
+
+    def _init_links(self, kv_transfer_config: KVTransferConfig):
+        """Read the link knobs of the extra config and reset the link state."""
+        self.link_parallelism = int(kv_transfer_config.get_from_extra_config(
+            "kv_link_parallelism", DEFAULT_KV_LINK_PARALLELISM))
+        self.link_retry_times = int(kv_transfer_config.get_from_extra_config(
+            "kv_link_retry_times", DEFAULT_KV_LINK_RETRY_TIMES))
+        self.link_timeout_s = float(kv_transfer_config.get_from_extra_config(
+            "kv_link_timeout_s", DEFAULT_KV_LINK_TIMEOUT_S))
+        # the decode side links to a prefill cluster on its first pull, the prefill side does not wait for its links
+        self.link_deferred = bool(kv_transfer_config.get_from_extra_config("kv_link_deferred", False))
+        if self.link_parallelism < 1 or self.link_retry_times < 1:
+            raise ValueError(f"kv_link_parallelism and kv_link_retry_times should be positive, "
+                             f"but are {self.link_parallelism} and {self.link_retry_times}.")
+        if self.link_timeout_s < 0:
+            raise ValueError(f"kv_link_timeout_s should not be negative, but is {self.link_timeout_s}.")
         self.rank_link_info_map = {}
+        # prefill cluster id -> links of this rank to it, planned by register_link
+        self._link_specs: dict[int, list[LinkSpec]] = defaultdict(list)
+        self._registed_link_infos: Optional[dict] = None
+        # prefill cluster id -> futures of its links, once they are started
+        self._link_futures: dict[int, list[Future]] = {}
+        self._ready_link_clusters: set[int] = set()
+        self._link_lock = threading.Lock()
+        # llm_datadist does not document link and unlink, which change the links of the engine, as thread-safe:
+        # they are called one at a time, while the links wait to be ready, most of their set up, in parallel
+        self._datadist_lock = threading.Lock()
+        self._link_executor: Optional[ThreadPoolExecutor] = None
 
     def _init_llm_data_dist(self):
         data_dist = LLMDataDist(self.data_dist_config.role, self.data_dist_config.cluster_id)
@@ -154,8 +243,7 @@ class LLMDataDistManager:
         llm_config.enable_switch_role = True
         llm_config.enable_cache_manager = True
 
-        # RoCE timeout is 20s
-        llm_config.sync_kv_timeout = 20000
+        llm_config.sync_kv_timeout = KV_PULL_TIMEOUT_MS
 
         llm_config.enable_remote_cache_accessible = True
         options = llm_config.generate_options()
@@ -167,6 +255,7 @@ class LLMDataDistManager:
         if len(self.registerd_kv_caches) > 0:
             raise ValueError("Attr `registerd_kv_caches` must be empty before register kv_caches.")
         flatten_kv_caches = unzip_kv_cache(kv_caches)
+        self.num_layers = len(flatten_kv_caches[0])
         for model_id, sub_kv_caches in enumerate(flatten_kv_caches):
             cache_desc = CacheDesc(num_tensors=len(sub_kv_caches), shape=tuple(sub_kv_caches[0].shape),
                                    data_type=TORCH_DTYPE_TO_NPU_DTYPE[sub_kv_caches[0].dtype])
@@ -182,11 +271,31 @@ class LLMDataDistManager:
             self.registerd_kv_caches.append(cache)
         logger.error(f" ***** registerd_kv_caches num:{len(self.registerd_kv_caches)}")
 
-    def _pull_blocks(self, src_cache_key, dst_cache, src_blocks, dst_blocks):
+    def register_staging_memory(self, staging_caches: list[list[torch.Tensor]]):
+        """Register the host staging caches of staged mode, laid out like the output of
+        `unzip_kv_cache`, after the device caches: the staging cache of model_id i
+        is registered as model_id len(registerd_kv_caches) + i."""
+        num_device_caches = len(self.registerd_kv_caches)
+        if len(staging_caches) != num_device_caches:
+            raise ValueError(f"Expected {num_device_caches} staging caches, but got {len(staging_caches)}.")
+        for model_id, sub_staging_caches in enumerate(staging_caches, start=num_device_caches):
+            cache_desc = CacheDesc(num_tensors=len(sub_staging_caches), shape=tuple(sub_staging_caches[0].shape),
+                                   data_type=TORCH_DTYPE_TO_NPU_DTYPE[sub_staging_caches[0].dtype],
+                                   placement=Placement.HOST)
+            cache_addrs = [int(item.data_ptr()) for item in sub_staging_caches]
+            cache_key = BlocksCacheKey(self.data_dist_engine.cluster_id, model_id=model_id)
+            self.registerd_staging_caches.append(
+                self.data_dist_engine.cache_manager.register_blocks_cache(cache_desc, cache_addrs, cache_key))
+
+    def _pull_blocks(self, src_cache_key, dst_cache, src_blocks, dst_blocks, layer_range=None, deadline=None):
+        # the same layers on both sides, the caches of P and D hold the layers in the same order
+        layer_kwargs = {} if layer_range is None else dict(src_layer_range=layer_range, dst_layer_range=layer_range)
         for _ in range(KV_CACHE_RETRY_TIMES):
+            # a retry too, the blocks may be released once the lease has ended
+            check_lease_deadline(deadline)
             try:
                 self.data_dist_engine.cache_manager.pull_blocks(src_cache_key, dst_cache, src_blocks,
-                                                                          dst_blocks)
+                                                                          dst_blocks, **layer_kwargs)
                 return
             except LLMException as e:
                 # Use the appropriate strategy depending on the type of anomaly
@@ -204,18 +313,44 @@ class LLMDataDistManager:
         logger.error(f"kv cache pull blocks retry error {src_cache_key} {src_blocks} {dst_blocks}")
         raise RuntimeError("kv cache pull blocks failed")
 
-    def pull_kv(self, src_blocks, tgt_blocks, prompt_cluster_id):
+    def pull_kv(self, src_blocks, tgt_blocks, prompt_cluster_id, layer_range: Optional[range] = None,
+                deadline: Optional[float] = None):
+        """Pull the blocks of all layers, or of the layers in `layer_range` only
+        (indices in the registered caches, see `unzip_kv_cache`), raising
+        KVLeaseExpiredError rather than starting a pull call after `deadline`."""
+        self.wait_for_links(prompt_cluster_id)
         # If this line is not added, the fx mode will report an error.
         # The preliminary reason is that the context is lost when multiple coroutines pull kv.
         torch.npu.set_device(f"npu:{self.local_rank}")
-        for model_id, kv_cache in enumerate(self.registerd_kv_caches):
-            prompt_cache_key = BlocksCacheKey(
-                prompt_cluster_id=prompt_cluster_id, model_id=model_id)
-            self._pull_blocks(prompt_cache_key, kv_cache,
-                              src_blocks, tgt_blocks)
+        # blocks copied into the staging caches of the prefill side are pulled from their model_ids
+        for is_staging, group_src_blocks, group_tgt_blocks in split_staging_blocks(src_blocks, tgt_blocks):
+            model_id_offset = len(self.registerd_kv_caches) if is_staging else 0
+            for model_id, kv_cache in enumerate(self.registerd_kv_caches):
+                prompt_cache_key = BlocksCacheKey(
+                    prompt_cluster_id=prompt_cluster_id, model_id=model_id_offset + model_id)
+                self._pull_blocks(prompt_cache_key, kv_cache,
+                                  group_src_blocks, group_tgt_blocks, layer_range, deadline)
 
     def register_link(self):
-
+        """Plan the links of this rank and set them up on a pool of `kv_link_parallelism` threads.
+        With `kv_link_deferred`, the decode side only plans them, they are set up by the first
+        pull from their prefill cluster, and the prefill side returns without waiting for them."""
+        registed_link_infos = self._plan_links()
+        status = self._start_planned_links()
+        if self.data_dist_config.is_prefill or (not self.multi_rank_pull_kv):
+            return status
+        return registed_link_infos, status
+
+    def is_pulled_from(self) -> bool:
+        # only the prefill ranks some decode rank links to are pulled from
+        self._plan_links()
+        return len(self._link_specs) > 0
+
+    def _plan_links(self):
+        """Plan the links of this rank into `_link_specs`, once. Returns the P cluster
+        ids of the links of every D cluster with multi_rank_pull_kv, on the decode side."""
+        if self._registed_link_infos is not None:
+            return self._registed_link_infos
         if self.data_dist_config.is_prefill:
             prefill_servers = [self.data_dist_config.local_info.server]
             decode_servers = self.data_dist_config.global_rank_table.decode_group_server_list
@@ -234,7 +369,6 @@ class LLMDataDistManager:
         p_rank_start = p_dp * prefill_tp_size
         p_rank_end = (p_dp + 1) * prefill_tp_size
 
-        link_num = 0
         registed_link_infos = {}
         for prefill_server in prefill_servers:
             # count the number of devices in the prefill server
@@ -257,28 +391,28 @@ class LLMDataDistManager:
                     )
 
                     # first kv link
-                    link_num, registed_link_info = self._create_kv_link(
+                    registed_link_info = self._create_kv_link(
                         prefill_server, decode_server, d_dp, p_start_rank, p_rank_start, p_rank_end,
-                        d_rank_start, d_rank_end, prefill_cluster_id, 
-                        self.data_dist_config.global_rank_table.get_cluster_id(decode_server), 
-                        link_num, registed_link_info)
+                        d_rank_start, d_rank_end, prefill_cluster_id,
+                        self.data_dist_config.global_rank_table.get_cluster_id(decode_server),
+                        registed_link_info)
 
-                    # second kv link
+                    # extra kv links to the following P ranks, the blocks are striped across all of them
                     if self.multi_rank_pull_kv:
-                        logger.warning(f"***** Now trying to build the 2nd kv link....")
-                        p_start_rank_2 = (p_start_rank + 1) % (p_rank_end - p_rank_start)
-                        link_num, registed_link_info = self._create_kv_link(
-                            prefill_server, decode_server, d_dp, p_start_rank_2, p_rank_start, p_rank_end,
-                            d_rank_start, d_rank_end, prefill_cluster_id, 
-                            self.data_dist_config.global_rank_table.get_cluster_id(decode_server), 
-                            link_num, registed_link_info)
+                        for link_idx in range(1, self.multi_rank_pull_kv_num_ranks):
+                            logger.warning(f"***** Now trying to build kv link {link_idx + 1}....")
+                            p_start_rank_i = (p_start_rank + link_idx) % (p_rank_end - p_rank_start)
+                            registed_link_info = self._create_kv_link(
+                                prefill_server, decode_server, d_dp, p_start_rank_i, p_rank_start, p_rank_end,
+                                d_rank_start, d_rank_end, prefill_cluster_id,
+                                self.data_dist_config.global_rank_table.get_cluster_id(decode_server),
+                                registed_link_info)
 
             if self.multi_rank_pull_kv:
                 registed_link_infos[prefill_cluster_id] = registed_link_info
 
-        if self.data_dist_config.is_prefill or (not self.multi_rank_pull_kv):
-            return self.check_register_status()
-        return registed_link_infos, self.check_register_status()
+        self._registed_link_infos = registed_link_infos
+        return registed_link_infos
 
     def count_devices_for_server_ip(self, data, target_ip):
         """
@@ -327,8 +461,7 @@ class LLMDataDistManager:
 
     def _create_kv_link(
         self, prefill_server, decode_server, d_dp, p_start_rank, p_rank_start, p_rank_end,
-        d_rank_start, d_rank_end, prefill_cluster_id, decode_cluster_id, link_num,
-        registed_link_info
+        d_rank_start, d_rank_end, prefill_cluster_id, decode_cluster_id, registed_link_info
     ):
         p_ranktables, d_ranktables = prepare_ranktables(
             prefill_server, decode_server,
@@ -393,7 +526,9 @@ class LLMDataDistManager:
 
         logger.warning(f"create link:{comm_names}")
 
-        self._build_device_link(comm_names, cluster_rank_infos, ranktables)
+        # the cluster id the pulls over this link name, as in registed_link_info
+        pull_cluster_id = prefill_cluster_id + p_start_rank if self.multi_rank_pull_kv else prefill_cluster_id
+        self._build_device_link(comm_names, cluster_rank_infos, ranktables, pull_cluster_id)
 
         if self.multi_rank_pull_kv:
             if not self.data_dist_config.is_prefill:
@@ -402,52 +537,126 @@ class LLMDataDistManager:
                     registed_link_info[key].append(prefill_cluster_id + p_start_rank)
                 else:
                     registed_link_info[key] = [prefill_cluster_id + p_start_rank]
+        return registed_link_info
 
-        link_num += 1
-        if link_num >= SCHEDULER_LINK_BATCH_SIZE:
-            link_num = 0
-            time.sleep(SCHEDULER_LINK_INTERVAL)
-        return link_num, registed_link_info
-
-    def _build_device_link(self, comm_names, cluster_rank_infos, rank_tables):
+    def _build_device_link(self, comm_names, cluster_rank_infos, rank_tables, pull_cluster_id):
         if self.rank in comm_names and self.rank in cluster_rank_infos and self.rank in rank_tables:
-            comm_name = comm_names[self.rank]
-
             cluster_rank_info = cluster_rank_infos[self.rank]
             cluster_rank_info = {int(key): value for key, value in cluster_rank_info.items()}
-            rank_table = json.dumps(rank_tables[self.rank])
-            comm_id = self.data_dist_engine.link(comm_name, cluster_rank_info, rank_table)
-            logger.info(f"rank:{self.rank} linked {comm_name}:{comm_id}, cluster_rank_info:{cluster_rank_info}")
-            # Save comm_name information
-            self.rank_link_info_map[comm_name] = RankLinkInfo(comm_name, comm_id, cluster_rank_info)
-
-    def check_register_status(self):
-        status = {comm_name: False for comm_name in self.rank_link_info_map.keys()}
-        ready_num = 0
-        while ready_num < len(self.rank_link_info_map):
-            for comm_name, rank_link_info in self.rank_link_info_map.items():
-                if status[comm_name]:
-                    continue
-                ret = self.data_dist_engine.query_register_mem_status(rank_link_info.comm_id)
-                if ret == RegisterMemStatus.OK:
-                    status[comm_name] = True
-                    ready_num += 1
-                    logger.debug(f"rank:{self.rank} check link status success")
-                    logger.debug(f"comm_id: {rank_link_info.comm_id} ret:{ret}")
-
-                elif ret == RegisterMemStatus.FAILED:
-                    logger.error(f"rank:{self.rank} check link status failed")
-                    logger.debug(f"comm_id: {rank_link_info.comm_id} ret:{ret}")
-                    raise RuntimeError("check kv link status failed")
-
-                logger.warning(f"rank:{self.rank} check link status")
-                logger.debug(f"comm_id: {rank_link_info.comm_id} ret:{ret}")
-
-            if ready_num < len(self.rank_link_info_map):
-                time.sleep(3)
-
+            self._link_specs[int(pull_cluster_id)].append(
+                LinkSpec(comm_names[self.rank], cluster_rank_info, json.dumps(rank_tables[self.rank])))
+
+    def _start_planned_links(self):
+        if self.link_deferred and not self.data_dist_config.is_prefill:
+            logger.info(f"rank:{self.rank} defers its kv links to {len(self._link_specs)} prefill clusters "
+                        f"to their first pull")
+            return True
+        futures = [future for cluster_id in list(self._link_specs) for future in self._start_links(cluster_id)]
+        if self.link_deferred:
+            for future in futures:
+                future.add_done_callback(_log_link_failure)
+            return True
+        for future in futures:
+            future.result()
+        self._ready_link_clusters.update(self._link_specs)
         return True
 
+    def _start_links(self, cluster_id) -> list[Future]:
+        """Submit the links to `cluster_id` to the link pool, once."""
+        with self._link_lock:
+            futures = self._link_futures.get(cluster_id)
+            if futures is None:
+                if self._link_executor is None:
+                    self._link_executor = ThreadPoolExecutor(
+                        max_workers=self.link_parallelism, thread_name_prefix="kv_link")
+                futures = [self._link_executor.submit(self._establish_link, spec)
+                           for spec in self._link_specs.get(cluster_id, [])]
+                self._link_futures[cluster_id] = futures
+        return futures
+
+    def wait_for_links(self, prompt_cluster_id):
+        """Wait until the links to `prompt_cluster_id` are ready, setting them up if they are deferred.
+        If one of them failed, it is set up again by the next call."""
+        cluster_id = int(prompt_cluster_id)
+        if cluster_id in self._ready_link_clusters:
+            return
+        futures = self._start_links(cluster_id)
+        try:
+            for future in futures:
+                future.result()
+        except Exception:
+            with self._link_lock:
+                if self._link_futures.get(cluster_id) is futures:
+                    del self._link_futures[cluster_id]
+            raise
+        self._ready_link_clusters.add(cluster_id)
+
+    def _establish_link(self, spec: "LinkSpec") -> "RankLinkInfo":
+        """Link `spec` and wait for it to be ready, unlinking it and trying again with backoff
+        if it fails, if it is not ready within `kv_link_timeout_s` or on a retryable error."""
+        torch.npu.set_device(f"npu:{self.local_rank}")
+        delays = backoff_delays(self.link_retry_times, KV_LINK_RETRY_BASE_SECOND, KV_LINK_RETRY_MAX_SECOND)
+        for attempt in range(self.link_retry_times):
+            comm_id = None
+            try:
+                with self._datadist_lock:
+                    comm_id = self.data_dist_engine.link(spec.comm_name, spec.cluster_rank_info, spec.rank_table)
+                logger.info(f"rank:{self.rank} linked {spec.comm_name}:{comm_id}, "
+                            f"cluster_rank_info:{spec.cluster_rank_info}")
+                error = self._wait_for_link_status(comm_id)
+            except LLMException as e:
+                if e.status_code not in RETRYABLE_CODES:
+                    raise e
+                error = str(e)
+            if error is None:
+                rank_link_info = RankLinkInfo(spec.comm_name, comm_id, spec.cluster_rank_info)
+                # Save comm_name information
+                with self._link_lock:
+                    self.rank_link_info_map[spec.comm_name] = rank_link_info
+                return rank_link_info
+            if comm_id is not None:
+                self._unlink(comm_id)
+            if attempt + 1 == self.link_retry_times:
+                break
+            logger.warning(f"rank:{self.rank} kv link {spec.comm_name} failed ({error}), "
+                           f"retry {attempt + 1}/{self.link_retry_times - 1} in {delays[attempt]}s")
+            time.sleep(delays[attempt])
+        logger.error(f"rank:{self.rank} kv link {spec.comm_name} failed after {self.link_retry_times} attempts")
+        raise RuntimeError(f"check kv link status failed: {spec.comm_name}")
+
+    def _wait_for_link_status(self, comm_id) -> Optional[str]:
+        """None once the link `comm_id` is ready, the reason if it failed or timed out."""
+        deadline = time.monotonic() + self.link_timeout_s if self.link_timeout_s > 0 else None
+        interval = KV_LINK_STATUS_INTERVAL_SECOND
+        while True:
+            ret = self.data_dist_engine.query_register_mem_status(comm_id)
+            logger.debug(f"comm_id: {comm_id} ret:{ret}")
+            if ret == RegisterMemStatus.OK:
+                return None
+            if ret == RegisterMemStatus.FAILED:
+                return "register mem status failed"
+            if deadline is not None and time.monotonic() >= deadline:
+                return f"not ready in {self.link_timeout_s}s"
+            time.sleep(interval)
+            interval = min(interval * 2, KV_LINK_STATUS_MAX_INTERVAL_SECOND)
+
+    def _unlink(self, comm_id):
+        try:
+            with self._datadist_lock:
+                self.data_dist_engine.unlink(comm_id)
+        except LLMException as e:
+            logger.warning(f"rank:{self.rank} unlink {comm_id} failed, {e}")
+
+
+def _log_link_failure(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"kv link failed: {future.exception()}")
+
+
+def ordered_layer_names(kv_caches: dict[str, torch.Tensor]) -> list[str]:
+    """Names of the layers in the order of their caches in `unzip_kv_cache`."""
+    return sorted(kv_caches, key=extract_layer_index)
+
 
 def unzip_kv_cache(kv_caches: dict[str, torch.Tensor], ):
     # Convert kv_caches dict to a list of tensors in the order of layer_index.
@@ -480,4 +689,5 @@ def unzip_kv_cache(kv_caches: dict[str, torch.Tensor], ):
     return flatten_kv_caches
 
 
-RankLinkInfo = namedtuple("RankLinkInfo", ["comm_name", "comm_id", "cluster_rank_info"])
\ No newline at end of file
+RankLinkInfo = namedtuple("RankLinkInfo", ["comm_name", "comm_id", "cluster_rank_info"])
+LinkSpec = namedtuple("LinkSpec", ["comm_name", "cluster_rank_info", "rank_table"])
\ No newline at end of file
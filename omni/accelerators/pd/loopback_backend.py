@@ -0,0 +1,193 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""
+Loopback KV transfer backend (`kv_transfer_backend: loopback`), for tests and
+benchmarks of the PD connector on a CPU host.
+
+The prefill side moves its registered caches, which must be contiguous CPU
+tensors, into files of `loopback_dir` (shared memory by default), in place, so
+that the model keeps writing to them. It lists them in
+`<loopback_dir>/<cluster_id>/manifest.json`. The decode side maps the files of
+a prefill cluster on its first pull and copies the blocks between the mapped
+tensors and its own caches.
+
+Every pull then waits for `loopback_latency_ms`, plus the time its bytes take
+at `loopback_bandwidth_gb_s` (0 for no limit) on the link of the prefill
+cluster, which the pulls of all threads share one after another.
+
+The caches of the TP ranks of an MLA prefill instance are the same, so only
+rank 0 exports them. multi_rank_pull_kv is not supported.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Optional
+
+import torch
+from vllm.config import VllmConfig
+from vllm.logger import init_logger
+
+from omni.accelerators.pd.kv_transfer_backend import KVTransferBackend
+from omni.accelerators.pd.llmdatadist_manager import LLMDataDistConfig, unzip_kv_cache
+from omni.accelerators.pd.utils import check_lease_deadline, split_staging_blocks
+
+logger = init_logger(__name__)
+
+DEFAULT_LOOPBACK_DIR = "/dev/shm/omni_kv_loopback"
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class LoopbackDataDistManager(KVTransferBackend):
+    def __init__(self, vllm_config: VllmConfig):
+        self.data_dist_config = LLMDataDistConfig(vllm_config)
+        if self.data_dist_config.multi_rank_pull_kv:
+            raise ValueError("multi_rank_pull_kv is not supported by the loopback KV transfer backend.")
+        self.rank = self.data_dist_config.rank
+        self.local_rank = self.data_dist_config.local_rank
+
+        kv_transfer_config = vllm_config.kv_transfer_config
+        self.root_dir = kv_transfer_config.get_from_extra_config("loopback_dir", DEFAULT_LOOPBACK_DIR)
+        self.latency_s = float(kv_transfer_config.get_from_extra_config("loopback_latency_ms", 0)) / 1000
+        self.bandwidth = float(kv_transfer_config.get_from_extra_config("loopback_bandwidth_gb_s", 0)) * 1e9
+        if self.latency_s < 0 or self.bandwidth < 0:
+            raise ValueError("loopback_latency_ms and loopback_bandwidth_gb_s should not be negative.")
+
+        self.registerd_kv_caches: list[list[torch.Tensor]] = []
+        self.registerd_staging_caches: list[list[torch.Tensor]] = []
+        self.num_layers = 0
+        # entries of the manifest of the prefill side, one list of (file, dtype, shape) per model_id
+        self._manifest: list[list[tuple[str, str, list[int]]]] = []
+        # cluster id -> mapped caches of the prefill cluster, per model_id
+        self._remote_caches: dict[str, list[list[torch.Tensor]]] = {}
+        # cluster id -> time at which its link is done with the pulls issued so far
+        self._link_free_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _cluster_dir(self, cluster_id) -> str:
+        return os.path.join(self.root_dir, str(cluster_id))
+
+    def register_memory(self, kv_caches: dict[str, torch.Tensor]):
+        if len(self.registerd_kv_caches) > 0:
+            raise ValueError("Attr `registerd_kv_caches` must be empty before register kv_caches.")
+        self.registerd_kv_caches = unzip_kv_cache(kv_caches)
+        self.num_layers = len(self.registerd_kv_caches[0])
+        if self.data_dist_config.is_prefill and self.rank == 0:
+            cluster_dir = self._cluster_dir(self.data_dist_config.cluster_id)
+            shutil.rmtree(cluster_dir, ignore_errors=True)
+            os.makedirs(cluster_dir)
+            atexit.register(shutil.rmtree, cluster_dir, ignore_errors=True)
+            self._export(self.registerd_kv_caches)
+            logger.info("Loopback KV caches of cluster %s are shared in %s.",
+                        self.data_dist_config.cluster_id, cluster_dir)
+
+    def is_pulled_from(self) -> bool:
+        return self.data_dist_config.is_prefill and self.rank == 0
+
+    def register_staging_memory(self, staging_caches: list[list[torch.Tensor]]):
+        num_device_caches = len(self.registerd_kv_caches)
+        if len(staging_caches) != num_device_caches:
+            raise ValueError(f"Expected {num_device_caches} staging caches, but got {len(staging_caches)}.")
+        self.registerd_staging_caches = staging_caches
+        if self.data_dist_config.is_prefill and self.rank == 0:
+            self._export(staging_caches)
+
+    def _export(self, caches: list[list[torch.Tensor]]):
+        """Move `caches` into files in place and add them to the manifest, after the model_ids registered so far."""
+        cluster_dir = self._cluster_dir(self.data_dist_config.cluster_id)
+        for sub_caches in caches:
+            model_id = len(self._manifest)
+            entries = []
+            for layer, tensor in enumerate(sub_caches):
+                file_name = f"{model_id}_{layer}.bin"
+                _share_in_place(tensor, os.path.join(cluster_dir, file_name))
+                entries.append((file_name, str(tensor.dtype).replace("torch.", ""), list(tensor.shape)))
+            self._manifest.append(entries)
+        # written next to its final path and renamed, so that the decode side never reads half a manifest
+        manifest_path = os.path.join(cluster_dir, MANIFEST_FILE_NAME)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def register_link(self):
+        # the files are opened on the first pull from every cluster, there is nothing to link
+        return True
+
+    def _remote(self, cluster_id, model_id: int) -> list[torch.Tensor]:
+        key = str(cluster_id)
+        with self._lock:
+            caches = self._remote_caches.get(key)
+            if caches is None or model_id >= len(caches):
+                caches = self._remote_caches[key] = self._open(key)
+        if model_id >= len(caches):
+            raise RuntimeError(f"Cluster {key} has no loopback KV cache of model_id {model_id}.")
+        return caches[model_id]
+
+    def _open(self, cluster_id: str) -> list[list[torch.Tensor]]:
+        cluster_dir = self._cluster_dir(cluster_id)
+        manifest_path = os.path.join(cluster_dir, MANIFEST_FILE_NAME)
+        if not os.path.isfile(manifest_path):
+            raise RuntimeError(f"No loopback KV caches are registered by cluster {cluster_id} in {self.root_dir}.")
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        caches = []
+        for entries in manifest:
+            sub_caches = []
+            for file_name, dtype, shape in entries:
+                numel = 1
+                for size in shape:
+                    numel *= size
+                tensor = torch.from_file(os.path.join(cluster_dir, file_name), shared=True, size=numel,
+                                         dtype=getattr(torch, dtype))
+                sub_caches.append(tensor.view(shape))
+            caches.append(sub_caches)
+        return caches
+
+    def pull_kv(self, src_blocks, tgt_blocks, prompt_cluster_id, layer_range: Optional[range] = None,
+                deadline: Optional[float] = None):
+        layers = layer_range if layer_range is not None else range(self.num_layers)
+        num_bytes = 0
+        # blocks copied into the staging caches of the prefill side are pulled from their model_ids
+        for is_staging, group_src_blocks, group_tgt_blocks in split_staging_blocks(src_blocks, tgt_blocks):
+            model_id_offset = len(self.registerd_kv_caches) if is_staging else 0
+            src_index = torch.as_tensor(group_src_blocks, dtype=torch.long)
+            tgt_index = torch.as_tensor(group_tgt_blocks, dtype=torch.long)
+            for model_id, kv_cache in enumerate(self.registerd_kv_caches):
+                check_lease_deadline(deadline)
+                remote_cache = self._remote(prompt_cluster_id, model_id_offset + model_id)
+                for layer in layers:
+                    blocks = remote_cache[layer].index_select(0, src_index)
+                    kv_cache[layer].index_copy_(0, tgt_index, blocks)
+                    num_bytes += blocks.numel() * blocks.element_size()
+        self._wait_for_link(prompt_cluster_id, num_bytes)
+
+    def _wait_for_link(self, cluster_id, num_bytes: int):
+        """Sleep until the pull of `num_bytes` would be done on the link of `cluster_id`."""
+        if self.latency_s == 0 and self.bandwidth == 0:
+            return
+        key = str(cluster_id)
+        transfer_s = num_bytes / self.bandwidth if self.bandwidth > 0 else 0.0
+        with self._lock:
+            now = time.monotonic()
+            free_at = max(now, self._link_free_at.get(key, now)) + transfer_s
+            self._link_free_at[key] = free_at
+        remaining = free_at + self.latency_s - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+def _share_in_place(tensor: torch.Tensor, path: str) -> None:
+    """Move the data of `tensor` into the shared file `path`, keeping the tensor object,
+    so that whoever holds it (the attention layers) reads and writes the file."""
+    if tensor.device.type != "cpu" or not tensor.is_contiguous():
+        raise ValueError("The loopback KV transfer backend only supports contiguous CPU KV caches.")
+    with open(path, "wb") as f:
+        f.truncate(tensor.numel() * tensor.element_size())
+    shared = torch.from_file(path, shared=True, size=tensor.numel(), dtype=tensor.dtype)
+    shared.copy_(tensor.reshape(-1))
+    tensor.set_(shared.untyped_storage(), 0, tensor.shape, tensor.stride())
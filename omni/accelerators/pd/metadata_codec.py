@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Binary wire format of the connector metadata published on the
+`async_pull_kv` fast path (`ipc:///tmp/sched-pub-*`).
+
+A message is a list of three ZMQ frames:
+
+    frame 0: fixed header, struct `<4sHI` (magic, version, number of requests)
+    frame 1: JSON list with one small record per request, holding its strings,
+             its lease deadline and the lengths of its block id segments
+    frame 2: all block ids (and spec token ids) of all requests, as one
+             contiguous int32 array
+
+On the receiving side frame 2 is wrapped by `np.frombuffer` and every block id
+list becomes a view into it, so decoding does not copy the block ids.
+"""
+
+import itertools
+import json
+import struct
+from typing import Any, Optional, Sequence, Union
+
+import numpy as np
+
+MAGIC = b"OMKV"
+VERSION = 3
+HEADER = struct.Struct("<4sHI")
+NUM_FRAMES = 3
+
+BlockIds = Union[Sequence[int], np.ndarray]
+
+
+def _is_nested(block_ids) -> bool:
+    return (not isinstance(block_ids, np.ndarray)
+            and len(block_ids) > 0
+            and isinstance(block_ids[0], (list, tuple, np.ndarray)))
+
+
+def _add_segments(block_ids, segments: list[BlockIds]) -> Union[int, list[int]]:
+    """Append the block id lists of `block_ids` to `segments` and return their
+    lengths: a list for per-group lists, a plain int for a flat list."""
+    if _is_nested(block_ids):
+        segments.extend(block_ids)
+        return [len(group) for group in block_ids]
+    segments.append(block_ids)
+    return len(block_ids)
+
+
+def encode_requests(requests: dict[str, Any]) -> list[Union[bytes, memoryview]]:
+    """Encode `DatadistConnectorMetadata.requests` into multipart frames.
+
+    Args:
+        requests: request id -> ReqMeta. `local_block_ids` and `remote_block_ids`
+            are either flat lists of block ids or, with omni attention, lists of
+            per-group lists.
+
+    Returns:
+        The frames to be sent with `send_multipart`.
+    """
+    records = []
+    segments: list[BlockIds] = []
+    for req_id, meta in requests.items():
+        local_lens = _add_segments(meta.local_block_ids, segments)
+        remote_lens = _add_segments(meta.remote_block_ids, segments)
+        if meta.spec_token_ids is None:
+            spec_len = None
+        else:
+            spec_len = len(meta.spec_token_ids)
+            segments.append(meta.spec_token_ids)
+        records.append([
+            req_id,
+            meta.remote_host,
+            meta.remote_cluster_id,
+            local_lens,
+            remote_lens,
+            spec_len,
+            meta.lease_deadline,
+        ])
+
+    total = sum(len(seg) for seg in segments)
+    blob = np.fromiter(itertools.chain.from_iterable(segments), dtype=np.int32, count=total)
+
+    header = HEADER.pack(MAGIC, VERSION, len(records))
+    return [header, json.dumps(records, separators=(",", ":")).encode(), memoryview(blob)]
+
+
+def decode_requests(frames: Sequence[Any]) -> dict[str, dict[str, Any]]:
+    """Decode frames produced by `encode_requests`.
+
+    Args:
+        frames: the received frames, either bytes or `zmq.Frame` objects
+            (from `recv_multipart(copy=False)`).
+
+    Returns:
+        request id -> keyword arguments of ReqMeta. Block id lists are int32
+        numpy views into the last frame.
+    """
+    if len(frames) != NUM_FRAMES:
+        raise ValueError(f"Expected {NUM_FRAMES} frames, but got {len(frames)}.")
+    header, records, blob = (getattr(frame, "buffer", frame) for frame in frames)
+    magic, version, num_reqs = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unknown metadata format: magic={magic!r}, version={version}.")
+    records = json.loads(bytes(records))
+    if len(records) != num_reqs:
+        raise ValueError(f"Header announces {num_reqs} requests, but {len(records)} are encoded.")
+    block_ids = np.frombuffer(blob, dtype=np.int32)
+
+    offset = 0
+
+    def take(length: int) -> np.ndarray:
+        nonlocal offset
+        view = block_ids[offset:offset + length]
+        offset += length
+        return view
+
+    def take_segments(lens: Union[int, list[int]]) -> Union[np.ndarray, list[np.ndarray]]:
+        # a plain int marks a flat list
+        return [take(n) for n in lens] if isinstance(lens, list) else take(lens)
+
+    requests = {}
+    for req_id, remote_host, remote_cluster_id, local_lens, remote_lens, spec_len, lease_deadline in records:
+        local_block_ids = take_segments(local_lens)
+        remote_block_ids = take_segments(remote_lens)
+        spec_token_ids: Optional[np.ndarray] = None if spec_len is None else take(spec_len)
+        requests[req_id] = dict(
+            local_block_ids=local_block_ids,
+            remote_block_ids=remote_block_ids,
+            remote_host=remote_host,
+            remote_cluster_id=remote_cluster_id,
+            spec_token_ids=spec_token_ids,
+            lease_deadline=lease_deadline,
+        )
+    if offset != len(block_ids):
+        raise ValueError(f"{len(block_ids) - offset} trailing block ids in metadata message.")
+    return requests
+
+
+def to_block_id_list(block_ids):
+    """Convert decoded block ids (int32 views, possibly nested per KV cache
+    group) back to python lists, as expected by the datadist APIs."""
+    if isinstance(block_ids, np.ndarray):
+        return block_ids.tolist()
+    if _is_nested(block_ids):
+        return [to_block_id_list(group) for group in block_ids]
+    return block_ids
@@ -0,0 +1,272 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import bisect
+import contextlib
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+import prometheus_client
+
+from vllm.logger import init_logger
+
+logger = init_logger(__name__)
+
+# Buckets of the pull latency histograms, in seconds.
+PULL_LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1,
+                        0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 20.0]
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, cheap enough to be updated from the
+    pull threads of every request."""
+
+    def __init__(self, buckets: list[float] = PULL_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (q in [0, 100]),
+        capped by the largest observed value."""
+        if self.count == 0:
+            return 0.0
+        target = self.count * q / 100
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+
+class _LinkStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.num_blocks = 0
+        self.num_bytes = 0
+        self.failures = 0
+        self.released = 0
+        self.inflight = 0
+        self.queue_depth = 0
+        self.leased_blocks = 0
+        self.lease_expirations = 0
+
+
+class KVTransferMetrics:
+    """Telemetry of the KV transfer of the PD connector.
+
+    Per source cluster id on D, and per own cluster id on P, it records pull latency
+    histograms, transferred blocks/bytes, failures, in-flight pulls, the
+    depth of the pull queue and, on P, the blocks leased to pulls that have
+    not happened yet and the leases that expired. Metrics are exported with prometheus_client,
+    labeled by role, DP rank and cluster id, and a summary is logged every
+    `log_interval` seconds by `maybe_log`.
+
+    NOTE: prometheus_client writes to PROMETHEUS_MULTIPROC_DIR if it is set, so
+    the metrics of the worker processes are collected by the /metrics endpoint
+    of the API server. Otherwise a separate endpoint can be started on `port`.
+    """
+
+    _prom_metrics = None
+    _prom_lock = threading.Lock()
+
+    def __init__(self, role: str, dp_rank: int, log_interval: float = 10.0,
+                 port: Optional[int] = None):
+        self.role = role
+        self.dp_rank = str(dp_rank)
+        self.log_interval = log_interval
+        self._links: defaultdict[str, _LinkStats] = defaultdict(_LinkStats)
+        self._lock = threading.Lock()
+        self._last_log_time = time.monotonic()
+        self._last_log_bytes = 0
+        self._prom = self._get_prom_metrics()
+        if port is not None:
+            prometheus_client.start_http_server(port)
+            logger.info("KV transfer metrics are served on port %s.", port)
+
+    @classmethod
+    def _get_prom_metrics(cls) -> dict:
+        # prometheus metrics can be registered only once per process
+        with cls._prom_lock:
+            if cls._prom_metrics is None:
+                labels = ["role", "dp_rank", "cluster_id"]
+                cls._prom_metrics = dict(
+                    latency=prometheus_client.Histogram(
+                        "omni:kv_transfer_latency_seconds",
+                        "Latency of KV transfers per remote cluster.",
+                        labels, buckets=PULL_LATENCY_BUCKETS),
+                    blocks=prometheus_client.Counter(
+                        "omni:kv_transfer_blocks",
+                        "Number of transferred KV blocks.", labels),
+                    bytes=prometheus_client.Counter(
+                        "omni:kv_transfer_bytes",
+                        "Number of transferred KV cache bytes.", labels),
+                    failures=prometheus_client.Counter(
+                        "omni:kv_transfer_failures",
+                        "Number of failed KV transfers.", labels),
+                    inflight=prometheus_client.Gauge(
+                        "omni:kv_transfer_inflight",
+                        "Number of KV transfers in flight.", labels,
+                        multiprocess_mode="livesum"),
+                    released=prometheus_client.Counter(
+                        "omni:kv_transfer_released_requests",
+                        "Number of requests whose prefill KV blocks were released after the pull.",
+                        labels),
+                    queue_depth=prometheus_client.Gauge(
+                        "omni:kv_transfer_queue_depth",
+                        "Number of KV transfer tasks waiting in the queue.", labels,
+                        multiprocess_mode="livesum"),
+                    leased_blocks=prometheus_client.Gauge(
+                        "omni:kv_transfer_leased_blocks",
+                        "Number of prefill KV blocks held for a decode pull under a lease.", labels,
+                        multiprocess_mode="livesum"),
+                    lease_expirations=prometheus_client.Counter(
+                        "omni:kv_transfer_lease_expirations",
+                        "Number of requests whose prefill KV blocks were released because their lease expired.",
+                        labels),
+                )
+            return cls._prom_metrics
+
+    def _labels(self, name: str, cluster_id):
+        return self._prom[name].labels(self.role, self.dp_rank, str(cluster_id))
+
+    @contextlib.contextmanager
+    def track_transfer(self, cluster_id, num_blocks: int, num_bytes: int):
+        """Time a transfer of `num_blocks` blocks, counting it as in flight
+        while it runs and as a failure if it raises."""
+        key = str(cluster_id)
+        with self._lock:
+            self._links[key].inflight += 1
+        self._labels("inflight", key).inc()
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._links[key].failures += 1
+            self._labels("failures", key).inc()
+            raise
+        else:
+            cost = time.perf_counter() - start
+            with self._lock:
+                link = self._links[key]
+                link.latency.observe(cost)
+                link.num_blocks += num_blocks
+                link.num_bytes += num_bytes
+            self._labels("latency", key).observe(cost)
+            self._labels("blocks", key).inc(num_blocks)
+            self._labels("bytes", key).inc(num_bytes)
+        finally:
+            with self._lock:
+                self._links[key].inflight -= 1
+            self._labels("inflight", key).dec()
+
+    def record_failure(self, cluster_id) -> None:
+        key = str(cluster_id)
+        with self._lock:
+            self._links[key].failures += 1
+        self._labels("failures", key).inc()
+
+    def record_released(self, cluster_id, num_requests: int) -> None:
+        key = str(cluster_id)
+        with self._lock:
+            self._links[key].released += num_requests
+        self._labels("released", key).inc(num_requests)
+
+    def set_queue_depth(self, cluster_id, depth: int) -> None:
+        key = str(cluster_id)
+        with self._lock:
+            self._links[key].queue_depth = depth
+        self._labels("queue_depth", key).set(depth)
+
+    def set_leased_blocks(self, cluster_id, num_blocks: int) -> None:
+        key = str(cluster_id)
+        with self._lock:
+            self._links[key].leased_blocks = num_blocks
+        self._labels("leased_blocks", key).set(num_blocks)
+
+    def record_lease_expired(self, cluster_id, num_requests: int) -> None:
+        key = str(cluster_id)
+        with self._lock:
+            self._links[key].lease_expirations += num_requests
+        self._labels("lease_expirations", key).inc(num_requests)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                key: dict(
+                    count=link.latency.count,
+                    mean=link.latency.sum / link.latency.count if link.latency.count else 0.0,
+                    p50=link.latency.percentile(50),
+                    p99=link.latency.percentile(99),
+                    max=link.latency.max,
+                    blocks=link.num_blocks,
+                    bytes=link.num_bytes,
+                    failures=link.failures,
+                    released=link.released,
+                    inflight=link.inflight,
+                    queue_depth=link.queue_depth,
+                    leased_blocks=link.leased_blocks,
+                    lease_expirations=link.lease_expirations,
+                )
+                for key, link in self._links.items()
+            }
+
+    def maybe_log(self) -> None:
+        """Log a summary of all links, at most once every `log_interval` seconds."""
+        now = time.monotonic()
+        elapsed = now - self._last_log_time
+        if elapsed < self.log_interval:
+            return
+        snapshot = self.snapshot()
+        total_bytes = sum(link["bytes"] for link in snapshot.values())
+        throughput = (total_bytes - self._last_log_bytes) / elapsed
+        self._last_log_time, self._last_log_bytes = now, total_bytes
+        if not snapshot:
+            return
+        logger.info("KV transfer %s dp_rank %s: %.2f MB/s", self.role, self.dp_rank, throughput / 2**20)
+        for key, link in sorted(snapshot.items()):
+            logger.info(
+                "  cluster %s: transfers=%d p50=%.4fs p99=%.4fs max=%.4fs blocks=%d "
+                "failures=%d released=%d inflight=%d queue_depth=%d leased_blocks=%d lease_expirations=%d",
+                key, link["count"], link["p50"], link["p99"], link["max"], link["blocks"],
+                link["failures"], link["released"], link["inflight"], link["queue_depth"],
+                link["leased_blocks"], link["lease_expirations"])
+
+
+def create_kv_transfer_metrics(role: str, vllm_config) -> KVTransferMetrics:
+    """Create the metrics of a connector worker from `additional_config`:
+    `kv_transfer_metrics_log_interval` (seconds between logged summaries) and
+    `kv_transfer_metrics_port` (base port of a dedicated prometheus endpoint,
+    offset by the local DP rank)."""
+    dp_rank = vllm_config.parallel_config.data_parallel_rank_local
+    additional_config = vllm_config.additional_config or {}
+    port = additional_config.get("kv_transfer_metrics_port", None)
+    return KVTransferMetrics(
+        role,
+        dp_rank,
+        log_interval=float(additional_config.get("kv_transfer_metrics_log_interval", 10.0)),
+        port=None if port is None else int(port) + dp_rank,
+    )
+
+
+def kv_cache_block_bytes(kv_caches) -> int:
+    """Bytes of one block id over all layers of `kv_caches`, a dict or list of
+    tensors or tuples of tensors shaped [num_blocks, ...]."""
+    total = 0
+    for kv_cache in (kv_caches.values() if isinstance(kv_caches, dict) else kv_caches):
+        for tensor in (kv_cache if isinstance(kv_cache, tuple) else (kv_cache,)):
+            if tensor.shape[0] > 0:
+                total += tensor[0].numel() * tensor.element_size()
+    return total
@@ -0,0 +1,209 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import queue
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from omni.accelerators.pd import llmdatadist_connector_v1 as connector_module
+from omni.accelerators.pd.kv_transfer_backend import KVTransferBackend
+from omni.accelerators.pd.llmdatadist_connector_v1 import (
+    DecodeConnectorWorker,
+    earliest_lease_deadline,
+    group_req_ids_by_host,
+    is_mergeable_task,
+    merge_block_ids,
+    split_task_batch,
+)
+from omni.accelerators.pd.utils import check_lease_deadline
+
+HOST = "tcp://10.0.0.1:5568"
+CLUSTER_ID = 0
+
+
+def make_task(request_id, local_block_ids, remote_block_ids, remote_host_ip=HOST, lease_deadline=None):
+    return {
+        'request_id': request_id,
+        'dst_cluster_id': CLUSTER_ID,
+        'local_block_ids': local_block_ids,
+        'remote_block_ids': remote_block_ids,
+        'remote_host_ip': remote_host_ip,
+        'lease_deadline': lease_deadline,
+    }
+
+
+class FakeBackend(KVTransferBackend):
+    """KV transfer backend recording the pulls, failing those which read one of `fail_blocks`."""
+
+    def __init__(self, fail_blocks=()):
+        self.fail_blocks = set(fail_blocks)
+        self.pulls: list[tuple[list, list]] = []
+        self.num_layers = 1
+
+    def register_memory(self, kv_caches):
+        pass
+
+    def group_block_bytes(self, kv_caches):
+        return [64, 16]
+
+    def register_link(self):
+        return True
+
+    def pull_kv(self, src_blocks, tgt_blocks, prompt_cluster_id, layer_range=None, deadline=None):
+        check_lease_deadline(deadline)
+        flat_src_blocks = src_blocks[0] if isinstance(src_blocks[0], list) else src_blocks
+        if self.fail_blocks.intersection(flat_src_blocks):
+            raise RuntimeError(f"pull of blocks {src_blocks} failed")
+        self.pulls.append((src_blocks, tgt_blocks))
+
+
+def make_decode_worker(backend: FakeBackend, **additional_config) -> DecodeConnectorWorker:
+    """A decode worker over `backend` whose acks to the prefill side are recorded in `acks`."""
+    vllm_config = types.SimpleNamespace(additional_config=additional_config,
+                                        parallel_config=types.SimpleNamespace(data_parallel_rank_local=0))
+    with mock.patch.object(connector_module, "create_kv_transfer_backend", return_value=backend):
+        worker = DecodeConnectorWorker(vllm_config, "127.0.0.1", CLUSTER_ID)
+    worker.register_kv_caches({})
+    worker.acks = []
+    worker._send_pulled_kv_req_list = lambda path, data: worker.acks.append((path, list(data)))
+    return worker
+
+
+def run_queue(worker: DecodeConnectorWorker, tasks: list) -> threading.Thread:
+    """Queue `tasks` and start the pull thread on them, once all are queued. Returns the thread
+    once every task has been marked done."""
+    q = queue.Queue()
+    for task in tasks:
+        q.put(task)
+    worker.queues[CLUSTER_ID] = q
+    thread = threading.Thread(target=worker.worker, args=(CLUSTER_ID, ), daemon=True)
+    thread.start()
+    joiner = threading.Thread(target=q.join, daemon=True)
+    joiner.start()
+    joiner.join(timeout=5)
+    if joiner.is_alive():
+        raise AssertionError(f"{q.unfinished_tasks} tasks were never marked done")
+    return thread
+
+
+def acked(worker: DecodeConnectorWorker) -> list:
+    return sorted(req_id for _, req_ids in worker.acks for req_id in req_ids)
+
+
+class TestTaskHelpers(unittest.TestCase):
+    def test_is_mergeable_task(self):
+        self.assertTrue(is_mergeable_task(make_task("a", [1, 2], [3, 4])))
+        self.assertTrue(is_mergeable_task(make_task("a", np.array([1, 2]), [3, 4])))
+        self.assertFalse(is_mergeable_task(make_task("a", [], [])))
+        # omni attention layout, a block list per KV cache group
+        self.assertFalse(is_mergeable_task(make_task("a", [[1, 2], [3]], [[4, 5], [4, 5]])))
+
+    def test_merge_block_ids_sorts_by_remote(self):
+        tasks = [make_task("a", [1, 2], [30, 10]), make_task("b", [3], [np.int32(20)])]
+        self.assertEqual(merge_block_ids(tasks), ([2, 3, 1], [10, 20, 30]))
+        local_block_ids, remote_block_ids = merge_block_ids(tasks)
+        self.assertIsInstance(remote_block_ids[1], int)
+
+    def test_split_task_batch(self):
+        tasks = [make_task(str(i), list(range(n)), list(range(n))) for i, n in enumerate([2, 2, 5, 1, 1])]
+        batches = [[task['request_id'] for task in batch] for batch in split_task_batch(tasks, 4)]
+        # the task larger than max_blocks forms a batch on its own
+        self.assertEqual(batches, [["0", "1"], ["2"], ["3", "4"]])
+        self.assertEqual(list(split_task_batch([], 4)), [])
+
+    def test_group_req_ids_by_host(self):
+        tasks = [make_task("a", [1], [1]), make_task("b", [2], [2], remote_host_ip="tcp://10.0.0.2:5568"),
+                 make_task("c", [3], [3])]
+        self.assertEqual(group_req_ids_by_host(tasks), {HOST: ["a", "c"], "tcp://10.0.0.2:5568": ["b"]})
+
+    def test_earliest_lease_deadline(self):
+        self.assertIsNone(earliest_lease_deadline([make_task("a", [1], [1])]))
+        tasks = [make_task("a", [1], [1], lease_deadline=20.0), make_task("b", [2], [2]),
+                 make_task("c", [3], [3], lease_deadline=10.0)]
+        self.assertEqual(earliest_lease_deadline(tasks), 10.0)
+
+
+class TestCoalesceTasks(unittest.TestCase):
+    def setUp(self):
+        self.worker = make_decode_worker(FakeBackend(), batch_pull_kv=True, batch_pull_kv_max_blocks=4)
+
+    def test_stops_at_unmergeable_task(self):
+        q = queue.Queue()
+        for task in (make_task("b", [2], [2]), None, make_task("c", [[3], [4]], [[3], [3]]),
+                     make_task("d", [5], [5])):
+            q.put(task)
+        tasks, leftover = self.worker._coalesce_tasks(q, make_task("a", [1], [1]))
+        self.assertEqual([task['request_id'] for task in tasks], ["a", "b"])
+        self.assertEqual(leftover['request_id'], "c")
+        self.assertEqual(q.get_nowait()['request_id'], "d")
+
+    def test_flushes_at_max_blocks(self):
+        q = queue.Queue()
+        for i in range(3):
+            q.put(make_task(str(i), [2 * i, 2 * i + 1], [2 * i, 2 * i + 1]))
+        tasks, leftover = self.worker._coalesce_tasks(q, q.get())
+        self.assertEqual([task['request_id'] for task in tasks], ["0", "1"])
+        self.assertIsNone(leftover)
+        self.assertEqual(q.qsize(), 1)
+
+    def test_does_not_wait_by_default(self):
+        start = time.monotonic()
+        tasks, leftover = self.worker._coalesce_tasks(queue.Queue(), make_task("a", [1], [1]))
+        self.assertEqual(len(tasks), 1)
+        self.assertIsNone(leftover)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class TestDecodeWorkerQueue(unittest.TestCase):
+    def test_batch(self):
+        backend = FakeBackend()
+        worker = make_decode_worker(backend, batch_pull_kv=True)
+        thread = run_queue(worker, [make_task("a", [1, 2], [12, 11]), make_task("b", [3], [10])])
+        self.assertEqual(backend.pulls, [([10, 11, 12], [3, 2, 1])])
+        self.assertEqual(worker.acks, [(HOST, ["a", "b"])])
+        self.assertEqual(worker.get_finished()[1], {"a", "b"})
+        self.assertTrue(thread.is_alive())
+
+    def test_leftover_of_failed_batch_is_pulled(self):
+        backend = FakeBackend(fail_blocks={11})
+        worker = make_decode_worker(backend, batch_pull_kv=True)
+        thread = run_queue(worker, [
+            make_task("a", [1], [10]),
+            make_task("b", [2], [11]),
+            # not mergeable, it ends the batch of a and b
+            make_task("c", [[3], [4]], [[12], [12]]),
+            make_task("d", [5], [13]),
+        ])
+        # the failed requests are acked, so that the prefill side releases their blocks
+        self.assertEqual(acked(worker), ["a", "b", "c", "d"])
+        self.assertEqual(worker.get_finished()[1], {"c", "d"})
+        self.assertEqual(backend.pulls, [([[12], [12]], [[3], [4]]), ([13], [5])])
+        self.assertTrue(thread.is_alive())
+
+    def test_failed_task_does_not_stop_the_thread(self):
+        backend = FakeBackend(fail_blocks={10})
+        worker = make_decode_worker(backend)
+        thread = run_queue(worker, [make_task("a", [1], [10]), None, make_task("b", [2], [11])])
+        self.assertEqual(acked(worker), ["a", "b"])
+        self.assertEqual(worker.get_finished()[1], {"b"})
+        self.assertTrue(thread.is_alive())
+
+    def test_expired_lease_is_not_pulled(self):
+        backend = FakeBackend()
+        worker = make_decode_worker(backend, batch_pull_kv=True)
+        run_queue(worker, [make_task("a", [1], [10], lease_deadline=time.time() - 1),
+                           make_task("b", [2], [11], lease_deadline=time.time() + 60)])
+        self.assertEqual(backend.pulls, [])
+        self.assertEqual(worker.get_finished()[1], set())
+        run_queue(worker, [make_task("c", [3], [12], lease_deadline=time.time() + 60)])
+        self.assertEqual(backend.pulls, [([12], [3])])
+        self.assertEqual(worker.get_finished()[1], {"c"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from omni.accelerators.pd import llmdatadist_manager as manager_module
+from omni.accelerators.pd.llmdatadist_manager import LLMDataDistManager
+
+class FakeRegisterMemStatus:
+    OK = "ok"
+    FAILED = "failed"
+
+
+class FakeLLMException(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"llm_datadist error {status_code}")
+        self.status_code = status_code
+
+
+PENDING = "pending"
+RETRYABLE_CODE = "link busy"
+
+
+class FakeKVTransferConfig:
+    def __init__(self, extra_config: dict):
+        self.extra_config = extra_config
+
+    def get_from_extra_config(self, key, default):
+        return self.extra_config.get(key, default)
+
+
+class FakeLinkEngine:
+    """llm_datadist engine whose links follow a script of statuses per link name:
+    the status of every attempt in order, the last one repeated, or an exception to raise.
+
+    Like llm_datadist, `link` returns at once and a link is ready `link_seconds` later. It
+    records the largest number of links being set up at the same time, and of link and
+    unlink calls running at the same time."""
+
+    def __init__(self, scripts: dict = None, link_seconds: float = 0.0):
+        self.scripts = scripts or {}
+        self.link_seconds = link_seconds
+        self.calls: list[str] = []
+        self.unlinked: list[int] = []
+        self.status: dict[int, object] = {}
+        self.ready_time: dict[int, float] = {}
+        self.max_concurrency = 0
+        self.max_call_concurrency = 0
+        self._linking: set[int] = set()
+        self._calls_running = 0
+        self._lock = threading.Lock()
+
+    def _enter_call(self):
+        with self._lock:
+            self._calls_running += 1
+            self.max_call_concurrency = max(self.max_call_concurrency, self._calls_running)
+        # long enough for concurrent calls to overlap
+        threading.Event().wait(0.001)
+        with self._lock:
+            self._calls_running -= 1
+
+    def link(self, comm_name, cluster_rank_info, rank_table):
+        self._enter_call()
+        with self._lock:
+            attempt = sum(name == comm_name for name in self.calls)
+            self.calls.append(comm_name)
+            comm_id = len(self.calls)
+        script = self.scripts.get(comm_name, [FakeRegisterMemStatus.OK])
+        status = script[min(attempt, len(script) - 1)]
+        if isinstance(status, Exception):
+            raise status
+        with self._lock:
+            self.status[comm_id] = status
+            self.ready_time[comm_id] = time.monotonic() + self.link_seconds
+            self._linking.add(comm_id)
+            self.max_concurrency = max(self.max_concurrency, len(self._linking))
+        return comm_id
+
+    def query_register_mem_status(self, comm_id):
+        with self._lock:
+            if time.monotonic() < self.ready_time[comm_id]:
+                return PENDING
+            self._linking.discard(comm_id)
+            return self.status[comm_id]
+
+    def unlink(self, comm_id):
+        self._enter_call()
+        with self._lock:
+            self._linking.discard(comm_id)
+            self.unlinked.append(comm_id)
+
+
+def make_manager(engine: FakeLinkEngine, links: dict, is_prefill: bool = False, **extra_config):
+    """A manager of rank 0 with the planned `links` {prefill cluster id: [link names]}."""
+    manager = LLMDataDistManager.__new__(LLMDataDistManager)
+    manager.rank = 0
+    manager.local_rank = 0
+    manager.data_dist_config = types.SimpleNamespace(is_prefill=is_prefill)
+    manager.data_dist_engine = engine
+    manager._init_links(FakeKVTransferConfig(extra_config))
+    for cluster_id, comm_names in links.items():
+        for comm_name in comm_names:
+            manager._build_device_link({0: comm_name}, {0: {"1": 0}}, {0: {}}, cluster_id)
+    return manager
+
+
+class TestLinkSetup(unittest.TestCase):
+    def setUp(self):
+        npu = types.SimpleNamespace(set_device=lambda device: None)
+        # the llm_datadist names the link set up uses, which the module only has if llm_datadist is installed
+        datadist = mock.patch.multiple(manager_module, create=True, RegisterMemStatus=FakeRegisterMemStatus,
+                                       LLMException=FakeLLMException, RETRYABLE_CODES=[RETRYABLE_CODE])
+        datadist.start()
+        self.addCleanup(datadist.stop)
+        # the backoff is recorded, and every wait is a short one
+        for patcher in (mock.patch.object(manager_module, "torch", types.SimpleNamespace(npu=npu)),
+                        mock.patch.object(manager_module.time, "sleep",
+                                          side_effect=lambda seconds: threading.Event().wait(0.001))):
+            self.sleep = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def backoff_sleeps(self):
+        return [c.args[0] for c in self.sleep.call_args_list if c.args[0] >= manager_module.KV_LINK_RETRY_BASE_SECOND]
+
+    def test_parallel_by_default(self):
+        engine = FakeLinkEngine(link_seconds=0.2)
+        links = {cluster_id: [f"{cluster_id}-{i}" for i in range(4)] for cluster_id in range(3)}
+        manager = make_manager(engine, links)
+        self.assertEqual(manager.link_parallelism, manager_module.DEFAULT_KV_LINK_PARALLELISM)
+        manager._start_planned_links()
+        self.assertEqual(len(manager.rank_link_info_map), 12)
+        self.assertEqual(engine.max_concurrency, manager_module.DEFAULT_KV_LINK_PARALLELISM)
+        # only waiting for the links is concurrent, link and unlink are called one at a time
+        self.assertEqual(engine.max_call_concurrency, 1)
+
+    def test_parallelism(self):
+        engine = FakeLinkEngine(link_seconds=0.05)
+        manager = make_manager(engine, {0: ["a", "b", "c", "d"]}, kv_link_parallelism=2)
+        manager._start_planned_links()
+        self.assertEqual(sorted(manager.rank_link_info_map), ["a", "b", "c", "d"])
+        self.assertEqual(engine.max_concurrency, 2)
+
+    def test_failed_link_among_parallel_links_is_reported(self):
+        failed = FakeRegisterMemStatus.FAILED
+        engine = FakeLinkEngine({"b": [failed]}, link_seconds=0.05)
+        manager = make_manager(engine, {0: ["a", "b"], 1: ["c", "d"]}, kv_link_retry_times=2)
+        with self.assertRaisesRegex(RuntimeError, "check kv link status failed: b"):
+            manager._start_planned_links()
+        self.assertEqual(engine.calls.count("b"), 2)
+        self.assertNotIn("b", manager.rank_link_info_map)
+        self.assertGreater(engine.max_concurrency, 1)
+        self.assertEqual(engine.max_call_concurrency, 1)
+
+    def test_failed_link_of_prefill_is_logged(self):
+        engine = FakeLinkEngine({"a": [FakeRegisterMemStatus.FAILED]})
+        manager = make_manager(engine, {0: ["a", "b"]}, is_prefill=True, kv_link_deferred=True,
+                               kv_link_retry_times=1)
+        with self.assertLogs(manager_module.logger, "ERROR") as logs:
+            self.assertTrue(manager._start_planned_links())
+            # the failure is logged by the link thread once the link is done
+            manager._link_executor.shutdown(wait=True)
+        self.assertTrue(any("kv link failed: check kv link status failed: a" in line for line in logs.output))
+        self.assertIn("b", manager.rank_link_info_map)
+
+    def test_retryable_error_is_retried(self):
+        engine = FakeLinkEngine({"a": [FakeLLMException(RETRYABLE_CODE), FakeRegisterMemStatus.OK]})
+        manager = make_manager(engine, {0: ["a"]})
+        manager._start_planned_links()
+        self.assertEqual(engine.calls, ["a", "a"])
+        self.assertEqual(manager.rank_link_info_map["a"].comm_id, 2)
+
+    def test_retry_with_backoff(self):
+        failed = FakeRegisterMemStatus.FAILED
+        engine = FakeLinkEngine({"a": [failed, failed, FakeRegisterMemStatus.OK]})
+        manager = make_manager(engine, {0: ["a"]})
+        manager._start_planned_links()
+        self.assertEqual(engine.calls, ["a", "a", "a"])
+        # the failed links are unlinked before they are tried again
+        self.assertEqual(engine.unlinked, [1, 2])
+        self.assertEqual(manager.rank_link_info_map["a"].comm_id, 3)
+        base = manager_module.KV_LINK_RETRY_BASE_SECOND
+        self.assertEqual(self.backoff_sleeps(), [base, 2 * base])
+
+    def test_gives_up_after_retry_times(self):
+        engine = FakeLinkEngine({"a": [FakeRegisterMemStatus.FAILED]})
+        manager = make_manager(engine, {0: ["a"]}, kv_link_retry_times=2)
+        with self.assertRaises(RuntimeError):
+            manager._start_planned_links()
+        self.assertEqual(engine.calls, ["a", "a"])
+        self.assertEqual(engine.unlinked, [1, 2])
+        self.assertNotIn("a", manager.rank_link_info_map)
+
+    def test_link_not_ready_in_time_is_retried(self):
+        engine = FakeLinkEngine({"a": [PENDING, FakeRegisterMemStatus.OK]})
+        manager = make_manager(engine, {0: ["a"]}, kv_link_timeout_s=0.01)
+        manager._start_planned_links()
+        self.assertEqual(engine.calls, ["a", "a"])
+        self.assertEqual(engine.unlinked, [1])
+        self.assertIn("a", manager.rank_link_info_map)
+
+    def test_non_retryable_error_is_raised(self):
+        engine = FakeLinkEngine({"a": [ValueError("bad rank table")]})
+        manager = make_manager(engine, {0: ["a"]})
+        with self.assertRaises(ValueError):
+            manager._start_planned_links()
+        self.assertEqual(engine.calls, ["a"])
+
+    def test_deferred_links_are_set_up_by_first_pull(self):
+        engine = FakeLinkEngine()
+        manager = make_manager(engine, {0: ["a", "b"], 1: ["c"]}, kv_link_deferred=True)
+        manager._start_planned_links()
+        self.assertEqual(engine.calls, [])
+
+        manager.wait_for_links("1")
+        self.assertEqual(engine.calls, ["c"])
+        manager.wait_for_links(1)
+        manager.wait_for_links("0")
+        self.assertEqual(sorted(engine.calls), ["a", "b", "c"])
+        # a cluster without links of this rank is ready at once
+        manager.wait_for_links("7")
+        self.assertEqual(len(engine.calls), 3)
+
+    def test_failed_deferred_link_is_set_up_again_by_next_pull(self):
+        failed = FakeRegisterMemStatus.FAILED
+        engine = FakeLinkEngine({"a": [failed, failed, FakeRegisterMemStatus.OK]})
+        manager = make_manager(engine, {0: ["a"]}, kv_link_deferred=True, kv_link_retry_times=2)
+        manager._start_planned_links()
+        with self.assertRaises(RuntimeError):
+            manager.wait_for_links("0")
+        manager.wait_for_links("0")
+        self.assertEqual(engine.calls, ["a", "a", "a"])
+        self.assertIn("a", manager.rank_link_info_map)
+
+    def test_deferred_prefill_links_start_at_once(self):
+        engine = FakeLinkEngine()
+        manager = make_manager(engine, {0: ["a"]}, is_prefill=True, kv_link_deferred=True)
+        manager._start_planned_links()
+        for futures in manager._link_futures.values():
+            for future in futures:
+                future.result()
+        self.assertEqual(engine.calls, ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import types
+import unittest
+
+import numpy as np
+
+from omni.accelerators.pd.metadata_codec import (
+    HEADER,
+    MAGIC,
+    VERSION,
+    decode_requests,
+    encode_requests,
+    to_block_id_list,
+)
+
+
+def req_meta(local_block_ids, remote_block_ids, spec_token_ids=None, remote_cluster_id="0", lease_deadline=None):
+    return types.SimpleNamespace(local_block_ids=local_block_ids, remote_block_ids=remote_block_ids,
+                                 remote_host="10.0.0.1", remote_cluster_id=remote_cluster_id,
+                                 spec_token_ids=spec_token_ids, lease_deadline=lease_deadline)
+
+
+def as_lists(decoded):
+    return {req_id: {key: to_block_id_list(value) if key.endswith("ids") and value is not None else value
+                     for key, value in fields.items()}
+            for req_id, fields in decoded.items()}
+
+
+class TestMetadataCodec(unittest.TestCase):
+    def test_round_trip(self):
+        requests = {
+            "flat": req_meta([1, 2, 3], [7, 8, 9], lease_deadline=1760000000.25),
+            "nested": req_meta([[4, 5], [], [6]], [10, 11, 12], spec_token_ids=[100, 101], remote_cluster_id="1"),
+            "nested_remote": req_meta([[13], [14, 15]], [[20, 21], [22, 23]]),
+            "empty": req_meta([], []),
+        }
+        decoded = decode_requests(encode_requests(requests))
+        self.assertEqual(list(decoded), list(requests))
+        for req_id, meta in requests.items():
+            self.assertEqual(as_lists(decoded)[req_id], vars(meta))
+
+    def test_no_requests(self):
+        self.assertEqual(decode_requests(encode_requests({})), {})
+
+    def test_block_ids_are_views_of_last_frame(self):
+        frames = encode_requests({"a": req_meta(np.array([1, 2]), [3, 4])})
+        # zmq.Frame objects from recv_multipart(copy=False) expose a buffer
+        frames = [types.SimpleNamespace(buffer=memoryview(bytes(frame))) for frame in frames]
+        decoded = decode_requests(frames)["a"]
+        self.assertEqual(decoded["local_block_ids"].dtype, np.int32)
+        self.assertFalse(decoded["local_block_ids"].flags.owndata)
+        self.assertIs(decoded["local_block_ids"].base, decoded["remote_block_ids"].base)
+        self.assertEqual(to_block_id_list(decoded["local_block_ids"]), [1, 2])
+
+    def test_rejects_malformed_messages(self):
+        frames = encode_requests({"a": req_meta([1], [2])})
+        with self.assertRaises(ValueError):
+            decode_requests(frames[:2])
+        with self.assertRaises(ValueError):
+            decode_requests([HEADER.pack(b"XXXX", VERSION, 1)] + frames[1:])
+        with self.assertRaises(ValueError):
+            decode_requests([HEADER.pack(MAGIC, VERSION - 1, 1)] + frames[1:])
+        with self.assertRaises(ValueError):
+            decode_requests([HEADER.pack(MAGIC, VERSION, 2)] + frames[1:])
+        with self.assertRaises(ValueError):
+            decode_requests(frames[:2] + [np.array([1, 2, 3], dtype=np.int32).tobytes()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,493 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from omni.accelerators.pd.utils import (
+    STAGING_BLOCK_ID_BASE,
+    BlockLeaseTable,
+    KVLeaseExpiredError,
+    LayerLoadTracker,
+    LinkThroughputTracker,
+    StagingSlotAllocator,
+    backoff_delays,
+    block_bytes_of,
+    check_lease_deadline,
+    contiguous_runs,
+    layer_groups,
+    num_blocks_of,
+    split_by_weights,
+    split_staging_blocks,
+    stripe_pull_blocks,
+)
+
+
+class TestSplitByWeights(unittest.TestCase):
+    def test_equal_weights(self):
+        self.assertEqual(split_by_weights(10, [1, 1]), [5, 5])
+        self.assertEqual(split_by_weights(10, [1, 1, 1]), [4, 3, 3])
+
+    def test_proportional(self):
+        self.assertEqual(split_by_weights(100, [3, 1]), [75, 25])
+        self.assertEqual(sum(split_by_weights(97, [0.3, 1.7, 2.9, 0.1])), 97)
+
+    def test_zero_weights_fall_back_to_equal(self):
+        self.assertEqual(split_by_weights(4, [0, 0]), [2, 2])
+
+    def test_invalid_weights(self):
+        with self.assertRaises(ValueError):
+            split_by_weights(4, [])
+        with self.assertRaises(ValueError):
+            split_by_weights(4, [1, -1])
+
+
+class TestStripePullBlocks(unittest.TestCase):
+    def test_flat_layout_is_contiguous(self):
+        local = list(range(10))
+        remote = list(range(100, 110))
+        stripes = stripe_pull_blocks(local, remote, [1, 1, 1])
+        self.assertEqual([len(l) for l, _ in stripes], [4, 3, 3])
+        self.assertEqual(sum((l for l, _ in stripes), []), local)
+        self.assertEqual(sum((r for _, r in stripes), []), remote)
+
+    def test_two_way_matches_former_split(self):
+        local = list(range(7))
+        remote = list(range(10, 17))
+        stripes = stripe_pull_blocks(local, remote, [1.0, 1.0])
+        self.assertEqual(stripes[0], (local[:4], remote[:4]))
+        self.assertEqual(stripes[1], (local[4:], remote[4:]))
+
+    def test_weighted(self):
+        stripes = stripe_pull_blocks(list(range(8)), list(range(8)), [3, 1])
+        self.assertEqual([len(l) for l, _ in stripes], [6, 2])
+
+    def test_omni_nested_layout(self):
+        # [[full attn blocks], [omni attn blocks]] on both sides
+        full_local, omni_local = list(range(9)), [50, 51, 52, 53]
+        full_remote, omni_remote = list(range(100, 109)), [200, 201, 202, 203]
+        stripes = stripe_pull_blocks([full_local, omni_local], [full_remote, omni_remote], [1, 1, 1])
+        self.assertEqual(len(stripes), 3)
+        for local, remote in stripes:
+            self.assertEqual(len(local), 2)
+            self.assertEqual(len(remote), 2)
+            self.assertEqual(len(local[0]), len(remote[0]))
+        self.assertEqual(sum((local[0] for local, _ in stripes), []), full_local)
+        self.assertEqual(sum((remote[0] for _, remote in stripes), []), full_remote)
+        # the omni group is pulled once and not split, ties go to the last rank
+        self.assertEqual([local[1] for local, _ in stripes], [[], [], omni_local])
+        self.assertEqual([remote[1] for _, remote in stripes], [[], [], omni_remote])
+
+    def test_omni_group_goes_to_fastest_link(self):
+        stripes = stripe_pull_blocks([[0, 1, 2, 3], [7]], [[10, 11, 12, 13], [10, 11, 12, 13]], [1, 5, 2])
+        self.assertEqual([local[1] for local, _ in stripes], [[], [7], []])
+
+    def test_omni_few_blocks(self):
+        # fewer full attn blocks than ranks, the omni group must still be pulled
+        stripes = stripe_pull_blocks([[0], [5, 6]], [[10], [10]], [1, 1, 1])
+        self.assertEqual([num_blocks_of(local) for local, _ in stripes], [3, 0, 0])
+        self.assertEqual(stripes[0], ([[0], [5, 6]], [[10], [10]]))
+
+    def test_omni_blocks_ride_with_full_blocks(self):
+        # no stripe carries omni attn blocks without full attn blocks
+        stripes = stripe_pull_blocks([[0, 1], [5]], [[10, 11], [10, 11]], [1, 1, 5])
+        for local, _ in stripes:
+            self.assertFalse(len(local[0]) == 0 and len(local[1]) > 0)
+        self.assertEqual([len(local[1]) for local, _ in stripes], [0, 0, 1])
+
+    def test_block_bytes_of(self):
+        self.assertEqual(block_bytes_of([0, 1, 2], [100]), 300)
+        self.assertEqual(block_bytes_of([[0, 1], [5]], [100, 10]), 210)
+
+    def test_numpy_block_ids(self):
+        local = np.arange(6, dtype=np.int32)
+        stripes = stripe_pull_blocks(local, local + 10, [1, 2])
+        self.assertEqual([len(l) for l, _ in stripes], [2, 4])
+        self.assertEqual(num_blocks_of(local), 6)
+
+    def test_mismatched_lengths(self):
+        with self.assertRaises(ValueError):
+            stripe_pull_blocks([0, 1], [0], [1, 1])
+
+
+class TestLinkThroughputTracker(unittest.TestCase):
+    def test_equal_weights_without_measurement(self):
+        tracker = LinkThroughputTracker()
+        self.assertEqual(tracker.weights([0, 1, 2]), [1.0, 1.0, 1.0])
+
+    def test_unmeasured_link_gets_mean(self):
+        tracker = LinkThroughputTracker(alpha=1.0)
+        tracker.update(0, 100, 1.0)
+        tracker.update(1, 300, 1.0)
+        self.assertEqual(tracker.weights([0, 1, 2]), [100.0, 300.0, 200.0])
+
+    def test_slow_link_is_floored(self):
+        tracker = LinkThroughputTracker(alpha=1.0, min_weight_ratio=0.1)
+        tracker.update(0, 1, 1.0)
+        tracker.update(1, 1999, 1.0)
+        self.assertEqual(tracker.weights([0, 1]), [100.0, 1999.0])
+
+    def test_moving_average(self):
+        tracker = LinkThroughputTracker(alpha=0.5)
+        tracker.update(0, 100, 1.0)
+        tracker.update(0, 200, 1.0)
+        self.assertEqual(tracker.get(0), 150.0)
+        tracker.update(0, 0, 1.0)
+        self.assertEqual(tracker.get(0), 150.0)
+
+
+class FakeLayerwiseDataDist:
+    """Pulls the blocks of a [num_layers, num_blocks] cache one layer group at a time,
+    in a thread and with a delay per group, like the layerwise pulls of the decode worker."""
+
+    def __init__(self, tracker, src_cache, dst_cache, group_size, delay_s, fail_group=None):
+        self.tracker = tracker
+        self.src_cache = src_cache
+        self.dst_cache = dst_cache
+        self.groups = layer_groups(src_cache.shape[0], group_size)
+        self.delay_s = delay_s
+        self.fail_group = fail_group
+
+    def pull_kv(self, request_id, src_blocks, dst_blocks):
+        def pull():
+            for i, layers in enumerate(self.groups):
+                time.sleep(self.delay_s)
+                if i == self.fail_group:
+                    self.tracker.fail(request_id)
+                    return
+                self.dst_cache[layers.start:layers.stop, dst_blocks] = \
+                    self.src_cache[layers.start:layers.stop, src_blocks]
+                self.tracker.mark_loaded(request_id, layers)
+
+        thread = threading.Thread(target=pull, daemon=True)
+        thread.start()
+        return thread
+
+
+class TestLayerGroups(unittest.TestCase):
+    def test_groups(self):
+        self.assertEqual(layer_groups(7, 3), [range(0, 3), range(3, 6), range(6, 7)])
+        self.assertEqual(layer_groups(4, 8), [range(0, 4)])
+        with self.assertRaises(ValueError):
+            layer_groups(4, 0)
+
+
+class TestLayerLoadTracker(unittest.TestCase):
+    def test_release_after_first_layer(self):
+        tracker = LayerLoadTracker(4)
+        tracker.add("a")
+        self.assertEqual(tracker.release(), set())
+        # unreleased requests are not in a forward and never block it
+        self.assertTrue(tracker.wait_for_layer(3, timeout=0))
+        tracker.mark_loaded("a", range(0, 2))
+        self.assertEqual(tracker.release(), {"a"})
+        self.assertEqual(tracker.release(), set())
+        self.assertTrue(tracker.wait_for_layer(1, timeout=0))
+        self.assertFalse(tracker.wait_for_layer(2, timeout=0))
+        tracker.mark_loaded("a", range(2, 4))
+        self.assertTrue(tracker.wait_for_layer(3, timeout=0))
+        self.assertEqual(len(tracker), 0)
+
+    def test_fully_loaded_before_release(self):
+        tracker = LayerLoadTracker(2)
+        tracker.add("a")
+        tracker.mark_loaded("a", range(0, 2))
+        self.assertEqual(tracker.release(), {"a"})
+        self.assertTrue(tracker.wait_for_layer(1, timeout=0))
+        self.assertEqual(len(tracker), 0)
+
+    def test_layer_needs_all_parts(self):
+        tracker = LayerLoadTracker(2)
+        tracker.add("a", num_parts=2)
+        tracker.mark_loaded("a", range(0, 2))
+        self.assertEqual(tracker.release(), set())
+        tracker.mark_loaded("a", range(0, 1))
+        self.assertEqual(tracker.release(), {"a"})
+        self.assertFalse(tracker.wait_for_layer(1, timeout=0))
+        tracker.mark_loaded("a", range(1, 2))
+        self.assertTrue(tracker.wait_for_layer(1, timeout=0))
+
+    def test_failed_released_request_fails_missing_layers(self):
+        tracker = LayerLoadTracker(3)
+        tracker.add("a")
+        tracker.add("b")
+        tracker.mark_loaded("a", range(0, 1))
+        tracker.mark_loaded("b", range(0, 3))
+        self.assertEqual(tracker.release(), {"a", "b"})
+        self.assertFalse(tracker.wait_for_layer(1, timeout=0))
+        tracker.fail("a")
+        self.assertTrue(tracker.wait_for_layer(0, timeout=0))
+        for layer in (1, 2):
+            with self.assertRaises(RuntimeError):
+                tracker.wait_for_layer(layer, timeout=0)
+        # late arrivals of a failed request are ignored
+        tracker.mark_loaded("a", range(1, 3))
+        with self.assertRaises(RuntimeError):
+            tracker.wait_for_layer(2, timeout=0)
+        self.assertEqual(len(tracker), 0)
+
+    def test_failed_unreleased_request_is_dropped(self):
+        tracker = LayerLoadTracker(2)
+        tracker.add("a")
+        tracker.mark_loaded("a", range(0, 1))
+        tracker.fail("a")
+        self.assertEqual(tracker.release(), set())
+        self.assertTrue(tracker.wait_for_layer(1, timeout=0))
+        self.assertEqual(len(tracker), 0)
+
+    def test_duplicate_request(self):
+        tracker = LayerLoadTracker(2)
+        tracker.add("a")
+        with self.assertRaises(ValueError):
+            tracker.add("a")
+
+    def test_wait_for_layer_with_fake_datadist(self):
+        num_layers, num_blocks = 10, 16
+        src_cache = np.arange(num_layers * num_blocks, dtype=np.float32).reshape(num_layers, num_blocks)
+        dst_cache = np.zeros_like(src_cache)
+        tracker = LayerLoadTracker(num_layers)
+        datadist = FakeLayerwiseDataDist(tracker, src_cache, dst_cache, group_size=3, delay_s=0.01)
+        src_blocks, dst_blocks = [1, 5, 9], [2, 3, 4]
+
+        tracker.add("a")
+        thread = datadist.pull_kv("a", src_blocks, dst_blocks)
+        while not tracker.release():
+            time.sleep(0.001)
+        # the forward consumes the layers while the following groups are being pulled
+        for layer in range(num_layers):
+            self.assertTrue(tracker.wait_for_layer(layer, timeout=5))
+            np.testing.assert_array_equal(dst_cache[layer, dst_blocks], src_cache[layer, src_blocks])
+        thread.join()
+        self.assertEqual(len(tracker), 0)
+
+    def test_second_layer_group_fails_with_fake_datadist(self):
+        num_layers, num_blocks = 9, 8
+        src_cache = np.arange(num_layers * num_blocks, dtype=np.float32).reshape(num_layers, num_blocks)
+        dst_cache = np.zeros_like(src_cache)
+        tracker = LayerLoadTracker(num_layers)
+        datadist = FakeLayerwiseDataDist(tracker, src_cache, dst_cache, group_size=3, delay_s=0.01, fail_group=1)
+        src_blocks, dst_blocks = [1, 5], [2, 3]
+
+        tracker.add("a")
+        thread = datadist.pull_kv("a", src_blocks, dst_blocks)
+        while not tracker.release():
+            time.sleep(0.001)
+        for layer in range(3):
+            self.assertTrue(tracker.wait_for_layer(layer, timeout=5))
+        # the forward fails instead of reading the blocks of the layers that never arrived
+        with self.assertRaises(RuntimeError):
+            tracker.wait_for_layer(3, timeout=5)
+        thread.join()
+        self.assertFalse(dst_cache[3:, dst_blocks].any())
+
+
+class TestSplitStagingBlocks(unittest.TestCase):
+    def test_device_blocks_only(self):
+        self.assertEqual(split_staging_blocks([1, 2], [3, 4]), [(False, [1, 2], [3, 4])])
+
+    def test_staging_blocks_only(self):
+        src = [STAGING_BLOCK_ID_BASE + 5, STAGING_BLOCK_ID_BASE + 6]
+        self.assertEqual(split_staging_blocks(src, [3, 4]), [(True, [5, 6], [3, 4])])
+
+    def test_mixed(self):
+        src = [7, STAGING_BLOCK_ID_BASE, 8, STAGING_BLOCK_ID_BASE + 1]
+        self.assertEqual(split_staging_blocks(src, [1, 2, 3, 4]),
+                         [(False, [7, 8], [1, 3]), (True, [0, 1], [2, 4])])
+
+
+class TestContiguousRuns(unittest.TestCase):
+    def test_runs(self):
+        self.assertEqual(contiguous_runs([]), [])
+        self.assertEqual(contiguous_runs([3, 4, 5]), [(0, 3, 3)])
+        self.assertEqual(contiguous_runs([3, 4, 9, 10, 2]), [(0, 3, 2), (2, 9, 2), (4, 2, 1)])
+
+
+class TestStagingSlotAllocator(unittest.TestCase):
+    def test_allocate_and_free(self):
+        allocator = StagingSlotAllocator(4)
+        self.assertEqual(allocator.allocate(2), [0, 1])
+        self.assertEqual(allocator.allocate(2), [2, 3])
+        self.assertIsNone(allocator.allocate(1))
+        allocator.free([0, 1])
+        self.assertEqual(allocator.num_free, 2)
+        # lowest ids first, so that the slots of a request are contiguous
+        allocator.free([3])
+        self.assertEqual(allocator.allocate(2), [0, 1])
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            StagingSlotAllocator(0)
+
+
+class TestBackoffDelays(unittest.TestCase):
+    def test_doubles_up_to_max(self):
+        self.assertEqual(backoff_delays(5, 1.0, 5.0), [1.0, 2.0, 4.0, 5.0])
+
+    def test_single_attempt_has_no_retry(self):
+        self.assertEqual(backoff_delays(1, 1.0, 5.0), [])
+        self.assertEqual(backoff_delays(0, 1.0, 5.0), [])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBlockLeaseTable(unittest.TestCase):
+    def test_ack_before_deadline(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, clock=clock)
+        leases.add("a", 3)
+        leases.add("b", 2)
+        self.assertEqual(leases.num_blocks, 5)
+        self.assertEqual(leases.ack(["a"]), ["a"])
+        self.assertEqual(leases.num_blocks, 2)
+        clock.now = 9
+        self.assertEqual(leases.expire(), [])
+        self.assertEqual(len(leases), 1)
+
+    def test_expire(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, clock=clock)
+        leases.add("a", 3)
+        clock.now = 5
+        leases.add("b", 2)
+        clock.now = 10
+        self.assertEqual(leases.expire(), [("a", 3)])
+        self.assertEqual(leases.num_blocks, 2)
+        clock.now = 15
+        self.assertEqual(leases.expire(), [("b", 2)])
+        self.assertEqual(leases.num_blocks, 0)
+
+    def test_late_ack_is_dropped(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, clock=clock)
+        leases.add("a", 1)
+        clock.now = 10
+        self.assertEqual(leases.expire(), [("a", 1)])
+        self.assertEqual(leases.ack(["a"]), [])
+        # a late ack is dropped until the expired lease is forgotten, ttl_s after it expired
+        leases.add("b", 1)
+        clock.now = 20
+        self.assertEqual(leases.expire(), [("b", 1)])
+        clock.now = 30
+        self.assertEqual(leases.ack(["b"]), ["b"])
+
+    def test_ack_before_lease(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, clock=clock)
+        self.assertEqual(leases.ack(["a"]), ["a"])
+        leases.add("a", 4)
+        self.assertEqual(len(leases), 0)
+        self.assertEqual(leases.num_blocks, 0)
+        clock.now = 100
+        self.assertEqual(leases.expire(), [])
+
+    def test_early_ack_is_forgotten(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, clock=clock)
+        self.assertEqual(leases.ack(["a", "b"]), ["a", "b"])
+        clock.now = 5
+        leases.add("a", 1)
+        self.assertEqual(len(leases), 0)
+        # the early ack of a lease never added is not kept for ever
+        clock.now = 10
+        leases.expire()
+        self.assertEqual(len(leases._acked_early), 0)
+        leases.add("b", 2)
+        self.assertEqual(len(leases), 1)
+
+    def test_expire_after_grace(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, grace_s=5, clock=clock)
+        leases.add("a", 3)
+        clock.now = 10
+        self.assertEqual(leases.expire(), [])
+        clock.now = 15
+        self.assertEqual(leases.expire(), [("a", 3)])
+
+    def test_invalid_ttl(self):
+        with self.assertRaises(ValueError):
+            BlockLeaseTable(0)
+        with self.assertRaises(ValueError):
+            BlockLeaseTable(10, grace_s=-1)
+
+
+class TestLeaseFence(unittest.TestCase):
+    def test_check_lease_deadline(self):
+        clock = FakeClock()
+        check_lease_deadline(None, clock=clock)
+        check_lease_deadline(10, clock=clock)
+        clock.now = 10
+        with self.assertRaises(KVLeaseExpiredError):
+            check_lease_deadline(10, clock=clock)
+
+    def test_pull_started_before_deadline_is_not_released(self):
+        clock = FakeClock()
+        leases = BlockLeaseTable(10, grace_s=5, clock=clock)
+        # the deadline of the transfer params, the lease is added by the worker a bit later
+        deadline = clock() + 10
+        clock.now = 0.5
+        leases.add("a", 2)
+        clock.now = 9.9
+        check_lease_deadline(deadline, clock=clock)
+        # the pull call in flight still reads the blocks, the next one is fenced off
+        clock.now = 10.5
+        self.assertEqual(leases.expire(), [])
+        with self.assertRaises(KVLeaseExpiredError):
+            check_lease_deadline(deadline, clock=clock)
+        clock.now = 15.5
+        self.assertEqual(leases.expire(), [("a", 2)])
+        # the ack sent by the decode side when it drops the request is dropped too
+        self.assertEqual(leases.ack(["a"]), [])
+
+    def test_expiry_racing_pulls(self):
+        ttl_s, grace_s, pull_s = 0.05, 0.2, 0.01
+        lock = threading.Lock()
+        leases = BlockLeaseTable(ttl_s, grace_s)
+        blocks = np.arange(8)
+        deadline = time.time() + ttl_s
+        leases.add("a", len(blocks))
+        released = threading.Event()
+        corrupted = []
+
+        def sweep():
+            # the prefill side reuses the blocks as soon as their lease has expired
+            while not released.is_set():
+                with lock:
+                    if leases.expire():
+                        blocks[:] = -1
+                        released.set()
+                time.sleep(0.001)
+
+        def pull():
+            # pull calls one after another, each reading the blocks for pull_s, until the deadline
+            while True:
+                try:
+                    check_lease_deadline(deadline)
+                except KVLeaseExpiredError:
+                    return
+                time.sleep(pull_s)
+                if (blocks != np.arange(8)).any():
+                    corrupted.append(time.time() - deadline)
+
+        sweeper = threading.Thread(target=sweep, daemon=True)
+        puller = threading.Thread(target=pull, daemon=True)
+        sweeper.start()
+        puller.start()
+        puller.join(timeout=5)
+        self.assertFalse(puller.is_alive())
+        self.assertFalse(released.is_set())
+        sweeper.join(timeout=5)
+        self.assertTrue(released.is_set())
+        self.assertEqual(corrupted, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,11 @@
 # Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
 
 import math
+import numbers
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
 
 
 #  | ------------------------------- prefill -------------------------------------|
@@ -96,3 +101,402 @@ def prepare_ranktables(prefill_node, decode_node, p_rank_start, p_rank_end, d_ra
         p_ranktables[p_ranks] = rank_table_dict
         d_ranktables[d_ranks] = rank_table_dict
     return p_ranktables, d_ranktables
+
+
+def num_blocks_of(block_ids) -> int:
+    """Number of blocks in a flat block id list, or in all groups of the nested
+    omni attention layout [[full attn blocks], [omni attn blocks]]."""
+    if len(block_ids) > 0 and not isinstance(block_ids[0], numbers.Integral):
+        return sum(len(group) for group in block_ids)
+    return len(block_ids)
+
+
+def block_bytes_of(block_ids, group_block_bytes: list[int]) -> int:
+    """Bytes moved for `block_ids` (flat, or nested per KV cache group) given
+    the bytes of one block id in every group."""
+    if len(block_ids) > 0 and not isinstance(block_ids[0], numbers.Integral):
+        return sum(len(group) * nbytes for group, nbytes in zip(block_ids, group_block_bytes))
+    return len(block_ids) * group_block_bytes[0]
+
+
+def split_by_weights(num_items: int, weights: list[float]) -> list[int]:
+    """Split `num_items` into len(weights) counts proportional to `weights`,
+    rounding with the largest remainder method so that the counts sum up to
+    `num_items`.
+    """
+    if len(weights) == 0:
+        raise ValueError("weights should not be empty")
+    if any(w < 0 for w in weights):
+        raise ValueError(f"weights should be non-negative, but got {weights}")
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1.0] * len(weights), float(len(weights))
+    quotas = [num_items * w / total for w in weights]
+    counts = [math.floor(q) for q in quotas]
+    remainder = num_items - sum(counts)
+    by_fraction = sorted(range(len(weights)), key=lambda i: (counts[i] - quotas[i], i))
+    for i in by_fraction[:remainder]:
+        counts[i] += 1
+    return counts
+
+
+def stripe_pull_blocks(local_block_ids, remote_block_ids, weights: list[float]):
+    """Split the blocks of one request into contiguous stripes, one per source
+    prefill rank, with stripe sizes proportional to `weights`.
+
+    Two layouts are supported:
+    * flat: `local_block_ids` and `remote_block_ids` are lists of block ids of
+      the same length.
+    * omni attention: `local_block_ids` and `remote_block_ids` are
+      [[full attn blocks], [omni attn blocks]]. Only the full attention blocks
+      are striped. The omni attention group holds the sink and recent window,
+      so it is kept in one piece and assigned to the non-empty stripe with the
+      largest weight, so that no stripe carries omni attention blocks only.
+
+    Returns:
+        A list of (local_blocks, remote_blocks) with the same layout as the
+        inputs, aligned with `weights`. Stripes may be empty.
+    """
+    nested = len(local_block_ids) > 0 and not isinstance(local_block_ids[0], numbers.Integral)
+    full_local = local_block_ids[0] if nested else local_block_ids
+    full_remote = remote_block_ids[0] if nested else remote_block_ids
+    if len(full_local) != len(full_remote):
+        raise ValueError(f"local and remote blocks mismatch: {len(full_local)} vs {len(full_remote)}")
+
+    counts = split_by_weights(len(full_local), weights)
+    stripes = []
+    start = 0
+    for count in counts:
+        stripes.append((full_local[start:start + count], full_remote[start:start + count]))
+        start += count
+    if not nested:
+        return stripes
+
+    # ties go to the last rank, which matches the former 2-way split
+    candidates = [i for i, count in enumerate(counts) if count > 0] or range(len(weights))
+    omni_idx = max(candidates, key=lambda i: (weights[i], i))
+    return [
+        ([local, local_block_ids[1]], [remote, remote_block_ids[1]]) if i == omni_idx
+        else ([local, []], [remote, []])
+        for i, (local, remote) in enumerate(stripes)
+    ]
+
+
+class LinkThroughputTracker:
+    """Exponential moving average of the KV pull throughput (blocks per second)
+    of every link, keyed by the source cluster id. Used to weight the stripes
+    of `multi_rank_pull_kv`, so that a slow link gets fewer blocks.
+    """
+
+    def __init__(self, alpha: float = 0.2, min_weight_ratio: float = 0.1):
+        self.alpha = alpha
+        # floor of a weight relative to the mean, so that a slow link keeps
+        # receiving some blocks and its throughput keeps being measured
+        self.min_weight_ratio = min_weight_ratio
+        self._throughput: dict = {}
+        self._lock = threading.Lock()
+
+    def update(self, cluster_id, num_blocks: int, seconds: float) -> None:
+        if num_blocks <= 0 or seconds <= 0:
+            return
+        sample = num_blocks / seconds
+        with self._lock:
+            prev = self._throughput.get(cluster_id)
+            self._throughput[cluster_id] = sample if prev is None else \
+                (1 - self.alpha) * prev + self.alpha * sample
+
+    def get(self, cluster_id) -> Optional[float]:
+        with self._lock:
+            return self._throughput.get(cluster_id)
+
+    def weights(self, cluster_ids: list) -> list[float]:
+        """Stripe weights of `cluster_ids`. Links without measurements get the
+        mean of the measured ones, so all weights are equal before the first pull."""
+        with self._lock:
+            throughput = {c: self._throughput[c] for c in cluster_ids if c in self._throughput}
+        if not throughput:
+            return [1.0] * len(cluster_ids)
+        mean = sum(throughput.values()) / len(throughput)
+        floor = mean * self.min_weight_ratio
+        return [max(throughput.get(c, mean), floor) for c in cluster_ids]
+
+
+def layer_groups(num_layers: int, group_size: int) -> list[range]:
+    """Consecutive ranges of at most `group_size` layers covering `num_layers`."""
+    if group_size <= 0:
+        raise ValueError(f"group_size should be positive, but is {group_size}")
+    return [range(start, min(start + group_size, num_layers)) for start in range(0, num_layers, group_size)]
+
+
+class LayerLoadTracker:
+    """Per-request, per-layer arrival of the KV pulled in layer groups
+    (`layerwise_pull_kv`).
+
+    A request is added when its pulls are queued, with the number of parts it
+    is pulled in (the stripes of `multi_rank_pull_kv`): a layer is loaded once
+    every part has pulled it. A request is released to the scheduler, by
+    `release`, as soon as its first layer is loaded. Only released requests
+    can be in a forward, so `wait_for_layer` only waits for those, until the
+    layer is loaded for all of them.
+
+    A released request whose pull fails is already running, with blocks that
+    will never be filled: `wait_for_layer` raises for its missing layers rather
+    than letting the forward read them.
+    """
+
+    def __init__(self, num_layers: int):
+        if num_layers <= 0:
+            raise ValueError(f"num_layers should be positive, but is {num_layers}")
+        self.num_layers = num_layers
+        self._cond = threading.Condition()
+        # request id -> [number of parts, arrivals per layer, number of leading layers loaded, released]
+        self._requests: dict = {}
+        # layer -> number of released requests which have not loaded it yet
+        self._num_pending = [0] * num_layers
+        # layer -> number of released requests which failed before loading it, and their ids
+        self._num_failed = [0] * num_layers
+        self._failed: set = set()
+
+    def add(self, request_id, num_parts: int = 1) -> None:
+        with self._cond:
+            if request_id in self._requests:
+                raise ValueError(f"request {request_id} is already tracked")
+            self._requests[request_id] = [num_parts, [0] * self.num_layers, 0, False]
+
+    def mark_loaded(self, request_id, layers: range) -> None:
+        """One part of `request_id` has pulled `layers`."""
+        with self._cond:
+            state = self._requests.get(request_id)
+            if state is None:
+                return
+            num_parts, arrivals, loaded, released = state
+            for layer in layers:
+                arrivals[layer] += 1
+            new_loaded = loaded
+            while new_loaded < self.num_layers and arrivals[new_loaded] >= num_parts:
+                new_loaded += 1
+            if new_loaded == loaded:
+                return
+            state[2] = new_loaded
+            if released:
+                self._unpend(loaded, new_loaded)
+                if new_loaded == self.num_layers:
+                    del self._requests[request_id]
+
+    def release(self) -> set:
+        """The requests whose first layer is loaded and which were not released yet."""
+        released_ids = set()
+        with self._cond:
+            for request_id, state in list(self._requests.items()):
+                _, _, loaded, released = state
+                if released or loaded == 0:
+                    continue
+                released_ids.add(request_id)
+                if loaded == self.num_layers:
+                    del self._requests[request_id]
+                    continue
+                state[3] = True
+                for layer in range(loaded, self.num_layers):
+                    self._num_pending[layer] += 1
+        return released_ids
+
+    def fail(self, request_id) -> None:
+        """The pull of `request_id` failed. It is dropped if it was not released yet,
+        otherwise the layers it has not loaded fail every `wait_for_layer`."""
+        with self._cond:
+            state = self._requests.pop(request_id, None)
+            if state is None or not state[3]:
+                return
+            self._failed.add(request_id)
+            for layer in range(state[2], self.num_layers):
+                self._num_failed[layer] += 1
+            self._unpend(state[2], self.num_layers)
+
+    def wait_for_layer(self, layer: int, timeout: Optional[float] = None) -> bool:
+        """Block until `layer` is loaded for every released request. False on timeout.
+        Raises RuntimeError if a released request failed before loading it."""
+        if self._num_pending[layer] == 0 and self._num_failed[layer] == 0:
+            return True
+        with self._cond:
+            loaded = self._cond.wait_for(
+                lambda: self._num_pending[layer] == 0 or self._num_failed[layer] > 0, timeout)
+            if self._num_failed[layer] > 0:
+                raise RuntimeError(f"KV of layer {layer} failed to load for requests {sorted(self._failed)}.")
+            return loaded
+
+    def _unpend(self, start: int, end: int) -> None:
+        for layer in range(start, end):
+            self._num_pending[layer] -= 1
+        self._cond.notify_all()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._requests)
+
+
+# Block ids from STAGING_BLOCK_ID_BASE up address the host staging caches that a
+# prefill instance offloads the KV to in staged mode (`kv_transfer_mode: staged`),
+# slot `block_id - STAGING_BLOCK_ID_BASE`. They stay below 2**31, the int32
+# block ids of the metadata codec.
+STAGING_BLOCK_ID_BASE = 1 << 30
+
+
+def split_staging_blocks(src_blocks: list[int], dst_blocks: list[int]) -> list[tuple[bool, list[int], list[int]]]:
+    """Split (src, dst) block pairs into the ones of the device caches and the
+    ones of the staging caches of the source, with staging slot ids.
+
+    Returns:
+        A list of (is_staging, src_blocks, dst_blocks), without empty groups.
+    """
+    if all(block_id < STAGING_BLOCK_ID_BASE for block_id in src_blocks):
+        return [(False, src_blocks, dst_blocks)]
+    device_pairs, staging_pairs = ([], []), ([], [])
+    for src, dst in zip(src_blocks, dst_blocks):
+        if src >= STAGING_BLOCK_ID_BASE:
+            staging_pairs[0].append(src - STAGING_BLOCK_ID_BASE)
+            staging_pairs[1].append(dst)
+        else:
+            device_pairs[0].append(src)
+            device_pairs[1].append(dst)
+    return [(is_staging, src, dst) for is_staging, (src, dst) in ((False, device_pairs), (True, staging_pairs))
+            if len(src) > 0]
+
+
+def contiguous_runs(block_ids) -> list[tuple[int, int, int]]:
+    """Runs of consecutive ids in `block_ids`, as (position in block_ids, first id, length)."""
+    runs = []
+    for i, block_id in enumerate(block_ids):
+        if runs and runs[-1][1] + runs[-1][2] == block_id:
+            position, first_id, length = runs[-1]
+            runs[-1] = (position, first_id, length + 1)
+        else:
+            runs.append((i, block_id, 1))
+    return runs
+
+
+class StagingSlotAllocator:
+    """Slots of the staging caches of staged mode, lowest ids first so that the
+    slots of a request tend to be contiguous and are copied with few runs."""
+
+    def __init__(self, num_slots: int):
+        if num_slots <= 0:
+            raise ValueError(f"num_slots should be positive, but is {num_slots}")
+        self.num_slots = num_slots
+        self._free = list(range(num_slots))
+        self._lock = threading.Lock()
+
+    def allocate(self, num: int) -> Optional[list[int]]:
+        """`num` free slots, or None if there are not enough."""
+        with self._lock:
+            if num > len(self._free):
+                return None
+            slots, self._free = self._free[:num], self._free[num:]
+            return slots
+
+    def free(self, slots: list[int]) -> None:
+        with self._lock:
+            self._free = sorted(self._free + list(slots))
+
+    @property
+    def num_free(self) -> int:
+        with self._lock:
+            return len(self._free)
+
+
+class BlockLeaseTable:
+    """Leases of the prefill blocks (or staging slots) held for a decode pull.
+
+    A request gets a lease of `ttl_s` seconds when its blocks start waiting for
+    the pull. `ack` ends the leases of the pulled requests and `expire` the
+    leases `grace_s` past their deadline, so that the blocks of a request whose
+    decode side is gone are released too. The decode side does not start a
+    pull after the deadline (`check_lease_deadline`), the grace covers a pull
+    started before it and the clock skew of the hosts, so that no pull reads
+    released blocks. Either way a request is returned once:
+
+    - an ack received after its lease expired is dropped, for `ttl_s` more
+      seconds, after which a late ack is taken as the one of an unknown request;
+    - an ack received before its lease is added is returned, and the lease is
+      not added then, if it is added within `ttl_s` seconds.
+
+    Not thread-safe, the caller holds its own lock.
+    """
+
+    def __init__(self, ttl_s: float, grace_s: float = 0.0, clock=time.monotonic):
+        if ttl_s <= 0:
+            raise ValueError(f"ttl_s should be positive, but is {ttl_s}")
+        if grace_s < 0:
+            raise ValueError(f"grace_s should not be negative, but is {grace_s}")
+        self.ttl_s = ttl_s
+        self.grace_s = grace_s
+        self._clock = clock
+        # request id -> (deadline plus grace, number of blocks), in deadline order
+        self._leases: OrderedDict = OrderedDict()
+        # request id -> time until which a late ack of the expired lease is dropped
+        self._expired: OrderedDict = OrderedDict()
+        # request id -> time until which the lease of an early ack is skipped
+        self._acked_early: OrderedDict = OrderedDict()
+        self.num_blocks = 0
+
+    def add(self, request_id, num_blocks: int) -> None:
+        self._forget_expired(self._clock())
+        if self._acked_early.pop(request_id, None) is not None:
+            return
+        self._leases[request_id] = (self._clock() + self.ttl_s + self.grace_s, num_blocks)
+        self.num_blocks += num_blocks
+
+    def ack(self, request_ids) -> list:
+        """The pulled requests among `request_ids` whose blocks are to be released."""
+        now = self._clock()
+        self._forget_expired(now)
+        released = []
+        for request_id in request_ids:
+            lease = self._leases.pop(request_id, None)
+            if lease is not None:
+                self.num_blocks -= lease[1]
+            elif self._expired.pop(request_id, None) is not None:
+                continue
+            else:
+                self._acked_early[request_id] = now + self.ttl_s
+            released.append(request_id)
+        return released
+
+    def expire(self) -> list[tuple]:
+        """(request id, number of blocks) of the leases past their deadline and grace, which end now."""
+        now = self._clock()
+        self._forget_expired(now)
+        expired = []
+        while self._leases:
+            request_id, (deadline, num_blocks) = next(iter(self._leases.items()))
+            if deadline > now:
+                break
+            del self._leases[request_id]
+            self.num_blocks -= num_blocks
+            self._expired[request_id] = now + self.ttl_s
+            expired.append((request_id, num_blocks))
+        return expired
+
+    def _forget_expired(self, now: float) -> None:
+        for forget_times in (self._expired, self._acked_early):
+            while forget_times and next(iter(forget_times.values())) <= now:
+                forget_times.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._leases)
+
+
+class KVLeaseExpiredError(RuntimeError):
+    """The lease of the prefill blocks of a request ended before they were pulled."""
+
+
+def check_lease_deadline(deadline: Optional[float], clock=time.time) -> None:
+    """Raise KVLeaseExpiredError once `deadline`, the wall clock time until which the prefill
+    side holds the blocks of a request for its pull (None for ever), has passed. Called before
+    every pull call, whose blocks the prefill side may release `grace_s` after the deadline."""
+    if deadline is not None and clock() >= deadline:
+        raise KVLeaseExpiredError(f"the lease of the prefill blocks ended {clock() - deadline:.1f}s ago")
+
+
+def backoff_delays(num_attempts: int, base_s: float, max_s: float) -> list[float]:
+    """Seconds to wait before each retry of `num_attempts` attempts, doubling from `base_s` up to `max_s`."""
+    return [min(base_s * 2 ** i, max_s) for i in range(max(num_attempts - 1, 0))]
@@ -5,6 +5,7 @@ from omni_planner.optim.optimizers import Optimizer
 import torch
 import time
 from omni_planner.utils import calculate_time
+from omni_planner.optim.replica_selection import replica_owner_table, replica_placement_pattern, select_replica_devices
 class  HEAT_ExpertsBalancer(Optimizer):
     """
     TokenBalance optimizer class inherits from Optimizer.
@@ -86,68 +87,16 @@ class  HEAT_ExpertsBalancer(Optimizer):
 
     def _build_loacl_expert_mapping_super_(self):
         """
-        混合优化版本：结合向量化和针对性循环，保留核心的 rank % count 分配逻辑。
+        向量化版本：保留核心的 rank % count 分配逻辑。
+        当前 rank 拥有的 expert 使用本地副本，只在一个 device 上的 expert 使用该 device，
+        其余 multi-device expert 使用拥有它的设备 (按设备号升序) 中的第 rank % count 个。
+        副本的选择由 replica_selection 中的 cumsum/gather 完成，不再逐个 (layer, expert) 循环。
         """
-        num_devices, num_layers, num_epids = self.placement_pattern.shape
+        # placement_pattern 变化后需要重新调用本函数，所有 rank 的缓存随之失效
+        self._owner_table = replica_owner_table(self.placement_pattern)
+        self._expert_mappings_all_ranks = None
 
-
-        # 1. 计算每个 expert 在多少个 device 上存在
-        expert_counts = torch.sum(self.placement_pattern, dim=0, dtype=torch.int) # shape: (num_layers, num_epids)
-
-        # 初始化结果张量
-        placement_pattern_super = torch.zeros_like(self.placement_pattern, dtype=torch.int)
-
-        # --- 处理 expert 只存在于一个 device 上的情况 (向量化) ---
-        single_device_mask = (expert_counts == 1)
-        placement_pattern_super = torch.where(single_device_mask.unsqueeze(0),
-                                       self.placement_pattern,
-                                       placement_pattern_super)
-
-        # --- 处理 expert 存在于多个 (>=2) device 上的情况 ---
-        multi_device_mask = (expert_counts >= 2)
-
-        # --- 子情况 1: 当前 device (self.rank) 拥有这个 multi-device expert (向量化) ---
-        current_device_has_it_mask = (self.placement_pattern[self.rank] == 1) & multi_device_mask
-        placement_pattern_super[self.rank, current_device_has_it_mask] = 1
-
-        # --- 子情况 2: 当前 device (self.rank) *不* 拥有这个 multi-device expert (识别 + 循环处理) ---
-        other_devices_have_it_mask = (~(self.placement_pattern[self.rank] == 1)) & multi_device_mask
-
-        # 获取需要进行模数分配的专家的 layer 和 expert 索引
-        l_indices, e_indices = torch.where(other_devices_have_it_mask)
-
-        # 如果存在需要特殊处理的专家，则进行循环
-        if len(l_indices) > 0:
-            # 提取这些专家在所有设备上的映射情况，方便查找
-            # relevant_mapping shape: (num_devices, num_relevant_experts)
-            relevant_mapping = self.placement_pattern[:, l_indices, e_indices]
-            # 提取这些专家的设备计数值
-            # relevant_counts shape: (num_relevant_experts,)
-            relevant_counts = expert_counts[l_indices, e_indices]
-
-            # 计算目标索引 (在拥有该专家的设备列表中的索引)
-            # target_indices_in_group shape: (num_relevant_experts,)
-            target_indices_in_group = self.rank % relevant_counts
-
-            # 循环处理每一个需要模数分配的专家
-            for i in range(len(l_indices)):
-                layer_idx = l_indices[i]
-                expert_idx = e_indices[i]
-                target_idx_in_group = target_indices_in_group[i]
-
-                # 找到拥有当前专家 (layer_idx, expert_idx) 的设备列表
-                # devices_with_expert shape: (count,)
-                devices_with_expert = torch.where(relevant_mapping[:, i] == 1)[0]
-
-                # 为了确保一致性，最好对设备列表进行排序
-                # (原始代码没有明确排序，但依赖列表顺序可能不稳定)
-                sorted_devices = torch.sort(devices_with_expert)[0]
-
-                # 根据计算出的模数索引选择目标设备
-                target_device = sorted_devices[target_idx_in_group]
-
-                # 在 placement_pattern_super 中标记目标设备
-                placement_pattern_super[target_device, layer_idx, expert_idx] = 1
+        placement_pattern_super = replica_placement_pattern(self.placement_pattern, self.rank, self._owner_table)
 
         # 调用后续处理函数
         if not self.is_global_maximum_offset :
@@ -160,6 +109,28 @@ class  HEAT_ExpertsBalancer(Optimizer):
 
         return 0
 
+    def build_expert_mappings_all_ranks(self):
+        """
+        一次计算所有 rank 的 expert_mapping_，结果会被缓存。
+
+        Returns:
+            - torch.Tensor: 形状为 (num_devices, num_layers, num_epids) 的 int32 张量，
+              第 r 行等于 rank 为 r 时的 expert_mapping_。
+        """
+        if self._expert_mappings_all_ranks is None:
+            num_devices = self.placement_pattern.shape[0]
+            # selected_devices shape: (num_devices, num_layers, num_epids)，没有副本时为 -1
+            selected_devices = select_replica_devices(
+                self.placement_pattern, torch.arange(num_devices), self._owner_table)
+            potential_global_indices = self._potential_global_indices(self.is_global_maximum_offset)
+            expert_mappings = torch.gather(potential_global_indices, 0, selected_devices.clamp(min=0))
+            expert_mappings = torch.where(selected_devices >= 0, expert_mappings, torch.full_like(expert_mappings, -1))
+            self._expert_mappings_all_ranks = expert_mappings.to(torch.int32)
+        return self._expert_mappings_all_ranks
+
+    def expert_mapping_for_rank(self, rank):
+        """rank 的 expert_mapping_，形状为 (num_layers, num_epids)，来自所有 rank 的缓存。"""
+        return self.build_expert_mappings_all_ranks()[rank]
 
     def _construct_expert_mapping_from_placement_pattern(self, expert_mappingX):
         """
@@ -174,40 +145,7 @@ class  HEAT_ExpertsBalancer(Optimizer):
             - torch.Tensor: 形状为 (num_layers, num_epids) 的张量，存储每个 expert 的唯一索引，或 -1。
         """
 
-        placement_pattern = self.placement_pattern
-        # 1. 计算本地累积和 (沿最后一个维度，即 num_epids)
-        #    这决定了专家在其所在设备和层内的本地序号 (1-based)
-        # cumsum_local shape: (num_devices, num_layers, num_epids)
-        cumsum_local = torch.cumsum(placement_pattern, dim=2)
-
-        # 2. 计算本地 0-based 索引
-        # local_indices shape: (num_devices, num_layers, num_epids)
-        local_indices = cumsum_local - 1
-
-        # --- 新增：计算层级设备偏移量 ---
-        # 3. 计算每个设备在每层实际拥有的专家数量
-        # experts_per_device_layer shape: (num_devices, num_layers)
-        experts_per_device_layer = torch.sum(placement_pattern, dim=2, dtype=torch.long)
-
-        # 4. 计算每层内，设备专家数量的前缀和 (cumulative sum across devices)
-        # cumulative_experts_per_layer shape: (num_devices, num_layers)
-        # cumulative_experts_per_layer[d, l] = sum(experts on devices 0 to d in layer l)
-        cumulative_experts_per_layer = torch.cumsum(experts_per_device_layer, dim=0)
-
-        # 5. 计算每个设备在每层的偏移量
-        # 偏移量是其前面所有设备在该层上的专家总数
-        # device_offset_layer shape: (num_devices, num_layers)
-        device_offset_layer = torch.zeros_like(cumulative_experts_per_layer)
-        # 将前缀和向下移动一位，设备 d 的偏移量等于设备 d-1 的前缀和
-        device_offset_layer[1:, :] = cumulative_experts_per_layer[:-1, :]
-        # 将偏移量扩展维度以进行广播
-        # device_offset_layer shape: (num_devices, num_layers, 1) -> broadcast to (num_devices, num_layers, num_epids)
-        device_offset_layer = device_offset_layer.unsqueeze(2)
-        # --- 结束新增部分 ---
-
-        # 6. 计算所有位置的潜在全局索引 (使用新的层级偏移量)
-        # potential_global_indices shape: (num_devices, num_layers, num_epids)
-        potential_global_indices = device_offset_layer + local_indices
+        potential_global_indices = self._potential_global_indices(with_global_offset=False)
 
         # 7. 创建全局掩码 (哪些位置实际有专家)
         # mask_all shape: (num_devices, num_layers, num_epids)
@@ -242,6 +180,38 @@ class  HEAT_ExpertsBalancer(Optimizer):
             - torch.Tensor: 形状为 (num_layers, num_epids) 的张量，存储每个 expert 的唯一索引，或 -1。
         """
 
+        potential_global_indices = self._potential_global_indices(with_global_offset=True)
+
+        # 7. 创建全局掩码 (哪些位置实际有专家)
+        # mask_all shape: (num_devices, num_layers, num_epids)
+        mask_all = expert_mappingX == 1
+
+        # 8. 初始化结果张量（使用一个中间态，形状与 potential_global_indices 相同）
+        # 用 -1 填充，这样在后续取 max 时，没有专家的位置会保持 -1
+        global_indices_masked = torch.full_like(potential_global_indices, -1, dtype=torch.long)
+
+        # 9. 使用掩码，只在专家存在的位置填充计算出的全局索引
+        global_indices_masked[mask_all] = potential_global_indices[mask_all]
+
+        # 10. 沿着设备维度 (dim=0) 取最大值进行降维
+        # 假设每个 (layer, epid) 最多只有一个设备拥有该专家。
+        # 如果没有任何设备拥有该专家，max(-1, -1, ...) 结果是 -1。
+        # expert_position shape: (num_layers, num_epids)
+        # torch.max 返回 (values, indices)，我们只需要 values
+        expert_position = torch.max(global_indices_masked, dim=0)[0]
+
+        return expert_position.to(torch.int32)
+
+    def _potential_global_indices(self, with_global_offset):
+        """
+        计算所有位置的潜在全局索引：设备在层内的偏移量 + 专家在设备内的本地序号。
+
+        Args:
+            with_global_offset (bool): 为 True 时每个设备的偏移量使用其在所有层中的最大专家数。
+
+        Returns:
+            - torch.Tensor: 形状为 (num_devices, num_layers, num_epids) 的张量。
+        """
         placement_pattern = self.placement_pattern
         # 1. 计算本地累积和 (沿最后一个维度，即 num_epids)
         #    这决定了专家在其所在设备和层内的本地序号 (1-based)
@@ -253,16 +223,22 @@ class  HEAT_ExpertsBalancer(Optimizer):
         local_indices = cumsum_local - 1
 
         # --- 新增：计算层级设备偏移量 ---
-        # 3. 计算每个设备在每层实际拥有的专家数量, 使用全局最大的作为offset
-        # experts_per_device_layer shape: (num_devices, num_layers)
-        # 先按原来的方式计算每个设备每层的专家数量
-        experts_per_device_layer_original = torch.sum(placement_pattern, dim=2, dtype=torch.long)
+        if not with_global_offset:
+            # 3. 计算每个设备在每层实际拥有的专家数量
+            # experts_per_device_layer shape: (num_devices, num_layers)
+            experts_per_device_layer = torch.sum(placement_pattern, dim=2, dtype=torch.long)
+        else:
+            # 3. 计算每个设备在每层实际拥有的专家数量, 使用全局最大的作为offset
+            # experts_per_device_layer shape: (num_devices, num_layers)
+            # 先按原来的方式计算每个设备每层的专家数量
+            experts_per_device_layer_original = torch.sum(placement_pattern, dim=2, dtype=torch.long)
 
-        # 在num_layers维度上取最大值，确保每个设备在所有层中使用相同数量的专家
-        experts_per_device_max = torch.max(experts_per_device_layer_original, dim=1, keepdim=True)[0]
+            # 在num_layers维度上取最大值，确保每个设备在所有层中使用相同数量的专家
+            experts_per_device_max = torch.max(experts_per_device_layer_original, dim=1, keepdim=True)[0]
+
+            # 将最大值复制到每一层，形成最终的experts_per_device_layer
+            experts_per_device_layer = experts_per_device_max.expand_as(experts_per_device_layer_original)
 
-        # 将最大值复制到每一层，形成最终的experts_per_device_layer
-        experts_per_device_layer = experts_per_device_max.expand_as(experts_per_device_layer_original)
         # 4. 计算每层内，设备专家数量的前缀和 (cumulative sum across devices)
         # cumulative_experts_per_layer shape: (num_devices, num_layers)
         # cumulative_experts_per_layer[d, l] = sum(experts on devices 0 to d in layer l)
@@ -283,23 +259,4 @@ class  HEAT_ExpertsBalancer(Optimizer):
         # potential_global_indices shape: (num_devices, num_layers, num_epids)
         potential_global_indices = device_offset_layer + local_indices
 
-        # 7. 创建全局掩码 (哪些位置实际有专家)
-        # mask_all shape: (num_devices, num_layers, num_epids)
-        mask_all = expert_mappingX == 1
-
-        # 8. 初始化结果张量（使用一个中间态，形状与 potential_global_indices 相同）
-        # 用 -1 填充，这样在后续取 max 时，没有专家的位置会保持 -1
-        global_indices_masked = torch.full_like(potential_global_indices, -1, dtype=torch.long)
-
-        # 9. 使用掩码，只在专家存在的位置填充计算出的全局索引
-        global_indices_masked[mask_all] = potential_global_indices[mask_all]
-
-        # 10. 沿着设备维度 (dim=0) 取最大值进行降维
-        # 假设每个 (layer, epid) 最多只有一个设备拥有该专家。
-        # 如果没有任何设备拥有该专家，max(-1, -1, ...) 结果是 -1。
-        # expert_position shape: (num_layers, num_epids)
-        # torch.max 返回 (values, indices)，我们只需要 values
-        expert_position = torch.max(global_indices_masked, dim=0)[0]
-
-        return expert_position.to(torch.int32)
-
+        return potential_global_indices
@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""
+Rank-modulo replica selection of HEAT_ExpertsBalancer, with tensor ops only.
+
+For every (layer, expert), a rank routes its tokens to its own replica if it
+has one, and otherwise to the (rank % count)-th device owning the expert, in
+ascending device order. Only torch is imported, so that the selection can be
+benchmarked on a CPU host (benchmarks/placement/bench_heat_mapping.py).
+"""
+
+import torch
+
+
+def replica_owner_table(placement_pattern):
+    """
+    按设备升序列出每个 expert 的副本所在设备。
+
+    Args:
+        placement_pattern (torch.Tensor): 形状为 (num_devices, num_layers, num_epids) 的 0/1 张量。
+
+    Returns:
+        - owners (torch.Tensor): 形状为 (max_count, num_layers, num_epids)，owners[k, l, e] 是
+          拥有 (l, e) 的第 k 个设备，不存在时为 0。
+        - expert_counts (torch.Tensor): 形状为 (num_layers, num_epids)，每个 expert 的副本数。
+    """
+    pattern = placement_pattern == 1
+    expert_counts = torch.sum(pattern, dim=0, dtype=torch.long)
+    max_count = max(int(expert_counts.max().item()), 1) if expert_counts.numel() > 0 else 1
+
+    # 副本在拥有者中的序号 (0-based)，由设备维度上的累积和得到
+    ordinal = torch.cumsum(pattern, dim=0, dtype=torch.long) - 1
+    devices, layers, epids = torch.nonzero(pattern, as_tuple=True)
+    owners = torch.zeros((max_count, *expert_counts.shape), dtype=torch.long, device=placement_pattern.device)
+    owners[ordinal[devices, layers, epids], layers, epids] = devices
+    return owners, expert_counts
+
+
+def select_replica_devices(placement_pattern, ranks, owner_table=None):
+    """
+    每个 rank 对每个 (layer, expert) 选择的设备：本 rank 拥有该 expert 时为本 rank，
+    否则为拥有者中的第 rank % count 个。
+
+    Args:
+        placement_pattern (torch.Tensor): 形状为 (num_devices, num_layers, num_epids) 的 0/1 张量。
+        ranks (Sequence[int] | torch.Tensor): 需要计算的 rank。
+        owner_table: 可选，复用 replica_owner_table(placement_pattern) 的结果。
+
+    Returns:
+        - torch.Tensor: 形状为 (len(ranks), num_layers, num_epids) 的 long 张量，没有副本的 expert 为 -1。
+    """
+    owners, expert_counts = owner_table if owner_table is not None else replica_owner_table(placement_pattern)
+    ranks = torch.as_tensor(ranks, dtype=torch.long, device=placement_pattern.device).reshape(-1, 1, 1)
+
+    target_in_group = ranks % expert_counts.clamp(min=1)
+    target_devices = torch.gather(owners, 0, target_in_group)
+    own_replica = placement_pattern[ranks.flatten()] == 1
+    selected = torch.where(own_replica, ranks, target_devices)
+    return torch.where(expert_counts > 0, selected, torch.full_like(selected, -1))
+
+
+def replica_placement_pattern(placement_pattern, rank, owner_table=None):
+    """
+    rank 的 placement_pattern_super：每个 (layer, expert) 在所选设备处为 1，其余为 0。
+
+    Returns:
+        - torch.Tensor: 形状为 (num_devices, num_layers, num_epids) 的 int 张量。
+    """
+    selected = select_replica_devices(placement_pattern, [rank], owner_table)
+    placement_pattern_super = torch.zeros_like(placement_pattern, dtype=torch.int)
+    placement_pattern_super.scatter_(0, selected.clamp(min=0), (selected >= 0).to(torch.int))
+    return placement_pattern_super
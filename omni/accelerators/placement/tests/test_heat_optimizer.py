@@ -332,6 +332,70 @@ class TestTokenBalance(unittest.TestCase):
                             "Optimizer_DEVSPEC 的 local_expert_mapping 初始化不正确")
 
 
+def _loop_placement_pattern_super(placement_pattern, rank):
+    """逐个 (layer, expert) 循环的原始实现，作为向量化版本的参照"""
+    expert_counts = torch.sum(placement_pattern, dim=0, dtype=torch.int)
+    placement_pattern_super = torch.zeros_like(placement_pattern, dtype=torch.int)
+    placement_pattern_super = torch.where((expert_counts == 1).unsqueeze(0), placement_pattern, placement_pattern_super)
+    multi_device_mask = (expert_counts >= 2)
+    placement_pattern_super[rank, (placement_pattern[rank] == 1) & multi_device_mask] = 1
+    l_indices, e_indices = torch.where((~(placement_pattern[rank] == 1)) & multi_device_mask)
+    for layer_idx, expert_idx in zip(l_indices.tolist(), e_indices.tolist()):
+        sorted_devices = torch.sort(torch.where(placement_pattern[:, layer_idx, expert_idx] == 1)[0])[0]
+        count = int(expert_counts[layer_idx, expert_idx])
+        placement_pattern_super[sorted_devices[rank % count], layer_idx, expert_idx] = 1
+    return placement_pattern_super
+
+
+class TestHeatReplicaSelection(unittest.TestCase):
+    def setUp(self):
+        path = _convert_pattern_path('./patterns/DSV3_0427_GSM8K_decode_RedFullLays_+10_58_MoELayers_32_dies_epmaxdeploy_12.npy')
+        self.real_pattern = torch.tensor(np.load(path).astype(np.int32), dtype=torch.int64, device=device)
+        generator = torch.Generator().manual_seed(0)
+        # 每个 expert 的副本数为 0 到 num_devices 不等
+        self.random_pattern = (torch.rand((6, 3, 16), generator=generator)
+                               < torch.rand((1, 3, 16), generator=generator)).to(torch.int64)
+
+    def _make_optimizer(self, placement_pattern, rank, is_global_maximum_offset=False):
+        _, num_layers, num_epids = placement_pattern.shape
+        cluster_status = MagicMock()
+        cluster_status.placement_pattern = placement_pattern
+        cluster_status.expert_mapping.local_expert_mapping = torch.zeros((num_layers, num_epids), dtype=torch.int32)
+        return HEAT_ExpertsBalancer(cluster_status, rank=rank, is_global_maximum_offset=is_global_maximum_offset)
+
+    def test_placement_pattern_super_matches_loop(self):
+        for placement_pattern in (self.real_pattern, self.random_pattern):
+            num_devices = placement_pattern.shape[0]
+            # 循环版本较慢，真实 pattern 只抽查部分 rank
+            ranks = range(num_devices) if num_devices <= 8 else (0, 1, num_devices // 2, num_devices - 1)
+            for rank in ranks:
+                optimizer = self._make_optimizer(placement_pattern, rank)
+                expected = _loop_placement_pattern_super(placement_pattern, rank)
+                self.assertTrue(torch.equal(optimizer.placement_pattern_super, expected),
+                                f"rank {rank} 的 placement_pattern_super 与循环版本不一致")
+                self.assertTrue(torch.equal(
+                    optimizer.expert_mapping_,
+                    optimizer._construct_expert_mapping_from_placement_pattern(expected)))
+
+    def test_all_ranks_mapping_matches_per_rank(self):
+        for is_global_maximum_offset in (False, True):
+            for placement_pattern in (self.real_pattern, self.random_pattern):
+                optimizer = self._make_optimizer(placement_pattern, 0, is_global_maximum_offset)
+                all_ranks = optimizer.build_expert_mappings_all_ranks()
+                self.assertEqual(all_ranks.shape, (placement_pattern.shape[0], *placement_pattern.shape[1:]))
+                self.assertIs(optimizer.build_expert_mappings_all_ranks(), all_ranks, "所有 rank 的结果应被缓存")
+                for rank in range(placement_pattern.shape[0]):
+                    per_rank = self._make_optimizer(placement_pattern, rank, is_global_maximum_offset)
+                    self.assertTrue(torch.equal(optimizer.expert_mapping_for_rank(rank), per_rank.expert_mapping_),
+                                    f"rank {rank} 的 expert_mapping_ 与单独计算的结果不一致")
+
+    def test_expert_without_replica_maps_to_minus_one(self):
+        placement_pattern = self.random_pattern.clone()
+        placement_pattern[:, 0, 0] = 0
+        optimizer = self._make_optimizer(placement_pattern, 1)
+        self.assertEqual(int(optimizer.expert_mapping_[0, 0]), -1)
+        self.assertTrue(torch.all(optimizer.build_expert_mappings_all_ranks()[:, 0, 0] == -1))
+
 
 if __name__ == "__main__":
     unittest.main()
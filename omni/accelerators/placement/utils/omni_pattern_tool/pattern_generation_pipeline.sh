@@ -55,6 +55,10 @@ PATTERN_MODE="all"
 COLLECTING_MODES="decode"
 # RECORDSTEP_RANGE: Range of recordstep or step values in the format 'start:end'. Can be empty.
 RECORDSTEP_RANGE=""
+# NUM_WORKERS: Processes ingesting the log files in bulk in log mode. Defaults to 0 (line-by-line parsing).
+NUM_WORKERS=0
+# LOCAL_SEARCH_ITERATIONS: Local search moves refining the greedy placement of every optimized layer. Defaults to 0 (greedy only).
+LOCAL_SEARCH_ITERATIONS=0
 
 # Function to display usage
 # This function prints the usage information and available options of the script, then exits with status code 1.
@@ -83,6 +87,8 @@ usage() {
     echo "  --pattern_mode <rearrange|redundant|all>        Pattern generation mode"
     echo "  --collecting_modes <prefill|decode|all>         Data collecting modes"
     echo "  --recordstep_range <start:end>                  Range of recordstep or step values (e.g., 400:500)"
+    echo "  --num_workers <num_workers>                     Processes ingesting log files in bulk (log mode, 0: line by line)"
+    echo "  --local_search_iterations <iterations>          Local search moves refining the greedy placement (0: greedy only)"
     echo "  -h, --help                                      Display this help message"
     echo "Example: $0 --input_log_files \"log-1.log\" \"log-2.log\" --input_mode log --num_ranks_of_collecting_data 64 --recordstep_range 400:500"
     echo "Example: $0 --input_txt_folders \"./decode\" \"./activation_datas\" --input_mode txt --pattern_mode all --recordstep_range 400:500"
@@ -94,7 +100,7 @@ usage() {
 # It uses GNU getopt to handle long and short options. If an argument is provided, it resets the corresponding default value.
 # If the argument parsing fails, it prints an error message and exits with status code 1.
 parse_arguments() {
-    TEMP=$(getopt -o h --long input_log_files:,input_txt_folders:,input_mode:,topk_id_count_dir:,placement_pattern_dir:,placement_pattern_view_dir:,placement_pattern_analysis_dir:,output_csv:,num_layers:,num_ranks_of_collecting_data:,num_positions_of_routed_experts:,num_ranks_target_pattern:,num_redundant_layers:,expert_redundant_limit:,num_layers_target_pattern:,num_eps_target_pattern:,dataset_name:,output_file_prefix:,pattern_mode:,collecting_modes:,recordstep_range:,help -n "$0" -- "$@")
+    TEMP=$(getopt -o h --long input_log_files:,input_txt_folders:,input_mode:,topk_id_count_dir:,placement_pattern_dir:,placement_pattern_view_dir:,placement_pattern_analysis_dir:,output_csv:,num_layers:,num_ranks_of_collecting_data:,num_positions_of_routed_experts:,num_ranks_target_pattern:,num_redundant_layers:,expert_redundant_limit:,num_layers_target_pattern:,num_eps_target_pattern:,dataset_name:,output_file_prefix:,pattern_mode:,collecting_modes:,recordstep_range:,num_workers:,local_search_iterations:,help -n "$0" -- "$@")
     if [ $? != 0 ]; then echo "Error: Failed to parse arguments!" >&2; exit 1; fi
     eval set -- "$TEMP"
 
@@ -150,6 +156,8 @@ parse_arguments() {
             --pattern_mode) PATTERN_MODE="$2"; shift 2 ;;
             --collecting_modes) COLLECTING_MODES="$2"; shift 2 ;;
             --recordstep_range) RECORDSTEP_RANGE="$2"; shift 2 ;;
+            --num_workers) NUM_WORKERS="$2"; shift 2 ;;
+            --local_search_iterations) LOCAL_SEARCH_ITERATIONS="$2"; shift 2 ;;
             -h|--help) usage ;;
             --) shift; break ;;
             *) echo "Error: Unknown parameter: $1" >&2; usage ;;
@@ -214,6 +222,18 @@ validate_inputs() {
         exit 1
     fi
 
+    # Validate num_workers
+    if ! [[ "$NUM_WORKERS" =~ ^[0-9]+$ ]]; then
+        echo "Error: num_workers must be a non-negative integer." >&2
+        exit 1
+    fi
+
+    # Validate local_search_iterations
+    if ! [[ "$LOCAL_SEARCH_ITERATIONS" =~ ^[0-9]+$ ]]; then
+        echo "Error: local_search_iterations must be a non-negative integer." >&2
+        exit 1
+    fi
+
     # Validate recordstep_range
     if [[ -n "$RECORDSTEP_RANGE" ]]; then
         if ! echo "$RECORDSTEP_RANGE" | grep -qE '^[0-9]+:[0-9]+$'; then
@@ -285,6 +305,8 @@ print_parameters() {
     echo "Pattern mode: $PATTERN_MODE"
     echo "Data collecting modes: $COLLECTING_MODES"
     echo "Recordstep range: ${RECORDSTEP_RANGE:-'all steps'}"
+    echo "Log ingestion workers: $NUM_WORKERS"
+    echo "Local search iterations: $LOCAL_SEARCH_ITERATIONS"
 }
 
 # Function to run the pipeline
@@ -313,6 +335,8 @@ run_pipeline() {
         --pattern_mode "$PATTERN_MODE" \
         --collecting_modes "$COLLECTING_MODES" \
         --recordstep_range "$RECORDSTEP_RANGE" \
+        --num_workers "$NUM_WORKERS" \
+        --local_search_iterations "$LOCAL_SEARCH_ITERATIONS" \
         --timestamp "$TIMESTAMP"  
 
     if [[ $? -eq 0 ]]; then
@@ -9,7 +9,7 @@ import numpy as np
 from datetime import datetime
 from pathlib import Path
 
-from step_1_generate_csv_with_ceiling import generate_csv
+from step_1_generate_csv_with_ceiling import generate_csv, activation_counts_npy_path
 from step_2_placement_pattern_generation import process_expert_deployments
 from step_3_placement_pattern_checking_and_plot import test_expert_mapping, view_patterns
 from step_4_load_analysis_and_plot import analyze_and_plot_deployments
@@ -80,6 +80,10 @@ def main():
                         help='Range of recordstep or step values to process (format: start:end, e.g., 400:500)')
     parser.add_argument('--timestamp', type=str, default=None,
                         help='Unified timestamp for file naming (format: YYYYMMDD_HHMMSS)')
+    parser.add_argument('--local_search_iterations', type=int, default=0,
+                        help='Local search moves refining the greedy placement of every optimized layer (0: greedy only)')
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help='Processes ingesting the log files in bulk when input_mode="log" (0: parse line by line)')
 
     args = parser.parse_args()
     if args.recordstep_range == "":
@@ -140,11 +144,14 @@ def main():
         num_positions_of_routed_experts=args.num_positions_of_routed_experts,
         collecting_modes=args.collecting_modes,
         log_timestamp=timestamp,
-        recordstep_range=args.recordstep_range
+        recordstep_range=args.recordstep_range,
+        num_workers=args.num_workers
     )
     
     output_csv_path = Path(args.topk_id_count_dir) / args.output_csv
     output_csv_path = str(output_csv_path)
+    # Steps 2 and 4 read the counts from the .npy intermediate instead of re-parsing the CSV
+    activation_counts_path = activation_counts_npy_path(output_csv_path)
 
     pp_path_lis = []
     ppname_lis = ['Baseline']
@@ -164,7 +171,7 @@ def main():
 
             print(f"Step 2: Generating placement pattern for num_special_layers={num_red_layers}, mode={mode}, saving to {output_path}")
             process_expert_deployments(
-                input_file=output_csv_path,
+                input_file=activation_counts_path,
                 output_dir=os.path.normpath(args.placement_pattern_dir),
                 num_ranks_target_pattern=args.num_ranks_target_pattern,
                 num_special_layers=num_red_layers,
@@ -175,7 +182,8 @@ def main():
                 is_redundant=is_redundant,
                 collecting_modes=args.collecting_modes,
                 log_timestamp=timestamp,
-                recordstep_range=args.recordstep_range
+                recordstep_range=args.recordstep_range,
+                local_search_iterations=args.local_search_iterations
             )
 
     for pp_path, ppname in zip(pp_path_lis, ppname_lis[1:]):
@@ -192,7 +200,7 @@ def main():
 
     print(f"Step 4: Analyzing and plotting load distributions")
     analyze_and_plot_deployments(
-        load_file=output_csv_path,
+        load_file=activation_counts_path,
         pp_path_lis=pp_path_lis,
         ppname_lis=ppname_lis,
         fig_save_path=os.path.normpath(args.placement_pattern_analysis_dir),
@@ -10,9 +10,11 @@ import glob
 import numpy as np
 import math
 import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import logging
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 # Configure font to support Chinese characters
 try:
@@ -26,6 +28,14 @@ except ImportError:
 LOG_PATTERN = re.compile(
     r'\[dump activation\] (prefill|decode) step (\d+) in rank (\d+) for layer (\d+) get (\d+) experts data: ([\d\s]+)'
 )
+# LOG_PATTERN applied to every line of a block of lines prefixed with '\n' (bulk ingestion):
+# leading whitespace is skipped like line.strip() and the expert data stops at the end of the line.
+# Starting with the literal '\n' instead of a multi-line '^' lets the regex engine jump between lines
+LOG_PATTERN_MULTILINE = re.compile(
+    r'\n[^\S\n]*\[dump activation\] (prefill|decode) step (\d+) in rank (\d+) for layer (\d+) get (\d+) experts data: ([\d \t\r\f\v]+)'
+)
+# Size of the blocks of lines parsed at once by the bulk ingestion
+LOG_CHUNK_CHARS = 64 * 1024 * 1024
 
 def parse_recordstep_range(recordstep_range: Optional[str]) -> Optional[Tuple[int, int]]:
     """Parse recordstep_range parameter (format: start:end)."""
@@ -86,6 +96,21 @@ def validate_inputs(
     
     parse_recordstep_range(recordstep_range)  # Validate recordstep_range format
 
+def activation_counts_npy_path(csv_path: str) -> str:
+    """Path of the .npy intermediate written by generate_csv next to its CSV."""
+    return os.path.splitext(csv_path)[0] + '.npy'
+
+def load_activation_counts(input_file: str) -> np.ndarray:
+    """
+    Load the (num_layers, num_positions_of_routed_experts) activation counts generated by step 1,
+    from the .npy intermediate or from the CSV.
+    The .npy intermediate is returned as a read-only integer memmap, so that callers only read the
+    rows they use; the CSV is parsed into float64 by np.genfromtxt. Both hold the same counts.
+    """
+    if input_file.endswith('.npy'):
+        return np.load(input_file, mmap_mode='r')
+    return np.genfromtxt(input_file, delimiter=',', skip_header=1)[:, 1:]
+
 def process_log_line(
     line: str,
     valid_modes: set,
@@ -191,6 +216,120 @@ def process_log_file(
     logger.error(f"Unable to read {log_file}, all encodings failed")
     raise ValueError(f"Unable to read {log_file}")
 
+def parse_log_chunk(
+    text: str,
+    valid_modes: set,
+    num_ranks_of_collecting_data: int,
+    num_layers: int,
+    numbers_per_rank: int,
+    csv_data: np.ndarray,
+    step_range: Optional[Tuple[int, int]],
+    skipped: Counter
+) -> int:
+    """
+    Bulk version of process_log_line for a block of lines: the matching lines are
+    filtered and accumulated into csv_data with numpy. Invalid lines are counted
+    per reason in `skipped` instead of being logged one by one.
+    """
+    matches = LOG_PATTERN_MULTILINE.findall('\n' + text)
+    if not matches:
+        return 0
+    modes, steps, rank_ids, layer_ids, expert_counts, expert_data = zip(*matches)
+    steps = np.array(steps, dtype=np.int64)
+    rank_ids = np.array(rank_ids, dtype=np.int64)
+    layer_ids = np.array(layer_ids, dtype=np.int64)
+    expert_counts = np.array(expert_counts, dtype=np.int64)
+
+    # Mode and step filters are silent, like in process_log_line
+    valid = np.isin(np.array(modes), list(valid_modes))
+    if step_range:
+        valid &= (step_range[0] <= steps) & (steps <= step_range[1])
+
+    checks = [
+        ('rank_id out of range', (rank_ids >= 0) & (rank_ids < num_ranks_of_collecting_data)),
+        ('layer_id out of range', (layer_ids >= 0) & (layer_ids < num_layers)),
+        ('expert count does not match data count',
+         np.fromiter((len(data.split()) for data in expert_data), dtype=np.int64, count=len(expert_data)) == expert_counts),
+        ('expert count does not equal the number of experts per rank', expert_counts == numbers_per_rank),
+    ]
+    for reason, passed in checks:
+        skipped[reason] += int(np.count_nonzero(valid & ~passed))
+        valid &= passed
+
+    rows = np.flatnonzero(valid)
+    if len(rows) == 0:
+        return 0
+    values = np.array(' '.join(expert_data[i] for i in rows).split(), dtype=np.int64)
+    values = np.ceil(values.reshape(len(rows), numbers_per_rank) / 128).astype(csv_data.dtype)
+    np.add.at(csv_data.reshape(num_layers, num_ranks_of_collecting_data, numbers_per_rank),
+              (layer_ids[rows], rank_ids[rows]), values)
+    return len(rows)
+
+def ingest_log_file(
+    log_file: str,
+    valid_modes: set,
+    num_ranks_of_collecting_data: int,
+    num_layers: int,
+    numbers_per_rank: int,
+    step_range: Optional[Tuple[int, int]]
+) -> Tuple[np.ndarray, int, int, Dict[str, int]]:
+    """
+    Streaming, bulk version of process_log_file, run in a worker process.
+    The file is read in blocks of LOG_CHUNK_CHARS characters, each parsed by parse_log_chunk.
+
+    Returns:
+        The (num_layers, num_ranks_of_collecting_data * numbers_per_rank) counts of the file,
+        the number of valid data lines, the number of lines and the skipped lines per reason
+    """
+    for encoding in ['utf-8', 'gbk']:
+        csv_data = np.zeros((num_layers, num_ranks_of_collecting_data * numbers_per_rank), dtype=int)
+        skipped = Counter()
+        processed_lines = 0
+        line_count = 0
+        try:
+            with open(log_file, 'r', encoding=encoding) as f:
+                while True:
+                    lines = f.readlines(LOG_CHUNK_CHARS)
+                    if not lines:
+                        break
+                    line_count += len(lines)
+                    processed_lines += parse_log_chunk(
+                        ''.join(lines), valid_modes, num_ranks_of_collecting_data, num_layers,
+                        numbers_per_rank, csv_data, step_range, skipped
+                    )
+            return csv_data, processed_lines, line_count, dict(skipped)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"Unable to read {log_file}")
+
+def ingest_log_files(
+    input_log_files: List[str],
+    valid_modes: set,
+    num_ranks_of_collecting_data: int,
+    num_layers: int,
+    numbers_per_rank: int,
+    csv_data: np.ndarray,
+    step_range: Optional[Tuple[int, int]],
+    num_workers: int
+) -> int:
+    """Ingest the log files with ingest_log_file on a pool of num_workers processes and add them into csv_data."""
+    total_processed_lines = 0
+    with ProcessPoolExecutor(max_workers=min(num_workers, len(input_log_files))) as executor:
+        futures = [
+            executor.submit(ingest_log_file, log_file, valid_modes, num_ranks_of_collecting_data,
+                            num_layers, numbers_per_rank, step_range)
+            for log_file in input_log_files
+        ]
+        for log_file, future in zip(input_log_files, futures):
+            file_data, processed_lines, line_count, skipped = future.result()
+            csv_data += file_data
+            total_processed_lines += processed_lines
+            for reason, count in skipped.items():
+                if count:
+                    logger.warning(f"Skipped {count} lines of {log_file}: {reason}")
+            logger.info(f"Finished processing log file {log_file}, total lines: {line_count}, valid data lines: {processed_lines}")
+    return total_processed_lines
+
 def process_txt_file(
     txt_file: str,
     num_layers: int,
@@ -234,7 +373,8 @@ def generate_csv(
     num_ranks_of_collecting_data: Optional[int] = None,
     num_positions_of_routed_experts: int = 256,
     log_timestamp: Optional[str] = None,
-    recordstep_range: Optional[str] = None
+    recordstep_range: Optional[str] = None,
+    num_workers: int = 0
 ) -> str:
     """
     Extract activation data from input files and generate a summarized CSV file.
@@ -251,6 +391,12 @@ def generate_csv(
         num_positions_of_routed_experts: Number of routed expert positions
         log_timestamp: Timestamp for log file naming (optional)
         recordstep_range: Range of recordstep or step values to process (format: start:end, optional)
+        num_workers: Log mode only. 0 parses the logs line by line in this process; N > 0 ingests them
+            in bulk with numpy on a pool of N processes, one file per task, and logs the skipped lines
+            per reason instead of one by one
+
+    The counts are also saved as a .npy file next to the CSV (see activation_counts_npy_path),
+    which steps 2 to 4 can read instead of re-parsing the CSV.
 
     Returns:
         Path to the generated CSV file
@@ -307,13 +453,20 @@ def generate_csv(
 
     if input_mode == 'log':
         valid_modes = {'prefill', 'decode'} if collecting_modes == 'all' else {collecting_modes}
-        for log_file in input_log_files:
-            processed_lines = process_log_file(
-                log_file, valid_modes, num_ranks_of_collecting_data, num_layers,
-                numbers_per_rank, csv_data, step_range
+        if num_workers > 0:
+            total_processed_lines = ingest_log_files(
+                input_log_files, valid_modes, num_ranks_of_collecting_data, num_layers,
+                numbers_per_rank, csv_data, step_range, num_workers
             )
-            total_processed_lines += processed_lines
-            total_processed_files += 1
+            total_processed_files = len(input_log_files)
+        else:
+            for log_file in input_log_files:
+                processed_lines = process_log_file(
+                    log_file, valid_modes, num_ranks_of_collecting_data, num_layers,
+                    numbers_per_rank, csv_data, step_range
+                )
+                total_processed_lines += processed_lines
+                total_processed_files += 1
     else:
         filtered_txt_files = []
         for txt_folder in input_txt_folders:
@@ -375,6 +528,10 @@ def generate_csv(
         logger.error(f"Unable to write CSV file {output_csv_path}, error: {e}")
         raise
 
+    output_npy_path = activation_counts_npy_path(output_csv_path)
+    np.save(output_npy_path, csv_data)
+    logger.info(f"Activation counts saved to: {output_npy_path}")
+
     return output_csv_path
 
 if __name__ == "__main__":
@@ -11,6 +11,8 @@ from typing import List, Tuple, Union, Optional
 import logging
 from datetime import datetime
 
+from step_1_generate_csv_with_ceiling import load_activation_counts
+
 # Configure font to support Chinese characters
 try:
     import matplotlib.pyplot as plt
@@ -223,6 +225,125 @@ def distribute_experts_to_ranks(
     max_device_load = np.max(device_loads) if total_deployments > 0 else 0.0
     return max_device_load, placement_matrix
 
+def refine_placement_local_search(
+    initial_loads: Union[List[float], np.ndarray],
+    placement_matrix: np.ndarray,
+    expert_redundant_limit: int,
+    is_redundant: bool = False,
+    num_iterations: int = 5000,
+    initial_temperature: float = 0.01,
+    seed: int = 0,
+    layer_idx: int = 0
+) -> Tuple[float, np.ndarray]:
+    """
+    Improve a placement matrix by simulated annealing, minimizing the maximum rank load.
+
+    The load of a rank is the sum of load / deployments of its experts, as in step 4.
+    Every iteration changes the most loaded rank with one of two moves:
+    - swap: exchange one of its experts with an expert of another rank
+    - replica transfer (redundant mode only): replace a replica of an expert deployed at least
+      twice on another rank by a new replica of one of its experts
+    Both moves keep the number of experts of every rank, deploy every expert at least once and
+    at most 1 + expert_redundant_limit times (and on distinct ranks). A worse placement is accepted
+    with probability exp(-delta / temperature), the temperature decaying geometrically from
+    initial_temperature times the mean rank load; the best placement seen is returned.
+
+    Args:
+        initial_loads: List or numpy array of expert loads.
+        placement_matrix: (num_ranks, num_experts) 0/1 placement to start from, e.g. from distribute_experts_to_ranks.
+        expert_redundant_limit: Maximum additional deployments per expert (total = 1 + limit).
+        is_redundant: If True, deployment counts may change; if False, only swaps are done.
+        num_iterations: Number of moves tried.
+        initial_temperature: Initial temperature relative to the mean rank load, 0 for a pure descent.
+        seed: Seed of the random moves.
+        layer_idx: Layer index, for logging.
+
+    Returns:
+        Tuple of maximum device load and placement matrix.
+    """
+    logger = logging.getLogger(__name__)
+    loads_np = np.asarray(initial_loads, dtype=float)
+    placement = np.array(placement_matrix, dtype=int)
+    num_ranks, num_experts = placement.shape
+    if loads_np.shape != (num_experts,):
+        raise ValueError(f"initial_loads must have {num_experts} elements, got shape {loads_np.shape}.")
+    deployments = placement.sum(axis=0)
+    if np.any(deployments == 0):
+        raise ValueError("Every expert must be deployed at least once in the initial placement.")
+    max_deployments_per_expert = min(1 + expert_redundant_limit, num_ranks)
+    if is_redundant and np.any(deployments > max_deployments_per_expert):
+        raise ValueError(f"The initial placement deploys an expert more than {max_deployments_per_expert} times.")
+
+    rng = np.random.default_rng(seed)
+    loads_per_instance = loads_np / deployments
+    rank_loads = placement @ loads_per_instance
+
+    def objective(loads):
+        # the standard deviation breaks ties between placements with the same maximum load
+        return loads.max() + 1e-3 * loads.std()
+
+    current = objective(rank_loads)
+    initial_max_load = best_max_load = rank_loads.max()
+    best_placement = placement.copy()
+    temperature = initial_temperature * rank_loads.mean()
+    cooling = 1e-3 ** (1.0 / max(num_iterations, 1))
+
+    for _ in range(num_iterations):
+        temperature *= cooling
+        src = int(np.argmax(rank_loads))
+        src_experts = np.flatnonzero(placement[src])
+        x = int(rng.choice(src_experts))
+        dst = int(rng.integers(num_ranks - 1))
+        dst += dst >= src
+        if placement[dst, x]:
+            continue
+
+        new_loads = rank_loads.copy()
+        is_transfer = is_redundant and deployments[x] < max_deployments_per_expert and rng.random() < 0.5
+        if is_transfer:
+            # replica transfer: a replica of y on dst becomes a replica of x
+            candidates = np.flatnonzero((placement[dst] == 1) & (deployments >= 2))
+            if len(candidates) == 0:
+                continue
+            y = int(rng.choice(candidates))
+            new_x = loads_np[x] / (deployments[x] + 1)
+            new_y = loads_np[y] / (deployments[y] - 1)
+            new_loads += placement[:, x] * (new_x - loads_per_instance[x])
+            new_loads += placement[:, y] * (new_y - loads_per_instance[y])
+            new_loads[dst] += new_x - new_y
+        else:
+            # swap x on src with y on dst
+            candidates = np.flatnonzero((placement[dst] == 1) & (placement[src] == 0))
+            if len(candidates) == 0:
+                continue
+            y = int(rng.choice(candidates))
+            new_loads[src] += loads_per_instance[y] - loads_per_instance[x]
+            new_loads[dst] += loads_per_instance[x] - loads_per_instance[y]
+
+        candidate = objective(new_loads)
+        delta = candidate - current
+        if delta > 0 and (temperature <= 0 or rng.random() >= np.exp(-delta / temperature)):
+            continue
+
+        if is_transfer:
+            placement[dst, y] = 0
+            placement[dst, x] = 1
+            deployments[x] += 1
+            deployments[y] -= 1
+            loads_per_instance[x] = new_x
+            loads_per_instance[y] = new_y
+        else:
+            placement[src, x], placement[src, y] = 0, 1
+            placement[dst, y], placement[dst, x] = 0, 1
+        rank_loads, current = new_loads, candidate
+        if rank_loads.max() < best_max_load:
+            best_max_load, best_placement = rank_loads.max(), placement.copy()
+
+    # recompute the loads of the best placement, free of the rounding of the incremental updates
+    best_max_load = np.max(best_placement @ (loads_np / best_placement.sum(axis=0)))
+    logger.info(f"Layer {layer_idx}: Local search reduced the maximum rank load from {initial_max_load:.2f} to {best_max_load:.2f}")
+    return best_max_load, best_placement
+
 def process_expert_deployments(
     input_file: str,
     output_dir: str,
@@ -235,13 +356,14 @@ def process_expert_deployments(
     is_redundant: bool = False,
     collecting_modes: str = 'all',
     log_timestamp: Optional[str] = None,
-    recordstep_range: Optional[str] = None
+    recordstep_range: Optional[str] = None,
+    local_search_iterations: int = 0
 ) -> np.ndarray:
     """
     Process expert deployments and generate a placement pattern, supporting both rearrange-only and redundant modes.
 
     Args:
-        input_file: Path to input CSV file.
+        input_file: Path to input CSV file, or to the .npy intermediate written next to it by step 1.
         output_dir: Directory for output placement pattern.
         num_ranks_target_pattern: Number of target ranks.
         num_special_layers: Number of layers to apply special allocation (rearrange or redundant).
@@ -253,6 +375,8 @@ def process_expert_deployments(
         collecting_modes: Data collection mode ('prefill', 'decode', or 'all') for filename.
         log_timestamp: Timestamp for log file naming (optional).
         recordstep_range: Range of recordstep or step values (format: start:end, optional).
+        local_search_iterations: Moves of refine_placement_local_search applied to every optimized
+            (redundant or high load) layer after the greedy allocation, 0 to keep the greedy placement.
 
     Returns:
         Placement pattern as a numpy array.
@@ -276,8 +400,7 @@ def process_expert_deployments(
     if num_special_layers is None:
         num_special_layers = num_layers_target_pattern
 
-    data = np.genfromtxt(input_file, delimiter=',', skip_header=1)
-    ep_activation_counts = data[:, 1:] + 3
+    ep_activation_counts = load_activation_counts(input_file) + 3
     logger.info(f"Shape of ep_activation_counts: {ep_activation_counts.shape}")
     logger.info(f"Maximum activation counts per layer: {ep_activation_counts.max(1)}")
 
@@ -322,6 +445,16 @@ def process_expert_deployments(
                 num_ranks_target_pattern=num_ranks_target_pattern,
                 layer_idx=layer_idx_moe
             )
+            if local_search_iterations > 0:
+                max_load, placement_matrix = refine_placement_local_search(
+                    initial_loads=ep_activation_counts[layer_idx_moe],
+                    placement_matrix=placement_matrix,
+                    expert_redundant_limit=expert_redundant_limit,
+                    is_redundant=is_redundant,
+                    num_iterations=local_search_iterations,
+                    seed=layer_idx_moe,
+                    layer_idx=layer_idx_moe
+                )
             logger.info(f"Layer {layer_idx_moe}: Optimized allocation, number of deployed experts = {sum(expert_allocation_count)}")
         else:
             # Rearrange mode, non-high load layers: use sequential allocation
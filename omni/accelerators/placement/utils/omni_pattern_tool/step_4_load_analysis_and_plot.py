@@ -11,6 +11,8 @@ import seaborn as sns
 import logging
 from datetime import datetime
 
+from step_1_generate_csv_with_ceiling import load_activation_counts
+
 # Configure font to support Unicode characters for plotting
 try:
     plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS']
@@ -405,7 +407,7 @@ def analyze_and_plot_deployments(
     Analyze deployments and generate load distribution plots.
 
     Args:
-        load_file: Path to load data CSV file.
+        load_file: Path to load data CSV file, or to the .npy intermediate written next to it by step 1.
         pp_path_lis: List of placement pattern file paths.
         ppname_lis: List of pattern names.
         fig_save_path: Path to save plots.
@@ -417,10 +419,10 @@ def analyze_and_plot_deployments(
     logger.info(f"Starting deployment analysis for load file: {load_file}, patterns: {ppname_lis}")
 
     try:
-        load_array = np.genfromtxt(load_file, delimiter=',', skip_header=1)[:, 1:]
+        load_array = load_activation_counts(load_file)
         logger.info(f"Loaded load array with shape: {load_array.shape}")
     except Exception as e:
-        logger.error(f"Failed to load CSV file {load_file}: {e}")
+        logger.error(f"Failed to load activation counts {load_file}: {e}")
         raise
 
     placement_pattern_lis = []
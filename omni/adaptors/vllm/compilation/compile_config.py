@@ -10,6 +10,9 @@ from torchair import patch_for_hcom
 from vllm.config import CompilationLevel, VllmConfig
 from vllm.logger import init_logger
 
+from omni.adaptors.vllm.compilation.gear_optimizer import (DecodeBatchHistogram, decode_num_tokens,
+                                                           optimize_gears, padded_tokens)
+
 logger = init_logger(__name__)
 
 MAX_GEAR_NUM = 6
@@ -62,9 +65,22 @@ class NPUCompilationConfig:
     decode_gear_list: Optional[list[int]] = None
     """The gear size of the different static plots"""
 
+    decode_batch_histogram: Optional[Union[str, list[str]]] = None
+    """Decode batch size histograms recorded by a previous deployment (paths
+    or glob patterns). If set and decode_gear_list is not, the gears are
+    chosen to minimize the padding of the recorded batches."""
+
+    decode_batch_histogram_dump_path: Optional[str] = None
+    """Record the histogram of the decode batch sizes to this path prefix,
+    one json file per DP rank."""
+
     block_num_floating_range: int = BLOCK_NUM_FLOATING_RANGE
     """The compilation cache allows for the range of fluctuations"""
 
+    use_profile_cache: bool = False
+    """Whether to reuse the memory profiling result of a previous start with
+    the same config in eager mode, instead of running profile_run."""
+
     def build_from_cli(self, raw_graph_config: dict[str,Any], vllm_config: VllmConfig):
         """Parse the CLI value for the compilation config.
         -O1, -O2, -O3, etc. is handled in FlexibleArgumentParser.
@@ -76,7 +92,10 @@ class NPUCompilationConfig:
         self.aclgraph_capture_sizes = raw_graph_config.get("aclgraph_capture_sizes", None)
         self.use_ge_graph_cached = raw_graph_config.get("use_ge_graph_cached", False)
         self.decode_gear_list = raw_graph_config.get("decode_gear_list", None)
+        self.decode_batch_histogram = raw_graph_config.get("decode_batch_histogram", None)
+        self.decode_batch_histogram_dump_path = raw_graph_config.get("decode_batch_histogram_dump_path", None)
         self.block_num_floating_range = raw_graph_config.get("block_num_floating_range", BLOCK_NUM_FLOATING_RANGE)
+        self.use_profile_cache = raw_graph_config.get("use_profile_cache", False)
 
         if self.aclgraph_capture_sizes and not isinstance(self.aclgraph_capture_sizes, list):
             raise TypeError("aclgraph_capture_sizes must be a list")
@@ -92,7 +111,14 @@ class NPUCompilationConfig:
         max_num_reqs = vllm_config.scheduler_config.max_num_seqs
         use_spec_decode = False if not vllm_config.speculative_config else (
                     vllm_config.speculative_config.method == "deepseek_mtp")
-        max_batch_size = max_num_reqs if not use_spec_decode else max_num_reqs * 2
+        num_speculative_tokens = vllm_config.speculative_config.num_speculative_tokens if use_spec_decode else 0
+        max_batch_size = decode_num_tokens(max_num_reqs, num_speculative_tokens)
+        if self.decode_batch_histogram:
+            if self.decode_gear_list:
+                logger.warning(f"decode_gear_list {self.decode_gear_list} is set, "
+                               f"ignoring decode_batch_histogram {self.decode_batch_histogram}")
+            else:
+                self.decode_gear_list = self.select_gears_from_histogram(max_batch_size, 1 + num_speculative_tokens)
         if not self.decode_gear_list:
             self.decode_gear_list = [max_batch_size]
 
@@ -108,6 +134,20 @@ class NPUCompilationConfig:
         if len(self.decode_gear_list) < MAX_GEAR_NUM and max(self.decode_gear_list) < max_batch_size:
             self.decode_gear_list.append(max_batch_size)
 
+    def select_gears_from_histogram(self, max_batch_size: int, tokens_per_req: int = 1) -> Optional[list[int]]:
+        histogram = DecodeBatchHistogram.load(self.decode_batch_histogram)
+        if not histogram.counts:
+            logger.warning(f"decode_batch_histogram {self.decode_batch_histogram} is empty")
+            return None
+        # the histogram and the gears count tokens, whole requests of tokens_per_req tokens
+        gears = optimize_gears(histogram.counts, max_batch_size, MAX_GEAR_NUM, align=tokens_per_req)
+        num_steps = histogram.num_steps
+        logger.info(
+            f"decode_gear_list {gears} selected from {num_steps} recorded decode steps: "
+            f"{padded_tokens(histogram.counts, gears) / num_steps:.2f} padded tokens per step, "
+            f"vs {padded_tokens(histogram.counts, [max_batch_size]) / num_steps:.2f} with [{max_batch_size}]")
+        return gears
+
     def init_backend(self, vllm_config: VllmConfig) -> Union[str, Callable]:
         if self.level == CompilationLevel.NO_COMPILATION:
             raise ValueError("No compilation level is set.")
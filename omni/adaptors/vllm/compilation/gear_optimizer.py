@@ -0,0 +1,167 @@
+#
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Traffic-driven selection of the torchair decode gears.
+
+In graph mode every decode batch is padded up to the closest gear of
+`decode_gear_list`. The model runner can record the histogram of the decode
+batch sizes it pads (the DP-global maximum when DP is enabled, i.e. the value
+the gear is chosen for) with `decode_batch_histogram_dump_path`, one
+`<path>.dp<rank>.json` file per DP rank, and the next deployment can pass them
+as `decode_batch_histogram` (e.g. "<path>.dp*.json") in
+`graph_model_compile_config` to have its gears chosen by `optimize_gears`
+instead of hand-writing `decode_gear_list`.
+
+Like the gears, the recorded sizes are numbers of tokens, `decode_num_tokens`:
+a decode step with MTP computes 1 + num_speculative_tokens tokens per request.
+
+This module only depends on the standard library, so that the optimizer and
+its report (benchmarks/worker/bench_gear_selection.py) run on any CPU host.
+"""
+
+import glob
+import json
+import os
+from collections import Counter
+from typing import Iterable, Optional, Sequence, Union
+
+HISTOGRAM_SAVE_INTERVAL = 1000
+
+
+class DecodeBatchHistogram:
+    """Number of decode steps per padded batch size."""
+
+    def __init__(self, counts: Optional[dict[int, int]] = None,
+                 path: Optional[str] = None,
+                 save_interval: int = HISTOGRAM_SAVE_INTERVAL):
+        self.counts: Counter = Counter(counts or {})
+        self.path = path
+        self.save_interval = save_interval
+        self._num_unsaved = 0
+
+    @property
+    def num_steps(self) -> int:
+        return sum(self.counts.values())
+
+    def record(self, batch_size: int) -> None:
+        self.counts[int(batch_size)] += 1
+        self._num_unsaved += 1
+        if self.path and self._num_unsaved >= self.save_interval:
+            self.save()
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the histogram as json. The file is replaced atomically, so a
+        deployment killed while saving keeps the previous dump."""
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the decode batch histogram to.")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"counts": {str(k): v for k, v in sorted(self.counts.items())}}, f)
+        os.replace(tmp_path, path)
+        self._num_unsaved = 0
+
+    @classmethod
+    def load(cls, paths: Union[str, Sequence[str]]) -> "DecodeBatchHistogram":
+        """Load and merge histogram files, e.g. one per DP rank. `paths` is a
+        path, a glob pattern or a list of them."""
+        if isinstance(paths, str):
+            paths = [paths]
+        files = sorted({f for pattern in paths for f in (glob.glob(pattern) or [pattern])})
+        histogram = cls()
+        for file in files:
+            with open(file) as f:
+                counts = json.load(f)["counts"]
+            histogram.counts.update({int(k): int(v) for k, v in counts.items()})
+        return histogram
+
+
+def decode_num_tokens(num_reqs: int, num_speculative_tokens: int = 0) -> int:
+    """Tokens of a decode batch of `num_reqs` requests, what its gear is chosen for."""
+    return num_reqs * (1 + num_speculative_tokens)
+
+
+def padded_tokens(counts: dict[int, int], gears: Iterable[int]) -> int:
+    """Total padding of the decode steps of `counts` with the given gears.
+    Batches larger than the largest gear, recorded with a larger
+    `max_num_seqs`, count as unpadded."""
+    gears = sorted(set(gears))
+    total = 0
+    for size, count in counts.items():
+        gear = next((g for g in gears if g >= size), gears[-1])
+        total += count * max(gear - size, 0)
+    return total
+
+
+def optimize_gears(counts: dict[int, int], max_batch_size: int, max_gear_num: int,
+                   align: int = 1) -> list[int]:
+    """The gears minimizing `padded_tokens`, at most `max_gear_num` of them,
+    the largest being `max_batch_size` so that every batch fits a graph.
+
+    An optimal gear set only uses observed batch sizes (rounded up to a
+    multiple of `align`): moving a gear down to the largest size it serves
+    never adds padding. Sorting the k candidates, the cost of the batches
+    served by gear c_j after gear c_i is a prefix sum difference, and the
+    best set is found by an O(max_gear_num * k^2) dynamic program.
+    """
+    if max_gear_num <= 0:
+        raise ValueError(f"max_gear_num must be positive, got {max_gear_num}.")
+    if align <= 0:
+        raise ValueError(f"align must be positive, got {align}.")
+    candidates = sorted({min(-(-size // align) * align, max_batch_size)
+                         for size, count in counts.items() if size > 0 and count > 0} | {max_batch_size})
+    # count and token sum of the batches rounded up to each candidate
+    num = [0] * len(candidates)
+    tokens = [0] * len(candidates)
+    for size, count in counts.items():
+        if size <= 0 or count <= 0:
+            continue
+        size = min(size, max_batch_size)
+        j = next(j for j, c in enumerate(candidates) if c >= size)
+        num[j] += count
+        tokens[j] += count * size
+    cum_num, cum_tokens = [0], [0]
+    for n, t in zip(num, tokens):
+        cum_num.append(cum_num[-1] + n)
+        cum_tokens.append(cum_tokens[-1] + t)
+
+    def cost(i: int, j: int) -> int:
+        # padding of the batches of candidates i+1..j served by gear j
+        return candidates[j] * (cum_num[j + 1] - cum_num[i + 1]) - (cum_tokens[j + 1] - cum_tokens[i + 1])
+
+    k = len(candidates)
+    # best[j]: least padding of the batches up to candidate j with a gear at j
+    best = [cost(-1, j) for j in range(k)]
+    # prevs[g][j]: gear before j in the best set of g + 2 gears, j if fewer are better
+    prevs = []
+    for _ in range(1, min(max_gear_num, k)):
+        new_best, prev = list(best), list(range(k))
+        for j in range(k):
+            for i in range(j):
+                padding = best[i] + cost(i, j)
+                if padding < new_best[j]:
+                    new_best[j], prev[j] = padding, i
+        if new_best == best:
+            break
+        best = new_best
+        prevs.append(prev)
+
+    # backtrack from the mandatory max_batch_size gear
+    gears, j = [candidates[-1]], k - 1
+    for prev in reversed(prevs):
+        if prev[j] != j:
+            j = prev[j]
+            gears.append(candidates[j])
+    return sorted(gears)
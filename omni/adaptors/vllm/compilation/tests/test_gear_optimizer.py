@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import os
+import random
+import tempfile
+import unittest
+
+from omni.adaptors.vllm.compilation.gear_optimizer import (
+    DecodeBatchHistogram,
+    decode_num_tokens,
+    optimize_gears,
+    padded_tokens,
+)
+
+
+def closest_gear(gears, num_tokens):
+    """NPUModelRunner._get_closest_gear."""
+    return next(gear for gear in sorted(gears) if gear >= num_tokens)
+
+
+class TestOptimizeGears(unittest.TestCase):
+    def test_single_gear_is_max_batch_size(self):
+        self.assertEqual(optimize_gears({3: 10, 7: 5}, 16, 1), [16])
+
+    def test_gears_at_observed_sizes(self):
+        counts = {2: 100, 8: 100, 30: 1}
+        self.assertEqual(optimize_gears(counts, 32, 3), [2, 8, 32])
+        self.assertEqual(padded_tokens(counts, [2, 8, 32]), 2)
+
+    def test_padding_never_grows_with_more_gears(self):
+        rng = random.Random(0)
+        counts = {rng.randint(1, 64): rng.randint(1, 100) for _ in range(40)}
+        paddings = [padded_tokens(counts, optimize_gears(counts, 64, n)) for n in range(1, 7)]
+        self.assertEqual(paddings, sorted(paddings, reverse=True))
+
+    def test_mtp_batches_fit_their_gears(self):
+        # with MTP every request of a decode step computes 1 + num_speculative_tokens tokens
+        num_speculative_tokens, max_num_reqs = 1, 32
+        max_batch_size = decode_num_tokens(max_num_reqs, num_speculative_tokens)
+        rng = random.Random(0)
+        histogram = DecodeBatchHistogram()
+        num_reqs_trace = [rng.randint(1, max_num_reqs) for _ in range(1000)]
+        for num_reqs in num_reqs_trace:
+            histogram.record(decode_num_tokens(num_reqs, num_speculative_tokens))
+
+        gears = optimize_gears(histogram.counts, max_batch_size, 6, align=1 + num_speculative_tokens)
+        self.assertEqual(max(gears), max_batch_size)
+        for num_reqs in num_reqs_trace:
+            num_tokens = decode_num_tokens(num_reqs, num_speculative_tokens)
+            # graph_pad_size of NPUModelRunner._prepare_inputs
+            graph_pad_size = closest_gear(gears, num_tokens) - num_reqs * (1 + num_speculative_tokens)
+            self.assertGreaterEqual(graph_pad_size, 0)
+            self.assertEqual(graph_pad_size % (1 + num_speculative_tokens), 0)
+
+
+class TestDecodeBatchHistogram(unittest.TestCase):
+    def test_save_and_load_merges_ranks(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for dp_rank, sizes in enumerate(([2, 2, 4], [4, 6])):
+                histogram = DecodeBatchHistogram(path=os.path.join(tmp_dir, f"gears.dp{dp_rank}.json"))
+                for size in sizes:
+                    histogram.record(size)
+                histogram.save()
+            loaded = DecodeBatchHistogram.load(os.path.join(tmp_dir, "gears.dp*.json"))
+        self.assertEqual(dict(loaded.counts), {2: 2, 4: 2, 6: 1})
+        self.assertEqual(loaded.num_steps, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
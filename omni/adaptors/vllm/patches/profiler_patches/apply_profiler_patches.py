@@ -7,7 +7,8 @@ from pathlib import Path
 import logging
 import yaml
 from .prof_wrapper import (torchnpu_prof_wrapper, 
-    timer_prof_wrapper, viztracer_prof_wrapper, marker_prof_wrapper)
+    timer_prof_wrapper, viztracer_prof_wrapper, marker_prof_wrapper,
+    aggregator_prof_wrapper)
 import time
 from typing import Optional, List, Tuple
 
@@ -18,7 +19,8 @@ wrapper_dict = {
     "torchnpu": torchnpu_prof_wrapper, 
     "timer": timer_prof_wrapper, 
     "viztracer": viztracer_prof_wrapper, 
-    "marker": marker_prof_wrapper
+    "marker": marker_prof_wrapper,
+    "aggregator": aggregator_prof_wrapper
 }
 
 # Parse config from namelist, apply profiler monkey patch
@@ -31,12 +33,9 @@ def apply_patches(namelist_path: str):
             config = yaml.safe_load(f)
 
         profiler_type = config.get('type')
-        if not (profiler_type=='torchnpu' or 
-                profiler_type=='timer' or 
-                profiler_type=='viztracer' or
-                profiler_type=='marker'):
-            logger.error(f"<<<type of namelist invalid, should be one of torchnpu/timer/viztracer/marker")
-            raise RuntimeError("<<<type of namelist invalid, should be one of torchnpu/timer/viztracer/marker")
+        if profiler_type not in wrapper_dict:
+            logger.error(f"<<<type of namelist invalid, should be one of torchnpu/timer/viztracer/marker/aggregator")
+            raise RuntimeError("<<<type of namelist invalid, should be one of torchnpu/timer/viztracer/marker/aggregator")
         logger.info(f"<<<Applying {profiler_type} profiler patches from {namelist_path}")
         wrapper_method = wrapper_dict[profiler_type]
         
@@ -0,0 +1,208 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""
+In-memory latency statistics of the "aggregator" profiler (aggregator_prof_wrapper).
+
+Every thread records into its own per-method counters and log-linear
+histogram, so that the patched methods never take a lock. The statistics of
+all threads are merged when a summary is flushed: periodically by a daemon
+thread, on a signal (SIGUSR1 by default) and at exit. Each flush appends one
+json line of cumulative statistics to `<save_dir>/timer_summary_<pid>.jsonl`:
+
+    {"timestamp": ..., "pid": ..., "methods": {"Scheduler.schedule":
+        {"count": ..., "mean_ms": ..., "p50_ms": ..., "p99_ms": ..., "max_ms": ...}}}
+"""
+
+import atexit
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+# 2**SUB_BUCKET_BITS buckets per power of two of nanoseconds: percentiles are
+# exact below 2**SUB_BUCKET_BITS ns and within 1 / 2**SUB_BUCKET_BITS above.
+SUB_BUCKET_BITS = 3
+NUM_BUCKETS = 64 << SUB_BUCKET_BITS
+
+
+def bucket_index(duration_ns: int) -> int:
+    if duration_ns < (1 << SUB_BUCKET_BITS):
+        return max(duration_ns, 0)
+    exponent = duration_ns.bit_length() - SUB_BUCKET_BITS - 1
+    return ((exponent + 1) << SUB_BUCKET_BITS) + (duration_ns >> exponent) - (1 << SUB_BUCKET_BITS)
+
+
+def bucket_midpoint(index: int) -> float:
+    if index < (1 << SUB_BUCKET_BITS):
+        return float(index)
+    exponent = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = (index & ((1 << SUB_BUCKET_BITS) - 1)) + (1 << SUB_BUCKET_BITS)
+    return ((mantissa << exponent) + ((mantissa + 1) << exponent) - 1) / 2
+
+
+class MethodStats:
+    """Counters of one method in one thread, only written by that thread."""
+
+    __slots__ = ("count", "total_ns", "min_ns", "max_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.buckets = [0] * NUM_BUCKETS
+
+    def record(self, duration_ns: int) -> None:
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        self.buckets[bucket_index(duration_ns)] += 1
+
+
+class LatencyAggregator:
+    def __init__(self):
+        self._local = threading.local()
+        # (method name, MethodStats) of every thread, appended once per thread and method
+        self._all_stats = []
+        self._register_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.save_dir = None
+        self.flush_interval_s = 0.0
+        self.summary_path = None
+
+    def stats_for(self, name: str) -> MethodStats:
+        """The counters of `name` in the calling thread."""
+        stats_by_name = getattr(self._local, "stats_by_name", None)
+        if stats_by_name is None:
+            stats_by_name = self._local.stats_by_name = {}
+        stats = stats_by_name.get(name)
+        if stats is None:
+            stats = stats_by_name[name] = MethodStats()
+            with self._register_lock:
+                self._all_stats.append((name, stats))
+        return stats
+
+    def record(self, name: str, duration_ns: int) -> None:
+        self.stats_for(name).record(duration_ns)
+
+    def summary(self) -> dict:
+        """Statistics of every method, merged over the threads, in milliseconds."""
+        with self._register_lock:
+            all_stats = list(self._all_stats)
+        merged = {}
+        for name, stats in all_stats:
+            count, total_ns, min_ns, max_ns, buckets = merged.get(name, (0, 0, None, 0, [0] * NUM_BUCKETS))
+            # a snapshot of counters being written: may be off by the calls in flight
+            for index, bucket_count in enumerate(list(stats.buckets)):
+                buckets[index] += bucket_count
+            stats_min_ns = stats.min_ns
+            if min_ns is None or (stats_min_ns is not None and stats_min_ns < min_ns):
+                min_ns = stats_min_ns
+            merged[name] = (count + stats.count, total_ns + stats.total_ns, min_ns, max(max_ns, stats.max_ns),
+                            buckets)
+
+        summary = {}
+        for name, (count, total_ns, min_ns, max_ns, buckets) in sorted(merged.items()):
+            if count == 0 or min_ns is None:
+                continue
+            summary[name] = {
+                "count": count,
+                "mean_ms": total_ns / count / 1e6,
+                "p50_ms": self._percentile(buckets, 0.50, min_ns, max_ns) / 1e6,
+                "p99_ms": self._percentile(buckets, 0.99, min_ns, max_ns) / 1e6,
+                "max_ms": max_ns / 1e6,
+            }
+        return summary
+
+    @staticmethod
+    def _percentile(buckets, quantile: float, min_ns: int, max_ns: int) -> float:
+        """The midpoint of the bucket of `quantile`, clamped to the recorded [min_ns, max_ns]."""
+        rank = quantile * sum(buckets)
+        cumulative = 0
+        for index, bucket_count in enumerate(buckets):
+            cumulative += bucket_count
+            if bucket_count and cumulative >= rank:
+                return min(max(bucket_midpoint(index), min_ns), max_ns)
+        return float(max_ns)
+
+    def flush(self) -> None:
+        if self.summary_path is None:
+            return
+        line = json.dumps({"timestamp": time.time(), "pid": os.getpid(), "methods": self.summary()})
+        with self._flush_lock:
+            try:
+                with open(self.summary_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logging.error(f"<<<Failed to flush timer summary to {self.summary_path}: {e}")
+
+    def start(self, save_dir: str, flush_interval_s: float, flush_signal) -> None:
+        """Flush to `save_dir` every `flush_interval_s` seconds (never if <= 0), on `flush_signal` and at exit."""
+        self.save_dir = save_dir
+        self.flush_interval_s = flush_interval_s
+        self._start_flushing()
+        if flush_signal:
+            self._install_signal_handler(getattr(signal, flush_signal) if isinstance(flush_signal, str)
+                                         else signal.Signals(flush_signal))
+        atexit.register(self.flush)
+        # a forked worker has its own statistics, summary file and flush thread
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def _start_flushing(self) -> None:
+        os.makedirs(self.save_dir, exist_ok=True)
+        self.summary_path = os.path.join(self.save_dir, f"timer_summary_{os.getpid()}.jsonl")
+        if self.flush_interval_s > 0:
+            threading.Thread(target=self._flush_loop, args=(self.flush_interval_s,),
+                             name="timer-summary-flush", daemon=True).start()
+        logging.info(f"<<<Timer summaries of process {os.getpid()} are flushed to {self.summary_path}")
+
+    def _restart_in_child(self) -> None:
+        self._local = threading.local()
+        self._all_stats = []
+        self._register_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_flushing()
+
+    def _flush_loop(self, flush_interval_s: float) -> None:
+        while True:
+            time.sleep(flush_interval_s)
+            self.flush()
+
+    def _install_signal_handler(self, signum) -> None:
+        try:
+            previous_handler = signal.getsignal(signum)
+
+            def handler(sig, frame):
+                # the file is written by another thread, not in the signal handler
+                threading.Thread(target=self.flush, name="timer-summary-flush", daemon=True).start()
+                if callable(previous_handler):
+                    previous_handler(sig, frame)
+
+            signal.signal(signum, handler)
+        except ValueError:
+            # signal handlers can only be installed from the main thread
+            logging.warning(f"<<<Cannot install the timer summary handler of {signum} outside the main thread")
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_latency_aggregator(params) -> LatencyAggregator:
+    """The LatencyAggregator of this process, started with the base_params of the namelist on first use."""
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = LatencyAggregator()
+            _aggregator.start(
+                params.get("save_dir", "./timer_summary"),
+                float(params.get("flush_interval_s", 60)),
+                params.get("flush_signal", "SIGUSR1"),
+            )
+        return _aggregator
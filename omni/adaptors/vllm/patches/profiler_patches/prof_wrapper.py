@@ -11,6 +11,7 @@ import time
 import logging
 import uuid
 from vllm.v1.engine import EngineCoreOutputs
+from .latency_aggregator import get_latency_aggregator
 
 def execute_operation(operation_str, param_dict):
     if operation_str:
@@ -180,6 +181,50 @@ def timer_prof_wrapper(original_method, params):
             return result
         return wrapper
 
+def aggregator_prof_wrapper(original_method, params):
+    # Like the timer, without a log line per call: durations go to the per-thread
+    # histograms of the LatencyAggregator, which flushes summaries to save_dir.
+    aggregator = get_latency_aggregator(params)
+    method_name = original_method.__qualname__
+    entry_operation = params.get("entry_operation", None)
+    exit_operation = params.get("exit_operation", None)
+    has_operations = bool(entry_operation or exit_operation)
+    perf_counter_ns = time.perf_counter_ns
+    if inspect.iscoroutinefunction(original_method):
+        logging.info(f"<<<INFO: {original_method.__qualname__} is async function, use async wrapper")
+        @functools.wraps(original_method)
+        async def async_wrapper(self, *args, **kwargs):
+            if has_operations:
+                param_dict = {"self": self, "args": args, "kwargs": kwargs}
+                execute_operation(entry_operation, param_dict)
+
+            st = perf_counter_ns()
+            result = await original_method(self, *args, **kwargs)
+            aggregator.record(method_name, perf_counter_ns() - st)
+
+            if has_operations:
+                param_dict["result"]=result
+                execute_operation(exit_operation, param_dict)
+            return result
+        return async_wrapper
+    else:
+        logging.info(f"<<<INFO: {original_method.__qualname__} is sync function, use sync wrapper")
+        @functools.wraps(original_method)
+        def wrapper(self, *args, **kwargs):
+            if has_operations:
+                param_dict = {"self": self, "args": args, "kwargs": kwargs}
+                execute_operation(entry_operation, param_dict)
+
+            st = perf_counter_ns()
+            result = original_method(self, *args, **kwargs)
+            aggregator.record(method_name, perf_counter_ns() - st)
+
+            if has_operations:
+                param_dict["result"]=result
+                execute_operation(exit_operation, param_dict)
+            return result
+        return wrapper
+
 def marker_prof_wrapper(original_method, params):
     entry_operation = params.get("entry_operation", None)
     exit_operation = params.get("exit_operation", None)
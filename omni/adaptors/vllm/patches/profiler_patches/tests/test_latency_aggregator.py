@@ -0,0 +1,50 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import threading
+import unittest
+
+from omni.adaptors.vllm.patches.profiler_patches.latency_aggregator import (
+    LatencyAggregator,
+    bucket_index,
+    bucket_midpoint,
+)
+
+
+class TestLatencyAggregator(unittest.TestCase):
+    def test_bucket_midpoint_within_relative_error(self):
+        for duration_ns in (0, 7, 8, 1000, 123456789, 2**40 + 12345):
+            midpoint = bucket_midpoint(bucket_index(duration_ns))
+            self.assertLessEqual(abs(midpoint - duration_ns), duration_ns / 8 + 0.5)
+
+    def test_percentiles_within_min_and_max(self):
+        aggregator = LatencyAggregator()
+        # the midpoint of the bucket of 2**20 ns is above 2**20 ns
+        self.assertGreater(bucket_midpoint(bucket_index(2**20)), 2**20)
+        aggregator.record("step", 2**20)
+        stats = aggregator.summary()["step"]
+        self.assertEqual(stats["p50_ms"], 2**20 / 1e6)
+        self.assertEqual(stats["p99_ms"], stats["max_ms"])
+
+        for _ in range(99):
+            aggregator.record("step", 2**20 + 1)
+        stats = aggregator.summary()["step"]
+        self.assertLessEqual(stats["p99_ms"], stats["max_ms"])
+        self.assertGreaterEqual(stats["p50_ms"], 2**20 / 1e6)
+
+    def test_merge_over_threads(self):
+        aggregator = LatencyAggregator()
+        aggregator.record("step", 5000)
+        thread = threading.Thread(target=lambda: [aggregator.record("step", 100) for _ in range(3)])
+        thread.start()
+        thread.join()
+        stats = aggregator.summary()["step"]
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["max_ms"], 5000 / 1e6)
+        self.assertEqual(stats["p50_ms"], 100 / 1e6)
+        self.assertAlmostEqual(stats["p99_ms"], 5000 / 1e6, delta=5000 / 8 / 1e6)
+        self.assertLessEqual(stats["p99_ms"], stats["max_ms"])
+
+
+if __name__ == "__main__":
+    unittest.main()
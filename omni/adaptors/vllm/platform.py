@@ -255,8 +255,10 @@ class ConfigUpdater:
         if enable_omni_attn:
             from omni.accelerators.cache import apply_omni_attn_patch
             kv_transfer_config = vllm_config.kv_transfer_config
-            is_kv_consumer = kv_transfer_config is None or kv_transfer_config.kv_role == 'kv_consumer'
-            apply_omni_attn_patch(enable=True, is_kv_consumer=is_kv_consumer, config=omni_attn_config)
+            is_colocated = kv_transfer_config is None
+            is_kv_consumer = is_colocated or kv_transfer_config.kv_role == 'kv_consumer'
+            apply_omni_attn_patch(enable=True, is_kv_consumer=is_kv_consumer, config=omni_attn_config,
+                                  is_colocated=is_colocated)
 
 
 class NPUPlatform(Platform):
@@ -0,0 +1,209 @@
+#
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Admission policies of the prefill-first NpuHybridScheduler.
+
+A policy decides in which order the waiting requests are tried when a prefill
+batch is built. The scheduler then admits them in that order while they fit
+the token budget and the KV cache. Requests only need `num_tokens`,
+`num_computed_tokens` and `arrival_time`, so the policies can be driven by a
+CPU-only simulation (see benchmarks/scheduler/bench_admission_policy.py).
+"""
+
+import time
+from typing import Optional, Sequence, TypeVar
+
+R = TypeVar("R")
+
+ADMISSION_POLICIES = ("fifo", "spf", "binpack")
+
+
+def estimate_prefill_tokens(request, long_prefill_token_threshold: int = 0) -> int:
+    """Number of prefill tokens of a waiting request, ignoring prefix cache hits."""
+    num_new_tokens = request.num_tokens - request.num_computed_tokens
+    if 0 < long_prefill_token_threshold < num_new_tokens:
+        num_new_tokens = long_prefill_token_threshold
+    return num_new_tokens
+
+
+class AdmissionPolicy:
+    """Strict arrival order: the head of the queue is always tried first, and
+    admission stops at the first request that cannot be allocated."""
+
+    name = "fifo"
+    # Stop at the first allocation failure instead of trying the next request.
+    stop_on_alloc_failure = True
+
+    def __init__(self, ttft_deadline_s: float = 0.0,
+                 long_prefill_token_threshold: int = 0):
+        self.ttft_deadline_s = ttft_deadline_s
+        self.long_prefill_token_threshold = long_prefill_token_threshold
+
+    def order(self, waiting: Sequence[R], token_budget: int,
+              now: Optional[float] = None,
+              max_num_reqs: Optional[int] = None) -> list[R]:
+        """Return `waiting` in the order the requests should be tried, given
+        the token budget and the number of requests that can still run."""
+        return list(waiting)
+
+    def _split_overdue(self, waiting: Sequence[R], now: float) -> tuple[list[R], list[R]]:
+        """Split out the requests that waited longer than `ttft_deadline_s`.
+        They are admitted first, in arrival order, so that no policy starves
+        a long prompt."""
+        if self.ttft_deadline_s <= 0:
+            return [], list(waiting)
+        overdue, others = [], []
+        for request in waiting:
+            if now - request.arrival_time >= self.ttft_deadline_s:
+                overdue.append(request)
+            else:
+                others.append(request)
+        return overdue, others
+
+    def _tokens(self, request) -> int:
+        return estimate_prefill_tokens(request, self.long_prefill_token_threshold)
+
+
+class ShortestPromptFirstPolicy(AdmissionPolicy):
+    """Shortest prompt first, with aging: the priority of a request is its
+    number of prefill tokens minus `aging_tokens_per_s` for every second it has
+    waited, so long prompts eventually get ahead of a stream of short ones."""
+
+    name = "spf"
+    stop_on_alloc_failure = False
+
+    def __init__(self, aging_tokens_per_s: float = 1024.0, **kwargs):
+        super().__init__(**kwargs)
+        self.aging_tokens_per_s = aging_tokens_per_s
+
+    def order(self, waiting, token_budget, now=None, max_num_reqs=None):
+        now = time.time() if now is None else now
+        overdue, others = self._split_overdue(waiting, now)
+        # sorted() is stable, so ties keep the arrival order
+        others = sorted(
+            others,
+            key=lambda r: self._tokens(r) - self.aging_tokens_per_s * (now - r.arrival_time))
+        return overdue + others
+
+
+class BinPackingPolicy(AdmissionPolicy):
+    """Fill the token budget as tightly as possible.
+
+    Among the first `window` waiting requests, the subset whose prefill tokens
+    sum closest to the token budget, with at most as many requests as can still
+    run, is tried first, then the remaining requests in arrival order. See
+    `pack_tokens`. Among equally tight subsets, older requests are preferred.
+
+    NOTE: packing favors short prompts when the queue is long, so it is best
+    combined with `admission_ttft_deadline_s`.
+    """
+
+    name = "binpack"
+    stop_on_alloc_failure = False
+
+    def __init__(self, window: int = 64, **kwargs):
+        super().__init__(**kwargs)
+        self.window = window
+
+    def order(self, waiting, token_budget, now=None, max_num_reqs=None):
+        now = time.time() if now is None else now
+        overdue, others = self._split_overdue(waiting, now)
+        budget = token_budget - sum(self._tokens(r) for r in overdue)
+        if max_num_reqs is not None:
+            max_num_reqs -= len(overdue)
+        if budget <= 0 or not others or (max_num_reqs is not None and max_num_reqs <= 0):
+            return overdue + others
+
+        candidates = others[:self.window]
+        chosen = set(pack_tokens([self._tokens(r) for r in candidates], budget, max_num_reqs))
+        packed = [r for i, r in enumerate(candidates) if i in chosen]
+        rest = [r for i, r in enumerate(candidates) if i not in chosen]
+        return overdue + packed + rest + others[self.window:]
+
+
+def pack_tokens(sizes: Sequence[int], budget: int,
+                max_items: Optional[int] = None) -> list[int]:
+    """Indices of the subset of `sizes` with the largest sum <= `budget`,
+    made of at most `max_items` items.
+
+    The subset sum is solved exactly with python ints as bitsets: bit s of
+    `reachable[i][c]` is set if c items of sizes[:i] sum to s. This costs
+    O(len(sizes) * max_items * budget / 64) word operations; without an item
+    limit a single bitset per item is kept. Backtracking from the last item
+    skips an item whenever the target sum is reachable without it, so earlier
+    items are preferred.
+    """
+    limited = max_items is not None and max_items < len(sizes)
+    num_counts = max_items + 1 if limited else 1
+    mask = (1 << (budget + 1)) - 1
+    reachable = [[1] + [0] * (num_counts - 1)]
+    for size in sizes:
+        prev = reachable[-1]
+        if not 0 < size <= budget:
+            reachable.append(prev)
+        elif not limited:
+            reachable.append([prev[0] | ((prev[0] << size) & mask)])
+        else:
+            cur = list(prev)
+            for c in range(1, num_counts):
+                cur[c] |= (prev[c - 1] << size) & mask
+            reachable.append(cur)
+
+    # the largest sum, reached with as few items as possible
+    target, count = max((bits.bit_length() - 1, -c) for c, bits in enumerate(reachable[-1]))
+    count = -count
+    chosen = []
+    for i in range(len(sizes), 0, -1):
+        if target == 0:
+            break
+        if (reachable[i - 1][count] >> target) & 1:
+            continue
+        chosen.append(i - 1)
+        target -= sizes[i - 1]
+        if limited:
+            count -= 1
+    chosen.reverse()
+    return chosen
+
+
+def create_admission_policy(additional_config: Optional[dict],
+                            long_prefill_token_threshold: int = 0) -> AdmissionPolicy:
+    """Create the admission policy from `additional_config`:
+
+    - `admission_policy`: "fifo" (default), "spf" or "binpack"
+    - `admission_ttft_deadline_s`: requests waiting longer are admitted first,
+      in arrival order (0 disables it)
+    - `admission_aging_tokens_per_s`: aging rate of "spf"
+    - `admission_window`: number of waiting requests considered by "binpack"
+    """
+    additional_config = additional_config or {}
+    name = additional_config.get("admission_policy", "fifo")
+    kwargs = dict(
+        ttft_deadline_s=float(additional_config.get("admission_ttft_deadline_s", 0.0)),
+        long_prefill_token_threshold=long_prefill_token_threshold,
+    )
+    if name == "fifo":
+        return AdmissionPolicy(**kwargs)
+    if name == "spf":
+        return ShortestPromptFirstPolicy(
+            aging_tokens_per_s=float(additional_config.get("admission_aging_tokens_per_s", 1024.0)),
+            **kwargs)
+    if name == "binpack":
+        window = int(additional_config.get("admission_window", 64))
+        if window <= 0:
+            raise ValueError(f"admission_window must be positive, got {window}.")
+        return BinPackingPolicy(window=window, **kwargs)
+    raise ValueError(
+        f"Unknown admission_policy {name!r}, expected one of {ADMISSION_POLICIES}.")
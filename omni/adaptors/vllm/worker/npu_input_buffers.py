@@ -0,0 +1,75 @@
+#
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Persistent decode inputs of NPUModelRunner, one set per decode gear.
+
+A decode step is always padded to a gear size, so its `input_ids` and
+`positions` can live in buffers allocated once per gear and updated in place,
+instead of being concatenated with a freshly allocated zero padding every step.
+The same tensors are passed to the compiled graph of a gear on every step.
+"""
+
+from typing import Iterable, Optional
+
+import torch
+
+
+class GearInputBuffers:
+    """`input_ids` and `positions` of one gear. The padding tail past the
+    tokens of the current step is kept zero: only the part written by a
+    longer previous step is cleared."""
+
+    def __init__(self, gear: int, dtype: torch.dtype, device: torch.device):
+        self.gear = gear
+        self.input_ids = torch.zeros(gear, dtype=dtype, device=device)
+        self.positions = torch.zeros(gear, dtype=dtype, device=device)
+        self._num_input_ids = 0
+        self._num_positions = 0
+
+    def fill_input_ids(self, src: torch.Tensor) -> torch.Tensor:
+        self._num_input_ids = self._fill(self.input_ids, src, self._num_input_ids)
+        return self.input_ids
+
+    def fill_positions(self, src: torch.Tensor) -> torch.Tensor:
+        self._num_positions = self._fill(self.positions, src, self._num_positions)
+        return self.positions
+
+    def reset(self) -> None:
+        """Zero both buffers, e.g. for a dummy run."""
+        self.input_ids.zero_()
+        self.positions.zero_()
+        self._num_input_ids = 0
+        self._num_positions = 0
+
+    @staticmethod
+    def _fill(dst: torch.Tensor, src: torch.Tensor, num_prev: int) -> int:
+        num_tokens = src.shape[0]
+        if num_tokens > dst.shape[0]:
+            raise RuntimeError(f"{num_tokens} tokens do not fit in gear {dst.shape[0]}.")
+        dst[:num_tokens].copy_(src, non_blocking=True)
+        if num_tokens < num_prev:
+            dst[num_tokens:num_prev].zero_()
+        return num_tokens
+
+
+class GearBufferArena:
+    """The GearInputBuffers of every decode gear."""
+
+    def __init__(self, gears: Iterable[int], dtype: torch.dtype, device: torch.device):
+        self.buffers = {gear: GearInputBuffers(gear, dtype, device) for gear in sorted(set(gears))}
+
+    def get(self, num_padded_tokens: int) -> Optional[GearInputBuffers]:
+        """The buffers of the gear of `num_padded_tokens` tokens, if any."""
+        return self.buffers.get(num_padded_tokens)
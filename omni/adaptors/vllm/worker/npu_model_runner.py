@@ -28,7 +28,8 @@ import numpy as np
 import torch
 import torch.distributed as dist
 from vllm.config import CompilationLevel, VllmConfig
-from vllm.distributed.parallel_state import get_pp_group, get_tensor_model_parallel_world_size
+from vllm.distributed.parallel_state import (get_pp_group, get_tensor_model_parallel_rank,
+                                             get_tensor_model_parallel_world_size)
 from vllm import forward_context
 from vllm.logger import logger
 from vllm.model_executor.model_loader import get_model
@@ -48,6 +49,9 @@ from omni.models.common.layers.sampler import SimpleSampler
 from omni.adaptors.vllm.platform import NPUPlatform
 from omni.models.common.config.model_config import update_model_extra_config, model_extra_config
 from omni.adaptors.vllm.worker.npu_model_profiling import run_model_with_profiling
+from omni.adaptors.vllm.worker.npu_swap import HostKVCache, get_num_host_blocks
+from omni.adaptors.vllm.worker.npu_input_buffers import GearBufferArena
+from omni.adaptors.vllm.compilation.gear_optimizer import DecodeBatchHistogram, decode_num_tokens
 from vllm.distributed.parallel_state import get_dp_group
 from vllm.distributed.kv_transfer import (get_kv_transfer_group,
                                           has_kv_transfer_group)
@@ -173,11 +177,21 @@ class NPUModelRunner(GPUModelRunner):
         self.drafter_mark_static = False
         self.dummy_drafter_mark_static = False
 
+        # Host copy of the KV cache for swap preemption, see initialize_kv_cache.
+        self.host_kv_cache: Optional[HostKVCache] = None
+
         self.total_step = 1
         self.curr_step = 0
         self.arange_npu = torch.arange(max(self.max_num_reqs + 1, self.max_model_len, self.max_num_tokens),
                                        dtype=torch.int64,
                                        device=self.device)
+        # Decode sample indices are a prefix of it, int32 with spec tokens.
+        self.arange_npu_int32 = self.arange_npu.to(torch.int32)
+        # Persistent input_ids and positions of every decode gear.
+        self.gear_buffers = GearBufferArena(
+            list(self.decode_gear_list) + [self.max_batch_size],
+            dtype=self.input_ids.dtype,
+            device=self.device)
 
     def _init_graph_options(self):
         from vllm.utils import supports_dynamo
@@ -195,6 +209,15 @@ class NPUModelRunner(GPUModelRunner):
         update_model_extra_config(decode_gear_list=self.decode_gear_list,
                                   enable_torchair_graph_mode=self.enable_torchair_graph_mode)
 
+        # Histogram of the decode batch sizes the gears are chosen for, saved by
+        # the first TP rank of every DP rank, see compilation/gear_optimizer.py.
+        self.decode_batch_histogram: Optional[DecodeBatchHistogram] = None
+        dump_path = self.vllm_config.npu_compilation_config.decode_batch_histogram_dump_path
+        if self.enable_torchair_graph_mode and dump_path:
+            dp_rank = self.vllm_config.parallel_config.data_parallel_rank
+            self.decode_batch_histogram = DecodeBatchHistogram(
+                path=f"{dump_path}.dp{dp_rank}.json" if get_tensor_model_parallel_rank() == 0 else None)
+
     def _prepare_inputs(
         self,
         scheduler_output: "SchedulerOutput",
@@ -264,8 +287,16 @@ class NPUModelRunner(GPUModelRunner):
 
         # calculate max_batch_size and padding size
         graph_pad_size = 0
-        if self.enable_torchair_graph_mode and attn_state == AscendAttentionState.DecodeOnly and len(self.decode_gear_list) > 1:
-            self.max_batch_size = self._get_max_token_num(self.vllm_config.parallel_config.data_parallel_size > 1, num_reqs)
+        if self.enable_torchair_graph_mode and attn_state == AscendAttentionState.DecodeOnly and (
+                len(self.decode_gear_list) > 1 or self.decode_batch_histogram is not None):
+            # the gears, and so the histogram, count tokens: 1 + num_speculative_tokens per request with MTP
+            num_decode_tokens = decode_num_tokens(
+                num_reqs, self.speculative_config.num_speculative_tokens if self.use_spec_decode else 0)
+            global_num_tokens = self._get_global_batch_size(
+                self.vllm_config.parallel_config.data_parallel_size > 1, num_decode_tokens)
+            if self.decode_batch_histogram is not None:
+                self.decode_batch_histogram.record(global_num_tokens)
+            self.max_batch_size = self._get_closest_gear(global_num_tokens)
         if attn_state == AscendAttentionState.DecodeOnly:
             if num_reqs > self.max_batch_size:
                 raise RuntimeError("num_reqs is bigger than max_batch_size")
@@ -278,7 +309,13 @@ class NPUModelRunner(GPUModelRunner):
             graph_pad_size = _get_pad_size(num_input_tokens)
 
         # padding positions
-        if graph_pad_size >= 0:
+        gear_buffers = None
+        if attn_state == AscendAttentionState.DecodeOnly:
+            gear_buffers = self.gear_buffers.get(num_input_tokens + graph_pad_size)
+        if gear_buffers is not None:
+            # updated in place, the padding tail stays zero
+            positions = gear_buffers.fill_positions(positions)
+        elif graph_pad_size >= 0:
             padding_positions = torch.zeros(graph_pad_size, dtype=positions.dtype, device=positions.device)
             positions = torch.cat([positions, padding_positions])
 
@@ -330,7 +367,11 @@ class NPUModelRunner(GPUModelRunner):
         has_spec_tokens = len(
             scheduler_output.scheduled_spec_decode_tokens) > 0
 
-        if has_spec_tokens:
+        if attn_state == AscendAttentionState.DecodeOnly:
+            # Every scheduled token is sampled.
+            arange = self.arange_npu_int32 if has_spec_tokens else self.arange_npu
+            sample_indices = arange[:total_num_scheduled_tokens]
+        elif has_spec_tokens:
             # 当前仅在DecodeOnly时才可能到此逻辑
             # TODO 复用GPU ModelRunner中的_calc_spec_decode_metadata及SpecDecodeMetadata
             # Get the number of draft tokens for each request.
@@ -423,7 +464,12 @@ class NPUModelRunner(GPUModelRunner):
         attn_state = next(iter(attn_metadata.values())).attn_state
 
         # padding input_ids
-        if graph_pad_size > 0:
+        gear_buffers = None
+        if attn_state == AscendAttentionState.DecodeOnly:
+            gear_buffers = self.gear_buffers.get(num_input_tokens + graph_pad_size)
+        if gear_buffers is not None:
+            input_ids = gear_buffers.fill_input_ids(input_ids)
+        elif graph_pad_size > 0:
             if attn_state == AscendAttentionState.DecodeOnly:
                 padding = torch.zeros(graph_pad_size, dtype=input_ids.dtype, device=input_ids.device)
             else:
@@ -486,7 +532,6 @@ class NPUModelRunner(GPUModelRunner):
                         inputs_embeds=None,
                         **model_kwargs,
                     )
-            self.maybe_wait_for_kv_save()
             finished_sending, finished_recving = self.get_finished_kv_transfers(scheduler_output)
             start_fc_exit = time.time()
         if isinstance(forward_results, tuple):
@@ -524,6 +569,12 @@ class NPUModelRunner(GPUModelRunner):
         intermediate_tensors: Optional[IntermediateTensors] = None,
     ) -> Union[ModelRunnerOutput, IntermediateTensors]:
         start = time.time()
+        # Swap preempted KV blocks out and resumed ones in before they are
+        # reused or read by the forward of this step.
+        if self.host_kv_cache is not None:
+            self.host_kv_cache.swap(
+                getattr(scheduler_output, "blocks_to_swap_out", None),
+                getattr(scheduler_output, "blocks_to_swap_in", None))
         # Update KVConnector with the KVConnector metadata forward().
         self._update_states(scheduler_output)
 
@@ -611,6 +662,8 @@ class NPUModelRunner(GPUModelRunner):
                 )
             else:
                 raise ValueError(f"Speculative method {self.speculative_config.method} is not supported in this version.")
+            # after the drafter, whose layers save their KV to the connector like the ones of the model
+            self.maybe_wait_for_kv_save()
 
             # NOTE: NPU -> CPU Sync happens here.
             # Move as many CPU operations as possible before this sync point.
@@ -776,12 +829,20 @@ class NPUModelRunner(GPUModelRunner):
             return hidden_states
 
         # With kv_caches: dummy run for graph capture/placement
-        if self.enable_torchair_graph_mode and len(self.decode_gear_list) > 1:
+        # same condition as in _prepare_inputs: idle DP ranks join the all-reduce
+        if self.enable_torchair_graph_mode and (
+                len(self.decode_gear_list) > 1 or self.decode_batch_histogram is not None):
             self.max_batch_size = self._get_max_token_num(
                 self.vllm_config.parallel_config.data_parallel_size > 1, num_tokens)
-        fake_input = torch.zeros(self.max_batch_size, dtype=input_ids.dtype, device=input_ids.device)
-        fake_positions = torch.zeros(self.max_batch_size, dtype=input_ids.dtype, device=input_ids.device)
-        input_ids, positions = fake_input, fake_positions
+        gear_buffers = self.gear_buffers.get(self.max_batch_size)
+        if gear_buffers is not None:
+            # capture the graph of the gear with its persistent inputs
+            gear_buffers.reset()
+            input_ids, positions = gear_buffers.input_ids, gear_buffers.positions
+        else:
+            fake_input = torch.zeros(self.max_batch_size, dtype=input_ids.dtype, device=input_ids.device)
+            fake_positions = torch.zeros(self.max_batch_size, dtype=input_ids.dtype, device=input_ids.device)
+            input_ids, positions = fake_input, fake_positions
         self.attn_mask = None
         self.attn_state = AscendAttentionState.DecodeOnly
 
@@ -931,6 +992,20 @@ class NPUModelRunner(GPUModelRunner):
         if has_kv_transfer_group():
             get_kv_transfer_group().register_kv_caches(kv_caches)
 
+        # Swap preemption of NpuHybridScheduler.
+        additional_config = self.vllm_config.additional_config or {}
+        if (additional_config.get("enable_hybrid_graph_mode", False)
+                and additional_config.get("preemption_mode", "recompute") == "swap"):
+            layer_to_backend = {
+                layer_name: self.attn_backends[i]
+                for i, kv_cache_group in enumerate(kv_cache_config.kv_cache_groups)
+                for layer_name in kv_cache_group.layer_names
+            }
+            self.host_kv_cache = HostKVCache(
+                get_num_host_blocks(self.cache_config.swap_space_bytes, kv_cache_config),
+                kv_caches,
+                layer_to_backend)
+
     def capture_model(self) -> None:
         if self.enable_torchair_graph_mode:
             decode_gear_list = self.decode_gear_list
@@ -986,10 +1061,12 @@ class NPUModelRunner(GPUModelRunner):
             return kv_cache_spec
         return super().get_kv_cache_spec()
 
-    def _get_max_token_num(self, is_enable_dp, num_tokens):
+    def _get_global_batch_size(self, is_enable_dp, num_tokens):
         if is_enable_dp:
             local_batch_tensor = torch.tensor([num_tokens], dtype=torch.int64, device='cpu')
             dist.all_reduce(local_batch_tensor, group=get_dp_group().cpu_group, op=dist.ReduceOp.MAX)
-            global_batch_size = local_batch_tensor.item()
-            return self._get_closest_gear(global_batch_size)
-        return self._get_closest_gear(num_tokens)
+            return local_batch_tensor.item()
+        return num_tokens
+
+    def _get_max_token_num(self, is_enable_dp, num_tokens):
+        return self._get_closest_gear(self._get_global_batch_size(is_enable_dp, num_tokens))
@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Memory profiling cache of NPUWorker in eager mode.
+
+`NPUWorker.determine_available_memory` runs `profile_run`, a dummy forward at
+the max number of tokens, to measure the peak activation memory of the model.
+With `use_profile_cache` in `graph_model_compile_config`, every rank stores
+that peak in `<TORCHAIR_CACHE_HOME>/.profile_cache/<key>/<rank>.json`, where the
+key hashes everything the peak depends on: the model, the parallel, scheduler
+and cache configs, `additional_config`, the model extra config, the device
+type and the software versions. A restart with the same key skips `profile_run` if every
+rank has its entry, and computes the KV cache size from the cached peak and
+the memory used at that point, which is measured again.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+from vllm.logger import logger
+from vllm.platforms import current_platform
+
+from omni.adaptors.vllm.utils import get_current_work_dir
+import omni.adaptors.vllm.envs as envs
+
+PROFILE_CACHE_PATH_NAME = ".profile_cache"
+
+
+def _versions() -> dict[str, Optional[str]]:
+    versions = {}
+    for module_name in ("vllm", "torch", "torch_npu"):
+        try:
+            versions[module_name] = getattr(__import__(module_name), "__version__", None)
+        except ImportError:
+            versions[module_name] = None
+    versions["cann"] = os.getenv("ASCEND_HOME_PATH", None)
+    return versions
+
+
+def _device_name() -> Optional[str]:
+    # e.g. Ascend910B3: the same config takes a different peak on another chip
+    try:
+        return current_platform.get_device_name()
+    except RuntimeError as e:
+        logger.warning("Failed to get the device name for the profile cache key: %s", e)
+        return None
+
+
+def _file_digest(path: str) -> Optional[str]:
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def profile_cache_factors(vllm_config) -> dict[str, Any]:
+    model_config = vllm_config.model_config
+    parallel_config = vllm_config.parallel_config
+    speculative_config = vllm_config.speculative_config
+    kv_transfer_config = vllm_config.kv_transfer_config
+    return {
+        "model": model_config.model,
+        "revision": model_config.revision,
+        "quantization": model_config.quantization,
+        "dtype": str(model_config.dtype),
+        "max_model_len": model_config.max_model_len,
+        "tensor_parallel_size": parallel_config.tensor_parallel_size,
+        "pipeline_parallel_size": parallel_config.pipeline_parallel_size,
+        "data_parallel_size": parallel_config.data_parallel_size,
+        "enable_expert_parallel": parallel_config.enable_expert_parallel,
+        "max_num_batched_tokens": vllm_config.scheduler_config.max_num_batched_tokens,
+        "max_num_seqs": vllm_config.scheduler_config.max_num_seqs,
+        "gpu_memory_utilization": vllm_config.cache_config.gpu_memory_utilization,
+        "block_size": vllm_config.cache_config.block_size,
+        "cache_dtype": vllm_config.cache_config.cache_dtype,
+        "num_speculative_tokens": speculative_config.num_speculative_tokens if speculative_config else None,
+        "kv_role": kv_transfer_config.kv_role if kv_transfer_config else None,
+        "additional_config": vllm_config.additional_config,
+        "model_extra_config": _file_digest(envs.MODEL_EXTRA_CFG_PATH),
+        "device": _device_name(),
+        "versions": _versions(),
+    }
+
+
+def profile_cache_key(factors: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(factors, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _profile_cache_file(key: str, rank: int) -> str:
+    return os.path.join(get_current_work_dir(PROFILE_CACHE_PATH_NAME), key, f"{rank}.json")
+
+
+def read_profile_peak_bytes(key: str, rank: int) -> Optional[int]:
+    """The cached peak memory of profile_run of `rank`, None if there is none."""
+    profile_cache_file = _profile_cache_file(key, rank)
+    try:
+        with open(profile_cache_file, "r", encoding="utf-8") as f:
+            profile_peak_bytes = int(json.load(f)["profile_peak_bytes"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.warning("Ignoring the unreadable profile cache file %s", profile_cache_file)
+        return None
+    return profile_peak_bytes if profile_peak_bytes >= 0 else None
+
+
+def write_profile_peak_bytes(key: str, rank: int, factors: dict[str, Any], profile_peak_bytes: int) -> None:
+    profile_cache_file = _profile_cache_file(key, rank)
+    try:
+        os.makedirs(os.path.dirname(profile_cache_file), exist_ok=True)
+        # written next to its final path and renamed, so that a reader never sees half a file
+        tmp_file = f"{profile_cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"profile_peak_bytes": int(profile_peak_bytes), "factors": factors}, f, default=str, indent=2)
+        os.replace(tmp_file, profile_cache_file)
+    except OSError as e:
+        logger.warning("Failed to write the profile cache file %s: %s", profile_cache_file, e)
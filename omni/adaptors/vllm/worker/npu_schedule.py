@@ -13,12 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import time
 from collections import deque
 from dataclasses import dataclass, fields
 
 from typing import Iterable, Optional, Type, Union
 
 from vllm.config import VllmConfig, SchedulerConfig
+from vllm.distributed.kv_events import KVEventBatch
 from vllm.logger import logger
 from vllm.multimodal import MULTIMODAL_REGISTRY, MultiModalRegistry
 from vllm.utils import cdiv
@@ -32,6 +34,11 @@ from vllm.v1.request import Request, RequestStatus
 from vllm.v1.spec_decode.metrics import SpecDecodingStats
 from vllm.v1.structured_output import StructuredOutputManager
 
+from omni.adaptors.vllm.worker.npu_admission import create_admission_policy
+from omni.adaptors.vllm.worker.npu_swap import (PREEMPTION_MODES, HostBlockPool,
+                                                get_block_bytes,
+                                                get_num_host_blocks)
+
 @dataclass
 class HybridSchedulerConfig(SchedulerConfig):
     enable_chunked_prefill: bool = False
@@ -86,7 +93,8 @@ class HybridSchedulerConfig(SchedulerConfig):
 
 class NpuHybridScheduler(Scheduler):
     """This Scheduler extends vllm's original v1 scheduler
-    with prefill-first scheduling strategy."""
+    with prefill-first scheduling strategy, optionally reserving the token
+    budget of the running decodes (`decode_reservation`)."""
 
     def __init__(
         self,
@@ -102,6 +110,50 @@ class NpuHybridScheduler(Scheduler):
                          include_finished_set, log_stats)
         self.scheduled_req_ids: set[str] = set()
         self.running: list[Request] = []
+        self.admission_policy = create_admission_policy(
+            self.vllm_config.additional_config,
+            self.scheduler_config.long_prefill_token_threshold)
+        additional_config = self.vllm_config.additional_config or {}
+        self.decode_reservation = additional_config.get(
+            "decode_reservation", False)
+        self.max_consecutive_prefill_steps = int(additional_config.get(
+            "max_consecutive_prefill_steps", 0))
+        if self.max_consecutive_prefill_steps < 0:
+            raise ValueError(
+                "max_consecutive_prefill_steps must be non-negative, got "
+                f"{self.max_consecutive_prefill_steps}.")
+        # Number of consecutive steps that admitted prefills while running
+        # decodes were stalled.
+        self.num_consecutive_prefill_steps = 0
+
+        # With swap preemption, the KV cache of preempted requests is kept in
+        # a pool of host memory of `swap_space` GiB per worker.
+        self.preemption_mode = additional_config.get(
+            "preemption_mode", "recompute")
+        if self.preemption_mode not in PREEMPTION_MODES:
+            raise ValueError(
+                f"Unknown preemption_mode {self.preemption_mode!r}, "
+                f"expected one of {PREEMPTION_MODES}.")
+        self.host_kv_pool: Optional[HostBlockPool] = None
+        if self.preemption_mode == "swap":
+            if self.scheduler_config.chunked_prefill_enabled:
+                # with chunked prefill, scheduling is left to vLLM's scheduler,
+                # which only preempts by recompute
+                raise ValueError(
+                    "Swap preemption is not supported with chunked prefill.")
+            if len(kv_cache_config.kv_cache_groups) != 1:
+                raise ValueError(
+                    "Swap preemption only supports a single KV cache group.")
+            num_host_blocks = get_num_host_blocks(
+                self.cache_config.swap_space_bytes, kv_cache_config)
+            if num_host_blocks <= 0:
+                raise ValueError(
+                    "swap_space is too small to hold a single KV block.")
+            self.host_kv_pool = HostBlockPool(num_host_blocks,
+                                              get_block_bytes(kv_cache_config))
+        # (src, dst) block id pairs to copy in the current step.
+        self.blocks_to_swap_out: list[tuple[int, int]] = []
+        self.blocks_to_swap_in: list[tuple[int, int]] = []
 
         if self.vllm_config.kv_transfer_config is not None and \
             self.vllm_config.kv_transfer_config.is_kv_consumer:
@@ -126,11 +178,165 @@ class NpuHybridScheduler(Scheduler):
         # Record scheduled LoRA requests.
         scheduled_loras: set[int] = set()
 
+        self.blocks_to_swap_out = []
+        self.blocks_to_swap_in = []
+        if self.host_kv_pool is not None:
+            self.host_kv_pool.start_step()
+
+        # Steps that admit prefills normally stall all running decodes. With
+        # decode reservation, running decodes are scheduled first and prefills
+        # only get the remaining token budget, unless fewer than
+        # `max_consecutive_prefill_steps` prefill-only steps were run in a row.
+        has_decodes = len(self.running) > 0
+        mixed_step = (self.decode_reservation and has_decodes and
+                      self.num_consecutive_prefill_steps >=
+                      self.max_consecutive_prefill_steps)
+        if mixed_step:
+            token_budget = self._schedule_running(
+                token_budget, scheduled_running_reqs, preempted_reqs,
+                req_to_new_block_ids, num_scheduled_tokens,
+                scheduled_spec_decode_tokens)
+            # Do not resume a request preempted in this very step.
+            if not preempted_reqs:
+                token_budget = self._schedule_waiting(
+                    token_budget, scheduled_new_reqs, scheduled_resumed_reqs,
+                    req_to_new_block_ids, num_scheduled_tokens,
+                    scheduled_loras)
+        else:
+            # Schedule prefill requests first.
+            token_budget = self._schedule_waiting(
+                token_budget, scheduled_new_reqs, scheduled_resumed_reqs,
+                req_to_new_block_ids, num_scheduled_tokens, scheduled_loras)
+            # If no prefill requests are scheduled,
+            # Schedule decode requests next.
+            if len(self.scheduled_req_ids) == 0:
+                token_budget = self._schedule_running(
+                    token_budget, scheduled_running_reqs, preempted_reqs,
+                    req_to_new_block_ids, num_scheduled_tokens,
+                    scheduled_spec_decode_tokens)
+        if has_decodes and not scheduled_running_reqs and (
+                scheduled_new_reqs or scheduled_resumed_reqs):
+            self.num_consecutive_prefill_steps += 1
+        else:
+            self.num_consecutive_prefill_steps = 0
+
+        # Check if the scheduling constraints are satisfied.
+        total_num_scheduled_tokens = sum(num_scheduled_tokens.values())
+        assert total_num_scheduled_tokens <= self.max_num_scheduled_tokens
+        assert token_budget >= 0
+        assert len(self.running) <= self.max_num_running_reqs
+        assert len(scheduled_new_reqs) + len(scheduled_resumed_reqs) + len(
+            scheduled_running_reqs) <= len(self.running)
+
+        # Get the longest common prefix among all requests in the running queue.
+        # This can be potentially used for cascade attention.
+        num_common_prefix_blocks = 0
+        if self.running:
+            any_request = self.running[0]
+            num_common_prefix_blocks = (
+                self.kv_cache_manager.get_num_common_prefix_blocks(
+                    any_request, len(self.running)))
+
+        # Construct the scheduler output.
+        new_reqs_data = [
+            NewRequestData.from_request(req,
+                                        req_to_new_block_ids[req.request_id])
+            for req in scheduled_new_reqs
+        ]
+        resumed_reqs_data = [
+            self._make_cached_request_data(
+                req,
+                num_scheduled_tokens[req.request_id],
+                len(scheduled_spec_decode_tokens.get(req.request_id, ())),
+                req_to_new_block_ids[req.request_id],
+                resumed_from_preemption=True,
+            ) for req in scheduled_resumed_reqs
+        ]
+        running_reqs_data = [
+            self._make_cached_request_data(
+                req,
+                num_scheduled_tokens[req.request_id],
+                len(scheduled_spec_decode_tokens.get(req.request_id, ())),
+                req_to_new_block_ids[req.request_id],
+                resumed_from_preemption=False,
+            ) for req in scheduled_running_reqs
+        ]
+        scheduler_output = SchedulerOutput(
+            scheduled_new_reqs=new_reqs_data,
+            scheduled_cached_reqs=resumed_reqs_data + running_reqs_data,
+            num_scheduled_tokens=num_scheduled_tokens,
+            total_num_scheduled_tokens=total_num_scheduled_tokens,
+            scheduled_spec_decode_tokens=scheduled_spec_decode_tokens,
+            scheduled_encoder_inputs={},
+            num_common_prefix_blocks=num_common_prefix_blocks,
+            # finished_req_ids is an existing state in the scheduler,
+            # instead of being newly scheduled in this step.
+            # It contains the request IDs that are finished in between
+            # the previous and the current steps.
+            finished_req_ids=self.finished_req_ids,  # type: ignore
+            free_encoder_input_ids=self.encoder_cache_manager.get_freed_ids(),
+            structured_output_request_ids={},
+            grammar_bitmask=None,
+        )
+
+        # Block copies of swap preemption, executed by the model runner
+        # before the forward of this step.
+        if self.host_kv_pool is not None:
+            scheduler_output.blocks_to_swap_out = self.blocks_to_swap_out
+            scheduler_output.blocks_to_swap_in = self.blocks_to_swap_in
+            if preempted_reqs:
+                self.host_kv_pool.log_stats()
+
+        # NOTE(Kuntai): this function is designed for multiple purposes:
+        # 1. Plan the KV cache store
+        # 2. Wrap up all the KV cache load / save ops into an opaque object
+        # 3. Clear the internal states of the connector
+        if self.connector is not None:
+            meta = self.connector.build_connector_meta(scheduler_output)
+            scheduler_output.kv_connector_metadata = meta
+
+        events = self.kv_cache_manager.take_events()
+        if events:
+            batch = KVEventBatch(ts=time.time(), events=events)
+            self.kv_event_publisher.publish(batch)
+
+        # Advance the number of computed tokens for the request AFTER
+        # the request is scheduled.
+        # 1. The scheduler_output of the current step has to include the
+        #    original number of scheduled tokens to determine input IDs.
+        # 2. Advance the number of computed tokens here allowing us to
+        #    schedule the prefill request again immediately in the next
+        #    scheduling step.
+        # 3. If some tokens (e.g. spec tokens) are rejected later, the number of
+        #    computed tokens will be adjusted in update_from_output.
+        for req_id, num_scheduled_token in num_scheduled_tokens.items():
+            self.requests[req_id].num_computed_tokens += num_scheduled_token
+
+        self.finished_req_ids = set()  # type: ignore
+        return scheduler_output
+
+    def _schedule_waiting(
+        self,
+        token_budget: int,
+        scheduled_new_reqs: list[Request],
+        scheduled_resumed_reqs: list[Request],
+        req_to_new_block_ids: dict[str, list[list[int]]],
+        num_scheduled_tokens: dict[str, int],
+        scheduled_loras: set[int],
+    ) -> int:
+        """Admit waiting requests for prefill within `token_budget`.
+        Returns the remaining token budget."""
         # Use a temporary deque to collect requests that need to be skipped
         # and put back at the head of the waiting queue later
         skipped_waiting_requests: deque[Request] = deque()
 
-        # Schedule prefill requests first.
+        # Let the admission policy decide in which order the waiting
+        # requests are tried.
+        if len(self.waiting) > 1 and self.admission_policy.name != "fifo":
+            self.waiting = deque(self.admission_policy.order(
+                self.waiting, token_budget,
+                max_num_reqs=self.max_num_running_reqs - len(self.running)))
+
         while self.waiting and token_budget > 0:
             if len(self.running) == self.max_num_running_reqs:
                 break
@@ -150,9 +356,19 @@ class NpuHybridScheduler(Scheduler):
                 continue
 
             prompt_limit = self._get_prompt_limit(request)
-            # Get already-cached tokens.
-            computed_blocks, num_computed_tokens = (
-                self.kv_cache_manager.get_computed_blocks(request))
+            swapped = (self.host_kv_pool is not None
+                       and request.request_id in self.host_kv_pool)
+            if swapped:
+                # The KV cache of the computed tokens is copied back from
+                # host memory into the newly allocated blocks.
+                computed_blocks = None
+                num_computed_tokens = request.num_computed_tokens
+                num_new_computed_tokens = 0
+            else:
+                # Get already-cached tokens.
+                computed_blocks, num_computed_tokens = (
+                    self.kv_cache_manager.get_computed_blocks(request))
+                num_new_computed_tokens = num_computed_tokens
             num_new_tokens = request.num_tokens - num_computed_tokens
             if (0 < self.scheduler_config.long_prefill_token_threshold <
                     num_new_tokens):
@@ -180,10 +396,15 @@ class NpuHybridScheduler(Scheduler):
                 continue
             assert num_new_tokens > 0
             new_blocks = self.kv_cache_manager.allocate_slots(
-                request, num_new_tokens, num_computed_tokens, computed_blocks)
+                request, num_new_tokens, num_new_computed_tokens,
+                computed_blocks)
             if new_blocks is None:
                 # The request cannot be scheduled.
-                break
+                if self.admission_policy.stop_on_alloc_failure:
+                    break
+                # A shorter request behind it may still fit.
+                skip_cur_request()
+                continue
 
             self.waiting.popleft()
             self.running.append(request)
@@ -199,7 +420,13 @@ class NpuHybridScheduler(Scheduler):
             if self.lora_config and request.lora_request:
                 scheduled_loras.add(request.lora_request.lora_int_id)
 
-            all_block_ids = computed_blocks.get_block_ids()[0] + new_blocks.get_block_ids()[0]    
+            if swapped:
+                all_block_ids = new_blocks.get_block_ids()[0]
+                host_block_ids = self.host_kv_pool.swap_in(request.request_id)
+                self.blocks_to_swap_in.extend(
+                    zip(host_block_ids, all_block_ids[:len(host_block_ids)]))
+            else:
+                all_block_ids = computed_blocks.get_block_ids()[0] + new_blocks.get_block_ids()[0]
             req_to_new_block_ids[request.request_id] = [all_block_ids]
 
             # Update request info.
@@ -211,152 +438,109 @@ class NpuHybridScheduler(Scheduler):
         # Put back any skipped requests at the head of the waiting queue
         if skipped_waiting_requests:
             self.waiting.extendleft(skipped_waiting_requests)
+        return token_budget
 
-        # If no prefill requests are scheduled,
-        # Schedule decode requests next.
-        if len(self.scheduled_req_ids) == 0:
-            req_index = 0
-            while req_index < len(self.running) and token_budget > 0:
-                request = self.running[req_index]
-                if request.request_id in self.scheduled_req_ids:
-                    # This request has already been scheduled.
-                    req_index += 1
-                    continue
-
-                num_new_tokens = (request.num_tokens_with_spec -
-                                  request.num_computed_tokens)
-                if (0 < self.scheduler_config.long_prefill_token_threshold <
-                        num_new_tokens):
-                    num_new_tokens = (
-                        self.scheduler_config.long_prefill_token_threshold)
-                num_new_tokens = min(num_new_tokens, token_budget)
-                assert num_new_tokens == 1
-
-                while True:
-                    new_blocks = self.kv_cache_manager.allocate_slots(
-                        request, num_new_tokens)
-                    if new_blocks is None:
-                        # The request cannot be scheduled.
-                        # Preempt the lowest-priority request.
-                        preempted_req = self.running.pop()
+    def _schedule_running(
+        self,
+        token_budget: int,
+        scheduled_running_reqs: list[Request],
+        preempted_reqs: list[Request],
+        req_to_new_block_ids: dict[str, list[list[int]]],
+        num_scheduled_tokens: dict[str, int],
+        scheduled_spec_decode_tokens: dict[str, list[int]],
+    ) -> int:
+        """Schedule one decode step of the running requests within
+        `token_budget`, preempting the latest requests if the KV cache is
+        full. Returns the remaining token budget."""
+        req_index = 0
+        while req_index < len(self.running) and token_budget > 0:
+            request = self.running[req_index]
+            if request.request_id in self.scheduled_req_ids:
+                # This request has already been scheduled.
+                req_index += 1
+                continue
+
+            num_new_tokens = (request.num_tokens_with_spec -
+                              request.num_computed_tokens)
+            if (0 < self.scheduler_config.long_prefill_token_threshold <
+                    num_new_tokens):
+                num_new_tokens = (
+                    self.scheduler_config.long_prefill_token_threshold)
+            num_new_tokens = min(num_new_tokens, token_budget)
+            assert num_new_tokens == 1
+
+            while True:
+                new_blocks = self.kv_cache_manager.allocate_slots(
+                    request, num_new_tokens)
+                if new_blocks is None:
+                    # The request cannot be scheduled.
+                    # Preempt the lowest-priority request.
+                    preempted_req = self.running.pop()
+                    if not self._swap_out(preempted_req):
                         self.kv_cache_manager.free(preempted_req)
-                        preempted_req.status = RequestStatus.PREEMPTED
                         preempted_req.num_computed_tokens = 0
-                        self.waiting.appendleft(preempted_req)
-                        preempted_reqs.append(preempted_req)
-                        if preempted_req == request:
-                            # No more request to preempt.
-                            can_schedule = False
-                            break
-                    else:
-                        # The request can be scheduled.
-                        can_schedule = True
+                    preempted_req.status = RequestStatus.PREEMPTED
+                    self.waiting.appendleft(preempted_req)
+                    preempted_reqs.append(preempted_req)
+                    if preempted_req == request:
+                        # No more request to preempt.
+                        can_schedule = False
                         break
-                if not can_schedule:
+                else:
+                    # The request can be scheduled.
+                    can_schedule = True
                     break
-                assert new_blocks is not None
-
-                # Schedule the request.
-                scheduled_running_reqs.append(request)
-                self.scheduled_req_ids.add(request.request_id)
-                req_to_new_block_ids[request.request_id] = new_blocks.get_block_ids()
-
-                num_scheduled_tokens[request.request_id] = num_new_tokens
-                token_budget -= num_new_tokens
-                req_index += 1
-
-                # Speculative decode related.
-                if request.spec_token_ids:
-                    num_scheduled_spec_tokens = (num_new_tokens +
-                                                 request.num_computed_tokens -
-                                                 request.num_tokens)
-                    if num_scheduled_spec_tokens > 0:
-                        # Trim spec_token_ids list to num_scheduled_spec_tokens.
-                        del request.spec_token_ids[num_scheduled_spec_tokens:]
-                        scheduled_spec_decode_tokens[request.request_id] = (
-                            request.spec_token_ids)
-
-        # Check if the scheduling constraints are satisfied.
-        total_num_scheduled_tokens = sum(num_scheduled_tokens.values())
-        assert total_num_scheduled_tokens <= self.max_num_scheduled_tokens
-        assert token_budget >= 0
-        assert len(self.running) <= self.max_num_running_reqs
-        assert len(scheduled_new_reqs) + len(scheduled_resumed_reqs) + len(
-            scheduled_running_reqs) <= len(self.running)
-
-        # Get the longest common prefix among all requests in the running queue.
-        # This can be potentially used for cascade attention.
-        num_common_prefix_blocks = 0
-        if self.running:
-            any_request = self.running[0]
-            num_common_prefix_blocks = (
-                self.kv_cache_manager.get_num_common_prefix_blocks(
-                    any_request, len(self.running)))
-
-        # Construct the scheduler output.
-        new_reqs_data = [
-            NewRequestData.from_request(req,
-                                        req_to_new_block_ids[req.request_id])
-            for req in scheduled_new_reqs
-        ]
-        resumed_reqs_data = [
-            self._make_cached_request_data(
-                req,
-                num_scheduled_tokens[req.request_id],
-                len(scheduled_spec_decode_tokens.get(req.request_id, ())),
-                req_to_new_block_ids[req.request_id],
-                resumed_from_preemption=True,
-            ) for req in scheduled_resumed_reqs
-        ]
-        running_reqs_data = [
-            self._make_cached_request_data(
-                req,
-                num_scheduled_tokens[req.request_id],
-                len(scheduled_spec_decode_tokens.get(req.request_id, ())),
-                req_to_new_block_ids[req.request_id],
-                resumed_from_preemption=False,
-            ) for req in scheduled_running_reqs
-        ]
-        scheduler_output = SchedulerOutput(
-            scheduled_new_reqs=new_reqs_data,
-            scheduled_cached_reqs=resumed_reqs_data + running_reqs_data,
-            num_scheduled_tokens=num_scheduled_tokens,
-            total_num_scheduled_tokens=total_num_scheduled_tokens,
-            scheduled_spec_decode_tokens=scheduled_spec_decode_tokens,
-            scheduled_encoder_inputs={},
-            num_common_prefix_blocks=num_common_prefix_blocks,
-            # finished_req_ids is an existing state in the scheduler,
-            # instead of being newly scheduled in this step.
-            # It contains the request IDs that are finished in between
-            # the previous and the current steps.
-            finished_req_ids=self.finished_req_ids,  # type: ignore
-            free_encoder_input_ids=self.encoder_cache_manager.get_freed_ids(),
-            structured_output_request_ids={},
-            grammar_bitmask=None,
-        )
-
-        # NOTE(Kuntai): this function is designed for multiple purposes:
-        # 1. Plan the KV cache store
-        # 2. Wrap up all the KV cache load / save ops into an opaque object
-        # 3. Clear the internal states of the connector
-        if self.connector is not None:
-            meta = self.connector.build_connector_meta(scheduler_output)
-            scheduler_output.kv_connector_metadata = meta
+            if not can_schedule:
+                break
+            assert new_blocks is not None
 
-        # Advance the number of computed tokens for the request AFTER
-        # the request is scheduled.
-        # 1. The scheduler_output of the current step has to include the
-        #    original number of scheduled tokens to determine input IDs.
-        # 2. Advance the number of computed tokens here allowing us to
-        #    schedule the prefill request again immediately in the next
-        #    scheduling step.
-        # 3. If some tokens (e.g. spec tokens) are rejected later, the number of
-        #    computed tokens will be adjusted in update_from_output.
-        for req_id, num_scheduled_token in num_scheduled_tokens.items():
-            self.requests[req_id].num_computed_tokens += num_scheduled_token
+            # Schedule the request.
+            scheduled_running_reqs.append(request)
+            self.scheduled_req_ids.add(request.request_id)
+            req_to_new_block_ids[request.request_id] = new_blocks.get_block_ids()
 
-        self.finished_req_ids = set()  # type: ignore
-        return scheduler_output
+            num_scheduled_tokens[request.request_id] = num_new_tokens
+            token_budget -= num_new_tokens
+            req_index += 1
+
+            # Speculative decode related.
+            if request.spec_token_ids:
+                num_scheduled_spec_tokens = (num_new_tokens +
+                                             request.num_computed_tokens -
+                                             request.num_tokens)
+                if num_scheduled_spec_tokens > 0:
+                    # Trim spec_token_ids list to num_scheduled_spec_tokens.
+                    del request.spec_token_ids[num_scheduled_spec_tokens:]
+                    scheduled_spec_decode_tokens[request.request_id] = (
+                        request.spec_token_ids)
+        return token_budget
+
+    def _swap_out(self, request: Request) -> bool:
+        """Copy the KV cache of a preempted request to host memory and free
+        its device blocks. Returns False if the request is to be recomputed
+        instead."""
+        if self.host_kv_pool is None:
+            return False
+        num_blocks = cdiv(request.num_computed_tokens, self.block_size)
+        if num_blocks == 0:
+            return False
+        host_block_ids, evicted = self.host_kv_pool.swap_out(
+            request.request_id, num_blocks)
+        for req_id in evicted:
+            # Its host copy is gone, so it is recomputed on resume.
+            self.requests[req_id].num_computed_tokens = 0
+        if host_block_ids is None:
+            return False
+        device_block_ids = self.kv_cache_manager.get_block_ids(
+            request.request_id)[0][:num_blocks]
+        self.blocks_to_swap_out.extend(zip(device_block_ids, host_block_ids))
+        self.kv_cache_manager.free(request)
+        return True
+
+    def _free_request(self, request: Request):
+        if self.host_kv_pool is not None:
+            self.host_kv_pool.free(request.request_id)
+        return super()._free_request(request)
 
     def _get_prompt_limit(self, request: Request) -> int:
         if (self.scheduler_config.chunked_prefill_enabled
@@ -547,6 +731,7 @@ class NpuHybridScheduler(Scheduler):
                 self._cached_reqs_data[req_data.req_id].append(req_data)
 
         self.running = new_running
+
         engine_core_outputs = EngineCoreOutputs(
             outputs=outputs,
             scheduler_stats=self.make_stats(spec_decoding_stats),
@@ -0,0 +1,171 @@
+#
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Swap preemption of NpuHybridScheduler.
+
+Instead of dropping the KV cache of a preempted request and recomputing its
+whole prefill on resume, the scheduler copies its blocks into a bounded pool of
+pinned host memory and copies them back when the request is resumed.
+
+The scheduler only does the bookkeeping (`HostBlockPool`) and attaches the
+block copies of a step to the scheduler output (`blocks_to_swap_out` and
+`blocks_to_swap_in`, lists of (src, dst) block id pairs). The model runner
+executes them with the `swap_blocks` hook of the attention backends
+(`HostKVCache`) before the forward of that step, swap outs first.
+"""
+
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+from vllm.logger import logger
+from vllm.utils import is_pin_memory_available
+from vllm.v1.kv_cache_interface import KVCacheConfig
+
+PREEMPTION_MODES = ("recompute", "swap")
+
+
+def get_block_bytes(kv_cache_config: KVCacheConfig) -> int:
+    """Bytes of one block id over all layers of the worker."""
+    return sum(group.kv_cache_spec.page_size_bytes * len(group.layer_names)
+               for group in kv_cache_config.kv_cache_groups)
+
+
+def get_num_host_blocks(swap_space_bytes: int, kv_cache_config: KVCacheConfig) -> int:
+    """Number of host blocks fitting in `swap_space_bytes`. The scheduler and
+    the model runner must agree on it, so both derive it from the same
+    configs."""
+    return int(swap_space_bytes) // get_block_bytes(kv_cache_config)
+
+
+class HostBlockPool:
+    """Scheduler-side bookkeeping of the host blocks.
+
+    Every swapped out request owns a list of host block ids, in the order of
+    its device blocks. When the pool is full, the requests that were swapped
+    out least recently are evicted: they lose their host blocks and fall back to
+    recompute preemption.
+
+    Host blocks released by a swap in are only reusable from the next step on,
+    and requests swapped out in the current step are never evicted in it, since
+    the copies of a step run after the scheduling of the whole step.
+    """
+
+    def __init__(self, num_blocks: int, block_bytes: int):
+        self.num_blocks = num_blocks
+        self.block_bytes = block_bytes
+        self.free_block_ids: list[int] = list(range(num_blocks - 1, -1, -1))
+        # request id -> host block ids, in swap out order (LRU first)
+        self.req_to_blocks: OrderedDict[str, list[int]] = OrderedDict()
+        self._pending_free: list[int] = []
+        self._num_step_blocks = 0
+
+        self.swap_out_bytes = 0
+        self.swap_in_bytes = 0
+        self.num_swap_outs = 0
+        self.num_swap_ins = 0
+        self.num_evictions = 0
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self.req_to_blocks
+
+    @property
+    def num_free_blocks(self) -> int:
+        return len(self.free_block_ids)
+
+    def start_step(self) -> None:
+        """Release the host blocks swapped in by the previous step."""
+        self.free_block_ids.extend(self._pending_free)
+        self._pending_free.clear()
+        self._num_step_blocks = 0
+
+    def swap_out(self, request_id: str, num_blocks: int) -> tuple[Optional[list[int]], list[str]]:
+        """Allocate `num_blocks` host blocks for a request, evicting the least
+        recently swapped out requests if needed.
+
+        Returns:
+            The host block ids, or None if the request does not fit in the pool
+            at all, and the ids of the evicted requests.
+        """
+        if num_blocks > self.num_blocks - len(self._pending_free) - self._num_step_blocks:
+            return None, []
+        evicted = []
+        while len(self.free_block_ids) < num_blocks:
+            victim, blocks = self.req_to_blocks.popitem(last=False)
+            self.free_block_ids.extend(blocks)
+            evicted.append(victim)
+            self.num_evictions += 1
+        block_ids = [self.free_block_ids.pop() for _ in range(num_blocks)]
+        self.req_to_blocks[request_id] = block_ids
+        self._num_step_blocks += num_blocks
+        self.swap_out_bytes += num_blocks * self.block_bytes
+        self.num_swap_outs += 1
+        return block_ids, evicted
+
+    def swap_in(self, request_id: str) -> list[int]:
+        """Return the host block ids of a request to be copied back. They are
+        released at the start of the next step."""
+        block_ids = self.req_to_blocks.pop(request_id)
+        self._pending_free.extend(block_ids)
+        self.swap_in_bytes += len(block_ids) * self.block_bytes
+        self.num_swap_ins += 1
+        return block_ids
+
+    def free(self, request_id: str) -> None:
+        """Drop the host blocks of a request finished while swapped out."""
+        block_ids = self.req_to_blocks.pop(request_id, None)
+        if block_ids:
+            self.free_block_ids.extend(block_ids)
+
+    def log_stats(self) -> None:
+        logger.info(
+            "Host KV pool: %d/%d blocks free, %d requests swapped out, "
+            "swap out %d reqs %.1f MB, swap in %d reqs %.1f MB, %d evictions.",
+            self.num_free_blocks, self.num_blocks, len(self.req_to_blocks),
+            self.num_swap_outs, self.swap_out_bytes / 2**20,
+            self.num_swap_ins, self.swap_in_bytes / 2**20, self.num_evictions)
+
+
+class HostKVCache:
+    """Worker-side pinned host copy of the KV cache of every layer, and the
+    execution of the block copies decided by the scheduler."""
+
+    def __init__(self, num_blocks: int, kv_caches: dict, layer_to_backend: dict):
+        self.num_blocks = num_blocks
+        self.layers = []
+        for layer_name, device_kv in kv_caches.items():
+            host_kv = tuple(
+                torch.empty((num_blocks, ) + tuple(tensor.shape[1:]),
+                            dtype=tensor.dtype,
+                            device="cpu",
+                            pin_memory=is_pin_memory_available())
+                for tensor in device_kv)
+            self.layers.append((layer_to_backend[layer_name], device_kv, host_kv))
+        logger.info("Allocated %d host KV blocks for swap preemption.", num_blocks)
+
+    def swap(self, blocks_to_swap_out: list[tuple[int, int]],
+             blocks_to_swap_in: list[tuple[int, int]]) -> None:
+        """Copy (device, host) pairs to host, then (host, device) pairs to
+        device. Device blocks freed by a swap out may be the target of a swap
+        in of the same step, so the order matters."""
+        if blocks_to_swap_out:
+            src_to_dst = torch.tensor(blocks_to_swap_out, dtype=torch.int64)
+            for backend, device_kv, host_kv in self.layers:
+                backend.swap_blocks(device_kv, host_kv, src_to_dst)
+        if blocks_to_swap_in:
+            src_to_dst = torch.tensor(blocks_to_swap_in, dtype=torch.int64)
+            for backend, device_kv, host_kv in self.layers:
+                backend.swap_blocks(host_kv, device_kv, src_to_dst)
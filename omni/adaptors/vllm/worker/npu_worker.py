@@ -29,7 +29,8 @@ from vllm.config import VllmConfig
 from vllm.distributed import (ensure_model_parallel_initialized,
                               init_distributed_environment,
                               set_custom_all_reduce,
-                              get_dp_group)
+                              get_dp_group,
+                              get_world_group)
 from vllm.distributed.kv_transfer import ensure_kv_transfer_initialized
 from vllm.logger import logger
 from vllm.model_executor import set_random_seed
@@ -45,6 +46,8 @@ from vllm.lora.request import LoRARequest
 from omni.adaptors.vllm.platform import NPUPlatform
 # from vllm.v1.worker.gpu_model_runner import GPUModelRunner
 from omni.adaptors.vllm.worker.npu_model_runner import NPUModelRunner
+from omni.adaptors.vllm.worker.npu_profile_cache import (
+    profile_cache_factors, profile_cache_key, read_profile_peak_bytes, write_profile_peak_bytes)
 from omni.adaptors.vllm.utils import (
     check_torchair_cache_exists, check_block_num_cache_exist, read_block_num_from_file, write_block_num_to_file, delete_torchair_cache_file, clear_var
 )
@@ -153,6 +156,7 @@ class NPUWorker(WorkerBase):
 
         self.enable_torchair_graph_mode = (self.vllm_config.npu_compilation_config.level > CompilationLevel.NO_COMPILATION and supports_dynamo())
         self.use_cached_npu_graph = self.vllm_config.npu_compilation_config.use_ge_graph_cached
+        self.use_profile_cache = self.vllm_config.npu_compilation_config.use_profile_cache
 
     def page_size_bytes(self) -> int:
         # For MLA we only store a single latent vector
@@ -167,14 +171,18 @@ class NPUWorker(WorkerBase):
         if int(os.getenv("NO_NPU_MOCK", "0")):
             return int(100000000)
 
-        cur_npu_kv_cache_bytes = self._compute_kv_cache_bytes()
         if not self.enable_torchair_graph_mode:
+            if self.use_profile_cache:
+                cur_npu_kv_cache_bytes = self._compute_kv_cache_bytes_with_profile_cache()
+            else:
+                cur_npu_kv_cache_bytes = self._compute_kv_cache_bytes()
             clear_var()
             # Only For Prefill Stage
             if model_extra_config.operator_opt_config.use_omni_placement:
                 self.model_runner.planner.start_dynamic_optimize_expert_load_balance()
             return cur_npu_kv_cache_bytes
 
+        cur_npu_kv_cache_bytes = self._compute_kv_cache_bytes()
         last_use_kv_cache_bytes = cur_npu_kv_cache_bytes
 
         if self.use_cached_npu_graph:
@@ -213,18 +221,50 @@ class NPUWorker(WorkerBase):
 
         return last_use_kv_cache_bytes
 
-    def _compute_kv_cache_bytes(self):
+    def _compute_kv_cache_bytes_with_profile_cache(self):
+        # Eager mode only: reuse the peak memory of profile_run of a previous
+        # start with the same config, see worker/npu_profile_cache.py. The cache
+        # is used only if every rank has its entry, since profile_run runs
+        # collectives that all ranks must join.
+        factors = profile_cache_factors(self.vllm_config)
+        key = profile_cache_key(factors)
+        rank = torch.distributed.get_rank()
+        profile_peak_bytes = read_profile_peak_bytes(key, rank)
+
+        local_peak_bytes = torch.tensor([-1 if profile_peak_bytes is None else profile_peak_bytes],
+                                        dtype=torch.int64, device="cpu")
+        all_peak_bytes = [torch.zeros_like(local_peak_bytes) for _ in range(get_world_group().world_size)]
+        dist.all_gather(all_peak_bytes, local_peak_bytes, group=get_world_group().cpu_group)
+        missing_ranks = [r for r, peak_bytes in enumerate(all_peak_bytes) if int(peak_bytes) < 0]
+        clear_var(local_peak_bytes, all_peak_bytes)
+
+        if not missing_ranks:
+            logger.info(f"Skipping profile_run, using the cached peak memory {profile_peak_bytes} of profile {key}")
+            return self._compute_kv_cache_bytes(profile_peak_bytes)
+        logger.info(f"No profile cache {key} for ranks {missing_ranks}, running profile_run")
+        npu_kv_cache_bytes = self._compute_kv_cache_bytes()
+        write_profile_peak_bytes(key, rank, factors, self.profile_peak_bytes)
+        return npu_kv_cache_bytes
+
+    def _compute_kv_cache_bytes(self, profile_peak_bytes: Optional[int] = None):
         # Profile the memory usage of the model and get the maximum number of
         # cache blocks that can be allocated with the remaining free memory.
         gc.collect()
         NPUPlatform.empty_cache()
 
-        # Execute a forward pass with dummy inputs to profile the memory usage
-        # of the model.
-        self.model_runner.profile_run()
-        # Calculate the number of blocks that can be allocated with the
-        # profiled peak memory.
-        free_npu_memory, total_npu_memory = NPUPlatform.mem_get_info()
+        if profile_peak_bytes is None:
+            free_before_profile = NPUPlatform.mem_get_info()[0]
+            # Execute a forward pass with dummy inputs to profile the memory usage
+            # of the model.
+            self.model_runner.profile_run()
+            # Calculate the number of blocks that can be allocated with the
+            # profiled peak memory.
+            free_npu_memory, total_npu_memory = NPUPlatform.mem_get_info()
+            self.profile_peak_bytes = max(free_before_profile - free_npu_memory, 0)
+        else:
+            # The memory profile_run would take on top of the current usage.
+            free_before_profile, total_npu_memory = NPUPlatform.mem_get_info()
+            free_npu_memory = free_before_profile - profile_peak_bytes
         # NOTE(woosuk): Here we assume that the other processes using the same
         # GPU did not change their memory usage during the profiling.
         peak_memory = self.init_npu_memory - free_npu_memory
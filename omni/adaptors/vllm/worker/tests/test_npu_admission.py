@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import itertools
+import random
+import types
+import unittest
+
+from omni.adaptors.vllm.worker.npu_admission import (
+    AdmissionPolicy,
+    BinPackingPolicy,
+    ShortestPromptFirstPolicy,
+    create_admission_policy,
+    estimate_prefill_tokens,
+    pack_tokens,
+)
+
+
+def request(num_tokens, arrival_time=0.0, num_computed_tokens=0):
+    return types.SimpleNamespace(num_tokens=num_tokens, num_computed_tokens=num_computed_tokens,
+                                 arrival_time=arrival_time)
+
+
+def best_sum(sizes, budget, max_items=None):
+    """The largest subset sum <= budget of at most max_items sizes, by brute force."""
+    best = 0
+    for n in range(len(sizes) + 1 if max_items is None else min(max_items, len(sizes)) + 1):
+        for subset in itertools.combinations(sizes, n):
+            if best < sum(subset) <= budget:
+                best = sum(subset)
+    return best
+
+
+class TestPackTokens(unittest.TestCase):
+    def test_exact_fit(self):
+        self.assertEqual(pack_tokens([5, 3, 4, 2], 9), [0, 2])
+        self.assertEqual(pack_tokens([5, 3, 4, 2], 14), [0, 1, 2, 3])
+
+    def test_prefers_earlier_items(self):
+        self.assertEqual(pack_tokens([3, 3, 3], 6), [0, 1])
+        self.assertEqual(pack_tokens([4, 2, 2, 4], 4), [0])
+
+    def test_skips_items_that_never_fit(self):
+        self.assertEqual(pack_tokens([10, 0, 3], 5), [2])
+        self.assertEqual(pack_tokens([], 5), [])
+        self.assertEqual(pack_tokens([6, 7], 5), [])
+
+    def test_max_items(self):
+        self.assertEqual(pack_tokens([1, 1, 1, 5], 6, max_items=2), [0, 3])
+        self.assertEqual(pack_tokens([2, 2, 2], 6, max_items=0), [])
+        # the largest sum with as few items as possible
+        self.assertEqual(pack_tokens([1, 1, 2], 2, max_items=2), [2])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            sizes = [rng.randint(0, 20) for _ in range(rng.randint(0, 8))]
+            budget = rng.randint(0, 60)
+            max_items = rng.choice([None, 0, 1, 2, 3, 10])
+            with self.subTest(sizes=sizes, budget=budget, max_items=max_items):
+                chosen = pack_tokens(sizes, budget, max_items)
+                self.assertEqual(chosen, sorted(set(chosen)))
+                self.assertEqual(sum(sizes[i] for i in chosen), best_sum(sizes, budget, max_items))
+                if max_items is not None:
+                    self.assertLessEqual(len(chosen), max_items)
+
+
+class TestAdmissionPolicies(unittest.TestCase):
+    def test_estimate_prefill_tokens(self):
+        self.assertEqual(estimate_prefill_tokens(request(100, num_computed_tokens=30)), 70)
+        self.assertEqual(estimate_prefill_tokens(request(100), long_prefill_token_threshold=64), 64)
+
+    def test_fifo(self):
+        waiting = [request(8000, 0.0), request(10, 1.0), request(100, 2.0)]
+        policy = AdmissionPolicy()
+        self.assertEqual(policy.order(waiting, 1024, now=3.0), waiting)
+        self.assertTrue(policy.stop_on_alloc_failure)
+
+    def test_spf_with_aging(self):
+        old_long, short, medium = request(2000, 0.0), request(10, 9.0), request(500, 9.5)
+        waiting = [old_long, short, medium]
+        policy = ShortestPromptFirstPolicy(aging_tokens_per_s=0.0)
+        self.assertEqual(policy.order(waiting, 1024, now=10.0), [short, medium, old_long])
+        # 10 s of aging at 200 tokens/s bring the long prompt ahead of the medium one
+        policy = ShortestPromptFirstPolicy(aging_tokens_per_s=200.0)
+        self.assertEqual(policy.order(waiting, 1024, now=10.0), [short, old_long, medium])
+        self.assertFalse(policy.stop_on_alloc_failure)
+
+    def test_overdue_requests_first(self):
+        overdue_long, short, overdue_medium = request(2000, 0.0), request(10, 9.0), request(500, 1.0)
+        waiting = [overdue_long, short, overdue_medium]
+        for policy in (ShortestPromptFirstPolicy(aging_tokens_per_s=0.0, ttft_deadline_s=5.0),
+                       BinPackingPolicy(ttft_deadline_s=5.0)):
+            with self.subTest(policy=policy.name):
+                self.assertEqual(policy.order(waiting, 4096, now=10.0), [overdue_long, overdue_medium, short])
+
+    def test_binpack(self):
+        waiting = [request(600, 0.0), request(300, 1.0), request(500, 2.0), request(200, 3.0)]
+        policy = BinPackingPolicy()
+        self.assertEqual(policy.order(waiting, 1000, now=4.0),
+                         [waiting[1], waiting[2], waiting[3], waiting[0]])
+        # at most one more request can run
+        self.assertEqual(policy.order(waiting, 1000, now=4.0, max_num_reqs=1),
+                         [waiting[0], waiting[1], waiting[2], waiting[3]])
+        self.assertEqual(policy.order(waiting, 1000, now=4.0, max_num_reqs=0), waiting)
+
+    def test_binpack_window(self):
+        waiting = [request(600, 0.0), request(300, 1.0), request(400, 2.0)]
+        policy = BinPackingPolicy(window=2)
+        # the request of 400 tokens is not considered
+        self.assertEqual(policy.order(waiting, 1000, now=3.0), waiting)
+
+    def test_create_admission_policy(self):
+        self.assertIs(type(create_admission_policy(None)), AdmissionPolicy)
+        policy = create_admission_policy(dict(admission_policy="spf", admission_aging_tokens_per_s=10,
+                                              admission_ttft_deadline_s=2), long_prefill_token_threshold=64)
+        self.assertIsInstance(policy, ShortestPromptFirstPolicy)
+        self.assertEqual((policy.aging_tokens_per_s, policy.ttft_deadline_s), (10.0, 2.0))
+        self.assertEqual(policy.long_prefill_token_threshold, 64)
+        policy = create_admission_policy(dict(admission_policy="binpack", admission_window=8))
+        self.assertEqual((policy.name, policy.window), ("binpack", 8))
+        with self.assertRaises(ValueError):
+            create_admission_policy(dict(admission_policy="binpack", admission_window=0))
+        with self.assertRaises(ValueError):
+            create_admission_policy(dict(admission_policy="lifo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
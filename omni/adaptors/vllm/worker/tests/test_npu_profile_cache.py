@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from omni.adaptors.vllm.worker import npu_profile_cache
+from omni.adaptors.vllm.worker.npu_profile_cache import (
+    profile_cache_factors,
+    profile_cache_key,
+    read_profile_peak_bytes,
+    write_profile_peak_bytes,
+)
+
+
+def make_vllm_config(max_num_batched_tokens=8192, **parallel):
+    ns = types.SimpleNamespace
+    return ns(
+        model_config=ns(model="/models/deepseek", revision=None, quantization=None, dtype="bfloat16",
+                        max_model_len=16384),
+        parallel_config=ns(tensor_parallel_size=parallel.get("tensor_parallel_size", 1),
+                           pipeline_parallel_size=1, data_parallel_size=1, enable_expert_parallel=True),
+        scheduler_config=ns(max_num_batched_tokens=max_num_batched_tokens, max_num_seqs=32),
+        cache_config=ns(gpu_memory_utilization=0.9, block_size=128, cache_dtype="auto"),
+        speculative_config=None,
+        kv_transfer_config=ns(kv_role="kv_producer"),
+        additional_config={"graph_model_compile_config": {"level": 0}},
+    )
+
+
+class TestProfileCache(unittest.TestCase):
+    def setUp(self):
+        cache_home = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_home.cleanup)
+        self.cache_home = cache_home.name
+        self.device_name = "Ascend910B3"
+        platform = types.SimpleNamespace(get_device_name=lambda: self.device_name)
+        for patcher in (
+                mock.patch.object(npu_profile_cache, "current_platform", platform),
+                mock.patch.object(npu_profile_cache, "get_current_work_dir",
+                                  lambda name: os.path.join(self.cache_home, name)),
+                mock.patch.dict(os.environ, {"MODEL_EXTRA_CFG_PATH": ""})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def key(self, **kwargs):
+        factors = profile_cache_factors(make_vllm_config(**kwargs))
+        return profile_cache_key(factors), factors
+
+    def test_key_is_stable(self):
+        self.assertEqual(self.key()[0], self.key()[0])
+        self.assertEqual(len(self.key()[0]), 16)
+
+    def test_key_depends_on_config_and_device(self):
+        key, _ = self.key()
+        self.assertNotEqual(self.key(max_num_batched_tokens=4096)[0], key)
+        self.assertNotEqual(self.key(tensor_parallel_size=2)[0], key)
+        self.device_name = "Ascend910B4"
+        self.assertNotEqual(self.key()[0], key)
+
+    def test_key_depends_on_model_extra_config(self):
+        key, _ = self.key()
+        extra_config = os.path.join(self.cache_home, "extra.json")
+        with open(extra_config, "w") as f:
+            f.write('{"operator_opt_config": {}}')
+        with mock.patch.dict(os.environ, {"MODEL_EXTRA_CFG_PATH": extra_config}):
+            self.assertNotEqual(self.key()[0], key)
+
+    def test_write_and_read(self):
+        key, factors = self.key()
+        self.assertIsNone(read_profile_peak_bytes(key, 0))
+        write_profile_peak_bytes(key, 0, factors, 123456)
+        self.assertEqual(read_profile_peak_bytes(key, 0), 123456)
+        # every rank has its own entry
+        self.assertIsNone(read_profile_peak_bytes(key, 1))
+        self.assertEqual(os.listdir(os.path.join(self.cache_home, ".profile_cache", key)), ["0.json"])
+
+    def test_config_mismatch_misses(self):
+        key, factors = self.key()
+        write_profile_peak_bytes(key, 0, factors, 123456)
+        self.device_name = "Ascend910B4"
+        self.assertIsNone(read_profile_peak_bytes(self.key()[0], 0))
+        self.assertIsNone(read_profile_peak_bytes(self.key(max_num_batched_tokens=4096)[0], 0))
+
+    def test_unreadable_entry_misses(self):
+        key, factors = self.key()
+        write_profile_peak_bytes(key, 0, factors, 123456)
+        path = os.path.join(self.cache_home, ".profile_cache", key, "0.json")
+        for content in ("{not json", '{"factors": {}}', '{"profile_peak_bytes": -1}'):
+            with self.subTest(content=content):
+                with open(path, "w") as f:
+                    f.write(content)
+                self.assertIsNone(read_profile_peak_bytes(key, 0))
+
+    def test_device_name_unavailable(self):
+        def no_device():
+            raise RuntimeError("no NPU")
+
+        with mock.patch.object(npu_profile_cache, "current_platform",
+                               types.SimpleNamespace(get_device_name=no_device)):
+            self.assertIsNone(profile_cache_factors(make_vllm_config())["device"])
+
+
+if __name__ == "__main__":
+    unittest.main()
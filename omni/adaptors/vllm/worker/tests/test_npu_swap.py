@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import unittest
+
+from omni.adaptors.vllm.worker.npu_swap import HostBlockPool
+
+
+class TestHostBlockPool(unittest.TestCase):
+    def test_alloc_and_free(self):
+        pool = HostBlockPool(8, block_bytes=100)
+        pool.start_step()
+        block_ids, evicted = pool.swap_out("a", 3)
+        self.assertEqual(len(set(block_ids)), 3)
+        self.assertEqual(evicted, [])
+        self.assertIn("a", pool)
+        self.assertEqual(pool.num_free_blocks, 5)
+        self.assertEqual(pool.swap_out_bytes, 300)
+
+        # a request finished while swapped out returns its blocks at once
+        pool.free("a")
+        self.assertNotIn("a", pool)
+        self.assertEqual(pool.num_free_blocks, 8)
+        pool.free("a")
+        self.assertEqual(pool.num_free_blocks, 8)
+
+    def test_swap_in_releases_blocks_next_step(self):
+        pool = HostBlockPool(4, block_bytes=1)
+        pool.start_step()
+        block_ids, _ = pool.swap_out("a", 4)
+        pool.start_step()
+        self.assertEqual(pool.swap_in("a"), block_ids)
+        self.assertNotIn("a", pool)
+        # the copy back runs in this step, so the blocks are not reusable yet
+        self.assertEqual(pool.num_free_blocks, 0)
+        self.assertEqual(pool.swap_out("b", 1), (None, []))
+        pool.start_step()
+        self.assertEqual(pool.num_free_blocks, 4)
+        self.assertEqual(pool.swap_out("b", 4)[1], [])
+        self.assertEqual((pool.num_swap_outs, pool.num_swap_ins, pool.swap_in_bytes), (2, 1, 4))
+
+    def test_exhaustion_evicts_least_recently_swapped_out(self):
+        pool = HostBlockPool(6, block_bytes=1)
+        pool.start_step()
+        pool.swap_out("a", 2)
+        pool.swap_out("b", 2)
+        pool.start_step()
+        pool.swap_out("c", 2)
+        pool.start_step()
+        block_ids, evicted = pool.swap_out("d", 3)
+        self.assertEqual(evicted, ["a", "b"])
+        self.assertEqual(len(block_ids), 3)
+        self.assertNotIn("a", pool)
+        self.assertNotIn("b", pool)
+        self.assertIn("c", pool)
+        self.assertEqual(pool.num_evictions, 2)
+        # no block is owned twice
+        owned = [b for blocks in pool.req_to_blocks.values() for b in blocks]
+        self.assertEqual(len(owned) + pool.num_free_blocks, 6)
+        self.assertEqual(len(set(owned)), len(owned))
+
+    def test_request_larger_than_pool(self):
+        pool = HostBlockPool(4, block_bytes=1)
+        pool.start_step()
+        pool.swap_out("a", 2)
+        self.assertEqual(pool.swap_out("b", 5), (None, []))
+        self.assertIn("a", pool)
+        self.assertEqual(pool.num_evictions, 0)
+
+    def test_no_eviction_of_requests_swapped_out_in_same_step(self):
+        # the copies of a step run after the whole step is scheduled
+        pool = HostBlockPool(4, block_bytes=1)
+        pool.start_step()
+        pool.swap_out("a", 3)
+        self.assertEqual(pool.swap_out("b", 2), (None, []))
+        self.assertIn("a", pool)
+        pool.start_step()
+        self.assertEqual(pool.swap_out("b", 2)[1], ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -38,8 +38,12 @@ class AttentionMaskBuilder:
     def update_attn_cache(self, seqlen: int, dtype: torch.dtype,
                           device: torch.device):
         if seqlen > self._seq_len_cached or self.attn_mask_cache.dtype != dtype:
-            self._seq_len_cached = seqlen
-            self.attn_mask_cache = generate_attn_mask(seqlen, dtype)
+            # Grow geometrically, so that a sequence length creeping up by one
+            # token per step does not regenerate the whole mask every step.
+            # Every user slices the cache to its own length.
+            if seqlen > self._seq_len_cached:
+                self._seq_len_cached = max(seqlen, 2 * self._seq_len_cached)
+            self.attn_mask_cache = generate_attn_mask(self._seq_len_cached, dtype)
         if self.attn_mask_cache.device != device:
             self.attn_mask_cache = self.attn_mask_cache.to(device)
 
@@ -67,40 +71,49 @@ class AttentionMaskBuilder:
         dtype,
         device,
     ) -> torch.Tensor:
-        max_seq_len = max(seq_lens, default=0)
+        if isinstance(seq_lens, torch.Tensor):
+            max_seq_len = int(seq_lens.max()) if seq_lens.numel() > 0 else 0
+        else:
+            max_seq_len = max(seq_lens, default=0)
         if max_seq_len <= self._seq_len_cached:
             self.update_attn_cache(max_seq_len, dtype, device)
             if self.attn_mask_cache.numel(
             ) > 1 and self.attn_mask_cache[0][1] > 0:
+                # out of place, get_attn_mask may return the cache itself
                 attn_mask = self.get_attn_mask(  # type: ignore
-                    max_seq_len, dtype, device)
-                attn_mask *= -10000
+                    max_seq_len, dtype, device) * -10000
             else:
                 attn_mask = self.attn_mask_cache
             return torch.index_select(attn_mask, dim=0,
                                       index=position)[:, :max_seq_len]
-        total_q_len = sum(query_lens)
-        attn_mask = torch.zeros((total_q_len, max_seq_len),
-                                dtype=dtype,
-                                device="cpu")
-
-        current_row = 0
-        for i in range(len(query_lens)):
-            seq_len = seq_lens[i]
-            q_len = query_lens[i]
-            context_len = seq_len - q_len
-
-            if context_len < 0:
-                raise ValueError("context_len must be non-negative")
-            attn_mask[current_row:current_row + q_len,
-                      context_len:] = self.splitfuse_mask_value
-            right_tensor = attn_mask[current_row:current_row + q_len,
-                                     context_len:seq_len]
-            right_tensor.masked_fill_(
-                right_tensor.tril() == self.splitfuse_mask_value, 0)
-            current_row += q_len
+        return self._build_splitfuse_attn_mask(seq_lens, query_lens,
+                                               max_seq_len, dtype, device)
 
-        return attn_mask.to(device, non_blocking=True)
+    def _build_splitfuse_attn_mask(self, seq_lens, query_lens,
+                                   max_seq_len: int, dtype: torch.dtype,
+                                   device: torch.device) -> torch.Tensor:
+        """Build the (total_q_len, max_seq_len) mask of a chunked prefill
+        batch on `device` by broadcasting: the query token t of a request
+        with context_len computed tokens sees the columns up to
+        context_len + t. Only the per-row limits are built on the host."""
+        seq_lens = torch.as_tensor(seq_lens, dtype=torch.int64)
+        query_lens = torch.as_tensor(query_lens, dtype=torch.int64,
+                                     device=seq_lens.device)
+        context_lens = seq_lens - query_lens
+        if bool((context_lens < 0).any()):
+            raise ValueError("context_len must be non-negative")
+        total_q_len = int(query_lens.sum())
+        starts = torch.cumsum(query_lens, dim=0) - query_lens
+        last_visible = (torch.repeat_interleave(context_lens - starts, query_lens)
+                        + torch.arange(total_q_len, device=seq_lens.device))
+        last_visible = last_visible.to(device, non_blocking=True)
+        masked = (torch.arange(max_seq_len, device=device)[None, :]
+                  > last_visible[:, None])
+        if dtype == torch.bool:
+            return masked
+        return torch.zeros((total_q_len, max_seq_len), dtype=dtype,
+                           device=device).masked_fill_(masked,
+                                                       self.splitfuse_mask_value)
 
 
 def generate_attn_mask(max_seq_len: int, dtype=torch.float16, mask_value=None):
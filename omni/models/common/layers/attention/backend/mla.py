@@ -28,7 +28,13 @@ from omni.models.common.config.model_config import model_extra_config
 from omni.models.common.layers.attention.backend.attention import AscendAttentionState
 from omni.adaptors.vllm.worker.npu_model_runner import NPUModelRunner
 from omni.models.common.layers.attention.backend.attention_dummy_builder import DummyAttentionMetadataBuilder
-from omni.accelerators.cache import OmniAttentionSpec, compute_omni_attn_metadata
+from omni.accelerators.cache import (
+    OmniAttentionSpec,
+    compute_omni_attn_metadata,
+    compute_omni_attn_prefill_context,
+)
+
+KVCACHE_NZ_DIM = 16
 
 
 def group_request_list(seq_lens, query_lens, block_tables, threshold):
@@ -101,6 +107,17 @@ class AscendMLABackend(AttentionBackend):
                             device=device)
         return (layer_kv_cache_nope, layer_kv_cache_pe)
 
+    @staticmethod
+    def swap_blocks(
+            src_kv_cache: List[torch.Tensor],
+            dst_kv_cache: List[torch.Tensor],
+            src_to_dst: torch.Tensor,
+    ) -> None:
+        src_indices = src_to_dst[:, 0]
+        dst_indices = src_to_dst[:, 1]
+        for src_cache, dst_cache in zip(src_kv_cache, dst_kv_cache):
+            dst_cache[dst_indices] = src_cache[src_indices].to(dst_cache.device)
+
 @dataclass
 class AscendMLAPrefillMetadata:
     """ Prefill Specific Metadata for Ascend"""
@@ -116,6 +133,53 @@ class AscendMLAPrefillMetadata:
     seq_kvlen_group: Optional[list] = None
     kv_index_list: Optional[list] = None
 
+    # omni attention compressed layers: cache rows of the sink and recent
+    # tokens left by the earlier chunks of every prompt, and the rows of
+    # [context, chunk] of every request in the context followed by the fresh KV
+    context_kv_index: Optional[torch.Tensor] = None
+    context_merge_index: Optional[torch.Tensor] = None
+
+
+def gather_prefill_context(
+    kv_cache: tuple[torch.Tensor, torch.Tensor],
+    prefill_metadata: Optional[AscendMLAPrefillMetadata],
+) -> Optional[tuple[torch.Tensor, torch.Tensor]]:
+    """Latent KV and rope key of the cached context of the prefill chunks in
+    an omni attention compressed layer, or None without context. It must be
+    read before the chunks are written to the cache."""
+    if prefill_metadata is None or prefill_metadata.context_kv_index is None:
+        return None
+    block_num, block_size, _, kv_lora_rank = kv_cache[0].shape
+    qk_rope_head_dim = kv_cache[1].shape[-1]
+    # adapt nz
+    kv_cache_a = kv_cache[0].view(block_num, 1, kv_lora_rank // KVCACHE_NZ_DIM, block_size, KVCACHE_NZ_DIM)
+    kv_cache_pe = kv_cache[1].view(block_num, 1, qk_rope_head_dim // KVCACHE_NZ_DIM, block_size, KVCACHE_NZ_DIM)
+    kv_a = kv_cache_a.transpose(1, 3).reshape(-1, kv_lora_rank) \
+        .index_select(0, prefill_metadata.context_kv_index)
+    k_pe = kv_cache_pe.transpose(1, 3).reshape(-1, qk_rope_head_dim) \
+        .index_select(0, prefill_metadata.context_kv_index)
+    return kv_a, k_pe
+
+
+def merge_prefill_context(
+    context: tuple[torch.Tensor, torch.Tensor],
+    kv_a: torch.Tensor,
+    k_pe: torch.Tensor,
+    prefill_metadata: AscendMLAPrefillMetadata,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Put the cached context of every prefill chunk before its fresh KV.
+    Rows past the prefill tokens, such as padding, stay at the end."""
+    merged = []
+    for context_kv, kv in zip(context, (kv_a, k_pe)):
+        kv = kv.view(-1, context_kv.shape[-1])
+        num_tokens = prefill_metadata.context_merge_index.shape[0] - context_kv.shape[0]
+        merged.append(torch.cat([
+            torch.cat([context_kv, kv[:num_tokens]]).index_select(0, prefill_metadata.context_merge_index),
+            kv[num_tokens:],
+        ]))
+    return merged[0], merged[1]
+
+
 @dataclass
 class AscendMLADecodeMetadata:
     # Input positions for rotrary embeddings since for MLA the rotary
@@ -458,43 +522,47 @@ class AscendMLAMetadataBuilder(DummyAttentionMetadataBuilder):
     ) -> AscendMLAMetadata:
 
         decode_metadata = None
+        prefill_metadata = None
         ref: AscendMLAMetadata = self.runner.full_attn_metadata
-        num_decodes, num_decode_tokens, num_prefills, prefill_metadata, ref_d = \
+        num_decodes, num_decode_tokens, num_prefills, ref_p, ref_d = \
             ref.num_decodes, ref.num_decode_tokens, ref.num_prefills, ref.prefill, ref.decode
+        if ref_d is None and ref_p is None:
+            raise RuntimeError(f"Full attention metadata should not be None!")
 
-        if ref_d is not None:
-            omni_block_table, omni_slot_mapping, omni_seq_lens = compute_omni_attn_metadata(
-                self.kv_cache_spec,
-                self.block_table,
-                num_actual_tokens,
-                num_decodes,
-                num_decode_tokens,
-                num_prefills,
-                self.runner.input_batch.num_prompt_tokens[:num_reqs],
-                self.runner.seq_lens_np[:num_reqs] - self.runner.input_batch.num_computed_tokens_cpu[:num_reqs],
-                self.runner.seq_lens_np[:num_reqs],
-                self.runner.device,
-                use_spec_decode=self.runner.use_spec_decode,
-            )
+        omni_block_table, omni_slot_mapping, omni_seq_lens = compute_omni_attn_metadata(
+            self.kv_cache_spec,
+            self.block_table,
+            num_actual_tokens,
+            num_decodes,
+            num_decode_tokens,
+            num_prefills,
+            self.runner.input_batch.num_prompt_tokens[:num_reqs],
+            self.runner.seq_lens_np[:num_reqs] - self.runner.input_batch.num_computed_tokens_cpu[:num_reqs],
+            self.runner.seq_lens_np[:num_reqs],
+            self.runner.device,
+            use_spec_decode=self.runner.use_spec_decode,
+        )
+        slot_mapping = torch.full_like(ref.slot_mapping, PAD_SLOT_ID)
+        slot_mapping[:num_actual_tokens].copy_(omni_slot_mapping, non_blocking=True)
 
+        if ref_d is not None:
             input_positions, cos, sin, best_topk = \
                 ref_d.input_positions, ref_d.cos, ref_d.sin, ref_d.best_topk
             num_tokens_per_req = num_decode_tokens // num_decodes
 
             block_table = torch.zeros_like(ref_d.block_table)
             seq_lens = (input_positions + 1).to(dtype=torch.int64)
-            slot_mapping = torch.full_like(ref.slot_mapping, PAD_SLOT_ID)
-            slot_mapping[:num_actual_tokens].copy_(omni_slot_mapping, non_blocking=True)
 
+            decode_block_table = omni_block_table[:num_decodes]
             if num_tokens_per_req > 1:
-                omni_block_table = omni_block_table.repeat_interleave(num_tokens_per_req, dim=0)
-            m, n = omni_block_table.shape
-            block_table[:m, :n].copy_(omni_block_table, non_blocking=True)
+                decode_block_table = decode_block_table.repeat_interleave(num_tokens_per_req, dim=0)
+            m, n = decode_block_table.shape
+            block_table[:m, :n].copy_(decode_block_table, non_blocking=True)
 
             if num_tokens_per_req == 1:
                 seq_lens.clamp_(min=0, max=self.kv_cache_spec.max_compressed_len)
             else:
-                seq_lens[:num_actual_tokens].copy_(omni_seq_lens, non_blocking=True)
+                seq_lens[:num_decode_tokens].copy_(omni_seq_lens, non_blocking=True)
 
             self.generate_activate_mask(num_actual_tokens, num_actual_tokens + graph_pad_size)
             decode_metadata = AscendMLADecodeMetadata(
@@ -505,8 +573,39 @@ class AscendMLAMetadataBuilder(DummyAttentionMetadataBuilder):
                 cos=cos.clone(),
                 sin=sin.clone(),
                 best_topk=best_topk)
-        else:
-            raise RuntimeError(f"Full attention metadata should not be None!")
+
+        if ref_p is not None:
+            # Compressed layers attend over the fresh KV of the prefill chunk,
+            # after the sink and recent tokens that the previous chunks of the
+            # prompt left in the cache. Without kv_index_list the fresh KV
+            # (merged with that context) is used, in one group.
+            query_lens = np.array(ref_p.query_lens)
+            context_kv_index, context_merge_index, kv_lens = compute_omni_attn_prefill_context(
+                self.kv_cache_spec,
+                self.block_table,
+                num_decodes,
+                num_prefills,
+                self.runner.input_batch.num_prompt_tokens[num_decodes:num_reqs],
+                query_lens,
+                self.runner.seq_lens_np[num_decodes:num_reqs],
+            )
+            if len(context_kv_index) > 0:
+                context_kv_index = context_kv_index.to(self.runner.device, non_blocking=True)
+                context_merge_index = context_merge_index.to(self.runner.device, non_blocking=True)
+            else:
+                context_kv_index, context_merge_index = None, None
+            prefill_metadata = AscendMLAPrefillMetadata(
+                attn_mask=ref_p.attn_mask,
+                query_lens=ref_p.query_lens,
+                seq_lens=kv_lens.tolist(),
+                input_positions=ref_p.input_positions,
+                block_table=omni_block_table[num_decodes:].to(self.runner.device, non_blocking=True),
+                max_query_len=ref_p.max_query_len,
+                seq_qlen_group=[list(itertools.accumulate(ref_p.query_lens))],
+                seq_kvlen_group=[np.cumsum(kv_lens).tolist()],
+                kv_index_list=[],
+                context_kv_index=context_kv_index,
+                context_merge_index=context_merge_index)
 
         return self.metadata_cls(
             num_actual_tokens=num_actual_tokens,
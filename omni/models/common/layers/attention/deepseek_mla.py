@@ -10,6 +10,7 @@ from vllm.attention.backends.abstract import (
     AttentionMetadata,
 )
 from vllm.attention import Attention
+from vllm.attention.layer import maybe_save_kv_layer_to_connector, wait_for_kv_layer_from_connector
 from vllm.utils import supports_dynamo
 from vllm.config import CacheConfig, QuantizationConfig, CompilationLevel, get_current_vllm_config
 from vllm.model_executor.layers.linear import (
@@ -24,6 +25,7 @@ from vllm.distributed.parallel_state import (
 from vllm.platforms import current_platform
 
 from omni.models.common.config.model_config import model_extra_config
+from omni.models.common.layers.attention.backend.mla import gather_prefill_context, merge_prefill_context
 from omni.models.common.layers.rotary_embedding import get_rope
 from omni.models.common.layers.linear import (
     MergedReplicatedLinear,
@@ -185,6 +187,14 @@ class DeepseekMLA(nn.Module):
 
         cur_vllm_config = get_current_vllm_config()
         self.enable_graph_mode = (cur_vllm_config.npu_compilation_config.level > CompilationLevel.NO_COMPILATION and supports_dynamo())
+        # with layerwise_pull_kv, decode schedules requests before the KV of their last layers has arrived
+        kv_transfer_config = cur_vllm_config.kv_transfer_config
+        self.wait_for_kv_layer = (kv_transfer_config is not None and kv_transfer_config.kv_role == "kv_consumer"
+                                  and (cur_vllm_config.additional_config or {}).get("layerwise_pull_kv", False)
+                                  and not self.enable_graph_mode)
+        # in staged mode, prefill offloads the KV of every layer to the host as soon as it is written
+        self.stage_kv_layer = (kv_transfer_config is not None and kv_transfer_config.kv_role == "kv_producer"
+                               and kv_transfer_config.get_from_extra_config("kv_transfer_mode", "pull") == "staged")
 
         self.attn_mask = ~torch.tril(
             torch.ones((2048, 2048), dtype=torch.bool, device=current_platform.device_type)
@@ -246,8 +256,12 @@ class DeepseekMLA(nn.Module):
             self.W_UK = torch.nn.Parameter(self.W_UK.contiguous(), requires_grad=False)
             self.W_UV = torch.nn.Parameter(self.W_UV.contiguous(), requires_grad=False)
             self.is_init = True
+        if self.wait_for_kv_layer:
+            wait_for_kv_layer_from_connector(self.vllm_attn.layer_name)
         if attn_metadata is None or attn_metadata.prefill is not None:
             output = self._forward_prefill(positions, hidden_states, kv_cache, attn_metadata, comm_group=comm_group)
+            if self.stage_kv_layer:
+                maybe_save_kv_layer_to_connector(self.vllm_attn.layer_name, kv_cache)
         else:
             output = self._forward_decode(
                 positions, hidden_states, kv_cache, attn_metadata,
@@ -313,7 +327,10 @@ class DeepseekMLA(nn.Module):
         q[..., self.qk_nope_head_dim:] = q_pe
         if isinstance(kv_cache, Dict):
             kv_cache = kv_cache.get("kv_cache")
+        prefill_context = None
         if kv_cache is not None and isinstance(kv_cache, Tuple) and kv_cache[0].numel() > 0:
+            if attn_metadata is not None:
+                prefill_context = gather_prefill_context(kv_cache, attn_metadata.prefill)
             # k_pe:BNS,64 kv_a:BNS, 512, kv_states:bnsd, cos,sin:bnsd,kv cache:bsnd
             _, _, k_pe, kv_a = torch_npu.npu_kv_rmsnorm_rope_cache(
                 latent_cache.view(-1, 1, 1, 576), # bnsd
@@ -339,6 +356,8 @@ class DeepseekMLA(nn.Module):
             k_pe = k_pe.unsqueeze(2)
             k_pe = torch_npu.npu_interleave_rope(k_pe, cos, sin)
             k_pe = k_pe.squeeze(2)
+        if prefill_context is not None:
+            kv_a, k_pe = merge_prefill_context(prefill_context, kv_a, k_pe, attn_metadata.prefill)
         attn_output = torch.empty(
             q.shape[0],
             self.num_local_heads,
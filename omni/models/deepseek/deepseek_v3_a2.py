@@ -64,6 +64,7 @@ from vllm.sequence import IntermediateTensors
 from omni.models.common.layers.activation import SiluAndMul
 from omni.models.common.layers.layernorm import RMSNorm
 from omni.models.common.layers.rotary_embedding import get_rope
+from omni.models.common.layers.attention.backend.mla import gather_prefill_context, merge_prefill_context
 
 from omni.models.common.layers.vocab_parallel_embedding import (
     ParallelLMHead, 
@@ -1318,7 +1319,9 @@ class AscendDeepseekAttention_MLA(nn.Module):
                 with torch.npu.stream(kv_stream):
                     if isinstance(kv_cache, Dict):
                         kv_cache = kv_cache.get("kv_cache")
+                    prefill_context = None
                     if kv_cache is not None and isinstance(kv_cache, Tuple) and kv_cache[0].numel() > 0: 
+                        prefill_context = gather_prefill_context(kv_cache, attn_metadata.prefill)
                         _, _, k_pe, kv_a = torch_npu.npu_kv_rmsnorm_rope_cache(
                             latent_cache.view(-1, 1, 1, self.kv_lora_rank + self.qk_rope_head_dim),
                             self.kv_a_layernorm.weight,
@@ -1338,10 +1341,14 @@ class AscendDeepseekAttention_MLA(nn.Module):
                         k_pe = k_pe.unsqueeze(2)
                         k_pe = torch_npu.npu_interleave_rope(k_pe, cos, sin)
                         k_pe = k_pe.squeeze(2)
+                    if prefill_context is not None:
+                        kv_a, k_pe = merge_prefill_context(prefill_context, kv_a, k_pe, attn_metadata.prefill)
             else:
                 if isinstance(kv_cache, Dict):
                     kv_cache = kv_cache.get("kv_cache")
+                prefill_context = None
                 if kv_cache is not None and isinstance(kv_cache, Tuple) and kv_cache[0].numel() > 0: 
+                    prefill_context = gather_prefill_context(kv_cache, attn_metadata.prefill)
                     _, _, k_pe, kv_a = torch_npu.npu_kv_rmsnorm_rope_cache(
                         latent_cache.view(-1, 1, 1, self.kv_lora_rank + self.qk_rope_head_dim),
                         self.kv_a_layernorm.weight,
@@ -1361,6 +1368,8 @@ class AscendDeepseekAttention_MLA(nn.Module):
                     k_pe = k_pe.unsqueeze(2)
                     k_pe = torch_npu.npu_interleave_rope(k_pe, cos, sin)
                     k_pe = k_pe.squeeze(2)
+                if prefill_context is not None:
+                    kv_a, k_pe = merge_prefill_context(prefill_context, kv_a, k_pe, attn_metadata.prefill)
             
             prefill_metadata = attn_metadata.prefill
             if len(prefill_metadata.seq_qlen_group) == 1:
@@ -1539,7 +1548,10 @@ class AscendDeepseekAttention_MLA(nn.Module):
 
         if isinstance(kv_cache, Dict):
             kv_cache = kv_cache.get("kv_cache")
+        prefill_context = None
         if kv_cache is not None and isinstance(kv_cache, Tuple) and kv_cache[0].numel() > 0:
+            if attn_metadata is not None:
+                prefill_context = gather_prefill_context(kv_cache, attn_metadata.prefill)
             _, _, k_pe, kv_a = torch_npu.npu_kv_rmsnorm_rope_cache(
                 latent_cache.view(-1, 1, 1, self.kv_lora_rank + self.qk_rope_head_dim),
                 self.kv_a_layernorm.weight,
@@ -1560,6 +1572,8 @@ class AscendDeepseekAttention_MLA(nn.Module):
             k_pe = k_pe.unsqueeze(2)
             k_pe = torch_npu.npu_interleave_rope(k_pe, cos, sin)
             k_pe = k_pe.squeeze(2)
+        if prefill_context is not None:
+            kv_a, k_pe = merge_prefill_context(prefill_context, kv_a, k_pe, attn_metadata.prefill)
 
         prefill_metadata = attn_metadata.prefill if attn_metadata is not None else None
         attn_output = torch.empty(q_nope.shape[0],
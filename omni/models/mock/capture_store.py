@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""
+Binary capture store of the mock model (MOCK_CAPTURE_FORMAT=binary).
+
+Every capturing process owns a shard of two append-only files in
+MOCK_CAPTURE_DIR, named after its rank, host and pid (`capture_shard_name`),
+so that no file and no lock is shared between processes, even between
+instances capturing into the same directory:
+
+- `<MOCK_CAPTURE_FILE>.<shard>.bin`: the raw bytes of the captured tensors, in
+  their own dtype, each blob aligned to BLOB_ALIGNMENT bytes.
+- `<MOCK_CAPTURE_FILE>.<shard>.idx`: one json line per captured entry with its
+  method, cache key, extra fields and the offset, dtype and shape of its tensors.
+
+A blob is written before its index line, so that a capture killed mid-write
+leaves at most an index line without data, which replay skips. Replay reads the
+index lines of all shards and maps the blob files with mmap; tensors are views
+of the mapped files and are only read when used.
+
+Keys made of a whole tensor, like the hidden state of `compute_logits`, are
+stored as their `tensor_key` digest instead of the tensor itself.
+"""
+
+import glob
+import hashlib
+import json
+import mmap
+import os
+import socket
+import threading
+from typing import Any, Dict, Optional
+
+import torch
+
+BLOB_ALIGNMENT = 64
+
+
+def capture_shard_name(rank_shard: str) -> str:
+    """Shard of the capturing process of rank `rank_shard` (e.g. "dp0_tp1")."""
+    return f"{rank_shard}.{socket.gethostname()}-{os.getpid()}"
+
+
+def shard_paths(directory: str, name: str, shard: str):
+    prefix = os.path.join(directory, f"{name}.{shard}")
+    return prefix + ".idx", prefix + ".bin"
+
+
+def tensor_key(tensor: torch.Tensor) -> str:
+    """Cache key of a tensor, the sha256 of its float32 bytes."""
+    data = tensor.detach().to(torch.float32).cpu().contiguous().numpy().tobytes()
+    return hashlib.sha256(data).hexdigest()
+
+
+class CaptureShardWriter:
+    """Appends captured entries to the shard files of one process. Appends of
+    several threads are serialized, so that the offsets in the index match the
+    blob file."""
+
+    def __init__(self, directory: str, name: str, shard: str):
+        index_path, blob_path = shard_paths(directory, name, shard)
+        self.index_file = open(index_path, "a", encoding="utf-8")
+        self.blob_file = open(blob_path, "ab")
+        self.offset = self.blob_file.tell()
+        self._lock = threading.Lock()
+
+    def append(self, method: str, key: str, tensors: Dict[str, torch.Tensor], **fields: Any) -> None:
+        """Write `tensors` to the blob file, then the index line of the entry."""
+        entry = {"method": method, "key": key, "tensors": {}, **fields}
+        tensors = {tensor_name: tensor.detach().cpu().contiguous() for tensor_name, tensor in tensors.items()}
+        with self._lock:
+            for tensor_name, tensor in tensors.items():
+                padding = -self.offset % BLOB_ALIGNMENT
+                if padding:
+                    self.blob_file.write(b"\0" * padding)
+                    self.offset += padding
+                data = tensor.reshape(-1).view(torch.uint8).numpy()
+                self.blob_file.write(data)
+                entry["tensors"][tensor_name] = [self.offset, str(tensor.dtype).replace("torch.", ""),
+                                                 list(tensor.shape)]
+                self.offset += data.nbytes
+            self.blob_file.flush()
+            self.index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.index_file.flush()
+
+    def close(self) -> None:
+        self.blob_file.close()
+        self.index_file.close()
+
+
+class CaptureStore:
+    """
+    Read-only view of the captured entries of all shards.
+
+    An entry captured by several shards (e.g. the KV caches of every TP rank
+    under the same key) is taken from the shards of rank `preferred_shard`
+    (e.g. "dp0_tp1") if they have it, otherwise from the first shard in name order.
+    """
+
+    def __init__(self, directory: str, name: str, preferred_shard: Optional[str] = None):
+        self.entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._blobs = {}
+        index_paths = sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + ".*.idx")))
+        if preferred_shard is not None:
+            prefix = f"{name}.{preferred_shard}."
+            index_paths.sort(key=lambda path: not os.path.basename(path).startswith(prefix))
+        if not index_paths:
+            raise FileNotFoundError(f"No capture shards {name}.*.idx found in {directory}.")
+        for index_path in index_paths:
+            self._load_shard(index_path)
+
+    def _load_shard(self, index_path: str) -> None:
+        blob_path = index_path[:-len(".idx")] + ".bin"
+        blob_size = os.path.getsize(blob_path)
+        if blob_size > 0:
+            with open(blob_path, "rb") as f:
+                # copy-on-write mapping: writable for torch.frombuffer, never written back
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            blob = None
+        self._blobs[blob_path] = blob
+
+        with open(index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # index line of an interrupted capture
+                tensors = {}
+                for tensor_name, (offset, dtype, shape) in entry["tensors"].items():
+                    tensor = self._view(blob, blob_size, offset, getattr(torch, dtype), shape)
+                    if tensor is None:
+                        break
+                    tensors[tensor_name] = tensor
+                else:
+                    entry["tensors"] = tensors
+                    self.entries.setdefault(entry["method"], {}).setdefault(entry["key"], entry)
+
+    @staticmethod
+    def _view(blob, blob_size: int, offset: int, dtype: torch.dtype, shape) -> Optional[torch.Tensor]:
+        numel = 1
+        for size in shape:
+            numel *= size
+        nbytes = numel * torch.empty((), dtype=dtype).element_size()
+        if nbytes == 0:
+            return torch.empty(shape, dtype=dtype)
+        if offset + nbytes > blob_size:
+            return None
+        return torch.frombuffer(blob, dtype=torch.uint8, count=nbytes, offset=offset).view(dtype).view(shape)
+
+    def get(self, method: str) -> Dict[str, Dict[str, Any]]:
+        """The entries of `method` by cache key; their "tensors" map names to tensors."""
+        return self.entries.get(method, {})
@@ -56,6 +56,8 @@ from vllm.forward_context import ForwardContext, get_forward_context
 
 from vllm.logger import logger
 
+from omni.models.mock.capture_store import CaptureShardWriter, CaptureStore, capture_shard_name, tensor_key
+
 
 def access_variable(variable_name, stack_level=1):
     """
@@ -155,6 +157,13 @@ def mock_model_class_factory(base_class: type) -> type:
         self.mock_capture_file = os.getenv(
             "MOCK_CAPTURE_FILE", default="mock_cache"
         ) + ("p" if self.prefill_process else "") # Append 'p' for prefill process
+        # "json": one file of json lines with base64 tensors, shared by all processes under MOCK_CAPTURE_FILE_LOCK.
+        # "binary": per-process shards of an index and mmap-able tensor blobs, see capture_store.py.
+        self.mock_capture_format = os.getenv("MOCK_CAPTURE_FORMAT", default="json")
+        if self.mock_capture_format not in ("json", "binary"):
+            raise ValueError(f"MOCK_CAPTURE_FORMAT must be 'json' or 'binary', got {self.mock_capture_format}.")
+        self.mock_capture_shard = f"dp{get_dp_group().rank_in_group}_tp{get_tp_group().rank_in_group}"
+        self.mock_capture_writer = None  # CaptureShardWriter, opened on the first binary capture
         self.simulate_elapsed_time = int(os.getenv("SIMULATE_ELAPSED_TIME", default='0'))
         self.random_mode = int(os.getenv("RANDOM_MODE", default='0'))
         self.forward_time = int(os.getenv("FORWARD_TIME", "0"))  # Simulated forward time in ms
@@ -196,6 +205,9 @@ def mock_model_class_factory(base_class: type) -> type:
         self.mock_cache_forward = {}
         self.mock_cache_compute_logits = {}
         self.mock_cache_sample = {}
+        if self.mock_capture_format == "binary":
+            initialize_mock_cache_from_store(self)
+            return
         with open(
             os.path.join(self.mock_capture_dir, self.mock_capture_file), "r"
         ) as f:
@@ -225,6 +237,55 @@ def mock_model_class_factory(base_class: type) -> type:
                     output_str = line["output_str"]
                     self.mock_cache_sample[input_str] = output_str
 
+    def initialize_mock_cache_from_store(self):
+        """
+        Binary counterpart of `initialize_mock_cache`: the captured tensors are
+        views of the memory-mapped shard blobs, read only when replayed.
+        The shard of this process is preferred for keys captured by several ranks.
+        """
+        self.mock_capture_store = CaptureStore(
+            self.mock_capture_dir, self.mock_capture_file, self.mock_capture_shard
+        )
+        for input_str, entry in self.mock_capture_store.get("forward").items():
+            tensors = entry["tensors"]
+            if self.prefill_process:
+                self.mock_cache_forward[input_str] = (
+                    tensors["output"],
+                    entry["elapsed_time"],
+                    tensors["kv_cache"],
+                    str(tuple(tensors["kv_cache"].shape)),
+                )
+            else:
+                self.mock_cache_forward[input_str] = (tensors["output"], entry["elapsed_time"])
+        for input_str, entry in self.mock_capture_store.get("compute_logits").items():
+            self.mock_cache_compute_logits[input_str] = entry["tensors"]["output"]
+
+    def get_capture_writer(self):
+        """
+        Returns the CaptureShardWriter of this process, opening its shard files
+        on first use.
+        """
+        if self.mock_capture_writer is None:
+            self.mock_capture_writer = CaptureShardWriter(
+                self.mock_capture_dir, self.mock_capture_file, capture_shard_name(self.mock_capture_shard)
+            )
+        return self.mock_capture_writer
+
+    def decode_captured_tensor(captured):
+        """
+        Returns a captured tensor from the mock cache: a view of the binary
+        store as is, or the float32 tensor of a base64 string of the json format.
+
+        Args:
+            captured: A tensor or a base64 string.
+
+        Returns:
+            A CPU tensor, flat for the json format.
+        """
+        if isinstance(captured, torch.Tensor):
+            return captured
+        return torch.Tensor(numpy.frombuffer(base64.b64decode(captured), dtype=numpy.float32))
+
     def forward(
         self,
         input_ids: torch.Tensor,
@@ -775,9 +836,8 @@ def mock_model_class_factory(base_class: type) -> type:
                 (output_str, captured_elapsed_time, kv_cache_str, kv_cache_shape) = (
                     self.mock_cache_forward[input_str]
                 )
-                tensor_bytes = base64.b64decode(kv_cache_str)
                 saved_kv_cache = (
-                    torch.Tensor(numpy.frombuffer(tensor_bytes, dtype=numpy.float32))
+                    decode_captured_tensor(kv_cache_str)
                     .to(input_ids.device)
                     .type(torch.bfloat16)
                     .view(ast.literal_eval(kv_cache_shape))
@@ -786,9 +846,8 @@ def mock_model_class_factory(base_class: type) -> type:
             else:
                 (output_str, captured_elapsed_time) = self.mock_cache_forward[input_str]
 
-            tensor_bytes = base64.b64decode(output_str)
             output = (
-                torch.Tensor(numpy.frombuffer(tensor_bytes, dtype=numpy.float32))
+                decode_captured_tensor(output_str)
                 .to(input_ids.device)
                 .type(torch.bfloat16)
                 .view(query_len, -1)
@@ -862,6 +921,15 @@ def mock_model_class_factory(base_class: type) -> type:
                     req_id,
                     position,
                 )
+                if self.mock_capture_format == "binary":
+                    tensors = {"output": output[curr_idx : curr_idx + query_len]}
+                    if self.prefill_process:
+                        tensors["kv_cache"] = concatenated_kv_cache
+                    get_capture_writer(self).append(
+                        "forward", input_str, tensors, elapsed_time=elapsed_time
+                    )
+                    curr_idx += query_len
+                    continue
                 if self.prefill_process:
                     kv_cache_str = base64.b64encode(
                         concatenated_kv_cache.type(torch.float32)
@@ -1219,6 +1287,18 @@ def mock_model_class_factory(base_class: type) -> type:
             outputs = replay_logits(self, hidden_states)
             return outputs
 
+    def logits_cache_key(self, hidden_state):
+        """
+        Returns the capture-replay cache key of a hidden state for compute_logits:
+        the base64 string of the whole hidden state for the json format, its
+        digest for the binary format.
+        """
+        if self.mock_capture_format == "binary":
+            return tensor_key(hidden_state)
+        return base64.b64encode(
+            hidden_state.type(torch.float32).cpu().numpy().tobytes()
+        ).decode("utf-8")
+
     def replay_logits(self, hidden_states):
         """
         Replays logits from the mock cache.
@@ -1231,13 +1311,10 @@ def mock_model_class_factory(base_class: type) -> type:
         """
         outputs = []
         for hidden_state in hidden_states:
-            input_str = base64.b64encode(
-                hidden_state.type(torch.float32).cpu().numpy().tobytes()
-            ).decode("utf-8")
+            input_str = logits_cache_key(self, hidden_state)
             output_str = self.mock_cache_compute_logits[input_str]
-            tensor_bytes = base64.b64decode(output_str)
             output = (
-                torch.Tensor(numpy.frombuffer(tensor_bytes, dtype=numpy.float32))
+                decode_captured_tensor(output_str)
                 .to(hidden_states.device)
                 .type(torch.bfloat16)
                 .view(-1, self.config.vocab_size)
@@ -1262,9 +1339,10 @@ def mock_model_class_factory(base_class: type) -> type:
         # Save captured input-output pair
         if self.capture_mode:
             for hidden_state, o in zip(hidden_states, output):
-                input_str = base64.b64encode(
-                    hidden_state.type(torch.float32).cpu().numpy().tobytes()
-                ).decode("utf-8")
+                input_str = logits_cache_key(self, hidden_state)
+                if self.mock_capture_format == "binary":
+                    get_capture_writer(self).append("compute_logits", input_str, {"output": o})
+                    continue
                 output_str = base64.b64encode(
                     o.type(torch.float32).cpu().numpy().tobytes()
                 ).decode("utf-8")
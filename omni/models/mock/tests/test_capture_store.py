@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import torch
+
+from omni.models.mock.capture_store import (
+    CaptureShardWriter,
+    CaptureStore,
+    capture_shard_name,
+    shard_paths,
+    tensor_key,
+)
+
+NAME = "mock_cache"
+
+
+class TestCaptureStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+
+    def test_round_trip(self):
+        output = torch.randn(3, 8).to(torch.bfloat16)
+        kv_cache = torch.arange(10, dtype=torch.float32).view(2, 5)
+        hidden_state = torch.randn(16)
+        logits = torch.randn(32)
+
+        writer = CaptureShardWriter(self.dir, NAME, capture_shard_name("dp0_tp0"))
+        writer.append("forward", "prompt", {"output": output, "kv_cache": kv_cache}, elapsed_time=1.5)
+        writer.append("compute_logits", tensor_key(hidden_state), {"output": logits})
+        writer.append("forward", "empty", {"output": torch.empty(0, 8)}, elapsed_time=0.0)
+        writer.close()
+
+        store = CaptureStore(self.dir, NAME, "dp0_tp0")
+        forward = store.get("forward")["prompt"]
+        self.assertEqual(forward["elapsed_time"], 1.5)
+        self.assertEqual(forward["tensors"]["output"].dtype, torch.bfloat16)
+        self.assertTrue(torch.equal(forward["tensors"]["output"], output))
+        self.assertTrue(torch.equal(forward["tensors"]["kv_cache"], kv_cache))
+        self.assertEqual(tuple(store.get("forward")["empty"]["tensors"]["output"].shape), (0, 8))
+        # replay looks the logits up by the digest of the same hidden state
+        replayed = store.get("compute_logits")[tensor_key(hidden_state.clone())]["tensors"]["output"]
+        self.assertTrue(torch.equal(replayed, logits))
+        self.assertEqual(store.get("sample"), {})
+
+    def test_tensor_key(self):
+        hidden_state = torch.randn(16)
+        self.assertEqual(tensor_key(hidden_state), tensor_key(hidden_state.to(torch.float64)))
+        self.assertNotEqual(tensor_key(hidden_state), tensor_key(hidden_state + 1))
+        self.assertEqual(len(tensor_key(torch.randn(4096))), 64)
+
+    def test_processes_of_same_rank_do_not_collide(self):
+        # two instances capturing into one directory, with the same dp/tp ranks
+        with mock.patch("os.getpid", return_value=100):
+            shard_a = capture_shard_name("dp0_tp0")
+        with mock.patch("os.getpid", return_value=200):
+            shard_b = capture_shard_name("dp0_tp0")
+        self.assertNotEqual(shard_paths(self.dir, NAME, shard_a), shard_paths(self.dir, NAME, shard_b))
+
+        writer_a = CaptureShardWriter(self.dir, NAME, shard_a)
+        writer_b = CaptureShardWriter(self.dir, NAME, shard_b)
+        for i in range(4):
+            writer_a.append("forward", f"a{i}", {"output": torch.full((i + 1,), float(i))}, elapsed_time=0)
+            writer_b.append("forward", f"b{i}", {"output": torch.full((i + 2,), -float(i))}, elapsed_time=0)
+        writer_a.close()
+        writer_b.close()
+
+        entries = CaptureStore(self.dir, NAME).get("forward")
+        for i in range(4):
+            self.assertTrue(torch.equal(entries[f"a{i}"]["tensors"]["output"], torch.full((i + 1,), float(i))))
+            self.assertTrue(torch.equal(entries[f"b{i}"]["tensors"]["output"], torch.full((i + 2,), -float(i))))
+
+    def test_concurrent_appends(self):
+        writer = CaptureShardWriter(self.dir, NAME, capture_shard_name("dp0_tp0"))
+
+        def capture(thread_id):
+            for i in range(50):
+                value = float(thread_id * 1000 + i)
+                writer.append("forward", f"{thread_id}-{i}", {"output": torch.full((i % 7 + 1,), value)},
+                              elapsed_time=0)
+
+        threads = [threading.Thread(target=capture, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        entries = CaptureStore(self.dir, NAME).get("forward")
+        self.assertEqual(len(entries), 200)
+        for key, entry in entries.items():
+            thread_id, i = map(int, key.split("-"))
+            self.assertTrue(torch.equal(entry["tensors"]["output"],
+                                        torch.full((i % 7 + 1,), float(thread_id * 1000 + i))))
+
+    def test_preferred_rank(self):
+        for rank, value in (("dp0_tp0", 0.0), ("dp0_tp1", 1.0)):
+            writer = CaptureShardWriter(self.dir, NAME, capture_shard_name(rank))
+            writer.append("forward", "shared", {"kv_cache": torch.full((2,), value)}, elapsed_time=0)
+            writer.close()
+        for rank, value in (("dp0_tp0", 0.0), ("dp0_tp1", 1.0)):
+            entry = CaptureStore(self.dir, NAME, rank).get("forward")["shared"]
+            self.assertTrue(torch.equal(entry["tensors"]["kv_cache"], torch.full((2,), value)))
+
+    def test_interrupted_capture_is_skipped(self):
+        shard = capture_shard_name("dp0_tp0")
+        writer = CaptureShardWriter(self.dir, NAME, shard)
+        writer.append("forward", "complete", {"output": torch.ones(4)}, elapsed_time=0)
+        writer.close()
+        index_path, _ = shard_paths(self.dir, NAME, shard)
+        with open(index_path, "a", encoding="utf-8") as f:
+            # an index line whose blob was never written, and a torn line
+            f.write('{"method": "forward", "key": "lost", "tensors": {"output": [4096, "float32", [4]]}}\n')
+            f.write('{"method": "forward", "ke')
+        entries = CaptureStore(self.dir, NAME).get("forward")
+        self.assertEqual(list(entries), ["complete"])
+
+    def test_missing_shards(self):
+        with self.assertRaises(FileNotFoundError):
+            CaptureStore(self.dir, NAME)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""Reference for `PanguToolParser.extract_tool_calls_streaming`, shared by its
+test and benchmarks/entrypoints/bench_pangu_tool_parser.py: the previous,
+rescanning parser, and a synthetic output streamed one delta at a time like
+the OpenAI chat serving does.
+
+It depends on vllm and partial_json_parser only, not on the omni packages.
+"""
+
+import json
+import time
+
+import partial_json_parser
+from partial_json_parser.core.options import Allow
+from vllm.entrypoints.chat_utils import random_tool_call_id
+from vllm.entrypoints.openai.protocol import (DeltaFunctionCall, DeltaMessage,
+                                              DeltaToolCall)
+from vllm.entrypoints.openai.tool_parsers.abstract_tool_parser import ToolParser
+
+TOOL_CALL_START = "[unused11]"
+TOOL_CALL_END = "[unused12]"
+WORDS = ["the", "model", "reads", "a", "file", "and", "then", "calls", "tool", "with", "some", "path",
+         "数据", "结果", "0.5", "-12", "\\n", "é"]
+
+
+class SyntheticTokenizer:
+    """Word-piece vocabulary of the synthetic output, with the tool call tags."""
+
+    def __init__(self):
+        self.pieces = {TOOL_CALL_START: 0, TOOL_CALL_END: 1}
+
+    def get_vocab(self):
+        return self.pieces
+
+    def token_id(self, piece):
+        return self.pieces.setdefault(piece, len(self.pieces))
+
+
+def make_output(num_tokens, num_tool_calls, rng):
+    """Pieces of an output with text and `num_tool_calls` tool calls in pipe
+    style, `name|{json}`, whose arguments hold about half of the tokens."""
+    pieces = []
+    text_tokens = num_tokens // (2 * (num_tool_calls + 1))
+    arg_tokens = num_tokens // (2 * max(num_tool_calls, 1))
+    for i in range(num_tool_calls + 1):
+        pieces += [rng.choice(WORDS) + " " for _ in range(text_tokens)]
+        if i == num_tool_calls:
+            break
+        arguments = {
+            "path": f"/data/file_{i}.txt",
+            "content": "".join(rng.choice(WORDS) + " " for _ in range(arg_tokens)),
+            "options": {"overwrite": bool(i % 2), "retries": i},
+        }
+        tool_text = f"write_file_{i}|" + json.dumps(arguments, ensure_ascii=False)
+        pieces.append(TOOL_CALL_START)
+        # tool call text in pieces of 1-4 characters
+        pos = 0
+        while pos < len(tool_text):
+            step = rng.randint(1, 4)
+            pieces.append(tool_text[pos:pos + step])
+            pos += step
+        pieces.append(TOOL_CALL_END)
+    return pieces
+
+
+def stream(parser, pieces, tokenizer, tokens_per_delta, tool_calls=None):
+    """DeltaMessages of `parser` and the time spent in it. The JSON of its
+    `prev_tool_call_arr` after each delta, which the chat serving reads when
+    the output finishes, is appended to `tool_calls` if given."""
+    previous_text, previous_token_ids = "", []
+    deltas = []
+    elapsed = 0.0
+    for start in range(0, len(pieces), tokens_per_delta):
+        delta_pieces = pieces[start:start + tokens_per_delta]
+        delta_text = "".join(delta_pieces)
+        delta_token_ids = [tokenizer.token_id(piece) for piece in delta_pieces]
+        current_text = previous_text + delta_text
+        current_token_ids = previous_token_ids + delta_token_ids
+        start_time = time.perf_counter()
+        deltas.append(parser.extract_tool_calls_streaming(
+            previous_text, current_text, delta_text,
+            previous_token_ids, current_token_ids, delta_token_ids, request=None))
+        elapsed += time.perf_counter() - start_time
+        if tool_calls is not None:
+            tool_calls.append(json.dumps(parser.prev_tool_call_arr, ensure_ascii=False))
+        previous_text, previous_token_ids = current_text, current_token_ids
+    return deltas, elapsed
+
+
+def comparable(delta):
+    if delta is None:
+        return None
+    dumped = delta.model_dump(exclude_none=True)
+    for tool_call in dumped.get("tool_calls", []):
+        tool_call.pop("id", None)
+    return dumped
+
+
+class RescanPanguToolParser(ToolParser):
+    """The previous extract_tool_calls_streaming, which counts the tool call
+    tags over all token ids, splits the whole text and parses the whole tool
+    call on every delta."""
+
+    def __init__(self, tokenizer):
+        super().__init__(tokenizer)
+        self.tool_call_start_token = TOOL_CALL_START
+        self.tool_call_end_token = TOOL_CALL_END
+        self.tool_call_start_token_id = self.vocab[TOOL_CALL_START]
+        self.tool_call_end_token_id = self.vocab[TOOL_CALL_END]
+
+    def extract_tool_calls_streaming(self, previous_text, current_text, delta_text,
+                                     previous_token_ids, current_token_ids, delta_token_ids, request):
+        if self.tool_call_start_token_id not in current_token_ids:
+            return DeltaMessage(content=delta_text)
+        try:
+            prev_tool_start_count = previous_token_ids.count(self.tool_call_start_token_id)
+            prev_tool_end_count = previous_token_ids.count(self.tool_call_end_token_id)
+            cur_tool_start_count = current_token_ids.count(self.tool_call_start_token_id)
+            cur_tool_end_count = current_token_ids.count(self.tool_call_end_token_id)
+            tool_call_portion = None
+            text_portion = None
+
+            if (cur_tool_start_count == cur_tool_end_count
+                    and prev_tool_end_count == cur_tool_end_count
+                    and self.tool_call_end_token not in delta_text):
+                return DeltaMessage(content=delta_text)
+
+            if self.tool_call_end_token in delta_text:
+                full_text = current_text + delta_text
+                tool_call_portion = full_text.split(self.tool_call_start_token)[-1].split(
+                    self.tool_call_end_token)[0].rstrip()
+                delta_text = delta_text.split(self.tool_call_end_token)[0].rstrip()
+                text_portion = delta_text.split(self.tool_call_end_token)[-1].lstrip()
+
+            flags = Allow.ALL if self.current_tool_name_sent else Allow.ALL & ~Allow.STR
+
+            if (cur_tool_start_count > cur_tool_end_count
+                    and cur_tool_start_count > prev_tool_start_count):
+                if len(delta_token_ids) > 1:
+                    tool_call_portion = current_text.split(self.tool_call_start_token)[-1]
+                else:
+                    tool_call_portion = None
+                    delta = None
+                text_portion = None
+                self.current_tool_id += 1
+                self.current_tool_name_sent = False
+                self.streamed_args_for_tool.append("")
+            elif (cur_tool_start_count > cur_tool_end_count
+                  and cur_tool_start_count == prev_tool_start_count):
+                tool_call_portion = current_text.split(self.tool_call_start_token)[-1]
+                text_portion = None
+            elif (cur_tool_start_count == cur_tool_end_count
+                  and cur_tool_end_count >= prev_tool_end_count):
+                if self.prev_tool_call_arr is None or len(self.prev_tool_call_arr) == 0:
+                    return None
+                diff = self.prev_tool_call_arr[self.current_tool_id].get("arguments")
+                if diff:
+                    diff = diff.encode('utf-8').decode('unicode_escape') if diff is str else diff
+                    if '"}' not in delta_text:
+                        return None
+                    end_loc = delta_text.rindex('"}')
+                    diff = delta_text[:end_loc] + '"}'
+                    self.streamed_args_for_tool[self.current_tool_id] += diff
+                    return DeltaMessage(tool_calls=[
+                        DeltaToolCall(index=self.current_tool_id,
+                                      function=DeltaFunctionCall(arguments=diff).model_dump(exclude_none=True))
+                    ])
+            else:
+                text = delta_text.replace(self.tool_call_start_token, "")
+                text = text.replace(self.tool_call_end_token, "")
+                return DeltaMessage(tool_calls=[], content=text)
+
+            try:
+                name_part, arg_part = tool_call_portion.split("|", 1)
+                parsed_args = partial_json_parser.loads(arg_part.strip(), flags)
+                current_tool_call = {"name": name_part.strip(), "arguments": parsed_args}
+            except partial_json_parser.core.exceptions.MalformedJSON:
+                return None
+            except json.decoder.JSONDecodeError:
+                return None
+
+            if not self.current_tool_name_sent:
+                if current_tool_call is None:
+                    return None
+                function_name = current_tool_call.get("name")
+                if function_name:
+                    self.current_tool_name_sent = True
+                    return DeltaMessage(tool_calls=[
+                        DeltaToolCall(index=self.current_tool_id, type="function", id=random_tool_call_id(),
+                                      function=DeltaFunctionCall(name=function_name).model_dump(exclude_none=True))
+                    ])
+                else:
+                    return None
+
+            if tool_call_portion is None:
+                return DeltaMessage(content=delta_text) if text_portion is not None else None
+
+            if len(self.prev_tool_call_arr) <= self.current_tool_id:
+                self.prev_tool_call_arr.append({})
+            prev_arguments = self.prev_tool_call_arr[self.current_tool_id].get("arguments")
+            cur_arguments = current_tool_call.get("arguments")
+
+            if not cur_arguments and not prev_arguments:
+                delta = None
+            elif not cur_arguments and prev_arguments:
+                delta = None
+            elif cur_arguments and not prev_arguments:
+                cur_arguments_json = json.dumps(cur_arguments, ensure_ascii=False)
+                if delta_text not in cur_arguments_json[:-2]:
+                    return None
+                args_delta_start_loc = cur_arguments_json[:-2].rindex(delta_text) + len(delta_text)
+                arguments_delta = cur_arguments_json[:args_delta_start_loc]
+                delta = DeltaMessage(tool_calls=[
+                    DeltaToolCall(index=self.current_tool_id,
+                                  function=DeltaFunctionCall(arguments=arguments_delta).model_dump(exclude_none=True))
+                ])
+                self.streamed_args_for_tool[self.current_tool_id] += arguments_delta
+            elif cur_arguments and prev_arguments:
+                if isinstance(delta_text, str) and len(delta_text.rstrip()) >= 1 and delta_text.rstrip()[-1] == '}':
+                    delta_text = delta_text.rstrip()[:-1]
+                delta = DeltaMessage(tool_calls=[
+                    DeltaToolCall(index=self.current_tool_id,
+                                  function=DeltaFunctionCall(arguments=delta_text).model_dump(exclude_none=True))
+                ])
+                self.streamed_args_for_tool[self.current_tool_id] += delta_text
+
+            if self.current_tool_id == len(self.prev_tool_call_arr) - 1:
+                self.prev_tool_call_arr[self.current_tool_id] = current_tool_call
+            else:
+                self.prev_tool_call_arr.append(current_tool_call)
+            return delta
+        except Exception:
+            return None
@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+import random
+import unittest
+
+from omni.models.pangu.tests import pangu_tool_parser_reference as reference
+from omni.models.pangu.tool_parsers.pangu_tool_parser import PanguToolParser
+
+
+class TestStreamingMatchesRescan(unittest.TestCase):
+    def assert_same_stream(self, pieces, tokens_per_delta=1):
+        tokenizer = reference.SyntheticTokenizer()
+        results = []
+        for parser_class in (reference.RescanPanguToolParser, PanguToolParser):
+            parser = parser_class(tokenizer)
+            tool_calls = []
+            deltas, _ = reference.stream(parser, pieces, tokenizer, tokens_per_delta, tool_calls)
+            results.append(([reference.comparable(delta) for delta in deltas], tool_calls,
+                            parser.streamed_args_for_tool))
+        (expected_deltas, expected_calls, expected_args), (deltas, calls, args) = results
+        for i, (expected, actual) in enumerate(zip(expected_deltas, deltas)):
+            self.assertEqual(actual, expected, f"delta {i}")
+        # the parsed tool calls match after every delta, not only at the end
+        for i, (expected, actual) in enumerate(zip(expected_calls, calls)):
+            self.assertEqual(actual, expected, f"tool calls after delta {i}")
+        self.assertEqual(args, expected_args)
+        return deltas
+
+    def test_synthetic_output(self):
+        pieces = reference.make_output(2000, 3, random.Random(0))
+        for tokens_per_delta in (1, 3):
+            with self.subTest(tokens_per_delta=tokens_per_delta):
+                self.assert_same_stream(pieces, tokens_per_delta)
+
+    def test_malformed_arguments(self):
+        pieces = ["some ", reference.TOOL_CALL_START, "read", "|", '{"', "path", '": "', "ab", "c", '"',
+                  ", ]", ', "m', '": 1}', reference.TOOL_CALL_END, " done"]
+        deltas = self.assert_same_stream(pieces)
+        # arguments that do not parse are not streamed
+        self.assertIsNone(deltas[pieces.index(", ]")])
+        self.assertIsNone(deltas[pieces.index(', "m')])
+        self.assertIsNotNone(deltas[pieces.index("c")])
+
+    def test_string_arguments(self):
+        # deltas within strings, which extend the last parse, around escapes,
+        # trailing whitespace, keys, nested containers and a repeated key
+        pieces = ["text ", reference.TOOL_CALL_START, "edit", "|", '{"pa', "th", '": "a', " b ", "  ", "c\\",
+                  "u00", "e9 d\\", "n", "  ", '", "ed', "its", '": [{"old": "x', "y  ", "\\", '" ', "\\\\", " \\",
+                  "ud83d", "\\ude00", "  ", '"}, "z', "z ", '"], "',
+                  "pa", 'th": "', "q", "r", '"}', reference.TOOL_CALL_END, " done"]
+        for tokens_per_delta in (1, 2):
+            with self.subTest(tokens_per_delta=tokens_per_delta):
+                self.assert_same_stream(pieces, tokens_per_delta)
+
+    def test_bare_string_arguments(self):
+        pieces = [reference.TOOL_CALL_START, "echo", "|", '"', "ab", " ", "c", " ", '"', reference.TOOL_CALL_END]
+        self.assert_same_stream(pieces)
+
+    def test_random_pieces(self):
+        rng = random.Random(1)
+        for _ in range(20):
+            pieces = reference.make_output(rng.randint(50, 300), rng.randint(1, 3), rng)
+            self.assert_same_stream(pieces, rng.randint(1, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,8 @@
 import json
 import re
 from collections.abc import Sequence
-from typing import Union
+from dataclasses import dataclass
+from typing import Optional, Union
 
 import partial_json_parser
 from partial_json_parser.core.options import Allow
@@ -21,6 +22,227 @@ from vllm.transformers_utils.tokenizer import AnyTokenizer, MistralTokenizer
 
 logger = init_logger(__name__)
 
+# characters which end a JSON string, start an escape, or make it invalid
+_JSON_STRING_BREAK = re.compile(r'["\\\x00-\x1f]')
+_JSON_CONTROL_CHAR = re.compile(r'[\x00-\x1f]')
+_JSON_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+@dataclass
+class _JSONContainer:
+    is_object: bool
+    # key of the last member of an object, and whether a key comes next
+    key: Optional[str] = None
+    expect_key: bool = True
+
+
+class _PartialToolCall:
+    """Partial parse of the tool call `name|{arguments}` after the start tag
+    at `offset` of the streamed text, carried across deltas.
+
+    The arguments are scanned for their JSON strings and containers as the
+    text grows. A delta which only extends the open string of the last parse,
+    escapes included, is applied to that parse; any other delta parses all
+    the arguments again with partial_json_parser, so that its errors are
+    raised as before.
+    """
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.num_scanned_chars = offset
+        self.name: Optional[str] = None
+        self.arguments_offset: Optional[int] = None
+        # last successful parse of the arguments and its flags
+        self.arguments = None
+        self.flags: Optional[int] = None
+        # JSON scanner state: open containers, and whether the text ends in
+        # a string, a key, an escape (-1 right after the backslash, else the
+        # unicode escape digits left)
+        self.containers: list[_JSONContainer] = []
+        self.in_string = False
+        self.in_key = False
+        self.escape = 0
+        self.string_offset = 0
+        # (container, key) of the open string value in the last parse, the
+        # container being None for bare string arguments; its decoded
+        # content, with the trailing whitespace left out of the parse, and
+        # the raw text of an escape not complete yet, left out too
+        self.string_location: Optional[tuple] = None
+        self.string_content = ""
+        self.string_trailing_spaces = 0
+        self.string_escape = ""
+
+    def parse(self, current_text: str, flags: int) -> Optional[dict]:
+        """The tool call of current_text, None while its name is not
+        complete. Raises the partial_json_parser errors of the arguments."""
+        if self.arguments_offset is None:
+            sep = current_text.find("|", self.num_scanned_chars)
+            if sep < 0:
+                self.num_scanned_chars = len(current_text)
+                return None
+            self.name = current_text[self.offset:sep].strip()
+            self.arguments_offset = self.num_scanned_chars = sep + 1
+
+        new_text = current_text[self.num_scanned_chars:]
+        extends_string = (flags == Allow.ALL and self.flags == Allow.ALL
+                          and self.in_string)
+        if extends_string and self.in_key:
+            # a partial key is left out of the parse
+            extends_string = (self.escape == 0 and
+                              not _JSON_STRING_BREAK.search(new_text))
+        elif extends_string:
+            extends_string = (self.string_location is not None
+                              and self._extend_string(new_text))
+        if not extends_string:
+            self._scan(current_text)
+            self.num_scanned_chars = len(current_text)
+            try:
+                self.arguments = partial_json_parser.loads(
+                    current_text[self.arguments_offset:].strip(), flags)
+            except Exception:
+                self.flags = None
+                raise
+            self.flags = flags
+            self._locate_string(current_text)
+        self.num_scanned_chars = len(current_text)
+        return {"name": self.name, "arguments": self.arguments}
+
+    def _scan(self, current_text: str):
+        for i in range(self.num_scanned_chars, len(current_text)):
+            char = current_text[i]
+            if self.in_string:
+                if self.escape < 0:
+                    self.escape = 4 if char == "u" else 0
+                elif self.escape > 0:
+                    self.escape -= 1
+                elif char == "\\":
+                    self.escape = -1
+                elif char == '"':
+                    self.in_string = False
+                    if self.in_key:
+                        container = self.containers[-1]
+                        container.expect_key = False
+                        try:
+                            container.key = json.loads(
+                                current_text[self.string_offset - 1:i + 1])
+                        except ValueError:
+                            container.key = None
+            elif char == '"':
+                self.in_string = True
+                self.in_key = bool(self.containers
+                                   and self.containers[-1].is_object
+                                   and self.containers[-1].expect_key)
+                self.string_offset = i + 1
+            elif char in "{[":
+                self.containers.append(_JSONContainer(is_object=char == "{"))
+            elif char in "}]":
+                if self.containers:
+                    self.containers.pop()
+            elif (char == "," and self.containers
+                  and self.containers[-1].is_object):
+                self.containers[-1].expect_key = True
+
+    def _locate_string(self, current_text: str):
+        """Find the open string value of the text in the last parse."""
+        self.string_location = None
+        if not self.in_string or self.in_key or self.escape != 0:
+            return
+        raw = current_text[self.string_offset:]
+        stripped = raw.rstrip()
+        try:
+            container, key = None, None
+            value = self.arguments
+            for open_container in self.containers:
+                container = value
+                if not isinstance(container, dict if open_container.is_object
+                                  else list):
+                    return
+                key = open_container.key if open_container.is_object else -1
+                value = container[key]
+            # the string must parse as the partial string does
+            if (not isinstance(value, str)
+                    or value != json.loads('"' + stripped + '"')):
+                return
+        except (KeyError, IndexError, TypeError, ValueError):
+            return
+        self.string_location = (container, key)
+        self.string_content = value + raw[len(stripped):]
+        self.string_trailing_spaces = len(raw) - len(stripped)
+        self.string_escape = ""
+
+    def _extend_string(self, new_text: str) -> bool:
+        """Apply new_text to the open string value of the last parse, False
+        if it does not only extend that string."""
+        if _JSON_CONTROL_CHAR.search(new_text):
+            return False
+        raw = self.string_escape + new_text
+        decoded = []
+        pos = 0
+        escape = ""
+        while True:
+            backslash = raw.find("\\", pos)
+            plain = raw[pos:] if backslash < 0 else raw[pos:backslash]
+            if '"' in plain:
+                return False
+            decoded.append(plain)
+            if backslash < 0:
+                break
+            char = raw[backslash + 1:backslash + 2]
+            if char == "u":
+                digits = raw[backslash + 2:backslash + 6]
+                if not _HEX_DIGITS.issuperset(digits):
+                    return False
+                if len(digits) < 4:
+                    escape = raw[backslash:]
+                    break
+                code_point = int(digits, 16)
+                if 0xd800 <= code_point <= 0xdfff:
+                    # surrogate pairs are left to the parser
+                    return False
+                decoded.append(chr(code_point))
+                pos = backslash + 6
+            elif char in _JSON_ESCAPES:
+                decoded.append(_JSON_ESCAPES[char])
+                pos = backslash + 2
+            elif not char:
+                escape = raw[backslash:]
+                break
+            else:
+                return False
+
+        # the text is stripped: trailing whitespace after the last escape is
+        # left out, and so is an escape not complete yet
+        if escape:
+            trailing_spaces = 0
+            self.escape = -1 if escape == "\\" else 6 - len(escape)
+        else:
+            stripped = plain.rstrip()
+            trailing_spaces = len(plain) - len(stripped)
+            if not stripped and len(decoded) == 1:
+                trailing_spaces += self.string_trailing_spaces
+            self.escape = 0
+        self.string_content += "".join(decoded)
+        self.string_trailing_spaces = trailing_spaces
+        self.string_escape = escape
+        value = self.string_content[:len(self.string_content) -
+                                    trailing_spaces]
+        container, key = self.string_location
+        if container is None:
+            self.arguments = value
+        else:
+            container[key] = value
+        return True
+
 
 @ToolParserManager.register_module("pangu")
 class PanguToolParser(ToolParser):
@@ -39,6 +261,20 @@ class PanguToolParser(ToolParser):
         self.streamed_args_for_tool: list[str] = [
         ]  # map what has been streamed for each tool so far to a list
 
+        # Streaming state carried across deltas, so that a delta only scans
+        # its own tokens and text:
+        # - tool call start/end tag counts of the first _num_scanned_tokens
+        #   token ids,
+        # - offset in the text right after the last start tag, valid for its
+        #   first _num_scanned_chars characters,
+        # - partial parse of the tool call after that offset.
+        self._num_scanned_tokens: int = 0
+        self._tool_start_count: int = 0
+        self._tool_end_count: int = 0
+        self._num_scanned_chars: int = 0
+        self._tool_call_offset: int = 0
+        self._partial_tool_call: Optional[_PartialToolCall] = None
+
         self.tool_call_start_token: str = "[unused11]"
         self.tool_call_end_token: str = "[unused12]"
 
@@ -58,6 +294,62 @@ class PanguToolParser(ToolParser):
                 "Pangu Tool parser could not locate tool call start/end "
                 "tokens in the tokenizer!")
 
+    def _scan_tool_tags(self, previous_token_ids: Sequence[int],
+                        current_token_ids: Sequence[int]):
+        """Counts of the start and end tags in the previous and current token
+        ids, scanning only the tokens since the last call."""
+        if (len(previous_token_ids) != self._num_scanned_tokens
+                or len(current_token_ids) < self._num_scanned_tokens):
+            # not the continuation of the last call: count from scratch
+            self._tool_start_count = previous_token_ids.count(
+                self.tool_call_start_token_id)
+            self._tool_end_count = previous_token_ids.count(
+                self.tool_call_end_token_id)
+            self._num_scanned_tokens = len(previous_token_ids)
+            self._num_scanned_chars = 0
+            self._tool_call_offset = 0
+            self._partial_tool_call = None
+        prev_tool_start_count = self._tool_start_count
+        prev_tool_end_count = self._tool_end_count
+
+        new_token_ids = current_token_ids[self._num_scanned_tokens:]
+        self._tool_start_count += new_token_ids.count(
+            self.tool_call_start_token_id)
+        self._tool_end_count += new_token_ids.count(
+            self.tool_call_end_token_id)
+        self._num_scanned_tokens = len(current_token_ids)
+        return (prev_tool_start_count, prev_tool_end_count,
+                self._tool_start_count, self._tool_end_count)
+
+    def _current_tool_call_offset(self, current_text: str) -> int:
+        """Offset of the text after the last start tag of current_text, the
+        whole text if there is none, scanning only the text since the last
+        call."""
+        if len(current_text) < self._num_scanned_chars:
+            self._num_scanned_chars = 0
+            self._tool_call_offset = 0
+        # a tag may straddle the text scanned by the last call
+        scan_from = max(
+            self._num_scanned_chars - len(self.tool_call_start_token) + 1, 0)
+        tag_loc = current_text.rfind(self.tool_call_start_token, scan_from)
+        if tag_loc >= 0:
+            self._tool_call_offset = tag_loc + len(self.tool_call_start_token)
+        self._num_scanned_chars = len(current_text)
+        return self._tool_call_offset
+
+    def _parse_tool_call(self, current_text: str, tool_call_offset: int,
+                         flags: int) -> Optional[dict]:
+        """Partial parse of the tool call at tool_call_offset of
+        current_text, None while its name is not complete, carried over from
+        the previous deltas of the same tool call."""
+        partial_tool_call = self._partial_tool_call
+        if (partial_tool_call is None
+                or partial_tool_call.offset != tool_call_offset
+                or len(current_text) < partial_tool_call.num_scanned_chars):
+            partial_tool_call = _PartialToolCall(tool_call_offset)
+            self._partial_tool_call = partial_tool_call
+        return partial_tool_call.parse(current_text, flags)
+
     def extract_tool_calls(
             self,
             model_output: str,
@@ -131,24 +423,18 @@ class PanguToolParser(ToolParser):
     ) -> Union[DeltaMessage, None]:
         logger.debug("delta_text: %s", delta_text)
         logger.debug("delta_token_ids: %s", delta_token_ids)
+        # figure out where we are in the parsing by counting tool call
+        # start & end tags, carried over from the previous deltas
+        (prev_tool_start_count, prev_tool_end_count, cur_tool_start_count,
+         cur_tool_end_count) = self._scan_tool_tags(previous_token_ids,
+                                                    current_token_ids)
         # check to see if we should be streaming a tool call - is there a
-        if self.tool_call_start_token_id not in current_token_ids:
+        if cur_tool_start_count == 0:
             logger.debug("No tool call tokens found!")
             return DeltaMessage(content=delta_text)
 
         try:
-
-            # figure out where we are in the parsing by counting tool call
-            # start & end tags
-            prev_tool_start_count = previous_token_ids.count(
-                self.tool_call_start_token_id)
-            prev_tool_end_count = previous_token_ids.count(
-                self.tool_call_end_token_id)
-            cur_tool_start_count = current_token_ids.count(
-                self.tool_call_start_token_id)
-            cur_tool_end_count = current_token_ids.count(
-                self.tool_call_end_token_id)
-            tool_call_portion = None
+            tool_call_offset = None
             text_portion = None
 
             # case: if we're generating text, OR rounding out a tool call
@@ -160,10 +446,8 @@ class PanguToolParser(ToolParser):
 
             if self.tool_call_end_token in delta_text:
                 logger.debug("tool_call_end_token in delta_text")
-                full_text = current_text + delta_text
-                tool_call_portion = full_text.split(
-                    self.tool_call_start_token)[-1].split(
-                    self.tool_call_end_token)[0].rstrip()
+                # the tool call portion is taken again by every case below
+                # that parses it
                 delta_text = delta_text.split(
                     self.tool_call_end_token)[0].rstrip()
                 text_portion = delta_text.split(
@@ -181,10 +465,10 @@ class PanguToolParser(ToolParser):
             if (cur_tool_start_count > cur_tool_end_count
                     and cur_tool_start_count > prev_tool_start_count):
                 if len(delta_token_ids) > 1:
-                    tool_call_portion = current_text.split(
-                        self.tool_call_start_token)[-1]
+                    tool_call_offset = self._current_tool_call_offset(
+                        current_text)
                 else:
-                    tool_call_portion = None
+                    tool_call_offset = None
                     delta = None
 
                 text_portion = None
@@ -199,9 +483,9 @@ class PanguToolParser(ToolParser):
             elif (cur_tool_start_count > cur_tool_end_count
                   and cur_tool_start_count == prev_tool_start_count):
 
-                # get the portion of the text that's the tool call
-                tool_call_portion = current_text.split(
-                    self.tool_call_start_token)[-1]
+                # get the offset of the text that's the tool call
+                tool_call_offset = self._current_tool_call_offset(
+                    current_text)
                 text_portion = None
 
             # case -- the current tool call is being closed.
@@ -241,13 +525,11 @@ class PanguToolParser(ToolParser):
                 return delta
 
             try:
-                # 仅支持 name|{...} 管道风格
-                name_part, arg_part = tool_call_portion.split("|", 1)
-                parsed_args = partial_json_parser.loads(arg_part.strip(), flags)
-                current_tool_call = {
-                    "name": name_part.strip(),
-                    "arguments": parsed_args
-                }
+                # 仅支持 name|{...} 管道风格, parsed incrementally: only the
+                # text since the previous delta is scanned
+                current_tool_call = self._parse_tool_call(
+                    current_text, tool_call_offset,
+                    flags) if tool_call_offset is not None else None
 
                 logger.debug("Parsed tool call %s", current_tool_call)
             except partial_json_parser.core.exceptions.MalformedJSON:
@@ -277,8 +559,8 @@ class PanguToolParser(ToolParser):
                     return None
             # case -- otherwise, send the tool call delta
 
-            # if the tool call portion is None, send the delta as text
-            if tool_call_portion is None:
+            # if there is no tool call portion, send the delta as text
+            if tool_call_offset is None:
                 # if there's text but not tool calls, send that -
                 # otherwise None to skip chunk
                 delta = DeltaMessage(content=delta_text) \
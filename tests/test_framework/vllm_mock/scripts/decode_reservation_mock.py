@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2025 Huawei Technologies Co., Ltd. All Rights Reserved.
+
+"""
+Measures the inter-token latency of NpuHybridScheduler with and without decode
+reservation, using the mock model in random mode (FORWARD_TIME per step).
+
+Requests arrive at a steady rate, so without decode reservation every step
+that admits a prefill stalls all running decodes and the inter-token latency
+is bursty. Run it once per configuration and compare the printed percentiles:
+
+    python ./scripts/decode_reservation_mock.py
+    python ./scripts/decode_reservation_mock.py --decode-reservation
+    python ./scripts/decode_reservation_mock.py --decode-reservation --max-consecutive-prefill-steps 2
+"""
+
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return f"p50={p50 * 1000:.1f}ms p90={p90 * 1000:.1f}ms p99={p99 * 1000:.1f}ms max={max(values) * 1000:.1f}ms"
+
+
+def run_steady_arrivals(args):
+    from vllm import LLM, SamplingParams
+
+    additional_config = {
+        "enable_hybrid_graph_mode": True,
+        "decode_reservation": args.decode_reservation,
+        "max_consecutive_prefill_steps": args.max_consecutive_prefill_steps,
+    }
+    llm = LLM(model=args.model,
+              tensor_parallel_size=args.tp,
+              trust_remote_code=True,
+              enforce_eager=True,
+              max_model_len=4096,
+              max_num_seqs=args.max_num_seqs,
+              gpu_memory_utilization=0.9,
+              additional_config=additional_config)
+    engine = llm.llm_engine
+    sampling_params = SamplingParams(max_tokens=args.output_len, temperature=0.0, ignore_eos=True)
+
+    rng = random.Random(0)
+    arrivals = []
+    now = 0.0
+    for i in range(args.num_reqs):
+        now += rng.expovariate(args.rate)
+        prompt = " ".join(["hello"] * rng.randint(args.min_prompt_len, args.max_prompt_len))
+        arrivals.append((now, str(i), prompt))
+    arrivals.reverse()
+
+    arrival_time = {}
+    token_times = {}
+    start = time.perf_counter()
+    while arrivals or engine.has_unfinished_requests():
+        elapsed = time.perf_counter() - start
+        while arrivals and arrivals[-1][0] <= elapsed:
+            _, req_id, prompt = arrivals.pop()
+            engine.add_request(req_id, prompt, sampling_params)
+            arrival_time[req_id] = time.perf_counter()
+            token_times[req_id] = []
+        if not engine.has_unfinished_requests():
+            time.sleep(min(0.001, max(0.0, arrivals[-1][0] - elapsed)))
+            continue
+        outputs = engine.step()
+        step_time = time.perf_counter()
+        for output in outputs:
+            times = token_times[output.request_id]
+            num_tokens = len(output.outputs[0].token_ids)
+            times.extend([step_time] * (num_tokens - len(times)))
+
+    ttft, tpot, itl = [], [], []
+    for req_id, times in token_times.items():
+        if not times:
+            continue
+        ttft.append(times[0] - arrival_time[req_id])
+        if len(times) > 1:
+            tpot.append((times[-1] - times[0]) / (len(times) - 1))
+            itl.extend(np.diff(times).tolist())
+
+    print(f"decode_reservation={args.decode_reservation} "
+          f"max_consecutive_prefill_steps={args.max_consecutive_prefill_steps}")
+    print(f"  TTFT: {percentiles(ttft)}")
+    print(f"  TPOT: {percentiles(tpot)}")
+    print(f"  ITL:  {percentiles(itl)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="/home/kc/models/Qwen2.5-7B-Instruct")
+    parser.add_argument("--tp", type=int, default=2)
+    parser.add_argument("--num-reqs", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=4.0, help="arrival rate (req/s)")
+    parser.add_argument("--min-prompt-len", type=int, default=64)
+    parser.add_argument("--max-prompt-len", type=int, default=1024)
+    parser.add_argument("--output-len", type=int, default=128)
+    parser.add_argument("--max-num-seqs", type=int, default=64)
+    parser.add_argument("--decode-reservation", action="store_true")
+    parser.add_argument("--max-consecutive-prefill-steps", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["VLLM_USE_V1"] = "1"
+    os.environ["VLLM_ENABLE_V1_MULTIPROCESSING"] = "0"
+    os.environ["ASCEND_RT_VISIBLE_DEVICES"] = "0,1"
+
+    os.environ["RANDOM_MODE"] = "1"
+    os.environ["FORWARD_TIME"] = "25"  # 25 milliseconds per step
+    os.environ["MOCK_CAPTURE_DIR"] = "/home/kc/capture/"
+
+    run_steady_arrivals(args)